@@ -0,0 +1,15 @@
+#!/bin/bash
+
+if [ -f /vault/secrets/secret_envs ]; then
+    echo "** Loading secrets from /vault/secrets/secret_envs **"
+    . /vault/secrets/secret_envs
+else
+    echo "** Secrets not found! **"
+fi
+
+# Resume any workflows that were lost in a Redis restart
+echo "** Recovering workflows **"
+django-admin recover_workflows
+
+echo "** Starting poller **"
+django-admin poller --loop $POLLER_OPTS
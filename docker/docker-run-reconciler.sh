@@ -0,0 +1,11 @@
+#!/bin/bash
+
+if [ -f /vault/secrets/secret_envs ]; then
+    echo "** Loading secrets from /vault/secrets/secret_envs **"
+    . /vault/secrets/secret_envs
+else
+    echo "** Secrets not found! **"
+fi
+
+echo "** Starting reconciler **"
+django-admin reconcile --loop $RECONCILER_OPTS
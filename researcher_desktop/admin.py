@@ -8,7 +8,7 @@ class DesktopTypeAdmin(admin.ModelAdmin):
     list_filter = ('enabled',)
     ordering = ('id',)
     list_display = ('id', 'image_name', 'default_flavor_name',
-                    'big_flavor_name', 'volume_size')
+                    'big_flavor_name', 'volume_size', 'pool_size')
 
 
 @admin.register(AvailabilityZone)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class ResearcherDesktopConfig(AppConfig):
     name = 'researcher_desktop'
+
+    def ready(self):
+        import researcher_desktop.signals  # noqa
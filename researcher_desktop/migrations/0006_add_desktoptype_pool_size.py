@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher_desktop', '0005_add_launch_wait'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='desktoptype',
+            name='pool_size',
+            field=models.IntegerField(default=0,
+                                      help_text='Number of pooled volumes '
+                                      'per availability zone'),
+        ),
+    ]
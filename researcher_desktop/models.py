@@ -6,7 +6,7 @@ from django.conf import settings
 from django.db import models
 
 from researcher_workspace import models as workspace_models
-from vm_manager.utils.utils import get_nectar, FlavorDetails
+from vm_manager.utils.catalogue import get_flavor_map
 
 
 logger = logging.getLogger(__name__)
@@ -62,6 +62,11 @@ class DesktopType(models.Model):
     launch_wait_extra = models.IntegerField(default=0,
                                             help_text="Extra launch wait "
                                             "time in seconds")
+    # The number of pre-cloned volumes to keep ready for launches in
+    # each of the desktop type's availability zones.
+    pool_size = models.IntegerField(default=0,
+                                    help_text="Number of pooled volumes "
+                                    "per availability zone")
 
     objects = DesktopTypeManager()
 
@@ -83,10 +88,7 @@ class DesktopType(models.Model):
 
     @cached_property
     def _flavor_map(self):
-        res = {}
-        for f in get_nectar().nova.flavors.list():
-            res[f.name] = FlavorDetails(f)
-        return res
+        return get_flavor_map()
 
     @property
     def security_groups(self):
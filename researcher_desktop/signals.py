@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from researcher_desktop.models import AvailabilityZone
+from vm_manager.utils.catalogue import invalidate, NETWORKS
+
+
+@receiver(post_save, sender=AvailabilityZone)
+@receiver(post_delete, sender=AvailabilityZone)
+def invalidate_zone_network(sender, instance, **kwargs):
+    invalidate(NETWORKS, instance.name)
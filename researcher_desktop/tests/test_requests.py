@@ -1,3 +1,4 @@
+from datetime import datetime, timedelta, timezone
 from unittest.mock import patch
 import uuid
 
@@ -5,14 +6,20 @@ from django.conf import settings
 from django.test import TestCase
 from django.urls import reverse
 
+from researcher_workspace.tests.budget import BudgetClient
 from researcher_workspace.tests.factories import UserFactory
 
 from researcher_desktop.models import DesktopType, AvailabilityZone
 from researcher_desktop.utils.utils import desktops_feature
+from vm_manager.constants import VM_OKAY
+from vm_manager.models import VMStatus
+from vm_manager.tests.fakes import FakeRedis
 
 
 class DesktopRequestTests(TestCase):
 
+    client_class = BudgetClient
+
     def setUp(self, *args, **kwargs):
         super().setUp(*args, **kwargs)
         self.desktop_type = DesktopType.objects.get(id='ubuntu')
@@ -253,3 +260,55 @@ class DesktopRequestTests(TestCase):
                                                desktops_feature())
         self.assertRedirects(response, reverse("home"),
                              fetch_redirect_response=False)
+
+    @patch("researcher_desktop.views.vm_man_views.get_vm_status_summary")
+    def test_status_vm_etag(self, mock_summary):
+        url = reverse("researcher_desktop:status_vm",
+                      kwargs={'desktop': self.desktop_type.id})
+        summary = {'status': 'VM_Waiting', 'status_progress': 25,
+                   'status_message': 'Starting'}
+        mock_summary.return_value = (7, summary)
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(summary, response.json())
+        self.assertEqual('"7"', response['ETag'])
+        mock_summary.assert_called_once_with(self.user, self.desktop_type.id)
+
+        # The same version is not modified
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"7"')
+        self.assertEqual(304, response.status_code)
+
+        # A new version is
+        mock_summary.return_value = (8, summary)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"7"')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('"8"', response['ETag'])
+
+        # Without a version, there is no ETag
+        mock_summary.return_value = (None, summary)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"7"')
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('ETag', response)
+
+    @patch('vm_manager.utils.status_updates._get_connection')
+    def test_status_vm_after_wait_time(self, mock_get):
+        mock_get.return_value = FakeRedis()
+        url = reverse("researcher_desktop:status_vm",
+                      kwargs={'desktop': self.desktop_type.id})
+        # A desktop that was launched, and whose wait time has passed
+        VMStatus.objects.create(
+            user=self.user, requesting_feature=self.feature,
+            operating_system=self.desktop_type.id, status=VM_OKAY,
+            status_progress=100, status_message="Ready",
+            wait_time=datetime.now(timezone.utc) - timedelta(hours=1))
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        etag = response['ETag']
+
+        # The status hasn't changed, so the polls are not modified
+        for _ in range(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(304, response.status_code)
+            self.assertEqual(etag, response['ETag'])
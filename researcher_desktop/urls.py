@@ -24,4 +24,6 @@ urlpatterns = [
     path('notify_vm/', views.notify_vm, name='notify_vm'),
     path('phone_home/', views.phone_home, name='phone_home'),
     path('status_vm/<str:desktop>', views.status_vm, name='status_vm'),
+    path('wait_status_vm/<str:desktop>',
+         views.wait_status_vm, name='wait_status_vm'),
 ]
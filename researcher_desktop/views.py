@@ -2,6 +2,8 @@ import logging
 
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.http import JsonResponse, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.views.decorators.csrf import csrf_exempt
 
 from researcher_desktop.utils.utils import get_desktop_type, \
@@ -18,18 +20,16 @@ logger = logging.getLogger(__name__)
 
 
 def render_modules(request):
-    modules = []
-    for dt in desktop_types():
+    desktops = []
+    for dt in desktop_types().select_related('feature'):
         buttons = [REBOOT_BUTTON, SHELVE_BUTTON, DELETE_BUTTON,
                    EXTEND_BUTTON, UNSHELVE_BUTTON]
         # If desktop is resizable, include the boost-related buttons
         if dt.is_resizable:
             buttons = buttons + [BOOST_BUTTON,
                    DOWNSIZE_BUTTON, EXTEND_BOOST_BUTTON]
-        modules.append(
-            vm_man_views.render_vm(request, request.user, dt, buttons)
-        )
-    return modules
+        desktops.append((dt, buttons))
+    return vm_man_views.render_vms(request, request.user, desktops)
 
 
 @login_required(login_url='login')
@@ -143,8 +143,28 @@ def phone_home(request):
 @user_passes_test(test_func=agreed_to_terms, login_url='terms',
                   redirect_field_name=None)
 def status_vm(request, desktop):
-    desktop_type = get_desktop_type(desktop)
-    result = vm_man_views.get_vm_status(request.user, desktop_type)
+    version, result = vm_man_views.get_vm_status_summary(
+        request.user, desktop)
+    # Unchanged statuses are "304 Not Modified", without a database query
+    etag = None if version is None else quote_etag(str(version))
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(result)
+    if etag:
+        response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@login_required(login_url='login')
+@user_passes_test(test_func=agreed_to_terms, login_url='terms',
+                  redirect_field_name=None)
+def wait_status_vm(request, desktop):
+    try:
+        version = int(request.GET.get('version', 0))
+    except ValueError:
+        version = 0
+    result = vm_man_views.wait_vm_status(request.user, desktop, version)
     return JsonResponse(result)
 
 
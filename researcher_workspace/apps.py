@@ -28,6 +28,7 @@ def connection_callback(sender, connection, **kwargs):
                     or 'showmigrations' in sys.argv
                     or 'migrate' in sys.argv):
                 REGISTRY.register(metrics.BumblebeeMetricsCollector())
+                REGISTRY.register(metrics.JobMetricsCollector())
             monitoring_initialised = True
 
 
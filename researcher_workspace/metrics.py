@@ -1,63 +1,282 @@
-from django.db.models import Count, EmailField, ExpressionWrapper, \
-    F, Func, Value
+from collections import defaultdict
+import json
+import logging
+import threading
+import time
 
-from prometheus_client.core import GaugeMetricFamily
+import django_rq
+from redis.exceptions import RedisError
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import StrIndex, Substr
+
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, \
+    HistogramMetricFamily
 
-from researcher_workspace import models as researcher_workspace_models
-from researcher_workspace import settings
 from vm_manager import models as vm_manager_models
+from vm_manager.utils import catalogue, job_metrics
+
+logger = logging.getLogger(__name__)
+
+# The fleet statistics are computed every METRICS_SNAPSHOT_INTERVAL
+# seconds (by a thread in the expirer), and kept in Redis for the
+# collectors.  They expire after SNAPSHOT_TTL_INTERVALS intervals, so if
+# they stop being refreshed, the collectors compute them instead.
+SNAPSHOT_KEY = 'bumblebee:metrics:snapshot'
+SNAPSHOT_TTL_INTERVALS = 3
+
+# The desktop (volume) counts in a snapshot
+DIMENSIONS = ['created', 'running', 'shelved', 'errored']
+
+
+def _get_connection():
+    return django_rq.get_connection('default')
+
+
+def _usage_filter(user_field):
+    # Exclude the super-user and monitoring desktops
+    return (Q(**{f"{user_field}__is_superuser": True})
+            | Q(**{f"{user_field}__username__in":
+                   settings.EXCLUDE_FROM_USAGE}))
+
+
+def _domain(email_field):
+    return Substr(email_field, StrIndex(email_field, Value('@')) + 1)
+
+
+def compute_snapshot():
+    """Compute the fleet statistics.
+
+    The desktop counts (by type, zone and user email domain) come from
+    one grouped query over the volumes, and the VMStatus states from one
+    over the users' latest VMStatuses.
+    """
+
+    volumes = vm_manager_models.Volume.objects \
+        .exclude(_usage_filter('user')) \
+        .values('operating_system', 'zone', domain=_domain('user__email')) \
+        .annotate(
+            created=Count('id'),
+            running=Count('id', filter=Q(deleted=None, shelved_at=None)),
+            shelved=Count('id', filter=Q(deleted=None,
+                                         shelved_at__isnull=False)),
+            errored=Count('id', filter=Q(deleted=None,
+                                         error_flag__isnull=False))) \
+        .order_by()
+
+    vm_statuses = vm_manager_models.VMStatus.objects
+    latest = vm_statuses.filter(
+        user=OuterRef('user'),
+        operating_system=OuterRef('operating_system'),
+        requesting_feature=OuterRef('requesting_feature')) \
+        .order_by('-created').values('pk')[:1]
+    states = vm_statuses.filter(pk=Subquery(latest)) \
+        .exclude(_usage_filter('user')) \
+        .values('operating_system', 'status',
+                zone=F('instance__boot_volume__zone'),
+                domain=_domain('user__email')) \
+        .annotate(count=Count('id')) \
+        .order_by()
+
+    return {
+        'time': time.time(),
+        'desktops': [[row['operating_system'], row['zone'], row['domain']]
+                     + [row[dimension] for dimension in DIMENSIONS]
+                     for row in volumes],
+        'states': [[row['operating_system'], row['zone'], row['domain'],
+                    row['status'], row['count']] for row in states],
+    }
+
+
+def refresh_snapshot(connection=None, interval=None):
+    """Compute the fleet statistics, and store them in Redis.
+
+    They are kept for SNAPSHOT_TTL_INTERVALS times the refresh
+    'interval' (METRICS_SNAPSHOT_INTERVAL by default).
+    """
+
+    interval = interval or settings.METRICS_SNAPSHOT_INTERVAL
+    snapshot = compute_snapshot()
+    connection = connection or _get_connection()
+    connection.set(SNAPSHOT_KEY, json.dumps(snapshot),
+                   ex=max(1, interval * SNAPSHOT_TTL_INTERVALS))
+    return snapshot
+
+
+def get_snapshot(connection=None):
+    """Get the stored fleet statistics.
+
+    If there aren't any (e.g. because they haven't been refreshed
+    lately), they are computed and stored.  If Redis is unavailable,
+    they are computed every time.
+    """
+
+    try:
+        connection = connection or _get_connection()
+        snapshot = connection.get(SNAPSHOT_KEY)
+        if snapshot:
+            return json.loads(snapshot)
+        return refresh_snapshot(connection)
+    except RedisError as e:
+        logger.warning(f"Cannot get the metrics snapshot: {e}")
+        return compute_snapshot()
+
+
+class SnapshotRefresher(object):
+    """Refreshes the fleet statistics every 'interval' seconds.
+
+    This runs in a thread of its own, so that it isn't held up by
+    anything else that the process is doing.  The statistics are only
+    refreshed while should_refresh() is true (e.g. while this process
+    is the expirer leader).
+    """
+
+    def __init__(self, interval, should_refresh=None):
+        self.interval = interval
+        self.should_refresh = should_refresh or (lambda: True)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.loop, name='metrics-snapshot', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def refresh(self):
+        if not self.should_refresh():
+            return None
+        # This thread's database connection is kept between refreshes,
+        # unless it has gone away
+        close_old_connections()
+        try:
+            return refresh_snapshot(interval=self.interval)
+        except Exception:
+            logger.exception("Refreshing the metrics snapshot failed")
+            return None
+
+    def loop(self):
+        while not self.stopped.is_set():
+            self.refresh()
+            self.stopped.wait(self.interval)
+
+
+def _gauge(name, desc, label, counts):
+    g = GaugeMetricFamily(name, desc, labels=[label])
+    for value, count in counts.items():
+        g.add_metric([str(value)], count)
+    return g
 
 
 class BumblebeeMetricsCollector(object):
     def collect(self):
-        volumes = vm_manager_models.Volume.objects.all()
-        all_users = researcher_workspace_models.User.objects.all()
-        exclusions = [u.get_username() for u in all_users if u.is_superuser] \
-            + settings.EXCLUDE_FROM_USAGE
-        for dimension in ['created', 'running', 'shelved']:
+        snapshot = get_snapshot()
+
+        # bumblebee_metrics_snapshot_age_seconds
+        yield GaugeMetricFamily(
+            'bumblebee_metrics_snapshot_age_seconds',
+            'Age of the fleet statistics snapshot',
+            value=max(0, time.time() - snapshot['time']))
 
+        for i, dimension in enumerate(DIMENSIONS, start=3):
             name = f"bumblebee_desktops_{dimension}"
             desc = f"Number of {dimension} desktops"
-            if dimension == 'created':
-                qs = volumes
-            elif dimension == 'running':
-                qs = volumes.filter(deleted=None, shelved_at=None)
-            elif dimension == 'shelved':
-                qs = volumes.filter(deleted=None).exclude(shelved_at=None)
-
-            # filter out super-user and monitoring desktops
-            qs = qs.exclude(user__username__in=exclusions)
+            total = 0
+            by_label = {'type': defaultdict(int), 'zone': defaultdict(int),
+                        'domain': defaultdict(int)}
+            for row in snapshot['desktops']:
+                total += row[i]
+                for label, value in zip(by_label, row):
+                    by_label[label][value] += row[i]
 
             # bumblebee_desktops_*_total
-            yield GaugeMetricFamily(f"{name}_total", desc,
-                                    value=qs.count() if qs else 0)
+            yield GaugeMetricFamily(f"{name}_total", desc, value=total)
 
-            # bumblebee_desktops_*_by_type
-            g = GaugeMetricFamily(
-                f"{name}_by_type", f"{desc} by_type", labels=['type'])
-            new_qs = qs.values('operating_system') \
-                       .annotate(Count('operating_system'))
-            for t in new_qs:
-                g.add_metric([t['operating_system']],
-                             t['operating_system__count'])
-            yield g
+            # bumblebee_desktops_*_by_{type,zone,domain}
+            for label, counts in by_label.items():
+                yield _gauge(f"{name}_by_{label}", f"{desc} by_{label}",
+                             label, counts)
 
-            # bumblebee_desktops_*_by_zone
+        # bumblebee_desktop_states and their breakdowns, from the users'
+        # latest VMStatuses
+        by_state = defaultdict(int)
+        by_label = {'type': defaultdict(int), 'zone': defaultdict(int),
+                    'domain': defaultdict(int)}
+        for *values, state, count in snapshot['states']:
+            by_state[state] += count
+            for label, value in zip(by_label, values):
+                by_label[label][(value, state)] += count
+        yield _gauge('bumblebee_desktop_states',
+                     'Number of desktops in each state', 'state', by_state)
+        for label, counts in by_label.items():
             g = GaugeMetricFamily(
-                f"{name}_by_zone", f"{desc} by_zone", labels=['zone'])
-            new_qs = qs.values('zone').annotate(Count('zone'))
-            for t in new_qs:
-                g.add_metric([t['zone']], t['zone__count'])
+                f"bumblebee_desktop_states_by_{label}",
+                f"Number of desktops in each state by {label}",
+                labels=[label, 'state'])
+            for (value, state), count in counts.items():
+                g.add_metric([str(value), state], count)
             yield g
 
-            # bumblebee_desktops_*_by_domain
-            g = GaugeMetricFamily(
-                f"{name}_by_domain", f"{desc} by domain", labels=['domain'])
-            new_qs = qs.values(
-                domain=ExpressionWrapper(
-                    Func(F('user__email'), Value('@'),
-                         Value(-1), function='substring_index'),
-                    output_field=EmailField())).annotate(Count('domain'))
-            for t in new_qs:
-                g.add_metric([t['domain']], t['domain__count'])
-            yield g
+        # bumblebee_catalogue_cache_{hits,misses}; each miss is an
+        # OpenStack (or database) lookup, and each hit is one saved
+        stats = catalogue.get_stats()
+        for outcome in (catalogue.HIT, catalogue.MISS):
+            c = CounterMetricFamily(
+                f"bumblebee_catalogue_cache_{outcome}",
+                f"Catalogue cache {outcome} by kind", labels=['kind'])
+            for kind, counts in stats.items():
+                c.add_metric([kind], counts[outcome])
+            yield c
+
+
+class JobMetricsCollector(object):
+    """The rq queue and scheduler backlogs, and the workflow timings.
+
+    The timings are recorded in Redis by the rqworkers (and the other
+    processes that run workflow steps), so that they can be served here
+    behind the MetricsAuthMiddleware.
+    """
+
+    def collect(self):
+        try:
+            histograms = job_metrics.get_histograms()
+            queue_counts, queue_lag = job_metrics.get_queue_stats()
+            scheduler_counts, scheduler_lag = \
+                job_metrics.get_scheduler_stats()
+        except RedisError as e:
+            logger.warning(f"Cannot get the rq metrics: {e}")
+            return
+
+        # bumblebee_rq_jobs and bumblebee_rq_queue_lag_seconds
+        g = GaugeMetricFamily('bumblebee_rq_jobs',
+                              'Number of rq jobs by state',
+                              labels=['queue', 'state'])
+        for state, count in queue_counts.items():
+            g.add_metric(['default', state], count)
+        yield g
+        g = GaugeMetricFamily('bumblebee_rq_queue_lag_seconds',
+                              'Age of the oldest queued rq job',
+                              labels=['queue'])
+        g.add_metric(['default'], queue_lag)
+        yield g
+
+        # bumblebee_rq_scheduled_jobs and
+        # bumblebee_rq_scheduler_lag_seconds
+        yield _gauge('bumblebee_rq_scheduled_jobs',
+                     'Number of rq-scheduler jobs by state', 'state',
+                     scheduler_counts)
+        yield GaugeMetricFamily('bumblebee_rq_scheduler_lag_seconds',
+                                'How late the oldest due scheduled job is',
+                                value=scheduler_lag)
+
+        # bumblebee_workflow_step_seconds, etc
+        for name, (desc, labels) in job_metrics.HISTOGRAMS.items():
+            h = HistogramMetricFamily(f"bumblebee_{name}", desc,
+                                      labels=labels)
+            for values, (buckets, total) in histograms[name].items():
+                h.add_metric(list(values), buckets, total)
+            yield h
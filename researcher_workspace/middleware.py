@@ -1,12 +1,32 @@
 import base64
+import logging
+import time
+
+from prometheus_client import Histogram
 import pytz
 
 from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection
 from django.http import HttpResponse
 from django.urls import resolve
 from django.utils import timezone
 
+from vm_manager.utils.utils import get_openstack_call_count
+
+logger = logging.getLogger(__name__)
+
+REQUEST_QUERIES = Histogram(
+    'bumblebee_request_queries', 'Database queries per request',
+    ['view'], buckets=(0, 5, 10, 20, 50, 100, 200, 500, float('inf')))
+REQUEST_QUERY_SECONDS = Histogram(
+    'bumblebee_request_query_seconds', 'Database time per request',
+    ['view'], buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5,
+                       float('inf')))
+REQUEST_OPENSTACK_CALLS = Histogram(
+    'bumblebee_request_openstack_calls', 'OpenStack API calls per request',
+    ['view'], buckets=(0, 1, 2, 5, 10, 20, 50, float('inf')))
+
 
 class TimezoneMiddleware:
     def __init__(self, get_response):
@@ -51,3 +71,72 @@ class MetricsAuthMiddleware:
             return self.get_response(request)
 
         return HttpResponse('Unauthorized', status=401)
+
+
+class RequestUsage(object):
+    """The database queries and OpenStack calls made for a request.
+
+    An instance is installed as a database execute wrapper, so that it
+    sees each query.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.openstack_calls = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.monotonic() - start
+
+    def over_budget(self, view_name):
+        """Get the usage that is over the view's budget, by limit."""
+
+        budget = get_budget(view_name)
+        return {limit: getattr(self, limit)
+                for limit, value in budget.items()
+                if getattr(self, limit) > value}
+
+    def __str__(self):
+        return (f"{self.queries} queries ({self.query_seconds:.3f}s), "
+                f"{self.openstack_calls} OpenStack calls")
+
+
+def get_budget(view_name):
+    """Get the query and OpenStack call limits for a view."""
+
+    budget = dict(settings.REQUEST_BUDGET)
+    budget.update(settings.REQUEST_BUDGETS.get(view_name, {}))
+    return budget
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        usage = RequestUsage()
+        openstack_calls = get_openstack_call_count()
+        with connection.execute_wrapper(usage):
+            response = self.get_response(request)
+        usage.openstack_calls = get_openstack_call_count() - openstack_calls
+
+        view_name = (request.resolver_match.view_name
+                     if request.resolver_match else 'unresolved')
+        REQUEST_QUERIES.labels(view_name).observe(usage.queries)
+        REQUEST_QUERY_SECONDS.labels(view_name).observe(usage.query_seconds)
+        REQUEST_OPENSTACK_CALLS.labels(view_name).observe(
+            usage.openstack_calls)
+        over = usage.over_budget(view_name)
+        if over:
+            logger.warning(f"{request.method} {request.path} ({view_name}) "
+                           f"is over its budget {over}: {usage}")
+
+        # For the tests' budget checks
+        response.usage = usage
+        response.view_name = view_name
+        return response
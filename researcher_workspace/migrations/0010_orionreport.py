@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('researcher_workspace', '0009_user_allow_blanks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrionReport',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('reporting_months', models.IntegerField()),
+                ('progress', models.IntegerField(default=0)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('file_name', models.CharField(
+                    blank=True, max_length=255, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(
+                    on_delete=django.db.models.deletion.PROTECT,
+                    to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -293,3 +293,23 @@ class AROWhitelist(models.Model):
 
     def __str__(self):
         return f"{self.username} is ARO whitelisted"
+
+
+class OrionReport(models.Model):
+    """An Orion report, which is generated by an rq job.
+
+    The finished report is 'file_name' in the 'reports' storage.
+    """
+
+    requested_by = models.ForeignKey(User, on_delete=models.PROTECT, )
+    created = models.DateTimeField(auto_now_add=True)
+    reporting_months = models.IntegerField()
+    # Progress in generating the report (0 to 100)
+    progress = models.IntegerField(default=0)
+    finished = models.DateTimeField(null=True, blank=True)
+    file_name = models.CharField(max_length=255, null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+
+    def __str__(self):
+        return (f"Orion report of {self.reporting_months} months "
+                f"requested by {self.requested_by} on {self.created}")
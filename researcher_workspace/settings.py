@@ -97,6 +97,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'researcher_workspace.middleware.TimezoneMiddleware',
     'researcher_workspace.middleware.MetricsAuthMiddleware',
+    'researcher_workspace.middleware.QueryBudgetMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django_prometheus.middleware.PrometheusAfterMiddleware',
 ]
@@ -156,6 +157,37 @@ RQ_QUEUES = {
         'DEFAULT_TIMEOUT': 360,
     },
 }
+# The rqscheduler polls every 5 seconds; a scheduled job that is more
+# than RQ_SCHEDULER_GRACE seconds past its time is reported as overdue.
+RQ_SCHEDULER_GRACE = int(get_setting('RQ_SCHEDULER_GRACE', '60'))
+
+# The OpenStack catalogue (flavors, source volumes and the AZ networks)
+# is cached in Redis, so that it is shared by all of the processes.  So
+# is the data for the reports, which are generated in (forked) rq jobs.
+CATALOGUE_CACHE = 'catalogue'
+REPORTS_CACHE = 'reports'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    CATALOGUE_CACHE: {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'{REDIS_URL}/0',
+        'KEY_PREFIX': 'bumblebee:catalogue',
+    },
+    REPORTS_CACHE: {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'{REDIS_URL}/0',
+        'KEY_PREFIX': 'bumblebee:reports',
+    },
+}
+# The catalogue entries' TTLs in seconds.  The source volumes' TTL is
+# shorter, so that new builds are picked up promptly.
+CATALOGUE_CACHE_TTLS = {
+    'flavors': int(get_setting('FLAVOR_CACHE_TTL', '3600')),
+    'source_volumes': int(get_setting('SOURCE_VOLUME_CACHE_TTL', '300')),
+    'networks': int(get_setting('NETWORK_CACHE_TTL', '3600')),
+}
 
 
 # OpenStack config
@@ -168,6 +200,10 @@ OS_KEYNAME = get_setting('OS_KEYNAME')
 
 OS_PROJECT_ID = get_setting('OS_PROJECT_ID', '')
 
+# The maximum number of pooled HTTP connections per OpenStack endpoint,
+# shared by the clients (and threads) of a process
+OS_CONNECTION_POOL_SIZE = int(get_setting('OS_CONNECTION_POOL_SIZE', '10'))
+
 AUTHENTICATION_BACKENDS = [
     'researcher_workspace.auth.ClassicAuthBackend',
     'researcher_workspace.auth.OIDCAuthBackend',
@@ -218,6 +254,25 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "researcher_workspace/static"),
 ]
 
+# The generated Orion reports are kept in the 'reports' storage, which
+# the web servers and the rqworkers must share.  The reports are only
+# downloaded via the (staff only) Orion report page.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'reports': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': get_setting('REPORT_DIR',
+                                    os.path.join(BASE_DIR, 'reports')),
+        },
+    },
+}
+
 COMPRESS_PRECOMPILERS = (
     ('text/x-scss', 'django_libsass.SassCompiler'),
 )
@@ -394,6 +449,40 @@ VOLUME_WARNING_2 = int(get_setting('SHELVED_VOLUME_WARNING_2', '1'))
 # Backups (archived desktops) are kept this number of days.
 BACKUP_LIFETIME = int(get_setting('BACKUP_LIFETIME', '90'))
 
+# The expiry actions (shelving, archiving, downsizing) of a cronjob run
+# are done by EXPIRER_WORKERS threads, with at most EXPIRER_ZONE_WORKERS
+# at a time in each availability zone.  The actions are started at no
+# more than EXPIRER_RATE per second overall, and EXPIRER_ZONE_RATE per
+# second per zone.  A run does at most EXPIRER_MAX_ACTIONS actions,
+# with the oldest deadlines first; the rest are left for the next run.
+# Zero means no limit (but EXPIRER_WORKERS = 1 means serially).
+EXPIRER_WORKERS = int(get_setting('EXPIRER_WORKERS', '1'))
+EXPIRER_ZONE_WORKERS = int(get_setting('EXPIRER_ZONE_WORKERS', '0'))
+EXPIRER_RATE = float(get_setting('EXPIRER_RATE', '0'))
+EXPIRER_ZONE_RATE = float(get_setting('EXPIRER_ZONE_RATE', '0'))
+EXPIRER_MAX_ACTIONS = int(get_setting('EXPIRER_MAX_ACTIONS', '0'))
+
+# The resident expirer ('django-admin expirer') runs each expiry job
+# every *_INTERVAL seconds.  Only the replica that holds the leader lock
+# runs the jobs; it renews the lock (including while a job is running)
+# every third of EXPIRER_LEADER_TIMEOUT seconds.  The expirer serves
+# its Prometheus metrics on EXPIRER_METRICS_PORT, if it is set.  The
+# leader also refreshes the fleet statistics snapshot (that the
+# Prometheus collector serves) every METRICS_SNAPSHOT_INTERVAL seconds,
+# in a thread of its own.
+EXPIRER_INTERVALS = {
+    'shelve': int(get_setting('SHELVE_INTERVAL', '3600')),
+    'downsize': int(get_setting('DOWNSIZE_INTERVAL', '3600')),
+    'archive': int(get_setting('ARCHIVE_INTERVAL', '3600')),
+    'delete_archives': int(get_setting('DELETE_ARCHIVES_INTERVAL', '3600')),
+    'refill_pool': int(get_setting('REFILL_POOL_INTERVAL', '300')),
+    'rollup_usage': int(get_setting('ROLLUP_USAGE_INTERVAL', '3600')),
+}
+EXPIRER_LEADER_TIMEOUT = int(get_setting('EXPIRER_LEADER_TIMEOUT', '900'))
+EXPIRER_METRICS_PORT = int(get_setting('EXPIRER_METRICS_PORT', '0'))
+METRICS_SNAPSHOT_INTERVAL = \
+    int(get_setting('METRICS_SNAPSHOT_INTERVAL', '60'))
+
 # Wait times and retry counts for the workflows in vm_manager.  The
 # wait times are all in seconds.
 LAUNCH_WAIT = int(get_setting('LAUNCH_WAIT', '600'))
@@ -432,6 +521,73 @@ VOLUME_POLL_DELETED_RETRIES = \
 VOLUME_CREATION_WAIT = int(get_setting('VOLUME_CREATION_WAIT', '180'))
 INSTANCE_LAUNCH_WAIT = int(get_setting('INSTANCE_LAUNCH_WAIT', '180'))
 
+# The reconciler records the observed OpenStack status of instances and
+# volumes every RECONCILE_INTERVAL seconds.  Status checks outside of the
+# workflows use these observations unless they are older than
+# OBSERVED_STATUS_MAX_AGE seconds.
+RECONCILE_INTERVAL = int(get_setting('RECONCILE_INTERVAL', '30'))
+RECONCILE_PAGE_SIZE = int(get_setting('RECONCILE_PAGE_SIZE', '500'))
+OBSERVED_STATUS_MAX_AGE = int(get_setting('OBSERVED_STATUS_MAX_AGE', '120'))
+
+# The poller checks the workflows' pending waits for OpenStack state
+# changes every POLLER_INTERVAL seconds.  Only one poller at a time does
+# a pass; its lock expires after POLLER_LOCK_TIMEOUT seconds.
+POLLER_INTERVAL = int(get_setting('POLLER_INTERVAL', '5'))
+POLLER_LOCK_TIMEOUT = int(get_setting('POLLER_LOCK_TIMEOUT', '300'))
+
+# Waits that are bounded by a deadline are first checked after the
+# median (p50) observed duration of the step, then with exponential
+# backoff (plus jitter) from POLLER_INTERVAL up to POLL_MAX_INTERVAL.
+# Their timeouts are the p99 observed duration times STEP_TIMEOUT_MARGIN,
+# but no more than the *_WAIT settings above.  The observations are the
+# last STEP_TIMING_SAMPLES completed steps for the desktop type and zone.
+# With fewer than STEP_TIMING_MIN_SAMPLES, the settings are used as is.
+POLL_MAX_INTERVAL = int(get_setting('POLL_MAX_INTERVAL', '60'))
+STEP_TIMEOUT_MARGIN = float(get_setting('STEP_TIMEOUT_MARGIN', '1.5'))
+STEP_TIMING_SAMPLES = int(get_setting('STEP_TIMING_SAMPLES', '200'))
+STEP_TIMING_MIN_SAMPLES = int(get_setting('STEP_TIMING_MIN_SAMPLES', '20'))
+
+# Each desktop type keeps 'pool_size' pre-cloned volumes in each of its
+# availability zones, so that launches don't need to wait for a clone.
+# The refill job (run by the expirer every REFILL_POOL_INTERVAL seconds,
+# or by cronjob --refill-pool) tops up the pools, and recycles pooled
+# volumes that were cloned from an old source volume.  A launch
+# tries up to VOLUME_POOL_CLAIM_ATTEMPTS pooled volumes before it falls
+# back to cloning a new one.
+VOLUME_POOL_CLAIM_ATTEMPTS = \
+    int(get_setting('VOLUME_POOL_CLAIM_ATTEMPTS', '3'))
+
+# The desktop progress bar waits for VMStatus changes (published via
+# Redis) for up to STATUS_WAIT_TIMEOUT seconds per request, rather than
+# polling.  Each waiting browser holds a web server thread for that long.
+# If the wait fails, the browser falls back to polling.
+STATUS_WAIT_TIMEOUT = int(get_setting('STATUS_WAIT_TIMEOUT', '25'))
+
+# Each request's database queries and OpenStack API calls are counted
+# (and exported as Prometheus histograms, by view).  A warning is logged
+# if a request makes more than REQUEST_BUDGET allows, or more than
+# REQUEST_BUDGETS allows for its view, e.g.
+# {'admin:index': {'queries': 50}}.
+REQUEST_BUDGET = {
+    'queries': int(get_setting('REQUEST_QUERY_BUDGET', '30')),
+    'openstack_calls': int(get_setting('REQUEST_OPENSTACK_CALL_BUDGET', '5')),
+}
+REQUEST_BUDGETS = {}
+
+# The Orion report is generated by an rq job, which is killed after
+# ORION_REPORT_TIMEOUT seconds.  The last ORION_REPORTS_KEPT reports are
+# kept for download.
+ORION_REPORT_TIMEOUT = int(get_setting('ORION_REPORT_TIMEOUT', '3600'))
+ORION_REPORTS_KEPT = int(get_setting('ORION_REPORTS_KEPT', '10'))
+
+# The database check (vm_manager/db_check) is done by an rq job, which is
+# killed after DB_CHECK_TIMEOUT seconds.  The last DB_CHECK_REPORTS_KEPT
+# results are kept.  If asked to, the job repairs the vanished Instances
+# and Volumes, DB_CHECK_REPAIR_WORKERS at a time.
+DB_CHECK_TIMEOUT = int(get_setting('DB_CHECK_TIMEOUT', '3600'))
+DB_CHECK_REPORTS_KEPT = int(get_setting('DB_CHECK_REPORTS_KEPT', '10'))
+DB_CHECK_REPAIR_WORKERS = int(get_setting('DB_CHECK_REPAIR_WORKERS', '4'))
+
 # OpenID Connect settings
 OIDC_OP_AUTHORIZATION_ENDPOINT = f'{OIDC_SERVER_URL}/auth'
 OIDC_OP_TOKEN_ENDPOINT = f'{OIDC_SERVER_URL}/token'
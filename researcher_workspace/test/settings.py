@@ -10,6 +10,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import os
 import logging
+import tempfile
 
 from django.contrib.messages import constants as message_constants
 from django.contrib.messages import constants as messages
@@ -24,6 +25,8 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/2.2/howto/deployment/checklist/
 
+EXCLUDE_FROM_USAGE = []
+
 ADMINS = [('Andy', 'andy@example.com'),
           ('Stephen', 'stephen@example.com')]
 
@@ -61,6 +64,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'researcher_workspace.middleware.QueryBudgetMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -161,6 +165,22 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "researcher_workspace/static"),
 ]
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+    'reports': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        'OPTIONS': {
+            'location': os.path.join(tempfile.gettempdir(),
+                                     'bumblebee-test-reports'),
+        },
+    },
+}
+
 COMPRESS_PRECOMPILERS = (
     ('text/x-scss', 'django_libsass.SassCompiler'),
 )
@@ -175,6 +195,7 @@ LOGIN_REDIRECT_URL_FAILURE = reverse_lazy('login_fail')
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
 
 OS_AUTH_URL = "https://keystone.rc.nectar.org.au:5000/v3/"
+OS_CONNECTION_POOL_SIZE = 10
 OS_AUTH_TYPE = 'v3applicationcredential'
 OS_AVAILABILITY_ZONE = 'some-az'
 OS_NETWORK = 'bumblebee'
@@ -310,6 +331,22 @@ VOLUME_EXPIRY = 90
 VOLUME_WARNING_1 = 7
 VOLUME_WARNING_2 = 1
 BACKUP_LIFETIME = 90
+EXPIRER_WORKERS = 1
+EXPIRER_ZONE_WORKERS = 0
+EXPIRER_RATE = 0
+EXPIRER_ZONE_RATE = 0
+EXPIRER_MAX_ACTIONS = 0
+EXPIRER_INTERVALS = {
+    'shelve': 3600,
+    'downsize': 3600,
+    'archive': 3600,
+    'delete_archives': 3600,
+    'refill_pool': 300,
+    'rollup_usage': 3600,
+}
+EXPIRER_LEADER_TIMEOUT = 900
+EXPIRER_METRICS_PORT = 0
+METRICS_SNAPSHOT_INTERVAL = 60
 
 # VM managers timeouts and retry counts.
 LAUNCH_WAIT = 300
@@ -331,6 +368,31 @@ VOLUME_POLL_DELETED_WAIT = 30
 VOLUME_POLL_DELETED_RETRIES = 5
 VOLUME_CREATION_WAIT = 180
 INSTANCE_LAUNCH_WAIT = 180
+RECONCILE_INTERVAL = 30
+RECONCILE_PAGE_SIZE = 500
+OBSERVED_STATUS_MAX_AGE = 120
+POLLER_INTERVAL = 5
+POLLER_LOCK_TIMEOUT = 300
+POLL_MAX_INTERVAL = 60
+STEP_TIMEOUT_MARGIN = 1.5
+STEP_TIMING_SAMPLES = 200
+STEP_TIMING_MIN_SAMPLES = 20
+STATUS_WAIT_TIMEOUT = 25
+
+REQUEST_BUDGET = {
+    'queries': 30,
+    'openstack_calls': 5,
+}
+REQUEST_BUDGETS = {}
+
+ORION_REPORT_TIMEOUT = 3600
+ORION_REPORTS_KEPT = 10
+
+DB_CHECK_TIMEOUT = 3600
+DB_CHECK_REPORTS_KEPT = 10
+DB_CHECK_REPAIR_WORKERS = 1
+
+VOLUME_POOL_CLAIM_ATTEMPTS = 3
 
 # Values that need to be set in local_settings.py
 PROXY_URL = False
@@ -356,6 +418,28 @@ RQ_QUEUES = {
         'DEFAULT_TIMEOUT': 360,
     },
 }
+RQ_SCHEDULER_GRACE = 60
+
+# The catalogue isn't cached in tests, except by the catalogue tests
+CATALOGUE_CACHE = 'catalogue'
+REPORTS_CACHE = 'reports'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    CATALOGUE_CACHE: {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    },
+    REPORTS_CACHE: {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'reports',
+    },
+}
+CATALOGUE_CACHE_TTLS = {
+    'flavors': 3600,
+    'source_volumes': 300,
+    'networks': 3600,
+}
 
 DESKTOP_TYPES = [
     {
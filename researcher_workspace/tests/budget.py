@@ -0,0 +1,21 @@
+from django.test import Client
+
+
+class BudgetClient(Client):
+    """A test client that fails a test if a request is over its budget.
+
+    The budgets are the REQUEST_BUDGET and REQUEST_BUDGETS settings that
+    QueryBudgetMiddleware warns about.
+    """
+
+    def request(self, **request):
+        response = super().request(**request)
+        usage = getattr(response, 'usage', None)
+        if usage is not None:
+            over = usage.over_budget(response.view_name)
+            if over:
+                raise AssertionError(
+                    f"{request['REQUEST_METHOD']} {request['PATH_INFO']} "
+                    f"({response.view_name}) is over its budget "
+                    f"{over}: {usage}")
+        return response
@@ -1,16 +1,30 @@
-from unittest.mock import patch
+from unittest.mock import Mock, patch
+import uuid
 
 from django.conf import settings
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
+from researcher_workspace.tests.budget import BudgetClient
 from researcher_workspace.tests.factories import UserFactory
 
-from researcher_workspace.models import User, Profile
+from researcher_workspace.models import User, Profile, OrionReport
+from researcher_workspace.utils.orion import get_storage
+from researcher_desktop.utils.utils import get_desktop_type
+from vm_manager.constants import MISSING
+from vm_manager.tests.factories import InstanceFactory, VolumeFactory
+from vm_manager.tests.fakes import FakeNectar
+from vm_manager.utils.utils import get_nectar
 
 
 class ResearcherWorkspaceRequestTests(TestCase):
 
+    client_class = BudgetClient
+
     def setUp(self, *args, **kwargs):
         super().setUp(*args, **kwargs)
         self.user = UserFactory.create(first_name="Luke",
@@ -209,3 +223,134 @@ class ResearcherWorkspaceRequestTests(TestCase):
         mock_create_ticket.assert_called_once()
         mock_messages.success.assert_not_called()
         mock_messages.error.assert_called_once()
+
+    @override_settings(CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'catalogue': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'desktop-details-tests',
+        },
+    })
+    def test_desktop_details_without_openstack(self):
+        desktop_type = get_desktop_type('ubuntu')
+        url = reverse("desktop_details",
+                      kwargs={'desktop_name': desktop_type.id})
+        self.user.terms_version = settings.TERMS_VERSION
+        self.user.save()
+        self.client.force_login(self.user)
+        caches['catalogue'].clear()
+
+        # The first render caches the flavors
+        with patch.object(get_nectar, 'nectar', FakeNectar(), create=True):
+            response = self.client.get(url)
+        self.assertTrue(response.context['launch_allowed'])
+
+        volume = VolumeFactory.create(
+            id=uuid.uuid4(), user=self.user,
+            operating_system=desktop_type.id,
+            requesting_feature=desktop_type.feature, zone='QRIScloud')
+        instance = InstanceFactory.create(
+            id=uuid.uuid4(), user=self.user, boot_volume=volume)
+
+        # After that, rendering makes no OpenStack calls at all (any use
+        # of the Nectar clients would fail), and the live desktop check
+        # is a single count query
+        with patch.object(get_nectar, 'nectar', Mock(spec=[]), create=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertFalse(response.context['launch_allowed'])
+            self.assertEqual(1, len([
+                q for q in queries
+                if 'vm_manager_instance' in q['sql']
+                and 'COUNT' in q['sql']]))
+
+            # The reconciler found that the instance has gone
+            instance.set_observed_status(MISSING)
+            response = self.client.get(url)
+            self.assertTrue(response.context['launch_allowed'])
+
+    @patch('researcher_workspace.utils.orion.django_rq')
+    def test_orion_report(self, mock_rq):
+        url = reverse("orion_report")
+        self.user.terms_version = settings.TERMS_VERSION
+        self.user.save()
+        self.client.force_login(self.user)
+
+        # Only for staff
+        response = self.client.post(url, {'reporting_months': 3})
+        self.assertTemplateUsed(response, 'researcher_workspace/404.html')
+        mock_rq.get_queue.assert_not_called()
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.post(url, {'reporting_months': 3})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        report = OrionReport.objects.get(requested_by=self.user)
+        self.assertEqual(3, report.reporting_months)
+        mock_rq.get_queue.return_value.enqueue.assert_called_once()
+
+        response = self.client.get(url)
+        self.assertEqual([report], list(response.context['reports']))
+        self.assertContains(response, reverse(
+            "orion_report_status", kwargs={'report_id': report.id}))
+
+        # The report can be downloaded once it is finished
+        status_url = reverse("orion_report_status",
+                             kwargs={'report_id': report.id})
+        download_url = reverse("orion_report_download",
+                               kwargs={'report_id': report.id})
+        self.assertEqual({'progress': 0, 'finished': False, 'error': None},
+                         self.client.get(status_url).json())
+        self.assertTemplateUsed(self.client.get(download_url),
+                                'researcher_workspace/404.html')
+
+        report.file_name = get_storage().save(
+            f"orion/{report.id}/Orion_Report.xlsx", ContentFile(b"xlsx"))
+        self.addCleanup(get_storage().delete, report.file_name)
+        report.progress = 100
+        report.finished = report.created
+        report.save()
+        self.assertEqual({'progress': 100, 'finished': True, 'error': None},
+                         self.client.get(status_url).json())
+        response = self.client.get(download_url)
+        self.assertEqual(b"xlsx", b"".join(response.streaming_content))
+        self.assertEqual('attachment; filename="Orion_Report.xlsx"',
+                         response['Content-Disposition'])
+
+    def test_user_search_report(self):
+        url = reverse("user_search")
+        self.user.is_staff = True
+        self.user.terms_version = settings.TERMS_VERSION
+        self.user.save()
+        others = UserFactory.create_batch(3)
+        UserFactory.create(is_active=False)
+        self.client.force_login(self.user)
+
+        with patch('researcher_workspace.views.USER_REPORT_PAGE_SIZE', 2):
+            response = self.client.get(url, {'page': 2})
+        self.assertEqual(2, response.context['page'].number)
+        self.assertEqual(2, response.context['page'].paginator.num_pages)
+        self.assertEqual(self.user.date_joined,
+                         response.context['first_date'])
+        self.assertEqual(others[-1].date_joined,
+                         response.context['last_date'])
+        self.assertEqual(4, response.context['growth'][-1]['num'])
+        self.assertContains(response, 'name="uid"')
+
+        # Searching is not paged
+        response = self.client.get(url, {'uid': 'luke'})
+        self.assertTemplateUsed(
+            response, 'researcher_workspace/staff/user_search.html')
+
+        response = self.client.post(url)
+        self.assertEqual('attachment; filename="Orion_User_Report.csv"',
+                         response['Content-Disposition'])
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual("id,name,username,email,date_joined,num,"
+                         "department,person_type", lines[0])
+        self.assertEqual(5, len(lines))
+        self.assertTrue(lines[1].startswith(
+            f"{self.user.id},Luke Sleepwalker,{self.user.username},"))
+        self.assertTrue(lines[4].endswith(",4,,"))
@@ -0,0 +1,179 @@
+from datetime import datetime, timezone
+import json
+from unittest.mock import Mock, patch
+import uuid
+
+from django.test import TestCase
+from redis.exceptions import RedisError
+
+from researcher_workspace.metrics import BumblebeeMetricsCollector, \
+    JobMetricsCollector, SNAPSHOT_KEY, SnapshotRefresher, \
+    compute_snapshot, get_snapshot
+from researcher_workspace.tests.factories import UserFactory
+from vm_manager.constants import VM_OKAY, VM_SHELVED
+from vm_manager.models import Volume
+from vm_manager.tests.factories import VMStatusFactory
+from vm_manager.tests.common import UUID_3
+from vm_manager.tests.fakes import FakeNectar, FakeRedis
+from vm_manager.tests.unit.vm_functions.base import VMFunctionTestBase
+from vm_manager.utils.job_metrics import STEP_SECONDS, observe
+
+utc = timezone.utc
+
+
+@patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
+class MetricsSnapshotTests(VMFunctionTestBase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.user.email = 'someone@uni.example.edu'
+        self.user.save()
+        self.redis = FakeRedis()
+        patcher = patch('researcher_workspace.metrics._get_connection',
+                        return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build_fleet(self):
+        # A running desktop, whose user's earlier VMStatus is superseded
+        VMStatusFactory.create(
+            user=self.user, operating_system=self.UBUNTU.id,
+            requesting_feature=self.UBUNTU.feature, status=VM_SHELVED)
+        self.build_fake_vol_inst_status(status=VM_OKAY)
+
+        # A shelved desktop that is in error
+        self.build_fake_volume(id=uuid.uuid4())
+        Volume.objects.exclude(id=UUID_3).update(
+            shelved_at=datetime.now(utc), error_flag=datetime.now(utc))
+
+        # A super-user's desktop, which isn't counted
+        self.user = UserFactory.create(is_superuser=True)
+        self.build_fake_vol_inst_status(volume_id=uuid.uuid4(),
+                                        instance_id=uuid.uuid4())
+
+    def test_compute_snapshot(self):
+        self.build_fleet()
+
+        with self.assertNumQueries(2):
+            snapshot = compute_snapshot()
+
+        self.assertEqual(
+            [['ubuntu', 'a_zone', 'uni.example.edu', 2, 1, 1, 1]],
+            snapshot['desktops'])
+        self.assertEqual(
+            [['ubuntu', 'a_zone', 'uni.example.edu', VM_OKAY, 1]],
+            snapshot['states'])
+
+    def test_get_snapshot(self):
+        self.build_fleet()
+
+        # The first collection computes and stores the snapshot, and
+        # later ones just read it
+        snapshot = get_snapshot()
+        self.assertEqual(snapshot, json.loads(self.redis.get(SNAPSHOT_KEY)))
+        self.assertEqual(180, self.redis.ttls[SNAPSHOT_KEY])
+        with self.assertNumQueries(0):
+            self.assertEqual(snapshot, get_snapshot())
+
+    @patch('researcher_workspace.metrics.logger')
+    def test_get_snapshot_no_redis(self, mock_logger):
+        connection = Mock()
+        connection.get.side_effect = RedisError("Connection refused")
+
+        snapshot = get_snapshot(connection)
+
+        self.assertEqual([], snapshot['desktops'])
+        mock_logger.warning.assert_called_once()
+
+    def test_snapshot_refresher(self):
+        self.build_fleet()
+        leader = Mock(return_value=False)
+        refresher = SnapshotRefresher(20, should_refresh=leader)
+
+        self.assertIsNone(refresher.refresh())
+        self.assertIsNone(self.redis.get(SNAPSHOT_KEY))
+        leader.return_value = True
+        snapshot = refresher.refresh()
+        self.assertEqual(snapshot, json.loads(self.redis.get(SNAPSHOT_KEY)))
+        self.assertEqual(60, self.redis.ttls[SNAPSHOT_KEY])
+
+    def test_snapshot_refresher_failed(self):
+        self.redis.set = Mock(side_effect=RedisError)
+        refresher = SnapshotRefresher(20)
+
+        with self.assertLogs('researcher_workspace.metrics', 'ERROR'):
+            self.assertIsNone(refresher.refresh())
+
+    def test_collect(self):
+        self.build_fleet()
+        snapshot = compute_snapshot()
+        snapshot['time'] -= 30
+        self.redis.set(SNAPSHOT_KEY, json.dumps(snapshot))
+
+        with self.assertNumQueries(0):
+            metrics = {metric.name: metric for metric
+                       in BumblebeeMetricsCollector().collect()}
+
+        def samples(name):
+            return {tuple(sample.labels.values()): sample.value
+                    for sample in metrics[name].samples}
+
+        self.assertTrue(
+            30 <= samples('bumblebee_metrics_snapshot_age_seconds')[()] < 60)
+        self.assertEqual({(): 2}, samples('bumblebee_desktops_created_total'))
+        self.assertEqual({('ubuntu',): 1},
+                         samples('bumblebee_desktops_running_by_type'))
+        self.assertEqual({('a_zone',): 1},
+                         samples('bumblebee_desktops_shelved_by_zone'))
+        self.assertEqual({('uni.example.edu',): 1},
+                         samples('bumblebee_desktops_errored_by_domain'))
+        self.assertEqual({(VM_OKAY,): 1},
+                         samples('bumblebee_desktop_states'))
+        self.assertEqual({('a_zone', VM_OKAY): 1},
+                         samples('bumblebee_desktop_states_by_zone'))
+
+
+@patch('researcher_workspace.metrics.job_metrics.get_scheduler_stats',
+       return_value=({'pending': 1, 'due': 0, 'overdue': 2}, 90))
+@patch('researcher_workspace.metrics.job_metrics.get_queue_stats',
+       return_value=({'queued': 4, 'started': 1, 'deferred': 0,
+                      'failed': 3}, 12))
+class JobMetricsCollectorTests(TestCase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.redis = FakeRedis()
+        patcher = patch('vm_manager.utils.job_metrics._get_connection',
+                        return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_collect(self, mock_queue, mock_scheduler):
+        observe(STEP_SECONDS, ['wait_for_backup', 'succeeded'], 42)
+
+        samples = {(sample.name, tuple(sample.labels.values())): sample.value
+                   for metric in JobMetricsCollector().collect()
+                   for sample in metric.samples}
+
+        self.assertEqual(4, samples[('bumblebee_rq_jobs',
+                                     ('default', 'queued'))])
+        self.assertEqual(12, samples[('bumblebee_rq_queue_lag_seconds',
+                                      ('default',))])
+        self.assertEqual(2, samples[('bumblebee_rq_scheduled_jobs',
+                                     ('overdue',))])
+        self.assertEqual(90, samples[('bumblebee_rq_scheduler_lag_seconds',
+                                      ())])
+        step = ('wait_for_backup', 'succeeded')
+        self.assertEqual(1, samples[('bumblebee_workflow_step_seconds_count',
+                                     step)])
+        self.assertEqual(42, samples[('bumblebee_workflow_step_seconds_sum',
+                                      step)])
+        self.assertEqual(0, samples[('bumblebee_workflow_step_seconds_bucket',
+                                     step + ('30',))])
+
+    @patch('researcher_workspace.metrics.logger')
+    def test_collect_no_redis(self, mock_logger, mock_queue, mock_scheduler):
+        mock_queue.side_effect = RedisError("Connection refused")
+
+        self.assertEqual([], list(JobMetricsCollector().collect()))
+        mock_logger.warning.assert_called_once()
@@ -0,0 +1,52 @@
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import resolve
+from prometheus_client import REGISTRY
+
+from researcher_workspace.middleware import QueryBudgetMiddleware
+from researcher_workspace.models import User
+from vm_manager.utils.utils import _count_openstack_call
+
+
+class QueryBudgetMiddlewareTests(TestCase):
+
+    def make_request(self, queries, openstack_calls):
+        def view(request):
+            for i in range(queries):
+                User.objects.count()
+            for i in range(openstack_calls):
+                _count_openstack_call(None)
+            return HttpResponse()
+
+        request = RequestFactory().get('/terms/')
+        request.resolver_match = resolve('/terms/')
+        return QueryBudgetMiddleware(view)(request)
+
+    def sample(self, name):
+        return REGISTRY.get_sample_value(f'{name}_sum',
+                                         {'view': 'terms'}) or 0
+
+    def test_within_budget(self):
+        queries = self.sample('bumblebee_request_queries')
+        with self.assertNoLogs('researcher_workspace.middleware'):
+            response = self.make_request(2, 1)
+
+        self.assertEqual('terms', response.view_name)
+        self.assertEqual(2, response.usage.queries)
+        self.assertEqual(1, response.usage.openstack_calls)
+        self.assertEqual({}, response.usage.over_budget('terms'))
+        self.assertEqual(queries + 2, self.sample('bumblebee_request_queries'))
+
+    @override_settings(REQUEST_BUDGETS={'terms': {'queries': 1}})
+    def test_over_budget(self):
+        calls = self.sample('bumblebee_request_openstack_calls')
+        with self.assertLogs('researcher_workspace.middleware',
+                             level='WARNING') as logs:
+            response = self.make_request(2, 6)
+
+        self.assertEqual({'queries': 2, 'openstack_calls': 6},
+                         response.usage.over_budget('terms'))
+        self.assertIn("GET /terms/ (terms) is over its budget",
+                      logs.output[0])
+        self.assertEqual(calls + 6,
+                         self.sample('bumblebee_request_openstack_calls'))
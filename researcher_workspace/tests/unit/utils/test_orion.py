@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+from unittest.mock import Mock, patch
+import zipfile
+
+from django.core.cache import cache, caches
+from django.test import TestCase, override_settings
+
+from researcher_workspace.models import OrionReport
+from researcher_workspace.tests.factories import UserFactory
+from researcher_workspace.utils.orion import generate_report, \
+    get_project_usage, get_storage, request_report
+from vm_manager.tests.fakes import FakeNectar
+
+utc = timezone.utc
+
+
+def fake_usage(project_id, start_date, end_date):
+    return Mock(total_vcpus_usage=start_date.month * 1.001,
+                total_local_gb_usage=2.0, total_memory_mb_usage=3.0,
+                server_usages=[{}, {}])
+
+
+@override_settings(OS_PROJECT_ID='a-project')
+class OrionReportTests(TestCase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        caches['reports'].clear()
+        self.user = UserFactory.create()
+        self.fake = FakeNectar()
+        self.fake.nova.usage.get.side_effect = fake_usage
+        patcher = patch('researcher_workspace.utils.orion.get_nectar',
+                        return_value=self.fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_project_usage(self):
+        now = datetime.now(utc)
+        this_month = (now.month, now.year)
+        last_month = ((now.month - 2) % 12 + 1,
+                      now.year - (1 if now.month == 1 else 0))
+
+        usages = get_project_usage([last_month, this_month])
+        self.assertEqual(
+            [{'CPU Hours': round(month * 1.001, 2), 'Disk GB-Hours': 2.0,
+              'RAM MB-Hours': 3.0, 'Servers Activity': 2}
+             for month, _ in [last_month, this_month]], usages)
+        self.assertEqual(2, self.fake.nova.usage.get.call_count)
+
+        # The closed month is cached (in the shared reports cache, not
+        # the process's own), and this month is fetched again
+        cache.clear()
+        self.assertEqual(usages, get_project_usage([last_month, this_month]))
+        self.assertEqual(3, self.fake.nova.usage.get.call_count)
+        self.assertEqual(
+            usages[0], caches['reports'].get(
+                f"orion:usage:a-project:{last_month[1]}-{last_month[0]:02}"))
+
+    @patch('researcher_workspace.utils.orion.django_rq')
+    def test_request_report(self, mock_rq):
+        with self.settings(ORION_REPORTS_KEPT=2):
+            for i in range(3):
+                report = request_report(self.user, 6)
+
+        mock_rq.get_queue.return_value.enqueue.assert_called_with(
+            generate_report, report.id, job_timeout=3600)
+        self.assertEqual(2, OrionReport.objects.count())
+
+    def test_generate_report(self):
+        UserFactory.create()
+        report = OrionReport.objects.create(
+            requested_by=self.user, reporting_months=3)
+
+        generate_report(report.id)
+
+        report.refresh_from_db()
+        self.assertEqual(100, report.progress)
+        self.assertIsNotNone(report.finished)
+        self.assertIsNone(report.error)
+        self.assertEqual(3, self.fake.nova.usage.get.call_count)
+        self.addCleanup(get_storage().delete, report.file_name)
+        with get_storage().open(report.file_name) as f, \
+                zipfile.ZipFile(f) as xlsx:
+            workbook = xlsx.read('xl/workbook.xml').decode()
+            users = xlsx.read('xl/worksheets/sheet1.xml').decode()
+        for sheet in ["User growth", "Peak VMs per month", "Boosts",
+                      "Project Usage"]:
+            self.assertIn(f'name="{sheet}"', workbook)
+        self.assertIn("NOT_MAPPED", users)
+
+    @patch('researcher_workspace.utils.orion.get_project_usage')
+    def test_generate_report_failed(self, mock_usage):
+        mock_usage.side_effect = Exception("Nova is down")
+        report = OrionReport.objects.create(
+            requested_by=self.user, reporting_months=3)
+
+        generate_report(report.id)
+
+        report.refresh_from_db()
+        self.assertEqual("Nova is down", report.error)
+        self.assertIsNotNone(report.finished)
+        self.assertIsNone(report.file_name)
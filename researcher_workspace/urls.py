@@ -18,6 +18,10 @@ urlpatterns = [
     path('desktop/<str:desktop_name>',
          views.desktop_details, name='desktop_details'),
     path('orion_report/', views.orion_report, name='orion_report'),
+    path('orion_report/<int:report_id>/status', views.orion_report_status,
+         name='orion_report_status'),
+    path('orion_report/<int:report_id>/download',
+         views.orion_report_download, name='orion_report_download'),
     path('about/', views.about, name='about'),
     path('terms/', views.terms, name='terms'),
     path('agree_terms/<int:version>', views.agree_terms, name='agree_terms'),
@@ -0,0 +1,199 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from dateutil.relativedelta import relativedelta
+import logging
+import tempfile
+
+import django_rq
+import xlsxwriter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files import File
+from django.core.files.storage import storages
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+import researcher_desktop.views as rdesk_views
+from researcher_workspace.constants import USAGE
+from researcher_workspace.models import OrionReport, User
+from researcher_workspace.utils import offset_month_and_year
+from researcher_workspace.utils.faculty_mapping import FACULTIES
+from vm_manager.utils.usage import update_daily_usage
+from vm_manager.utils.utils import get_nectar
+
+logger = logging.getLogger(__name__)
+
+utc = timezone.utc
+
+REPORT_NAME = 'Orion_Report.xlsx'
+REPORT_CONTENT_TYPE = ('application/vnd.openxmlformats-officedocument'
+                       '.spreadsheetml.sheet')
+
+# The Nova usage of closed months doesn't change, so it's cached forever
+# (in the REPORTS_CACHE)
+USAGE_KEY_PREFIX = 'orion:usage'
+
+
+def get_storage():
+    return storages['reports']
+
+
+def request_report(user, reporting_months):
+    """Start generating an Orion report, in an rq job."""
+
+    report = OrionReport.objects.create(
+        requested_by=user, reporting_months=reporting_months)
+    _prune_reports()
+    queue = django_rq.get_queue('default')
+    queue.enqueue(generate_report, report.id,
+                  job_timeout=settings.ORION_REPORT_TIMEOUT)
+    logger.info(f"{user} requested {report}")
+    return report
+
+
+def _prune_reports():
+    storage = get_storage()
+    old = OrionReport.objects.order_by('-created')[
+        settings.ORION_REPORTS_KEPT:]
+    for report in old:
+        if report.file_name:
+            storage.delete(report.file_name)
+        report.delete()
+
+
+def generate_report(report_id):
+    """The rq job that generates an Orion report."""
+
+    report = OrionReport.objects.get(pk=report_id)
+    try:
+        with tempfile.NamedTemporaryFile(suffix='.xlsx') as output:
+            _write_report(report, output.name)
+            file_name = get_storage().save(
+                f"orion/{report.id}/{REPORT_NAME}", File(output))
+    except Exception as e:
+        logger.exception(f"Generating {report} failed")
+        _update(report, error=str(e), finished=datetime.now(utc))
+        return
+    _update(report, file_name=file_name, progress=100,
+            finished=datetime.now(utc))
+
+
+def _update(report, **fields):
+    OrionReport.objects.filter(pk=report.pk).update(**fields)
+
+
+def _write_report(report, path):
+    now = datetime.now(utc)
+    months = [offset_month_and_year(month_offset, now.month, now.year)
+              for month_offset in range(report.reporting_months, 0, -1)]
+    labels = [f"01/{month}/{year}" for month, year in months]
+
+    # In constant memory mode, each row is flushed to disk once the
+    # next one is started
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    try:
+        user_counts = _get_user_counts(months)
+        _write_sheet(workbook, "User growth",
+                     ['Month'] + list(FACULTIES.keys()),
+                     ([label] + list(counts.values())
+                      for label, counts in zip(labels, user_counts)))
+        _update(report, progress=10)
+
+        # The rollup is normally brought up to date by the expirer, but
+        # this is a background job, so it can afford to make sure
+        update_daily_usage()
+        for vm_report in rdesk_views.rd_report(report.reporting_months):
+            values = vm_report["values"]
+            _write_sheet(workbook, vm_report["name"],
+                         ['Month'] + [str(os) for os, _ in values],
+                         ([label] + [counts[month] for _, counts in values]
+                          for label, month in zip(labels, months)))
+        _update(report, progress=40)
+
+        if not settings.OS_PROJECT_ID:
+            logger.info("No usage info available: project id not configured")
+        else:
+            usages = get_project_usage(months)
+            _write_sheet(workbook, "Project Usage",
+                         ['Month'] + list(USAGE.keys()),
+                         ([label] + list(usage.values())
+                          for label, usage in zip(labels, usages)))
+        _update(report, progress=90)
+    finally:
+        workbook.close()
+
+
+def _write_sheet(workbook, name, header, rows):
+    worksheet = workbook.add_worksheet(name)
+    worksheet.write_row(0, 0, header)
+    for row, values in enumerate(rows, start=1):
+        worksheet.write_row(row, 0, values)
+
+
+def _get_user_counts(months):
+    """Count the active users who had joined by the end of each month.
+
+    The users' faculties aren't known, so they are all 'NOT_MAPPED'.
+    """
+
+    first = datetime(day=1, month=months[0][0], year=months[0][1],
+                     tzinfo=utc)
+    users = User.objects.filter(is_active=True)
+    count = users.filter(date_joined__lt=first).count()
+    joined = {(row['month'].month, row['month'].year): row['count']
+              for row in users.filter(date_joined__gte=first)
+              .annotate(month=TruncMonth('date_joined', tzinfo=utc))
+              .values('month').annotate(count=Count('id'))
+              .order_by('month')}
+    user_counts = []
+    for month in months:
+        count += joined.get(month, 0)
+        counts = FACULTIES.copy()
+        counts['NOT_MAPPED'] = counts['Total'] = count
+        user_counts.append(counts)
+    return user_counts
+
+
+def _usage_key(month, year):
+    return f"{USAGE_KEY_PREFIX}:{settings.OS_PROJECT_ID}:{year}-{month:02}"
+
+
+def _fetch_usage(month, year):
+    start_date = datetime(day=1, month=month, year=year)
+    end_date = start_date + relativedelta(months=+1)
+    usage = get_nectar().nova.usage.get(settings.OS_PROJECT_ID,
+                                        start_date, end_date)
+    return {
+        'CPU Hours': round(usage.total_vcpus_usage, 2),
+        'Disk GB-Hours': round(usage.total_local_gb_usage, 2),
+        'RAM MB-Hours': round(usage.total_memory_mb_usage, 2),
+        'Servers Activity': len(usage.server_usages),
+    }
+
+
+def get_project_usage(months):
+    """Get the project's Nova usage for each (month, year).
+
+    The usage of the closed months is cached forever, in Redis, so
+    that it is kept between reports.  The rest is fetched concurrently.
+    """
+
+    cache = caches[settings.REPORTS_CACHE]
+    now = datetime.now(utc)
+    this_month = (now.month, now.year)
+    keys = {month: _usage_key(*month) for month in months}
+    usages = cache.get_many([keys[month] for month in months
+                             if month != this_month])
+    missing = [month for month in months if keys[month] not in usages]
+    if missing:
+        workers = min(len(missing), settings.OS_CONNECTION_POOL_SIZE)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            fetched = dict(zip(missing, executor.map(
+                lambda month: _fetch_usage(*month), missing)))
+        usages.update((keys[month], usage)
+                      for month, usage in fetched.items())
+        cache.set_many({keys[month]: usage
+                        for month, usage in fetched.items()
+                        if month != this_month}, timeout=None)
+    return [usages[keys[month]] for month in months]
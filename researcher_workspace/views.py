@@ -2,11 +2,9 @@ import pdb
 
 import csv
 from datetime import datetime, timezone
-from dateutil.relativedelta import relativedelta
-from io import BytesIO
+import itertools
 import logging
 
-import pandas
 import pytz
 
 from django.apps import apps
@@ -17,9 +15,12 @@ from django.contrib.auth import logout as auth_logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.core.files.uploadhandler import TemporaryFileUploadHandler
 from django.core.mail import mail_managers
+from django.core.paginator import Paginator
+from django.db.models import Count, Max, Min
+from django.db.models.functions import TruncDate
 from django.dispatch import receiver
-from django.http import HttpResponse, HttpResponseRedirect, Http404, \
-    StreamingHttpResponse
+from django.http import FileResponse, HttpResponse, \
+    HttpResponseRedirect, Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils.html import format_html
@@ -28,50 +29,70 @@ from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from researcher_desktop.utils.utils import get_desktop_type, \
     get_applicable_zones
 
-from .constants import USAGE
 from .forms import UserSearchForm, ProjectForm, \
     ProfileForm, PermissionRequestForm, SupportRequestForm
 from .models import PermissionRequest, Feature, Project, AROWhitelist, \
-    add_username_to_whitelist, remove_username_from_whitelist, User
+    add_username_to_whitelist, remove_username_from_whitelist, User, \
+    OrionReport
 from .templatetags.group_filters import has_group
-from .utils import redirect_home, agreed_to_terms, not_support_staff, \
-    offset_month_and_year
-from .utils import send_notification
-from .utils.faculty_mapping import FACULTIES, FACULTY_MAPPING
+from .utils import redirect_home, agreed_to_terms, not_support_staff
+from .utils import orion, send_notification
 from .utils.freshdesk import create_ticket
 
 import researcher_desktop.views as rdesk_views
 
 from vm_manager.constants import NO_VM
-from vm_manager.utils.utils import get_nectar
 from vm_manager.views import desktop_limit_check
 
 logger = logging.getLogger(__name__)
 
 utc = timezone.utc
 
+# The users are read from the database, and shown, in batches of these
+REPORT_CHUNK_SIZE = 2000
+USER_REPORT_PAGE_SIZE = 100
 
-def _get_users_for_report():
-    # backend = ResplatLDAPBackend()
-    django_users = User.objects.filter(is_active=True).order_by('date_joined')
-    users = []
-    num = 1
-    for django_user in django_users:
-        user = {'id': django_user.id,
-                'name': django_user.get_full_name(),
-                'username': django_user.username,
-                'email': django_user.email,
-                'date_joined': django_user.date_joined, 'num': num}
-        # ldap_user = backend.get_user(django_user.id).ldap_user.attrs
-        # if ldap_user:
-        #     user['department'] = ldap_user['department']
-        #     user['person_type'] = ldap_user['auedupersontype'][0]
-        # else:
-        user['department'] = [""]
-        user['person_type'] = ""
-        users.append(user)
-        num += 1
-    return users
+
+# The columns of the user report CSV
+USER_REPORT_COLUMNS = ['id', 'name', 'username', 'email', 'date_joined',
+                       'num', 'department', 'person_type']
+
+
+class _Echo:
+    """A file-like object that returns what is written to it."""
+
+    def write(self, value):
+        return value
+
+
+def _get_user_report_rows():
+    """Generate the user report rows (in USER_REPORT_COLUMNS order)."""
+
+    users = User.objects.filter(is_active=True) \
+        .order_by('date_joined', 'id') \
+        .values_list('id', 'first_name', 'last_name', 'username',
+                     'email', 'date_joined')
+    for num, (id, first_name, last_name, username, email, date_joined) \
+            in enumerate(users.iterator(chunk_size=REPORT_CHUNK_SIZE),
+                         start=1):
+        # The users' departments and roles aren't known (they used to
+        # come from LDAP)
+        name = f"{first_name} {last_name}".strip()
+        yield [id, name, username, email, date_joined, num, "", ""]
+
+
+def _get_user_growth():
+    """Get the number of active users who had joined by each day."""
+
+    days = User.objects.filter(is_active=True) \
+        .annotate(day=TruncDate('date_joined', tzinfo=utc)) \
+        .values('day').annotate(count=Count('id')).order_by('day')
+    total = 0
+    growth = []
+    for day in days:
+        total += day['count']
+        growth.append({'date': day['day'], 'num': total})
+    return growth
 
 
 @login_required(login_url='login')
@@ -81,19 +102,16 @@ def user_search(request):
 
     # Download csv of all users on the site
     if request.method == 'POST':
-        users = _get_users_for_report()
-        response = HttpResponse(content_type='text/csv')
+        writer = csv.writer(_Echo())
+        rows = itertools.chain([USER_REPORT_COLUMNS], _get_user_report_rows())
+        response = StreamingHttpResponse(
+            (writer.writerow(row) for row in rows), content_type='text/csv')
         response['Content-Disposition'] = \
             'attachment; filename="Orion_User_Report.csv"'
-        writer = csv.writer(response)
-        columns = [key for key in users[0].keys()]
-        writer.writerow(columns)
-        for user in users:
-            writer.writerow([user[key] for key in columns])
         return response
 
     # Search for users
-    if request.GET:
+    if request.GET and 'page' not in request.GET:
         form = UserSearchForm(request.GET)
         users = []
         return render(request, 'researcher_workspace/staff/user_search.html',
@@ -101,11 +119,16 @@ def user_search(request):
 
     # Show user reporting page
     form = UserSearchForm()
-    users = _get_users_for_report()
+    users = User.objects.filter(is_active=True).order_by('date_joined', 'id')
+    dates = users.aggregate(first_date=Min('date_joined'),
+                            last_date=Max('date_joined'))
+    page = Paginator(users.only('id', 'first_name', 'last_name', 'username',
+                                'email', 'date_joined'),
+                     USER_REPORT_PAGE_SIZE).get_page(
+        request.GET.get('page'))
     return render(request, 'researcher_workspace/staff/user_reporting.html',
-                  {'users': users, 'form': form,
-                   'first_date': users[0]['date_joined'],
-                   'last_date': users[-1]['date_joined']})
+                  {'page': page, 'form': form,
+                   'growth': _get_user_growth(), **dates})
 
 
 @login_required(login_url='login')
@@ -137,89 +160,47 @@ def orion_report(request):
     if not (request.user.is_staff or has_group(request.user, 'Support Staff')):
         return custom_page_not_found(request)
     if request.method != 'POST':
+        context = rdesk_views.rd_report_page()
+        context['reports'] = OrionReport.objects.select_related(
+            'requested_by').order_by('-created')[:5]
         return render(request,
                       'researcher_workspace/staff/orion_reporting.html',
-                      rdesk_views.rd_report_page())
+                      context)
     reporting_months = int(request.POST.get("reporting_months", "6"))
     if reporting_months < 1:
         raise ValueError(f"{request.user} requested Orion reporting "
                          "for reporting_months < 1")
-    output = BytesIO()
-    writer = pandas.ExcelWriter(output, engine='xlsxwriter')
-    vm_report = rdesk_views.rd_report(reporting_months)
-    users = _get_users_for_report()
-    now = datetime.now(utc)
-    user_count = dict([(offset_month_and_year(month_offset, now.month,
-                                              now.year),
-                        FACULTIES.copy())
-                       for month_offset in range(reporting_months, 0, -1)])
-    for user in users:
-        user["simple_date"] = (user["date_joined"].month,
-                               user["date_joined"].year)
-    for date in user_count:
-        for user in [user for user in users
-                     if user["simple_date"][1] < date[1]
-                     or (user["simple_date"][1] == date[1]
-                         and user["simple_date"][0] <= date[0])]:
-            try:
-                user_count[date][FACULTY_MAPPING[user["department"][0]]] += 1
-            except KeyError:
-                user_count[date]['NOT_MAPPED'] += 1
-            user_count[date]['Total'] += 1
-
-    user_count_report = [
-        [f"01/{month[0]}/{month[1]}"] + [user_count[month][faculty]
-                                         for faculty in FACULTIES.keys()]
-        for month in user_count.keys()]
-    user_count_report_data_frame = pandas.DataFrame(
-        user_count_report, columns=['Month'] + list(FACULTIES.keys()))
-    user_count_report_data_frame.to_excel(writer, sheet_name="User growth")
-    for report in vm_report:
-        report_data_frame = pandas.DataFrame(
-            [[f"01/{month[0]}/{month[1]}"] + [value[1][month]
-                                              for value in report["values"]]
-             for month in report["values"][0][1].keys()],
-            columns=['Month'] + [os for os, values in report["values"]])
-        report_data_frame.to_excel(writer, sheet_name=report["name"])
-
-    # Project Usage Count
-    n = get_nectar()
-    if not settings.OS_PROJECT_ID:
-        logger.info("No usage info available: project id not configured")
-    else:
-        usage_count = dict(
-            [(offset_month_and_year(month_offset, now.month, now.year),
-              USAGE.copy())
-             for month_offset in range(reporting_months, 0, -1)])
-        for date in usage_count:
-            start_date = datetime(day=1, month=date[0], year=date[1])
-            end_date = start_date + relativedelta(months=+1)
-            usage = n.nova.usage.get(settings.OS_PROJECT_ID,
-                                     start_date, end_date)
-            usage_count[date]['CPU Hours'] = round(usage.total_vcpus_usage, 2)
-            usage_count[date]['Disk GB-Hours'] = \
-                round(usage.total_local_gb_usage, 2)
-            usage_count[date]['RAM MB-Hours'] = \
-                round(usage.total_memory_mb_usage, 2)
-            usage_count[date]['Servers Activity'] = len(usage.server_usages)
-
-            usage_report = [
-                [f"01/{month[0]}/{month[1]}"] + [usage_count[month][usage]
-                                                 for usage in USAGE.keys()]
-                for month in usage_count.keys()]
-            usage_report_data_frame = pandas.DataFrame(
-                usage_report, columns=['Month'] + list(USAGE.keys()))
-            usage_report_data_frame.to_excel(writer,
-                                             sheet_name="Project Usage")
-
-    writer.save()
-    output.seek(0)
-    response = StreamingHttpResponse(
-        output,
-        content_type=('application/vnd.openxmlformats-officedocument'
-                      '.spreadsheetml.sheet'))
-    response['Content-Disposition'] = 'attachment; filename=Orion_Report.xlsx'
-    return response
+    orion.request_report(request.user, reporting_months)
+    messages.info(request, "The Orion report is being generated. "
+                  "It can be downloaded from this page when it is ready.")
+    return HttpResponseRedirect(reverse('orion_report'))
+
+
+def _get_orion_report(request, report_id):
+    if not (request.user.is_staff or has_group(request.user, 'Support Staff')):
+        raise Http404()
+    try:
+        return OrionReport.objects.get(pk=report_id)
+    except OrionReport.DoesNotExist:
+        raise Http404()
+
+
+@login_required(login_url='login')
+def orion_report_status(request, report_id):
+    report = _get_orion_report(request, report_id)
+    return JsonResponse({'progress': report.progress,
+                         'finished': report.finished is not None,
+                         'error': report.error})
+
+
+@login_required(login_url='login')
+def orion_report_download(request, report_id):
+    report = _get_orion_report(request, report_id)
+    if not report.file_name:
+        raise Http404()
+    return FileResponse(orion.get_storage().open(report.file_name, 'rb'),
+                        as_attachment=True, filename=orion.REPORT_NAME,
+                        content_type=orion.REPORT_CONTENT_TYPE)
 
 
 def index(request):
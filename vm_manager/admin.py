@@ -10,7 +10,9 @@ from django_admin_listfilter_dropdown.filters import DropdownFilter
 
 
 from vm_manager.constants import VM_OKAY, NO_VM
-from vm_manager.models import Instance, Volume, Resize, Expiration, VMStatus
+from vm_manager.models import Instance, Volume, Resize, \
+    ResourceExpiration, ResizeExpiration, BackupExpiration, VMStatus, \
+    WorkflowRun, WorkflowStep, PooledVolume, DailyUsage
 from vm_manager.utils.expiry import InstanceExpiryPolicy, \
     VolumeExpiryPolicy, BoostExpiryPolicy
 from vm_manager.vm_functions.admin_functionality import \
@@ -98,7 +100,7 @@ def admin_check_vmstatuses(modelAdmin, request, queryset):
         admin_check_vmstatus(request, vmstatus)
 
 
-@admin.register(Expiration)
+@admin.register(ResourceExpiration, ResizeExpiration, BackupExpiration)
 class ExpirationAdmin(admin.ModelAdmin):
     list_filter = [('id', DropdownFilter),
                    ('stage', DropdownFilter), 'stage_date']
@@ -120,7 +122,8 @@ class Expirable(object):
                 '<div style="white-space: nowrap">{}</div>'
                 '<br><a href="{}" class="button">Open</a>'.format(
                     localize(localtime(obj.expiration.expires)),
-                    reverse("admin:vm_manager_expiration_change",
+                    reverse("admin:vm_manager_"
+                            f"{obj.expiration._meta.model_name}_change",
                             args=(obj.expiration.pk,))
                 ))
         else:
@@ -344,4 +347,70 @@ class VMStatusAdmin(admin.ModelAdmin):
         return settings.DEBUG
 
 
+class WorkflowStepInline(admin.TabularInline):
+    model = WorkflowStep
+    extra = 0
+    fields = ('func', 'created', 'reached', 'started', 'finished',
+              'outcome', 'deadline', 'attempts', 'job_id')
+    readonly_fields = fields
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(WorkflowRun)
+class WorkflowRunAdmin(admin.ModelAdmin):
+    list_filter = ['kind', 'outcome', 'desktop_type', 'zone', 'created',
+                   'finished']
+    readonly_fields = ('id', 'kind', 'desktop_type', 'zone', 'created',
+                       'finished', 'outcome')
+    ordering = ('-created',)
+    inlines = [WorkflowStepInline]
+    list_display = (
+        '__str__',
+        'kind',
+        'created',
+        'finished',
+        'outcome',
+    )
+
+    def has_delete_permission(self, request, obj=None):
+        return settings.DEBUG
+
+
+@admin.register(PooledVolume)
+class PooledVolumeAdmin(admin.ModelAdmin):
+    list_filter = ['operating_system', 'zone', 'build', 'created', 'ready']
+    readonly_fields = ('id', 'operating_system', 'zone', 'image', 'build',
+                       'size', 'created', 'ready')
+    ordering = ('operating_system', 'zone', 'created')
+    list_display = (
+        '__str__',
+        'build',
+        'created',
+        'ready',
+    )
+
+
+@admin.register(DailyUsage)
+class DailyUsageAdmin(admin.ModelAdmin):
+    list_filter = ['operating_system', 'zone', 'date']
+    readonly_fields = ('date', 'operating_system', 'zone', 'created',
+                       'deleted', 'errored', 'boosted', 'reverted',
+                       'instances', 'peak', 'boosts')
+    ordering = ('-date', 'operating_system', 'zone')
+    list_display = (
+        '__str__',
+        'instances',
+        'peak',
+        'boosts',
+        'created',
+        'deleted',
+        'errored',
+    )
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
 admin.site.disable_action('delete_selected')
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class VmManagerConfig(AppConfig):
     name = 'vm_manager'
+
+    def ready(self):
+        import vm_manager.signals  # noqa
@@ -63,6 +63,14 @@ WF_RETRY = 'failed_retryable'
 # Workflow failed - non-retryable
 WF_FAIL = 'failed'
 
+# Workflow kinds.  These are recorded on WorkflowRun.
+WF_LAUNCH = 'launch'
+WF_SHELVE = 'shelve'
+WF_DELETE = 'delete'
+WF_ARCHIVE = 'archive'
+WF_RESIZE = 'resize'
+WF_REBOOT = 'reboot'
+
 # Button names
 REBOOT_BUTTON = "REBOOT_BUTTON"
 SHELVE_BUTTON = "SHELVE_BUTTON"
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from vm_manager.utils.catalogue import CATALOGUE_KINDS, HIT, MISS, \
+    get_stats, invalidate, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Show the catalogue cache statistics, or invalidate the cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invalidate', choices=CATALOGUE_KINDS,
+                            action='append',
+                            help='Invalidate the cached entries of a kind')
+        parser.add_argument('--reset-stats', action='store_true',
+                            help='Reset the hit and miss counts')
+
+    def handle(self, *args, **options):
+        for kind in options['invalidate'] or []:
+            invalidate(kind)
+        for kind, counts in get_stats().items():
+            self.stdout.write(
+                f"{kind}: {counts[HIT]} hits, {counts[MISS]} misses")
+        if options['reset_stats']:
+            reset_stats()
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from vm_manager.utils.query_plans import SUPPORTED_VENDORS, analyze, \
+    check_query_plans, seed
+
+
+class Command(BaseCommand):
+    help = ('Check that the vm_manager model manager methods use indexes, '
+            'in a throwaway database seeded with a large dataset')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000,
+                            help='The number of users to seed')
+        parser.add_argument('--noinput', '--no-input', action='store_false',
+                            dest='interactive',
+                            help='Replace an existing test database '
+                            'without asking')
+
+    def handle(self, *args, **options):
+        if connection.vendor not in SUPPORTED_VENDORS:
+            raise CommandError(
+                f"Can't check {connection.vendor} query plans; the "
+                f"supported databases are {', '.join(SUPPORTED_VENDORS)}")
+
+        # The dataset goes in a test database, like the one that the
+        # tests use, which is destroyed afterwards
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(
+            verbosity=options['verbosity'],
+            autoclobber=not options['interactive'], serialize=False)
+        try:
+            user = seed(options['users'])
+            analyze()
+            results = check_query_plans(user)
+        finally:
+            connection.creation.destroy_test_db(
+                old_name, verbosity=options['verbosity'])
+
+        failed = 0
+        for name, queries in results.items():
+            if queries is None:
+                failed += 1
+                self.stdout.write(f"{name}: not checked")
+                continue
+            problems = [problem for _, _, problems in queries
+                        for problem in problems]
+            if problems:
+                failed += 1
+            self.stdout.write(
+                f"{name}: {', '.join(problems) if problems else 'ok'}")
+            if problems or options['verbosity'] > 1:
+                for sql, plan, _ in queries:
+                    self.stdout.write(f"  {sql}")
+                    for row in plan:
+                        self.stdout.write(f"    {row}")
+        if failed:
+            raise CommandError(
+                f"{failed} of {len(results)} manager methods don't use "
+                "indexes")
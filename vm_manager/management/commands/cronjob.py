@@ -5,6 +5,8 @@ from django.core.management.base import BaseCommand
 from researcher_desktop.utils.utils import desktops_feature
 from vm_manager.utils.expirer import VolumeExpirer, InstanceExpirer, \
     ResizeExpirer, ArchiveExpirer
+from vm_manager.utils.usage import update_daily_usage
+from vm_manager.utils.volume_pool import VolumePool
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +23,10 @@ class Command(BaseCommand):
                             help='Run the archive job')
         parser.add_argument('--delete-archives', action='store_true',
                             help='Run the archive deletion job')
+        parser.add_argument('--refill-pool', action='store_true',
+                            help='Run the volume pool refill job')
+        parser.add_argument('--rollup-usage', action='store_true',
+                            help='Run the daily usage rollup job')
         parser.add_argument('--dry-run', action='store_true',
                             help='Only count the affected objects')
         parser.add_argument('--verbose', action='store_true',
@@ -40,6 +46,10 @@ class Command(BaseCommand):
             self.archive_job()
         if options['delete_archives']:
             self.delete_archives_job()
+        if options['refill_pool']:
+            self.refill_pool_job()
+        if options['rollup_usage']:
+            self.rollup_usage_job()
 
     def downsize_job(self):
         feature = desktops_feature()
@@ -68,3 +78,16 @@ class Command(BaseCommand):
         expirer = ArchiveExpirer(dry_run=self.dry_run, verbose=self.verbose)
         counts = expirer.run(feature)
         logger.info(f"Archive deletion counts: {counts}")
+
+    def refill_pool_job(self):
+        logger.info("Starting volume pool refill")
+        pool = VolumePool(dry_run=self.dry_run)
+        counts = pool.run()
+        logger.info(f"Volume pool counts: {counts}")
+
+    def rollup_usage_job(self):
+        logger.info("Starting daily usage rollup")
+        if self.dry_run:
+            return
+        rows = update_daily_usage()
+        logger.info(f"Daily usage rows: {rows}")
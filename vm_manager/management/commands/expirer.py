@@ -0,0 +1,57 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from prometheus_client import start_http_server
+
+from researcher_workspace.metrics import SnapshotRefresher
+from vm_manager.utils.expirer_daemon import ExpirerDaemon, EXPIRY_JOBS
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Run the expiry jobs on a schedule, as a resident process'
+
+    def add_arguments(self, parser):
+        for job in EXPIRY_JOBS:
+            option = job.replace('_', '-')
+            parser.add_argument(
+                f'--{option}-interval', type=int,
+                default=settings.EXPIRER_INTERVALS[job],
+                help=f'Seconds between {job} job runs; 0 to disable')
+        parser.add_argument('--metrics-snapshot-interval', type=int,
+                            default=settings.METRICS_SNAPSHOT_INTERVAL,
+                            help='Seconds between refreshes of the fleet '
+                            'statistics; 0 to disable')
+        parser.add_argument('--metrics-port', type=int,
+                            default=settings.EXPIRER_METRICS_PORT,
+                            help='Serve Prometheus metrics on this port')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count the affected objects')
+        parser.add_argument('--verbose', action='store_true',
+                            help='In dry-run mode, output the emails')
+
+    def handle(self, *args, **options):
+        intervals = {job: options[f'{job}_interval']
+                     for job in EXPIRY_JOBS if options[f'{job}_interval']}
+        if not intervals:
+            raise CommandError("All of the expiry jobs are disabled")
+        if options['metrics_port']:
+            start_http_server(options['metrics_port'])
+        daemon = ExpirerDaemon(intervals, dry_run=options['dry_run'],
+                               verbose=options['verbose'])
+        refresher = None
+        if options['metrics_snapshot_interval']:
+            # Only the leader refreshes the fleet statistics
+            refresher = SnapshotRefresher(
+                options['metrics_snapshot_interval'],
+                should_refresh=daemon.owns_lock)
+            refresher.start()
+        logger.info(f"Starting expirer with intervals {intervals}")
+        try:
+            daemon.loop(tick=daemon.heartbeat)
+        finally:
+            if refresher:
+                refresher.stop()
+            daemon.release()
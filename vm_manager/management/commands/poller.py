@@ -0,0 +1,35 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vm_manager.utils.poller import Poller
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Resolve the workflows' pending waits for OpenStack resources"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling every --interval seconds')
+        parser.add_argument('--interval', type=int,
+                            default=settings.POLLER_INTERVAL,
+                            help='Seconds between polling passes')
+
+    def handle(self, *args, **options):
+        poller = Poller()
+        while True:
+            start = time.monotonic()
+            try:
+                poller.run()
+            except Exception:
+                if not options['loop']:
+                    raise
+                logger.exception("Polling pass failed")
+            if not options['loop']:
+                return
+            time.sleep(max(0, options['interval']
+                           - (time.monotonic() - start)))
@@ -0,0 +1,35 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vm_manager.utils.reconciler import Reconciler
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Record the observed OpenStack state of instances and volumes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep reconciling every --interval seconds')
+        parser.add_argument('--interval', type=int,
+                            default=settings.RECONCILE_INTERVAL,
+                            help='Seconds between reconciliation passes')
+
+    def handle(self, *args, **options):
+        reconciler = Reconciler()
+        while True:
+            start = time.monotonic()
+            try:
+                reconciler.run()
+            except Exception:
+                if not options['loop']:
+                    raise
+                logger.exception("Reconciliation pass failed")
+            if not options['loop']:
+                return
+            time.sleep(max(0, options['interval']
+                           - (time.monotonic() - start)))
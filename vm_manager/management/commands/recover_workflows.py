@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from vm_manager.utils.recovery import recover_runs
+
+
+class Command(BaseCommand):
+    help = 'Re-arm unfinished workflow runs whose rq jobs or waits are lost'
+
+    def handle(self, *args, **options):
+        counts = recover_runs()
+        self.stdout.write(
+            ", ".join(f"{name}: {count}" for name, count in counts.items()))
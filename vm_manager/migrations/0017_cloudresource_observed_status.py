@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 02:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0016_allow_blank_expiries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cloudresource',
+            name='observed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='cloudresource',
+            name='observed_status',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0017_cloudresource_observed_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkflowRun',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID')),
+                ('kind', models.CharField(
+                    blank=True, max_length=16, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('outcome', models.CharField(
+                    blank=True, max_length=32, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WorkflowStep',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID')),
+                ('func', models.CharField(max_length=255)),
+                ('args', models.JSONField(default=list)),
+                ('kwargs', models.JSONField(default=dict)),
+                ('wait', models.JSONField(blank=True, null=True)),
+                ('deadline', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('job_id', models.CharField(
+                    blank=True, max_length=64, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('outcome', models.CharField(
+                    blank=True, max_length=32, null=True)),
+                ('run', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='steps', to='vm_manager.workflowrun')),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0018_workflowrun_workflowstep'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workflowrun',
+            name='desktop_type',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='workflowrun',
+            name='zone',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='workflowstep',
+            name='reached',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='workflowstep',
+            index=models.Index(fields=['func', 'reached'],
+                               name='vm_manager__func_f4e81b_idx'),
+        ),
+    ]
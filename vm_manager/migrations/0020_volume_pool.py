@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:58
+
+from django.db import migrations, models
+import researcher_workspace.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0019_workflow_step_timings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PooledVolume',
+            fields=[
+                ('id', researcher_workspace.models.Char32UUIDField(
+                    editable=False, primary_key=True, serialize=False)),
+                ('operating_system', models.CharField(max_length=20)),
+                ('zone', models.CharField(max_length=32)),
+                ('image', models.CharField(max_length=100)),
+                ('build', models.IntegerField(default=0)),
+                ('size', models.IntegerField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('ready', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0020_volume_pool'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='instance',
+            name='guac_inputs',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='instance',
+            name='guac_url',
+            field=models.CharField(blank=True, max_length=1024, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0021_instance_guac_url'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='instance',
+            index=models.Index(fields=['ip_address'],
+                               name='vm_manager__ip_addr_3c047a_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0022_instance_ip_address_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cloudresource',
+            index=models.Index(
+                fields=['user', 'deleted', 'marked_for_deletion'],
+                name='vm_manager__user_id_27a914_idx'),
+        ),
+    ]
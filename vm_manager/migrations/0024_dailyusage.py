@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0023_cloudresource_live_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyUsage',
+            fields=[
+                ('id', models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID')),
+                ('date', models.DateField()),
+                ('operating_system', models.CharField(max_length=20)),
+                ('zone', models.CharField(
+                    blank=True, max_length=32, null=True)),
+                ('created', models.IntegerField(default=0)),
+                ('deleted', models.IntegerField(default=0)),
+                ('errored', models.IntegerField(default=0)),
+                ('boosted', models.IntegerField(default=0)),
+                ('reverted', models.IntegerField(default=0)),
+                ('instances', models.IntegerField(default=0)),
+                ('peak', models.IntegerField(default=0)),
+                ('boosts', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Daily usage',
+                'constraints': [models.UniqueConstraint(
+                    fields=('operating_system', 'date', 'zone'),
+                    name='unique_daily_usage')],
+            },
+        ),
+    ]
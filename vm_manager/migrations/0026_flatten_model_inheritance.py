@@ -0,0 +1,283 @@
+# Flatten the CloudResource and Expiration multi-table inheritance.
+#
+# CloudResource and Expiration become abstract models, so each of
+# Instance, Volume and the three kinds of Expiration gets the inherited
+# columns in its own table.  The parent rows are copied into the child
+# tables, and then the parent tables are dropped.
+#
+# Each child table keeps its primary key column, so the foreign keys
+# that point at them stay valid.  The column is renamed from
+# '<parent>_ptr_id' to 'id' as a separate step, because SQLite only
+# updates the references for a plain column rename.
+#
+# Reversing this migration copies the parent rows back.  That fails if
+# two kinds of Expiration have since been given the same id.
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+from researcher_workspace import models as workspace_models
+
+
+# The fields that move from the parents to the children
+RESOURCE_FIELDS = ['user', 'created', 'expiration', 'marked_for_deletion',
+                   'deleted', 'error_flag', 'error_message',
+                   'observed_status', 'observed_at']
+EXPIRATION_FIELDS = ['expires', 'stage', 'stage_date']
+
+RESOURCES = ['Volume', 'Instance']
+EXPIRATIONS = ['ResourceExpiration', 'ResizeExpiration', 'BackupExpiration']
+
+
+class AlterModelBases(migrations.operations.base.Operation):
+    """Change a model's bases in the migration state.
+
+    The autodetector doesn't notice a model's bases changing; the
+    database changes are done by the other operations.
+    """
+
+    reduces_to_sql = True
+    reversible = True
+
+    def __init__(self, name, bases):
+        self.name = name
+        self.bases = bases
+
+    def deconstruct(self):
+        return (self.__class__.__name__, [],
+                {'name': self.name, 'bases': self.bases})
+
+    def state_forwards(self, app_label, state):
+        state.models[app_label, self.name.lower()].bases = self.bases
+        state.reload_model(app_label, self.name.lower(), delay=False)
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        pass
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        pass
+
+    def describe(self):
+        return f"Alter bases of {self.name}"
+
+
+def copy_fields(parent_name, child_names, fields):
+    def copy(apps, schema_editor):
+        # One UPDATE per child table, rather than a query per row
+        parent = apps.get_model('vm_manager', parent_name)
+        for child_name in child_names:
+            child = apps.get_model('vm_manager', child_name)
+            parents = parent.objects.filter(pk=OuterRef('pk'))
+            child.objects.update(**{
+                field: Subquery(parents.values(field)[:1])
+                for field in fields})
+    return copy
+
+
+def restore_parents(parent_name, child_names, fields):
+    def restore(apps, schema_editor):
+        parent = apps.get_model('vm_manager', parent_name)
+        attnames = ['id'] + [parent._meta.get_field(field).attname
+                             for field in fields]
+        for child_name in child_names:
+            child = apps.get_model('vm_manager', child_name)
+            parent.objects.bulk_create(
+                [parent(**row) for row in child.objects.values(*attnames)],
+                batch_size=1000)
+            if 'created' in fields:
+                # bulk_create sets the auto_now_add fields
+                children = child.objects.filter(pk=OuterRef('pk'))
+                parent.objects.filter(pk__in=child.objects.values('pk')) \
+                    .update(created=Subquery(
+                        children.values('created')[:1]))
+    return restore
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0025_reconciliationreport'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # CloudResource -> Volume and Instance
+        *[AlterModelBases(name=name, bases=(models.Model,))
+          for name in RESOURCES],
+        *[operation for name in RESOURCES for operation in [
+            migrations.AddField(
+                model_name=name.lower(),
+                name='user',
+                field=models.ForeignKey(
+                    null=True,
+                    on_delete=django.db.models.deletion.PROTECT,
+                    to=settings.AUTH_USER_MODEL),
+            ),
+            migrations.AddField(
+                model_name=name.lower(),
+                name='created',
+                field=models.DateTimeField(null=True),
+            ),
+            migrations.AddField(
+                model_name=name.lower(),
+                name='expiration',
+                field=models.OneToOneField(
+                    blank=True, null=True,
+                    on_delete=django.db.models.deletion.CASCADE,
+                    related_name='expiration_for_%(class)s',
+                    to='vm_manager.resourceexpiration'),
+            ),
+            migrations.AddField(
+                model_name=name.lower(),
+                name='marked_for_deletion',
+                field=models.DateTimeField(blank=True, null=True),
+            ),
+            migrations.AddField(
+                model_name=name.lower(),
+                name='deleted',
+                field=models.DateTimeField(blank=True, null=True),
+            ),
+            migrations.AddField(
+                model_name=name.lower(),
+                name='error_flag',
+                field=models.DateTimeField(blank=True, null=True),
+            ),
+            migrations.AddField(
+                model_name=name.lower(),
+                name='error_message',
+                field=models.TextField(blank=True, null=True),
+            ),
+            migrations.AddField(
+                model_name=name.lower(),
+                name='observed_status',
+                field=models.CharField(blank=True, max_length=32,
+                                       null=True),
+            ),
+            migrations.AddField(
+                model_name=name.lower(),
+                name='observed_at',
+                field=models.DateTimeField(blank=True, null=True),
+            ),
+        ]],
+        migrations.RunPython(
+            copy_fields('CloudResource', RESOURCES, RESOURCE_FIELDS),
+            reverse_code=migrations.RunPython.noop),
+        *[operation for name in RESOURCES for operation in [
+            migrations.AlterField(
+                model_name=name.lower(),
+                name='user',
+                field=models.ForeignKey(
+                    on_delete=django.db.models.deletion.PROTECT,
+                    to=settings.AUTH_USER_MODEL),
+            ),
+            migrations.AlterField(
+                model_name=name.lower(),
+                name='created',
+                field=models.DateTimeField(auto_now_add=True),
+            ),
+            migrations.AlterField(
+                model_name=name.lower(),
+                name='cloudresource_ptr',
+                field=workspace_models.Char32UUIDField(
+                    db_column='cloudresource_ptr_id', editable=False,
+                    primary_key=True, serialize=False),
+            ),
+            migrations.RenameField(
+                model_name=name.lower(),
+                old_name='cloudresource_ptr',
+                new_name='id',
+            ),
+            migrations.AlterField(
+                model_name=name.lower(),
+                name='id',
+                field=workspace_models.Char32UUIDField(
+                    editable=False, primary_key=True, serialize=False),
+            ),
+        ]],
+        migrations.RunPython(
+            migrations.RunPython.noop,
+            reverse_code=restore_parents('CloudResource', RESOURCES,
+                                         RESOURCE_FIELDS)),
+        migrations.DeleteModel(
+            name='CloudResource',
+        ),
+        migrations.AddIndex(
+            model_name='volume',
+            index=models.Index(
+                fields=['user', 'deleted', 'marked_for_deletion'],
+                name='vm_manager__user_id_547fca_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instance',
+            index=models.Index(
+                fields=['user', 'deleted', 'marked_for_deletion'],
+                name='vm_manager__user_id_08f45b_idx'),
+        ),
+
+        # Expiration -> ResourceExpiration, ResizeExpiration and
+        # BackupExpiration
+        *[AlterModelBases(name=name, bases=(models.Model,))
+          for name in EXPIRATIONS],
+        *[operation for name in EXPIRATIONS for operation in [
+            migrations.AddField(
+                model_name=name.lower(),
+                name='expires',
+                field=models.DateTimeField(null=True),
+            ),
+            migrations.AddField(
+                model_name=name.lower(),
+                name='stage',
+                field=models.IntegerField(default=0),
+            ),
+            migrations.AddField(
+                model_name=name.lower(),
+                name='stage_date',
+                field=models.DateTimeField(null=True),
+            ),
+        ]],
+        migrations.RunPython(
+            copy_fields('Expiration', EXPIRATIONS, EXPIRATION_FIELDS),
+            reverse_code=migrations.RunPython.noop),
+        *[operation for name in EXPIRATIONS for operation in [
+            migrations.AlterField(
+                model_name=name.lower(),
+                name='expires',
+                field=models.DateTimeField(),
+            ),
+            migrations.AlterField(
+                model_name=name.lower(),
+                name='stage_date',
+                field=models.DateTimeField(),
+            ),
+            migrations.AlterField(
+                model_name=name.lower(),
+                name='expiration_ptr',
+                field=models.AutoField(
+                    auto_created=True, db_column='expiration_ptr_id',
+                    primary_key=True, serialize=False, verbose_name='ID'),
+            ),
+            migrations.RenameField(
+                model_name=name.lower(),
+                old_name='expiration_ptr',
+                new_name='id',
+            ),
+            migrations.AlterField(
+                model_name=name.lower(),
+                name='id',
+                field=models.AutoField(
+                    auto_created=True, primary_key=True, serialize=False,
+                    verbose_name='ID'),
+            ),
+        ]],
+        migrations.RunPython(
+            migrations.RunPython.noop,
+            reverse_code=restore_parents('Expiration', EXPIRATIONS,
+                                         EXPIRATION_FIELDS)),
+        migrations.DeleteModel(
+            name='Expiration',
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0026_flatten_model_inheritance'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='backupexpiration',
+            index=models.Index(fields=['stage', 'expires'],
+                               name='vm_manager__stage_f9018b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='instance',
+            index=models.Index(fields=['boot_volume', 'created'],
+                               name='vm_manager__boot_vo_1f6665_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resize',
+            index=models.Index(fields=['instance', 'requested'],
+                               name='vm_manager__instanc_e056eb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resizeexpiration',
+            index=models.Index(fields=['stage', 'expires'],
+                               name='vm_manager__stage_cf4ece_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resourceexpiration',
+            index=models.Index(fields=['stage', 'expires'],
+                               name='vm_manager__stage_3831c5_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vmstatus',
+            index=models.Index(
+                fields=['user', 'operating_system', 'requesting_feature',
+                        'created'],
+                name='vm_manager__user_id_d7e0c7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='volume',
+            index=models.Index(
+                fields=['user', 'operating_system', 'requesting_feature',
+                        'deleted', 'marked_for_deletion'],
+                name='vm_manager__user_id_cc5942_idx'),
+        ),
+    ]
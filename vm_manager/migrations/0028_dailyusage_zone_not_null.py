@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:43
+
+from django.db import migrations, models
+
+
+def clear_rollup(apps, schema_editor):
+    # The rows with a NULL zone may be duplicates, so the rollup is
+    # cleared.  The expirer's rollup_usage job rebuilds it from the
+    # Instances and Resizes on its next run.
+    DailyUsage = apps.get_model('vm_manager', 'DailyUsage')
+    DailyUsage.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0027_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_rollup,
+                             reverse_code=migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='dailyusage',
+            name='zone',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:00
+
+from django.db import migrations, models
+
+
+def mark_ready(apps, schema_editor):
+    # The existing statuses' desktops are treated as having been ready
+    # already, so that their next reboot or resize isn't timed as a
+    # launch
+    VMStatus = apps.get_model('vm_manager', 'VMStatus')
+    VMStatus.objects.update(ready=models.F('created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0028_dailyusage_zone_not_null'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vmstatus',
+            name='ready',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_ready,
+                             reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vm_manager', '0029_vmstatus_ready'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='instance',
+            index=models.Index(
+                fields=['ip_address', 'marked_for_deletion', 'error_flag'],
+                name='vm_manager__ip_addr_ac2ac5_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='instance',
+            name='vm_manager__ip_addr_3c047a_idx',
+        ),
+    ]
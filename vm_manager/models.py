@@ -1,11 +1,13 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+import hashlib
 import logging
 import nanoid
+import re
 import string
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connections, models, router, transaction
 from django.http import Http404
 from django.template.defaultfilters import safe
 
@@ -36,10 +38,17 @@ EXP_EXPIRY_FAILED_RETRYABLE = 6
 
 
 class Expiration(models.Model):
+    # Each kind of expiration has its own table (see the concrete
+    # subclasses below), so that fetching one doesn't need a join
     expires = models.DateTimeField()
     stage = models.IntegerField(default=0)
     stage_date = models.DateTimeField()
 
+    class Meta:
+        abstract = True
+        # For the expirers' scans
+        indexes = [models.Index(fields=['stage', 'expires'])]
+
     def __str__(self):
         return (f"Expires on {self.expires}, stage {self.stage}, "
                 f"stage_date {self.stage_date}")
@@ -83,17 +92,24 @@ class BackupExpiration(Expiration):
 
 
 class CloudResource(models.Model):
+    # The fields common to Instances and Volumes.  This is an abstract
+    # model, so that they are in the Instance and Volume tables and
+    # querying those doesn't need a join.
     id = Char32UUIDField(primary_key=True, editable=False)
     user = models.ForeignKey(User, on_delete=models.PROTECT, )
     created = models.DateTimeField(auto_now_add=True)
     expiration = models.OneToOneField(ResourceExpiration,
                                       on_delete=models.CASCADE,
                                       null=True, blank=True,
-                                      related_name='expiration_for')
+                                      related_name='expiration_for_%(class)s')
     marked_for_deletion = models.DateTimeField(null=True, blank=True)
     deleted = models.DateTimeField(null=True, blank=True)
     error_flag = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(null=True, blank=True)
+    # The resource's status as last observed in OpenStack, either by
+    # the reconciler or by a live lookup.
+    observed_status = models.CharField(max_length=32, null=True, blank=True)
+    observed_at = models.DateTimeField(null=True, blank=True)
 
     def error(self, msg, gone=False):
         self.error_flag = datetime.now(utc)
@@ -110,9 +126,36 @@ class CloudResource(models.Model):
         Expiration.do_set_expires(self, ResourceExpiration, expires,
                                   stage=stage)
 
+    def set_observed_status(self, status, observed_at=None):
+        """Record an observed OpenStack status for this resource.
+
+        This only updates the observation fields, so that it doesn't
+        clobber concurrent changes to the rest of the row.
+        """
+
+        self.observed_status = status
+        self.observed_at = observed_at or datetime.now(utc)
+        type(self).objects.filter(pk=self.pk).update(
+            observed_status=self.observed_status,
+            observed_at=self.observed_at)
+
+    def observed_status_is_fresh(self, max_age=None):
+        if max_age is None:
+            max_age = settings.OBSERVED_STATUS_MAX_AGE
+        if max_age <= 0 or not self.observed_status or not self.observed_at:
+            return False
+        return (datetime.now(utc) - self.observed_at
+                <= timedelta(seconds=max_age))
+
     def get_expires(self):
         return self.expiration.expires if self.expiration else None
 
+    class Meta:
+        abstract = True
+        # For counting a user's live resources
+        indexes = [models.Index(
+            fields=['user', 'deleted', 'marked_for_deletion'])]
+
 
 class VolumeManager(models.Manager):
     def get_volume(self, user, desktop_type):
@@ -152,6 +195,13 @@ class Volume(CloudResource):
 
     objects = VolumeManager()
 
+    class Meta(CloudResource.Meta):
+        # For get_volume
+        indexes = CloudResource.Meta.indexes + [
+            models.Index(fields=['user', 'operating_system',
+                                 'requesting_feature', 'deleted',
+                                 'marked_for_deletion'])]
+
     def __str__(self):
         return (f"Volume {self.id} of {self.operating_system} "
                 f"for {self.user}")
@@ -187,21 +237,54 @@ def _create_hostname_id():
     return ERROR
 
 
+class PooledVolume(models.Model):
+    """A pre-cloned bootable volume waiting to be claimed by a launch.
+
+    Pooled volumes aren't assigned to a user.  When a launch claims
+    one, it is deleted from the pool and a Volume is created for it.
+    """
+
+    id = Char32UUIDField(primary_key=True, editable=False)
+    operating_system = models.CharField(max_length=20)
+    zone = models.CharField(max_length=32)
+    # The source volume, and its 'nectar_build'
+    image = models.CharField(max_length=100)
+    build = models.IntegerField(default=0)
+    size = models.IntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    # When Cinder reported that the volume was available
+    ready = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return (f"Pooled volume {self.id} of {self.operating_system} "
+                f"in {self.zone}")
+
+
 class InstanceManager(models.Manager):
-    def get_live_instances(self, user, desktop_type):
-        """Get the live instances for a user.
+    def live_instances(self, user, desktop_type=None):
+        """Query the live instances for a user.
 
         In this context, 'live' means not deleted / marked for deletion,
-        and not missing on the OpenStack side.  If 'desktop_type' is not
-        None, also filter by that.
+        and not observed to be missing on the OpenStack side.  This uses
+        the observed (reconciled) status, so it doesn't call Nova.  If
+        'desktop_type' is not None, also filter by that.
         """
 
-        qs = self.filter(user=user, deleted=None, marked_for_deletion=None)
+        qs = self.filter(user=user, deleted=None, marked_for_deletion=None) \
+            .exclude(observed_status=MISSING)
         if desktop_type:
             qs = qs.filter(
                 boot_volume__operating_system=desktop_type.id,
                 boot_volume__requesting_feature=desktop_type.feature)
-        return [i for i in qs if i.get_status != MISSING]
+        return qs
+
+    def get_live_instances(self, user, desktop_type):
+        """Get the live instances for a user, as a list."""
+
+        return list(self.live_instances(user, desktop_type))
+
+    def count_live_instances(self, user, desktop_type=None):
+        return self.live_instances(user, desktop_type).count()
 
     def get_instance(self, user, desktop_type):
         try:
@@ -242,12 +325,7 @@ class InstanceManager(models.Manager):
                     boot_volume__requesting_feature=requesting_feature)
                 return instance
             except Instance.DoesNotExist:
-                instances = self.filter(
-                    ip_address=None,
-                    marked_for_deletion=None, error_flag=None,
-                    boot_volume__requesting_feature=requesting_feature)
-                for instance in instances:
-                    instance.get_ip_addr()
+                self._resolve_ip_address(ip_address, requesting_feature)
                 instance = self.get(
                     ip_address=ip_address,
                     marked_for_deletion=None, error_flag=None,
@@ -263,6 +341,29 @@ class InstanceManager(models.Manager):
             logger.error(error)
             raise error
 
+    def _resolve_ip_address(self, ip_address, requesting_feature):
+        """Record the IP address of the live instance that has it.
+
+        IP addresses are normally recorded when an instance goes ACTIVE.
+        This is the fallback: one Nova list call, filtered by the IP
+        address, rather than a get for each instance without one.
+        """
+
+        candidates = self.filter(
+            ip_address=None, marked_for_deletion=None, error_flag=None,
+            boot_volume__requesting_feature=requesting_feature)
+        if not candidates.exists():
+            return
+        n = get_nectar()
+        # Nova's 'ip' filter is a regex
+        servers = n.nova.servers.list(
+            search_opts={'ip': f"^{re.escape(ip_address)}$"})
+        updated = candidates.filter(
+            pk__in=[server.id for server in servers]) \
+            .update(ip_address=ip_address)
+        logger.info(f"Resolved ip_address={ip_address} for {updated} "
+                    f"of {len(servers)} servers")
+
     # vm_id is untrusted because it comes from the user, so should
     # be handled with care
     def get_instance_by_untrusted_vm_id(self, vm_id, user,
@@ -325,9 +426,21 @@ class Instance(CloudResource):
         on_delete=models.SET_NULL, null=True, blank=True)
     username = models.CharField(max_length=20)
     password = models.CharField(max_length=32)
+    # The Guacamole connection URL, and a digest of the inputs to the
+    # connection's parameters when they were last written
+    guac_url = models.CharField(max_length=1024, null=True, blank=True)
+    guac_inputs = models.CharField(max_length=64, null=True, blank=True)
 
     objects = InstanceManager()
 
+    class Meta(CloudResource.Meta):
+        # For the notify_vm callbacks, which look live instances up by
+        # IP address, and for finding a volume's latest instance
+        indexes = CloudResource.Meta.indexes + [
+            models.Index(fields=['ip_address', 'marked_for_deletion',
+                                 'error_flag']),
+            models.Index(fields=['boot_volume', 'created'])]
+
     def get_ip_addr(self):
         if self.ip_address:
             return self.ip_address
@@ -336,10 +449,28 @@ class Instance(CloudResource):
             nova_server = n.nova.servers.get(self.id)
             for key in nova_server.addresses:
                 self.ip_address = nova_server.addresses[key][0]['addr']
-                self.save()
+            if self.ip_address:
+                Instance.objects.filter(pk=self.pk).update(
+                    ip_address=self.ip_address)
             return self.ip_address
 
+    def _guac_inputs(self):
+        # A digest of the values that the Guacamole connection depends on
+        inputs = [self.ip_address, self.username, self.password,
+                  self.boot_volume.zone]
+        return hashlib.sha256(
+            '\0'.join(str(i) for i in inputs).encode()).hexdigest()
+
     def create_guac_connection(self):
+        """Write the Guacamole connection's parameters and permission.
+
+        The parameters are written as one bulk upsert (or, where the
+        database can't do that, replaced in a transaction).  The connection
+        URL is then cached on the instance, along with a digest of the
+        parameters' inputs, so that get_url() only needs to rewrite them
+        when an input changes.
+        """
+
         params = [
             ('hostname', self.get_ip_addr()),
             ('username', self.username),
@@ -357,50 +488,87 @@ class Instance(CloudResource):
         # This object will be created by the auth backend.
         gentity = GuacamoleEntity.objects.get(name=self.user.email)
 
-        for k, v in params:
-            gcp, created = GuacamoleConnectionParameter.objects.get_or_create(
+        parameters = [
+            GuacamoleConnectionParameter(
                 connection=self.guac_connection,
-                parameter_name=k,
-                defaults={'parameter_value': v})
-            if not created:
-                gcp.parameter_value = v
+                parameter_name=k, parameter_value=v) for k, v in params]
+        db = router.db_for_write(GuacamoleConnectionParameter)
+        if connections[db].features.supports_update_conflicts_with_target:
+            GuacamoleConnectionParameter.objects.bulk_create(
+                parameters, update_conflicts=True,
+                unique_fields=['connection', 'parameter_name'],
+                update_fields=['parameter_value'])
+        else:
+            # MySQL can't upsert on given unique fields, so replace the
+            # parameters instead
+            with transaction.atomic(using=db):
+                GuacamoleConnectionParameter.objects.filter(
+                    connection=self.guac_connection).delete()
+                GuacamoleConnectionParameter.objects.bulk_create(parameters)
 
         GuacamoleConnectionPermission.objects.get_or_create(
             entity=gentity,
             connection=self.guac_connection,
             permission='READ')
 
-    def get_url(self):
-        self.create_guac_connection()
-        url = settings.GUACAMOLE_URL_TEMPLATE.format(
+        self.guac_url = settings.GUACAMOLE_URL_TEMPLATE.format(
             env=settings.ENVIRONMENT_NAME,
             zone=self.boot_volume.zone.lower(),  # lowercase for FQDN
             path=guac_utils.get_connection_path(self.guac_connection)
         )
-        return url
+        self.guac_inputs = self._guac_inputs()
+        # Only update the cache fields, as for set_observed_status
+        Instance.objects.filter(pk=self.pk).update(
+            guac_url=self.guac_url, guac_inputs=self.guac_inputs)
+
+    def get_url(self):
+        if not self.guac_url or self.guac_inputs != self._guac_inputs():
+            self.create_guac_connection()
+        return self.guac_url
 
     def get_status(self):
+        """Get the instance's current status from Nova.
+
+        This always makes a live call, and records the result as the
+        instance's observed status.
+        """
+
         n = get_nectar()
         try:
-            instance_result = n.nova.servers.get(self.id)
-            return instance_result.status
+            status = n.nova.servers.get(self.id).status
         except nova_exceptions.NotFound:
-            return MISSING
+            status = MISSING
+        self.set_observed_status(status)
+        return status
 
-    def check_active_status(self):
-        return self.get_status() == ACTIVE
+    def get_observed_status(self, max_age=None):
+        """Get the instance's status, preferring the observed status.
 
-    def check_active_or_resize_statuses(self):
-        return self.get_status() in {ACTIVE, VERIFY_RESIZE, RESIZE}
+        The observed status is used if it is no older than 'max_age'
+        seconds (default settings.OBSERVED_STATUS_MAX_AGE).  Otherwise,
+        fall back to a live Nova call.  A 'max_age' of zero forces a
+        live call.
+        """
+
+        if self.observed_status_is_fresh(max_age):
+            return self.observed_status
+        return self.get_status()
+
+    def check_active_status(self, max_age=None):
+        return self.get_observed_status(max_age) == ACTIVE
 
-    def check_resizing_status(self):
-        return self.get_status() == RESIZE
+    def check_active_or_resize_statuses(self, max_age=None):
+        return self.get_observed_status(max_age) in {
+            ACTIVE, VERIFY_RESIZE, RESIZE}
 
-    def check_shutdown_status(self):
-        return self.get_status() == SHUTDOWN
+    def check_resizing_status(self, max_age=None):
+        return self.get_observed_status(max_age) == RESIZE
 
-    def check_verify_resize_status(self):
-        return self.get_status() == VERIFY_RESIZE
+    def check_shutdown_status(self, max_age=None):
+        return self.get_observed_status(max_age) == SHUTDOWN
+
+    def check_verify_resize_status(self, max_age=None):
+        return self.get_observed_status(max_age) == VERIFY_RESIZE
 
     def boot_volume_fields(self):
         return safe('\n'.join(
@@ -437,6 +605,10 @@ class Resize(models.Model):
 
     objects = ResizeManager()
 
+    class Meta:
+        # For get_latest_resize
+        indexes = [models.Index(fields=['instance', 'requested'])]
+
     def expired(self):
         return self.reverted or self.instance.deleted
 
@@ -472,6 +644,31 @@ class VMStatusManager(models.Manager):
         except VMStatus.DoesNotExist:
             return None
 
+    def get_latest_vm_statuses(self, user, desktop_types):
+        """Get the latest VMStatus for this User for each DesktopType.
+
+        This is one query, which also fetches the instances, their boot
+        volumes and their expirations.  Returns a dict of DesktopType id
+        to VMStatus (or None if there are none).
+        """
+        latest = self.filter(
+            user=user,
+            operating_system=models.OuterRef('operating_system'),
+            requesting_feature=models.OuterRef('requesting_feature')) \
+            .order_by('-created').values('pk')[:1]
+        vm_statuses = {
+            (vm_status.operating_system, vm_status.requesting_feature_id):
+            vm_status
+            for vm_status in self.filter(
+                user=user,
+                operating_system__in=[dt.id for dt in desktop_types],
+                pk=models.Subquery(latest)).select_related(
+                    'instance', 'instance__expiration',
+                    'instance__boot_volume',
+                    'instance__boot_volume__expiration')}
+        return {dt.id: vm_statuses.get((dt.id, dt.feature_id))
+                for dt in desktop_types}
+
     # TODO(SC) - The 'requesting_feature' argument is redundant (AFAIK)
     # In fact it is probably redundant on the model class too.
     def get_vm_status_by_instance(self, instance, requesting_feature,
@@ -550,6 +747,23 @@ class VMStatus(models.Model):
     status_done = models.TextField(null=True, blank=True)
     # Polling should wait until this time for the workflow to complete
     wait_time = models.DateTimeField(null=True, blank=True)
+    # When the desktop that this status was created for (by a launch or
+    # an unshelve) first became ready
+    ready = models.DateTimeField(null=True, blank=True)
+
+    def set_ready(self):
+        """Record that the desktop is ready, if it is for the first time.
+
+        Returns True if it is.  Reboots and resizes reuse the VMStatus,
+        so they don't count.
+        """
+
+        now = datetime.now(utc)
+        updated = VMStatus.objects.filter(pk=self.pk, ready=None) \
+                                  .update(ready=now)
+        if updated:
+            self.ready = now
+        return bool(updated)
 
     def error(self, message):
         self.status = VM_ERROR
@@ -563,8 +777,123 @@ class VMStatus(models.Model):
     class Meta:
         verbose_name = 'VM Status'
         verbose_name_plural = 'VM Statuses'
+        # For get_latest_vm_status(es).  (Looking up by instance uses
+        # the foreign key's index.)
+        indexes = [models.Index(fields=['user', 'operating_system',
+                                        'requesting_feature', 'created'])]
     objects = VMStatusManager()
 
     def __str__(self):
         return (f"Status of {self.operating_system} for {self.user} is "
                 f"{self.status}")
+
+
+class WorkflowRun(models.Model):
+    """A (possibly multi-step) workflow that is run by the rqworkers.
+
+    The steps and their arguments are recorded in the database, so that
+    the rq jobs only need to carry the run id, and so that a run whose
+    job has been lost can be resumed.
+    """
+
+    kind = models.CharField(max_length=16, null=True, blank=True)
+    # The desktop type and availability zone, for the step timings
+    desktop_type = models.CharField(max_length=32, null=True, blank=True)
+    zone = models.CharField(max_length=32, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    outcome = models.CharField(max_length=32, null=True, blank=True)
+
+    def current_step(self):
+        return self.steps.order_by('-id').first()
+
+    def __str__(self):
+        state = (self.outcome or "finished") if self.finished else "running"
+        return f"Workflow run {self.id} ({self.kind}) is {state}"
+
+
+class WorkflowStep(models.Model):
+    run = models.ForeignKey(WorkflowRun, on_delete=models.CASCADE,
+                            related_name='steps')
+    # Dotted path of the function, and its (encoded) arguments
+    func = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    # The poller wait that the step is waiting on, if any
+    wait = models.JSONField(null=True, blank=True)
+    deadline = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    # The rq job that will (or did) run the step
+    job_id = models.CharField(max_length=64, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    # When the poller saw the resource reach the state being waited for
+    reached = models.DateTimeField(null=True, blank=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    outcome = models.CharField(max_length=32, null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['func', 'reached'])]
+
+    def __str__(self):
+        return f"Step {self.id} ({self.func}) of workflow run {self.run_id}"
+
+
+class DailyUsage(models.Model):
+    """A day's desktop lifecycle counts for a desktop type and zone.
+
+    The rows are rolled up from the Instances and Resizes by
+    vm_manager.utils.usage, for the reports.  'instances' and 'boosts'
+    are the numbers live at the end of the day, and 'peak' is the most
+    instances that were live at once during the day.
+    """
+
+    date = models.DateField()
+    operating_system = models.CharField(max_length=20)
+    # '' for the volumes with no zone, as a NULL would make the rows
+    # non-unique
+    zone = models.CharField(max_length=32, blank=True, default='')
+    created = models.IntegerField(default=0)
+    deleted = models.IntegerField(default=0)
+    errored = models.IntegerField(default=0)
+    boosted = models.IntegerField(default=0)
+    reverted = models.IntegerField(default=0)
+    instances = models.IntegerField(default=0)
+    peak = models.IntegerField(default=0)
+    boosts = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'Daily usage'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['operating_system', 'date', 'zone'],
+                name='unique_daily_usage'),
+        ]
+
+    def __str__(self):
+        return (f"Usage of {self.operating_system} in {self.zone} "
+                f"on {self.date}")
+
+
+class ReconciliationReport(models.Model):
+    """The results of a database check, which is run by an rq job.
+
+    'results' maps each category (see vm_manager.utils.db_check) to a
+    list of [id, name, environment] entries, and 'counts' maps it to
+    the number of entries.  If 'repair' is set, the repairable entries
+    are repaired, and 'repairs' has the counts of the outcomes.
+    """
+
+    requested_by = models.ForeignKey(
+        User, on_delete=models.PROTECT, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    repair = models.BooleanField(default=False)
+    finished = models.DateTimeField(null=True, blank=True)
+    counts = models.JSONField(default=dict)
+    results = models.JSONField(default=dict)
+    repairs = models.JSONField(default=dict)
+    error = models.TextField(null=True, blank=True)
+
+    def __str__(self):
+        return (f"Database check requested by {self.requested_by} "
+                f"on {self.created}")
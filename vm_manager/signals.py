@@ -0,0 +1,12 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from vm_manager.models import VMStatus
+from vm_manager.utils.status_updates import publish_status
+
+
+@receiver(post_save, sender=VMStatus)
+def publish_vm_status(sender, instance, **kwargs):
+    # Publish once the change is visible to the web processes
+    transaction.on_commit(lambda: publish_status(instance))
@@ -15,30 +15,60 @@ var progress = 0;
 //     document.getElementById("{{ app_name }}-{{ desktop_type.id }}-time").innerHTML = {{ app_name }}_{{ desktop_type.id }}_minutes + ":" + {{ app_name }}_{{ desktop_type.id }}_seconds;
 // }, 1000);
 
+function show_status(vm_status) {
+    console.log(vm_status);
+    progress = (vm_status.status_progress > progress) ? vm_status.status_progress : Math.min(++progress, 100);
+    // console.log(progress);
+    bar.setAttribute("aria-valuenow", progress);
+    bar.setAttribute("style", "width: " + progress + "%");
+    barMessage.innerHTML = vm_status.status_message;
+    if (vm_status.status != "VM_Waiting") {
+        reloaded = true;
+        window.setTimeout(function() {
+            console.log("complete");
+            window.location.reload(1);
+        }, 1500);
+    }
+}
+
 async function poll_status(url, interval) {
     while(!reloaded) {
         await new Promise(r => setTimeout(r, interval));
         fetch(url)
             .then(resp => resp.json())
-            .then(vm_status => {
-                console.log(vm_status);
-                progress = (vm_status.status_progress > progress) ? vm_status.status_progress : Math.min(++progress, 100);
-                // console.log(progress);
-                bar.setAttribute("aria-valuenow", progress);
-                bar.setAttribute("style", "width: " + progress + "%");
-                barMessage.innerHTML = vm_status.status_message;
-                if (vm_status.status != "VM_Waiting") {
-                    reloaded = true;
-                    window.setTimeout(function() {
-                        console.log("complete");
-                        window.location.reload(1);
-                    }, 1500);
-                }
-            });
+            .then(show_status);
+    }
+}
+
+// Wait for the status to change, rather than polling for it.  The
+// server holds each request until the status changes (or times out).
+// If waiting isn't working, fall back to polling.
+async function wait_status(wait_url, poll_url, interval) {
+    var version = 0;
+    while(!reloaded) {
+        try {
+            const resp = await fetch(wait_url + "?version=" + version);
+            if (!resp.ok) {
+                throw new Error(resp.statusText);
+            }
+            const vm_status = await resp.json();
+            show_status(vm_status);
+            if (vm_status.version === null) {
+                throw new Error("waiting is unavailable");
+            }
+            version = vm_status.version;
+        } catch (error) {
+            console.log("Falling back to polling: " + error);
+            poll_status(poll_url, interval);
+            return;
+        }
     }
 }
 
 {% with app_name|add:":status_vm" as url_path %}
 var status_url = "{% url url_path desktop_type.id %}";
 {% endwith %}
-poll_status(status_url, 5000)
+{% with app_name|add:":wait_status_vm" as url_path %}
+var wait_status_url = "{% url url_path desktop_type.id %}";
+{% endwith %}
+wait_status(wait_status_url, status_url, 5000)
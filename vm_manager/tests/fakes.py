@@ -1,6 +1,9 @@
+import time
 from unittest.mock import Mock
 import uuid
 
+from redis.exceptions import LockNotOwnedError
+
 from vm_manager.tests.common import UUID_1
 
 
@@ -58,3 +61,144 @@ class FakeNectar(object):
         self.cinder.volumes.list = Mock(return_value=VOLUMES)
         self.cinder.volumes.create = Mock(
             return_value=FakeVolume(id=UUID_1))
+
+
+class FakeRedis(object):
+    """Just enough of a Redis connection for the registries and caches."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.values = {}
+        self.ttls = {}
+        self.subscribers = {}
+
+    def get(self, name):
+        return self.values.get(name)
+
+    def mget(self, *names):
+        return [self.values.get(name) for name in names]
+
+    def set(self, name, value, ex=None, nx=False):
+        if nx and name in self.values:
+            return None
+        self.values[name] = value
+        if ex:
+            self.ttls[name] = ex
+        return True
+
+    def delete(self, *names):
+        return len([self.values.pop(name) for name in names
+                    if name in self.values])
+
+    def incr(self, name):
+        self.values[name] = int(self.values.get(name, 0)) + 1
+        return self.values[name]
+
+    def expire(self, name, time):
+        return name in self.values
+
+    def publish(self, channel, message):
+        subscribers = self.subscribers.get(channel, [])
+        for pubsub in subscribers:
+            pubsub.messages.append({'type': 'message', 'channel': channel,
+                                    'data': str(message).encode()})
+        return len(subscribers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return FakePubSub(self)
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def lock(self, name, timeout=None, **kwargs):
+        return FakeLock(self, name, timeout)
+
+    def hset(self, name, key, value):
+        self.hashes.setdefault(name, {})[key] = value
+
+    def hget(self, name, key):
+        return self.hashes.get(name, {}).get(key)
+
+    def hgetall(self, name):
+        return dict(self.hashes.get(name, {}))
+
+    def hincrby(self, name, key, amount=1):
+        hash = self.hashes.setdefault(name, {})
+        hash[key] = int(hash.get(key, 0)) + amount
+        return hash[key]
+
+    def hincrbyfloat(self, name, key, amount=1.0):
+        hash = self.hashes.setdefault(name, {})
+        hash[key] = float(hash.get(key, 0)) + amount
+        return hash[key]
+
+    def hdel(self, name, *keys):
+        hash = self.hashes.get(name, {})
+        return len([hash.pop(key) for key in keys if key in hash])
+
+
+class FakePipeline(object):
+    """Queues the commands, and runs them on execute()."""
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        return [getattr(self.redis, name)(*args, **kwargs)
+                for name, args, kwargs in commands]
+
+
+class FakeLock(object):
+    """A lock, held while its token is in the FakeRedis."""
+
+    def __init__(self, redis, name, timeout):
+        self.redis = redis
+        self.name = name
+        self.timeout = timeout
+        self.token = str(uuid.uuid4())
+
+    def acquire(self, blocking=True):
+        return bool(self.redis.set(self.name, self.token,
+                                   ex=self.timeout, nx=True))
+
+    def owned(self):
+        return self.redis.get(self.name) == self.token
+
+    def reacquire(self):
+        if not self.owned():
+            raise LockNotOwnedError("Not owned")
+        return True
+
+    def release(self):
+        if not self.owned():
+            raise LockNotOwnedError("Not owned")
+        self.redis.delete(self.name)
+
+
+class FakePubSub(object):
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.messages = []
+
+    def subscribe(self, *channels):
+        for channel in channels:
+            self.redis.subscribers.setdefault(channel, []).append(self)
+
+    def get_message(self, timeout=0.0):
+        if not self.messages:
+            time.sleep(timeout)
+        return self.messages.pop(0) if self.messages else None
+
+    def close(self):
+        for subscribers in self.redis.subscribers.values():
+            if self in subscribers:
+                subscribers.remove(self)
@@ -1,8 +1,12 @@
+from unittest.mock import patch
+
 from django.conf import settings
 from django.test import TestCase
 from django.urls import reverse
 
 from researcher_workspace.tests.factories import UserFactory
+from vm_manager.models import ReconciliationReport
+from vm_manager.utils.db_check import MISSING_INSTANCES
 
 
 class VMManagerAdminRequestTests(TestCase):
@@ -36,3 +40,26 @@ class VMManagerAdminRequestTests(TestCase):
         self.client.force_login(self.superuser)
         response = self.client.get(url)
         self.assertEqual(200, response.status_code)
+
+    @patch('vm_manager.utils.db_check.django_rq')
+    def test_db_check(self, mock_rq):
+        url = reverse("vm_manager:db_check")
+
+        # Only for superusers
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertTemplateUsed(response, 'researcher_workspace/404.html')
+
+        self.client.force_login(self.superuser)
+        response = self.client.post(url, {'repair': 'on'})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        report = ReconciliationReport.objects.get()
+        self.assertTrue(report.repair)
+        mock_rq.get_queue.return_value.enqueue.assert_called_once()
+
+        report.results = {MISSING_INSTANCES: [['an-id', 'a-name', 'env']]}
+        report.counts = {MISSING_INSTANCES: 1}
+        report.save()
+        response = self.client.get(url)
+        self.assertContains(response, "Missing Instances")
+        self.assertContains(response, "a-name")
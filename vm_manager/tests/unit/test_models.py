@@ -1,7 +1,8 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from unittest.mock import patch
 import uuid
 
+from django.db import connection
 from django.http import Http404
 from django.test import TestCase
 
@@ -13,7 +14,7 @@ from guacamole.tests.factories import GuacamoleConnectionFactory
 from vm_manager.tests.factories import InstanceFactory, VolumeFactory, \
     ResizeFactory, VMStatusFactory
 from vm_manager.tests.fakes import Fake, FakeNectar
-from vm_manager.constants import ERROR
+from vm_manager.constants import ERROR, ACTIVE, SHUTDOWN, MISSING
 from vm_manager.utils.utils import get_nectar
 
 from vm_manager.models import Instance, Volume, Resize, VMStatus, \
@@ -179,6 +180,42 @@ class InstanceModelTests(VMManagerModelTestBase):
 
         fake.nova.servers.get.assert_called_once_with(fake_instance.id)
         self.assertEqual('testing', status)
+        self.assertEqual('testing', fake_instance.observed_status)
+        self.assertEqual(
+            'testing',
+            Instance.objects.get(pk=fake_instance.pk).observed_status)
+
+    @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
+    def test_get_observed_status(self):
+        fake = get_nectar()
+        fake.nova.servers.get.return_value = Fake(status=SHUTDOWN)
+        fake.nova.servers.get.reset_mock()
+
+        fake_volume = self.make_volume()
+        fake_instance = InstanceFactory.create(
+            id=uuid.uuid4(), user=self.user, boot_volume=fake_volume)
+
+        # No observation yet, so a live call
+        self.assertTrue(fake_instance.check_shutdown_status())
+        fake.nova.servers.get.assert_called_once_with(fake_instance.id)
+
+        # Fresh observation
+        fake.nova.servers.get.reset_mock()
+        fake_instance.set_observed_status(ACTIVE)
+        self.assertTrue(fake_instance.check_active_status())
+        self.assertTrue(fake_instance.check_active_or_resize_statuses())
+        fake.nova.servers.get.assert_not_called()
+
+        # Forced live call
+        self.assertTrue(fake_instance.check_shutdown_status(max_age=0))
+        fake.nova.servers.get.assert_called_once_with(fake_instance.id)
+
+        # Stale observation
+        fake.nova.servers.get.reset_mock()
+        fake_instance.set_observed_status(
+            ACTIVE, observed_at=datetime.now(utc) - timedelta(hours=1))
+        self.assertEqual(SHUTDOWN, fake_instance.get_observed_status())
+        fake.nova.servers.get.assert_called_once_with(fake_instance.id)
 
     def test_create_guac_connection(self):
         fake_volume = self.make_volume()
@@ -212,6 +249,53 @@ class InstanceModelTests(VMManagerModelTestBase):
         self.assertTrue(
             url.startswith("https://tiger-guacamole-qriscloud.example.com"
                            "/#/client/"))
+        self.assertEqual(url, Instance.objects.get(
+            pk=fake_instance.pk).guac_url)
+
+        # The URL is cached, so the parameters aren't rewritten ...
+        with self.assertNumQueries(0):
+            self.assertEqual(url, fake_instance.get_url())
+
+        # ... unless one of their inputs changes
+        fake_instance.ip_address = "10.0.0.2"
+        self.assertEqual(url, fake_instance.get_url())
+        self.assertEqual(11,
+                         GuacamoleConnectionParameter.objects.filter(
+                             connection=fake_guac_connection).count())
+        self.assertEqual("10.0.0.2",
+                         GuacamoleConnectionParameter.objects.get(
+                             connection=fake_guac_connection,
+                             parameter_name='hostname').parameter_value)
+
+    def test_create_guac_connection_without_upsert(self):
+        # As for MySQL, which can't upsert on the unique fields
+        fake_volume = self.make_volume()
+        fake_guac_connection = GuacamoleConnectionFactory.create()
+        fake_instance = InstanceFactory.create(
+            id=uuid.uuid4(), user=self.user, boot_volume=fake_volume,
+            guac_connection=fake_guac_connection,
+            ip_address="10.0.0.1")
+        GuacamoleEntity.objects.create(
+            name=self.user.username, type='USER')
+        GuacamoleConnectionParameter.objects.create(
+            connection=fake_guac_connection, parameter_name='hostname',
+            parameter_value="10.0.0.9")
+        manager = GuacamoleConnectionParameter.objects
+
+        with patch.object(connection.features,
+                          'supports_update_conflicts_with_target', False), \
+                patch.object(manager, 'bulk_create',
+                             wraps=manager.bulk_create) as mock_bulk_create:
+            fake_instance.create_guac_connection()
+
+        self.assertNotIn('unique_fields', mock_bulk_create.call_args.kwargs)
+        self.assertEqual(11,
+                         GuacamoleConnectionParameter.objects.filter(
+                             connection=fake_guac_connection).count())
+        self.assertEqual("10.0.0.1",
+                         GuacamoleConnectionParameter.objects.get(
+                             connection=fake_guac_connection,
+                             parameter_name='hostname').parameter_value)
 
     def test_get_instance(self):
         self.assertIsNone(
@@ -267,55 +351,36 @@ class InstanceModelTests(VMManagerModelTestBase):
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
     def test_get_instance_by_ip_with_lookup(self):
         ip_address = '10.0.0.3'
-        ip_address_2 = '10.0.0.4'
 
         fake_volume = self.make_volume()
         fake_instance = InstanceFactory.create(
             id=uuid.uuid4(), user=self.user, boot_volume=fake_volume)
+        fake_instance_2 = InstanceFactory.create(
+            id=uuid.uuid4(), user=self.user, boot_volume=fake_volume)
 
         fake = get_nectar()
         fake.nova.servers.get.reset_mock()
-        fake.nova.servers.get.return_value = Fake(
-            addresses={
-                'private': [
-                    {
-                        "OS-EXT-IPS-MAC:mac_addr": "00:0c:29:0d:11:74",
-                        "OS-EXT-IPS:type": "fixed",
-                        "addr": ip_address,
-                        "version": 4
-                    }
-                ]
-            }
-        )
+        fake.nova.servers.list.return_value = []
 
         self.assertIsNone(
             Instance.objects.get_instance_by_ip_address(
-                ip_address_2, self.desktop_type.feature))
-        fake.nova.servers.get.assert_called_once_with(fake_instance.id)
-
-        fake_instance_2 = InstanceFactory.create(
-            id=uuid.uuid4(), user=self.user, boot_volume=fake_volume)
-
-        fake.nova.servers.get.return_value = Fake(
-            addresses={
-                'private': [
-                    {
-                        "OS-EXT-IPS-MAC:mac_addr": "00:0c:29:0d:11:74",
-                        "OS-EXT-IPS:type": "fixed",
-                        "addr": ip_address_2,
-                        "version": 4
-                    }
-                ]
-            }
-        )
+                ip_address, self.desktop_type.feature))
+        fake.nova.servers.list.assert_called_once_with(
+            search_opts={'ip': r'^10\.0\.0\.3$'})
 
+        fake.nova.servers.list.return_value = [
+            Fake(id=str(fake_instance_2.id))]
         self.assertEqual(
             fake_instance_2,
             Instance.objects.get_instance_by_ip_address(
-                ip_address_2, self.desktop_type.feature))
+                ip_address, self.desktop_type.feature))
 
-        test_instance = Instance.objects.get(pk=fake_instance_2.pk)
-        self.assertEqual(test_instance.ip_address, ip_address_2)
+        # One list call, rather than a get for each instance
+        fake.nova.servers.get.assert_not_called()
+        self.assertEqual(ip_address, Instance.objects.get(
+            pk=fake_instance_2.pk).ip_address)
+        self.assertIsNone(Instance.objects.get(
+            pk=fake_instance.pk).ip_address)
 
     @patch('vm_manager.models.logger')
     def test_get_instance_by_vm_id(self, mock_logger):
@@ -434,6 +499,15 @@ class InstanceModelTests(VMManagerModelTestBase):
             Instance.objects.get_live_instances(self.user,
                                                 desktop_type2))
 
+        # Instances that the reconciler found missing aren't live
+        fake_instance3.set_observed_status(MISSING)
+        self.assertEqual(
+            [], Instance.objects.get_live_instances(self.user,
+                                                    desktop_type2))
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                1, Instance.objects.count_live_instances(self.user))
+
 
 class ResizeModelTests(VMManagerModelTestBase):
 
@@ -552,6 +626,30 @@ class VMStatusModelTests(VMManagerModelTestBase):
                          VMStatus.objects.get_latest_vm_status(
                              self.user, self.desktop_type))
 
+    def test_get_latest_vm_statuses(self):
+        other_desktop_type = DesktopTypeFactory.create(
+            id='other', name='other', feature=self.feature)
+        desktop_types = [self.desktop_type, other_desktop_type]
+        self.assertEqual(
+            {self.desktop_type.id: None, other_desktop_type.id: None},
+            VMStatus.objects.get_latest_vm_statuses(self.user, desktop_types))
+
+        self.make_vmstatus()
+        vmstatus = self.make_vmstatus()
+        # Another user's, and another feature's, are ignored
+        self.make_vmstatus(user=UserFactory.create())
+        self.make_vmstatus(requesting_feature=FeatureFactory.create())
+        with self.assertNumQueries(1):
+            vm_statuses = VMStatus.objects.get_latest_vm_statuses(
+                self.user, desktop_types)
+            self.assertEqual(
+                {self.desktop_type.id: vmstatus,
+                 other_desktop_type.id: None}, vm_statuses)
+            # The instance and its volume come with it
+            self.assertEqual(self.volume,
+                             vm_statuses[self.desktop_type.id]
+                             .instance.boot_volume)
+
     def test_get_vm_status_by_volume(self):
         other_feature = FeatureFactory.create()
         with self.assertRaises(Http404):
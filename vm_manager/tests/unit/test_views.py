@@ -19,19 +19,20 @@ from vm_manager.constants import ACTIVE, SHUTDOWN, BUILD, REBUILD, \
     VM_CREATING, VM_RESIZING, NO_VM, VM_SHELVED, VM_MISSING, VM_ERROR, \
     VM_SHUTDOWN, VM_SUPERSIZED, ALL_VM_STATES, \
     CLOUD_INIT_STARTED, CLOUD_INIT_FINISHED, SCRIPT_OKAY, \
-    EXTEND_BUTTON, EXTEND_BOOST_BUTTON, BOOST_BUTTON
+    EXTEND_BUTTON, EXTEND_BOOST_BUTTON, BOOST_BUTTON, \
+    WF_LAUNCH, WF_DELETE, WF_SHELVE, WF_REBOOT, WF_RESIZE
 
-from vm_manager.models import VMStatus, Instance, Volume, Resize, Expiration, \
-    EXP_INITIAL, EXP_FIRST_WARNING, EXP_EXPIRING, EXP_EXPIRY_COMPLETED, \
-    EXP_EXPIRY_FAILED_RETRYABLE
+from vm_manager.models import VMStatus, Instance, Volume, Resize, \
+    ResizeExpiration, EXP_INITIAL, EXP_FIRST_WARNING, EXP_EXPIRING, \
+    EXP_EXPIRY_COMPLETED, EXP_EXPIRY_FAILED_RETRYABLE
 from vm_manager.utils.utils import get_nectar, after_time
 from vm_manager.views import launch_vm_worker, delete_vm_worker, \
     shelve_vm_worker, unshelve_vm_worker, reboot_vm_worker, \
     supersize_vm_worker, downsize_vm_worker
 
 from vm_manager.views import launch_vm, delete_vm, shelve_vm, unshelve_vm, \
-    reboot_vm, supersize_vm, downsize_vm, get_vm_state, render_vm, notify_vm, \
-    phone_home, rd_report_for_user, delete_shelved_vm
+    reboot_vm, supersize_vm, downsize_vm, get_vm_state, render_vm, \
+    render_vms, notify_vm, phone_home, rd_report_for_user, delete_shelved_vm
 
 utc = timezone.utc
 
@@ -70,34 +71,29 @@ class VMManagerViewTests(TestCase):
         else:
             self.vm_status = None
 
-    @patch('vm_manager.views.django_rq')
-    def test_launch_vm_exists(self, mock_rq):
+    @patch('vm_manager.views.start_workflow')
+    def test_launch_vm_exists(self, mock_start):
         self.build_existing_vm(VM_OKAY)
         self.assertEqual(
             f"User {self.user} already has 1 live desktops",
             launch_vm(self.user, self.UBUNTU, self.zone))
 
-        mock_rq.get_queue.assert_not_called()
+        mock_start.assert_not_called()
 
-    @patch('vm_manager.views.django_rq')
-    def test_launch_vm_not_properly_deleted(self, mock_rq):
+    @patch('vm_manager.views.start_workflow')
+    def test_launch_vm_not_properly_deleted(self, mock_start):
         self.build_existing_vm(VM_DELETED)
 
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
-
         self.assertEqual(
             f"User {self.user} already has 1 live desktops",
             launch_vm(self.user, self.UBUNTU, self.zone))
         self.assertIsNotNone(
             VMStatus.objects.get_latest_vm_status(self.user, self.UBUNTU))
 
-    @patch('vm_manager.views.django_rq')
-    def test_launch_vm(self, mock_rq):
+    @patch('vm_manager.views.start_workflow')
+    def test_launch_vm(self, mock_start):
         self.build_existing_vm(VM_DELETED)
 
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
         now = datetime.now(utc)
 
         self.instance.deleted = now
@@ -118,13 +114,12 @@ class VMManagerViewTests(TestCase):
         self.assertTrue(after_time(settings.LAUNCH_WAIT)
                         >= vm_status.wait_time)
 
-        mock_rq.get_queue.assert_called_once_with("default")
-        mock_queue.enqueue.assert_called_once_with(
-            launch_vm_worker, user=self.user, desktop_type=self.UBUNTU,
-            zone=self.zone)
+        mock_start.assert_called_once_with(
+            WF_LAUNCH, launch_vm_worker, user=self.user,
+            desktop_type=self.UBUNTU, zone=self.zone)
 
-    @patch('vm_manager.views.django_rq')
-    def test_delete_vm_inconsistent(self, mock_rq):
+    @patch('vm_manager.views.start_workflow')
+    def test_delete_vm_inconsistent(self, mock_start):
         with self.assertRaises(Http404):
             delete_vm(self.user, uuid.uuid4(), self.FEATURE)
 
@@ -148,13 +143,10 @@ class VMManagerViewTests(TestCase):
             "Cannot delete VM.",
             delete_vm(self.user, self.instance.id, self.FEATURE))
 
-        mock_rq.get_queue.assert_not_called()
-
-    @patch('vm_manager.views.django_rq')
-    def test_delete_vm(self, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+        mock_start.assert_not_called()
 
+    @patch('vm_manager.views.start_workflow')
+    def test_delete_vm(self, mock_start):
         self.build_existing_vm(VM_OKAY)
         self.assertEqual(
             f"Status of {self.UBUNTU.id} for "
@@ -168,12 +160,11 @@ class VMManagerViewTests(TestCase):
         self.assertIsNotNone(
             vm_status.instance.boot_volume.marked_for_deletion)
 
-        mock_rq.get_queue.assert_called_once_with("default")
-        mock_queue.enqueue.assert_called_once_with(
-            delete_vm_worker, self.instance)
+        mock_start.assert_called_once_with(
+            WF_DELETE, delete_vm_worker, self.instance)
 
-    @patch('vm_manager.views.django_rq')
-    def test_shelve_vm_inconsistent(self, mock_rq):
+    @patch('vm_manager.views.start_workflow')
+    def test_shelve_vm_inconsistent(self, mock_start):
         with self.assertRaises(Http404):
             shelve_vm(self.user, uuid.uuid4(), self.FEATURE)
 
@@ -192,12 +183,10 @@ class VMManagerViewTests(TestCase):
                 f"is in wrong state ({status}). Cannot shelve VM.",
                 shelve_vm(self.user, self.instance.id, self.FEATURE))
 
-        mock_rq.get_queue.assert_not_called()
+        mock_start.assert_not_called()
 
-    @patch('vm_manager.views.django_rq')
-    def test_shelve_vm(self, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    @patch('vm_manager.views.start_workflow')
+    def test_shelve_vm(self, mock_start):
         self.build_existing_vm(VM_OKAY)
 
         self.assertEqual(
@@ -205,17 +194,16 @@ class VMManagerViewTests(TestCase):
             f"is {VM_WAITING}",
             shelve_vm(self.user, self.instance.id, self.FEATURE))
 
-        mock_rq.get_queue.assert_called_once_with("default")
-        mock_queue.enqueue.assert_called_once_with(
-            shelve_vm_worker, self.instance)
+        mock_start.assert_called_once_with(
+            WF_SHELVE, shelve_vm_worker, self.instance)
         vm_status = VMStatus.objects.get(pk=self.vm_status.id)
         self.assertEqual(VM_WAITING, vm_status.status)
         self.assertEqual(0, vm_status.status_progress)
         self.assertIsNotNone(vm_status.instance.marked_for_deletion)
         self.assertIsNone(vm_status.instance.boot_volume.marked_for_deletion)
 
-    @patch('vm_manager.views.django_rq')
-    def test_unshelve_vm_inconsistent(self, mock_rq):
+    @patch('vm_manager.views.start_workflow')
+    def test_unshelve_vm_inconsistent(self, mock_start):
         self.assertEqual(
             f"VMStatus for user {self.user}, "
             f"desktop_type {self.UBUNTU.id} "
@@ -234,23 +222,19 @@ class VMManagerViewTests(TestCase):
                 f"is in wrong state ({status}). Cannot unshelve VM.",
                 unshelve_vm(self.user, self.UBUNTU))
 
-        mock_rq.get_queue.assert_not_called()
+        mock_start.assert_not_called()
 
-    @patch('vm_manager.views.django_rq')
-    def test_unshelve_vm_existing(self, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    @patch('vm_manager.views.start_workflow')
+    def test_unshelve_vm_existing(self, mock_start):
         self.build_existing_vm(VM_SHELVED)
 
         self.assertEqual(
             f"User {self.user} already has 1 live desktops",
             unshelve_vm(self.user, self.UBUNTU))
-        mock_rq.get_queue.assert_not_called()
+        mock_start.assert_not_called()
 
-    @patch('vm_manager.views.django_rq')
-    def test_unshelve_vm(self, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    @patch('vm_manager.views.start_workflow')
+    def test_unshelve_vm(self, mock_start):
         self.build_existing_vm(VM_SHELVED)
         now = datetime.now(utc)
         self.instance.deleted = now
@@ -261,10 +245,9 @@ class VMManagerViewTests(TestCase):
             f"is {VM_CREATING}",
             unshelve_vm(self.user, self.UBUNTU))
 
-        mock_rq.get_queue.assert_called_once_with("default")
-        mock_queue.enqueue.assert_called_once_with(
-            unshelve_vm_worker, user=self.user, desktop_type=self.UBUNTU,
-            zone=self.zone)
+        mock_start.assert_called_once_with(
+            WF_LAUNCH, unshelve_vm_worker, user=self.user,
+            desktop_type=self.UBUNTU, zone=self.zone)
         vm_status = VMStatus.objects.get_latest_vm_status(
             self.user, self.UBUNTU)
         self.assertTrue(vm_status.pk != self.vm_status.pk)
@@ -274,8 +257,8 @@ class VMManagerViewTests(TestCase):
         self.assertEqual(vm_status.operating_system, self.UBUNTU.id)
         self.assertEqual(vm_status.requesting_feature, self.FEATURE)
 
-    @patch('vm_manager.views.django_rq')
-    def test_reboot_vm_inconsistent(self, mock_rq):
+    @patch('vm_manager.views.start_workflow')
+    def test_reboot_vm_inconsistent(self, mock_start):
         with self.assertRaises(Http404):
             reboot_vm(self.user, uuid.uuid4(), REBOOT_SOFT, self.FEATURE)
 
@@ -296,12 +279,10 @@ class VMManagerViewTests(TestCase):
         with self.assertRaises(Http404):
             reboot_vm(self.user, self.instance.id, "squirrelly", self.FEATURE)
 
-        mock_rq.get_queue.assert_not_called()
+        mock_start.assert_not_called()
 
-    @patch('vm_manager.views.django_rq')
-    def test_reboot_vm(self, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    @patch('vm_manager.views.start_workflow')
+    def test_reboot_vm(self, mock_start):
         self.build_existing_vm(VM_OKAY)
         now = datetime.now(utc)
 
@@ -310,10 +291,9 @@ class VMManagerViewTests(TestCase):
             f"{self.user} is {VM_WAITING}",
             reboot_vm(self.user, self.instance.id, REBOOT_SOFT, self.FEATURE))
 
-        mock_rq.get_queue.assert_called_once_with("default")
-        mock_queue.enqueue.assert_called_once_with(
-            reboot_vm_worker, self.user, self.instance.id, REBOOT_SOFT,
-            VM_OKAY, self.FEATURE)
+        mock_start.assert_called_once_with(
+            WF_REBOOT, reboot_vm_worker, self.user, self.instance.id,
+            REBOOT_SOFT, VM_OKAY, self.FEATURE)
         vm_status = VMStatus.objects.get_latest_vm_status(
             self.user, self.UBUNTU)
         self.assertEqual(vm_status.pk, self.vm_status.pk)
@@ -321,8 +301,8 @@ class VMManagerViewTests(TestCase):
         self.assertEqual(0, vm_status.status_progress)
         self.assertTrue(now < vm_status.wait_time)
 
-    @patch('vm_manager.views.django_rq')
-    def test_supersize_vm_inconsistent(self, mock_rq):
+    @patch('vm_manager.views.start_workflow')
+    def test_supersize_vm_inconsistent(self, mock_start):
         with self.assertRaises(Http404):
             supersize_vm(self.user, uuid.uuid4(), self.FEATURE)
 
@@ -340,12 +320,10 @@ class VMManagerViewTests(TestCase):
                 "Cannot supersize VM.",
                 supersize_vm(self.user, self.instance.id, self.FEATURE))
 
-        mock_rq.get_queue.assert_not_called()
+        mock_start.assert_not_called()
 
-    @patch('vm_manager.views.django_rq')
-    def test_supersize_vm(self, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    @patch('vm_manager.views.start_workflow')
+    def test_supersize_vm(self, mock_start):
         self.build_existing_vm(VM_OKAY)
         now = datetime.now(utc)
 
@@ -354,9 +332,8 @@ class VMManagerViewTests(TestCase):
             f"is {VM_RESIZING}",
             supersize_vm(self.user, self.instance.id, self.FEATURE))
 
-        mock_rq.get_queue.assert_called_once_with("default")
-        mock_queue.enqueue.assert_called_once_with(
-            supersize_vm_worker, instance=self.instance,
+        mock_start.assert_called_once_with(
+            WF_RESIZE, supersize_vm_worker, instance=self.instance,
             desktop_type=self.UBUNTU)
         vm_status = VMStatus.objects.get_latest_vm_status(
             self.user, self.UBUNTU)
@@ -365,8 +342,8 @@ class VMManagerViewTests(TestCase):
         self.assertEqual(0, vm_status.status_progress)
         self.assertTrue(now < vm_status.wait_time)
 
-    @patch('vm_manager.views.django_rq')
-    def test_downsize_vm_inconsistent(self, mock_rq):
+    @patch('vm_manager.views.start_workflow')
+    def test_downsize_vm_inconsistent(self, mock_start):
         with self.assertRaises(Http404):
             downsize_vm(self.user, uuid.uuid4(), self.FEATURE)
 
@@ -384,12 +361,10 @@ class VMManagerViewTests(TestCase):
                 "Cannot downsize VM.",
                 downsize_vm(self.user, self.instance.id, self.FEATURE))
 
-        mock_rq.get_queue.assert_not_called()
+        mock_start.assert_not_called()
 
-    @patch('vm_manager.views.django_rq')
-    def test_downsize_vm(self, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    @patch('vm_manager.views.start_workflow')
+    def test_downsize_vm(self, mock_start):
         self.build_existing_vm(VM_SUPERSIZED)
         now = datetime.now(utc)
 
@@ -398,9 +373,8 @@ class VMManagerViewTests(TestCase):
             f"is {VM_RESIZING}",
             downsize_vm(self.user, self.instance.id, self.FEATURE))
 
-        mock_rq.get_queue.assert_called_once_with("default")
-        mock_queue.enqueue.assert_called_once_with(
-            downsize_vm_worker, instance=self.instance,
+        mock_start.assert_called_once_with(
+            WF_RESIZE, downsize_vm_worker, instance=self.instance,
             desktop_type=self.UBUNTU)
         vm_status = VMStatus.objects.get_latest_vm_status(
             self.user, self.UBUNTU)
@@ -686,6 +660,36 @@ class VMManagerViewTests(TestCase):
         mock_loader.render_to_string.assert_has_calls(calls)
         mock_messages.info.assert_not_called()
 
+    @patch('vm_manager.views.loader')
+    def test_render_vms(self, mock_loader):
+        mock_loader.render_to_string.side_effect = \
+            lambda template, context, request: template
+        CENTOS = get_desktop_type('centos')
+        TERN = get_desktop_type('tern')
+        desktops = [(self.UBUNTU, ["ONE"]), (CENTOS, ["TWO"]),
+                    (TERN, ["THREE"])]
+        self.build_existing_vm(VM_ERROR)
+        VMStatusFactory.create(
+            instance=None, user=self.user, operating_system=TERN.id,
+            requesting_feature=self.FEATURE, status=VM_ERROR)
+
+        results = render_vms("The Request", self.user, desktops)
+
+        # Only the last active desktop's module is rendered
+        self.assertEqual(
+            [(None, f"vm_manager/html/{NO_VM}.html",
+              f"vm_manager/javascript/{VM_ERROR}.js", VM_ERROR),
+             (f"vm_manager/html/{NO_VM}.html",
+              f"vm_manager/html/{NO_VM}.html",
+              f"vm_manager/javascript/{NO_VM}.js", NO_VM),
+             (f"vm_manager/html/{VM_MISSING}.html",
+              f"vm_manager/html/{NO_VM}.html",
+              f"vm_manager/javascript/{VM_MISSING}.js", VM_MISSING)],
+            results)
+        context = mock_loader.render_to_string.call_args_list[0].args[1]
+        self.assertEqual(self.vm_status, context['vm_status'])
+        self.assertEqual(["ONE"], context['buttons_to_display'])
+
     @patch('vm_manager.views.loader')
     @patch('vm_manager.models.Instance.get_url')
     @patch('vm_manager.views.messages')
@@ -951,7 +955,7 @@ class VMManagerViewTests(TestCase):
         self.assertEqual(VM_OKAY, vm_status.status)
         self.assertEqual(100, vm_status.status_progress)
         resize = Resize.objects.get(pk=resize.pk)
-        expiration = Expiration.objects.get(pk=resize.expiration.pk)
+        expiration = ResizeExpiration.objects.get(pk=resize.expiration.pk)
         self.assertEqual(EXP_EXPIRY_COMPLETED, expiration.stage)
         self.assertTrue(now < expiration.stage_date)
 
@@ -962,6 +966,35 @@ class VMManagerViewTests(TestCase):
             f"Phone home for {self.instance} - success!",
             phone_home(fake_request, self.FEATURE))
 
+    @patch('vm_manager.views.job_metrics')
+    @patch('vm_manager.views.generate_hostname', return_value='foo')
+    def test_ready_observed_once(self, mock_gen, mock_metrics):
+        self.build_existing_vm(VM_WAITING)
+        fake_request = Fake(GET={
+            'ip': '10.0.0.1',
+            'hn': 'foo',
+            'os': self.UBUNTU.id,
+            'state': SCRIPT_OKAY,
+            'msg': CLOUD_INIT_FINISHED
+        })
+
+        notify_vm(fake_request, self.FEATURE)
+
+        mock_metrics.observe_ready.assert_called_once()
+        vm_status = mock_metrics.observe_ready.call_args.args[0]
+        self.assertEqual(self.vm_status.pk, vm_status.pk)
+        self.assertIsNotNone(vm_status.ready)
+
+        # A reboot reuses the VMStatus, so its phone home isn't timed
+        # as a launch
+        VMStatus.objects.filter(pk=self.vm_status.pk).update(
+            status=VM_WAITING)
+        fake_request = Fake(POST={'instance_id': self.instance.id})
+        self.assertEqual(
+            f"Phone home for {self.instance} - success!",
+            phone_home(fake_request, self.FEATURE))
+        mock_metrics.observe_ready.assert_called_once()
+
     @patch('vm_manager.views.datetime')
     def test_rd_report_for_user(self, mock_datetime):
         # Freeze time ...
@@ -1074,9 +1107,10 @@ class VMManagerViewTests(TestCase):
             f"vm_status: Status of {self.UBUNTU.id} for {self.user} "
             f"is {VM_SHELVED}")
 
+    @patch('vm_manager.views.run_workflow')
     @patch('vm_manager.views.logger')
     @patch('vm_manager.views.delete_volume_worker')
-    def test_delete_shelved_vm(self, mock_delete, mock_logger):
+    def test_delete_shelved_vm(self, mock_delete, mock_logger, mock_run):
         self.build_existing_vm(VM_SHELVED)
         self.instance.deleted = datetime.now(utc)
         self.instance.save()
@@ -1088,4 +1122,4 @@ class VMManagerViewTests(TestCase):
         mock_logger.error.assert_not_called()
         mock_logger.info.assert_called_once_with(
             f"Deleting shelved volume {self.volume}")
-        mock_delete.assert_called_once_with(self.volume)
+        mock_run.assert_called_once_with(WF_DELETE, mock_delete, self.volume)
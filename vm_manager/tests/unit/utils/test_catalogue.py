@@ -0,0 +1,114 @@
+import uuid
+
+from unittest.mock import Mock, patch
+
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from researcher_desktop.tests.factories import AvailabilityZoneFactory
+from researcher_desktop.utils.utils import get_desktop_type
+
+from vm_manager.tests.fakes import FakeNectar, FakeVolume
+from vm_manager.utils.catalogue import cached, invalidate, get_stats, \
+    reset_stats, get_flavor_map, FLAVORS, NETWORKS, SOURCE_VOLUMES
+from vm_manager.vm_functions.create_vm import _get_source_volume, \
+    _get_network_id
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'catalogue': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalogue-tests',
+    },
+}
+
+
+@override_settings(CACHES=CACHES)
+class CatalogueTests(TestCase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        caches['catalogue'].clear()
+
+    def test_cached(self):
+        fetch = Mock(return_value='value')
+
+        self.assertEqual('value', cached(FLAVORS, 'a key', fetch))
+        self.assertEqual('value', cached(FLAVORS, 'a key', fetch))
+        fetch.assert_called_once_with()
+        self.assertEqual({'hits': 1, 'misses': 1}, get_stats()[FLAVORS])
+
+        # Refreshing always fetches
+        fetch.return_value = 'new value'
+        self.assertEqual('new value',
+                         cached(FLAVORS, 'a key', fetch, refresh=True))
+        self.assertEqual('new value', cached(FLAVORS, 'a key', fetch))
+        self.assertEqual(2, fetch.call_count)
+
+        reset_stats()
+        self.assertEqual({'hits': 0, 'misses': 0}, get_stats()[FLAVORS])
+
+    def test_invalidate(self):
+        fetch = Mock(return_value='value')
+        cached(NETWORKS, 'a', fetch)
+        cached(NETWORKS, 'b', fetch)
+        cached(FLAVORS, 'a', fetch)
+
+        invalidate(NETWORKS, 'a')
+        cached(NETWORKS, 'a', fetch)
+        cached(NETWORKS, 'b', fetch)
+        self.assertEqual(4, fetch.call_count)
+
+        # Invalidating a kind doesn't affect the other kinds
+        invalidate(NETWORKS)
+        cached(NETWORKS, 'a', fetch)
+        cached(NETWORKS, 'b', fetch)
+        cached(FLAVORS, 'a', fetch)
+        self.assertEqual(6, fetch.call_count)
+
+    @patch('vm_manager.utils.catalogue.get_nectar')
+    def test_flavor_map(self, mock_get):
+        fake = FakeNectar()
+        mock_get.return_value = fake
+        flavors = get_flavor_map()
+        self.assertEqual(flavors.keys(), get_flavor_map().keys())
+        fake.nova.flavors.list.assert_called_once_with()
+
+        # Each fresh DesktopType uses the shared map
+        desktop_type = get_desktop_type('ubuntu')
+        self.assertEqual(flavors[desktop_type.default_flavor_name].id,
+                         desktop_type.default_flavor.id)
+        fake.nova.flavors.list.assert_called_once_with()
+
+    @patch('vm_manager.vm_functions.create_vm.get_nectar')
+    def test_source_volume(self, mock_get):
+        desktop_type = get_desktop_type('ubuntu')
+        zone = AvailabilityZoneFactory.create(
+            name="a_zone", zone_weight=1, network_id=uuid.uuid4())
+        fake = FakeNectar()
+        fake.cinder.volumes.list.return_value = [
+            FakeVolume(id='1', name=desktop_type.image_name,
+                       metadata={'nectar_build': '2'})]
+        mock_get.return_value = fake
+
+        self.assertEqual('1', _get_source_volume(desktop_type, zone).id)
+        source = _get_source_volume(desktop_type, zone)
+        self.assertEqual('1', source.id)
+        self.assertEqual({'nectar_build': '2'}, source.metadata)
+        fake.cinder.volumes.list.assert_called_once()
+        self.assertEqual({'hits': 1, 'misses': 1},
+                         get_stats()[SOURCE_VOLUMES])
+
+    def test_network(self):
+        zone = AvailabilityZoneFactory.create(
+            name="a_zone", zone_weight=1, network_id=uuid.uuid4())
+        self.assertEqual(zone.network_id, _get_network_id(zone.name))
+        self.assertEqual(zone.network_id, _get_network_id(zone.name))
+        self.assertEqual({'hits': 1, 'misses': 1}, get_stats()[NETWORKS])
+
+        # Saving the zone invalidates its network
+        zone.network_id = uuid.uuid4()
+        zone.save()
+        self.assertEqual(zone.network_id, _get_network_id(zone.name))
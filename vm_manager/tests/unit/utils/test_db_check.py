@@ -0,0 +1,157 @@
+from datetime import datetime, timezone
+from unittest.mock import patch
+import uuid
+
+import novaclient
+
+from guacamole.tests.factories import GuacamoleConnectionFactory
+from vm_manager.constants import VM_OKAY, VOLUME_AVAILABLE
+from vm_manager.models import Instance, ReconciliationReport
+from vm_manager.tests.fakes import FakeNectar, FakeServer, FakeVolume
+from vm_manager.tests.unit.vm_functions.base import VMFunctionTestBase
+from vm_manager.utils.db_check import DELETED_INSTANCES, \
+    MISSING_INSTANCES, MISSING_VOLUMES, ORPHANED_CONNECTIONS, REPAIRED, \
+    VANISHED_INSTANCES, VANISHED_VOLUMES, db_check, repair_all, \
+    request_db_check, run_db_check
+
+utc = timezone.utc
+
+
+def paged(resources):
+    # A fake OpenStack 'list' call, that pages with markers
+    def list_func(marker=None, limit=None, **kwargs):
+        ids = [resource.id for resource in resources]
+        start = ids.index(marker) + 1 if marker else 0
+        return resources[start:start + limit]
+    return list_func
+
+
+@patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
+class DbCheckTests(VMFunctionTestBase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.fake = FakeNectar()
+        patcher = patch('vm_manager.utils.db_check.get_nectar',
+                        return_value=self.fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch(
+            'vm_manager.vm_functions.admin_functionality.get_nectar',
+            return_value=self.fake)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def build_fleet(self):
+        # A desktop that is fine, one that has been deleted (but whose
+        # server is still there), and one whose server has vanished
+        self.volume, self.instance = self.build_fake_vol_instance()
+        _, deleted = self.build_fake_vol_instance(
+            volume_id=uuid.uuid4(), instance_id=uuid.uuid4())
+        Instance.objects.filter(pk=deleted.pk).update(
+            deleted=datetime.now(utc))
+        self.vanished_volume, self.vanished, _ = \
+            self.build_fake_vol_inst_status(
+                volume_id=uuid.uuid4(), instance_id=uuid.uuid4(),
+                status=VM_OKAY)
+        self.stranger = FakeServer(id=str(uuid.uuid4()), name='stranger',
+                                   metadata={'environment': 'other'})
+        servers = [FakeServer(id=str(instance.id), name=str(instance),
+                              metadata={'environment': 'tiger'})
+                   for instance in (self.instance, deleted)]
+        self.fake.nova.servers.list.side_effect = paged(
+            servers + [self.stranger])
+        self.fake.cinder.volumes.list.side_effect = paged([
+            FakeVolume(id=str(volume.id), name='vdu-x', metadata={})
+            for volume in (self.volume, self.vanished_volume)])
+        self.orphan = GuacamoleConnectionFactory.create(
+            connection_name='orphan')
+
+    def test_db_check(self):
+        self.build_fleet()
+
+        results = db_check(page_size=2)
+
+        self.assertEqual(2, self.fake.nova.servers.list.call_count)
+        self.assertEqual(
+            [str(Instance.objects.exclude(deleted=None).get().id)],
+            [entry[0] for entry in results[DELETED_INSTANCES]])
+        self.assertEqual([[self.stranger.id, 'stranger', 'other']],
+                         results[MISSING_INSTANCES])
+        self.assertEqual([str(self.vanished.id)],
+                         [entry[0] for entry in results[VANISHED_INSTANCES]])
+        self.assertEqual([], results[MISSING_VOLUMES])
+        # The deleted desktop's volume is live, but not listed
+        self.assertEqual(1, len(results[VANISHED_VOLUMES]))
+        self.assertIn([self.orphan.connection_id, 'orphan'],
+                      results[ORPHANED_CONNECTIONS])
+
+    def test_db_check_while_deleting(self):
+        self.build_fleet()
+        list_servers = self.fake.nova.servers.list.side_effect
+
+        def list_while_shelving(**kwargs):
+            # The vanished desktop is shelved while the servers are
+            # being listed
+            Instance.objects.filter(pk=self.vanished.pk).update(
+                marked_for_deletion=datetime.now(utc))
+            return list_servers(**kwargs)
+
+        self.fake.nova.servers.list.side_effect = list_while_shelving
+
+        results = db_check(page_size=2)
+
+        self.assertEqual([], results[VANISHED_INSTANCES])
+
+    def test_repair_all_deleted(self):
+        self.build_fleet()
+        results = db_check(page_size=2)
+        results[VANISHED_VOLUMES] = []
+        deleted = datetime(2024, 1, 1, tzinfo=utc)
+        Instance.objects.filter(pk=self.vanished.pk).update(deleted=deleted)
+
+        counts = repair_all(results, workers=1)
+
+        self.assertEqual(0, sum(counts.values()))
+        self.fake.nova.servers.get.assert_not_called()
+        self.vanished.refresh_from_db()
+        self.assertEqual(deleted, self.vanished.deleted)
+
+    @patch('vm_manager.utils.db_check.django_rq')
+    def test_request_db_check(self, mock_rq):
+        with self.settings(DB_CHECK_REPORTS_KEPT=2):
+            for i in range(3):
+                report = request_db_check(self.user, repair=True)
+
+        mock_rq.get_queue.return_value.enqueue.assert_called_with(
+            run_db_check, report.id, job_timeout=3600)
+        self.assertEqual(2, ReconciliationReport.objects.count())
+
+    def test_run_db_check_repair(self):
+        self.build_fleet()
+        self.fake.nova.servers.get.side_effect = \
+            novaclient.exceptions.NotFound(404)
+        self.fake.cinder.volumes.get.return_value = FakeVolume(
+            id=self.vanished_volume.id, status=VOLUME_AVAILABLE)
+        report = ReconciliationReport.objects.create(
+            requested_by=self.user, repair=True)
+
+        run_db_check(report.id)
+
+        report.refresh_from_db()
+        self.assertIsNone(report.error)
+        self.assertIsNotNone(report.finished)
+        self.assertEqual(1, report.counts[VANISHED_INSTANCES])
+        self.assertEqual(2, report.repairs[REPAIRED])
+        self.vanished.refresh_from_db()
+        self.assertIsNotNone(self.vanished.deleted)
+
+    def test_run_db_check_failed(self):
+        self.fake.nova.servers.list.side_effect = Exception("Nova is down")
+        report = ReconciliationReport.objects.create(requested_by=self.user)
+
+        run_db_check(report.id)
+
+        report.refresh_from_db()
+        self.assertEqual("Nova is down", report.error)
+        self.assertEqual({}, report.counts)
@@ -1,13 +1,16 @@
 from datetime import datetime, timedelta, timezone
 import re
+import threading
+import time
 from unittest.mock import Mock, patch
 
 from django.test import TestCase
 
 from researcher_desktop.utils.utils import get_desktop_type, desktops_feature
 
-from vm_manager.models import Expiration
-from vm_manager.utils.expirer import Expirer, \
+from vm_manager.models import ResourceExpiration
+from vm_manager.tests.factories import VolumeFactory
+from vm_manager.utils.expirer import Expirer, VolumeExpirer, RateLimiter, \
     EXP_INITIAL, EXP_FIRST_WARNING, EXP_FINAL_WARNING, EXP_EXPIRING, \
     EXP_EXPIRY_COMPLETED, EXP_EXPIRY_FAILED, EXP_EXPIRY_FAILED_RETRYABLE, \
     EXP_NOTIFY, EXP_SUCCESS, EXP_FAIL, EXP_RETRY, EXP_SKIP, EXP_STARTED
@@ -71,65 +74,65 @@ class ExpirerTests(TestCase):
         target = object()
 
         # When do_expire returns EXP_SUCCESS ...
-        fake_expiration = Expiration(expires=now - timedelta(days=1),
-                                     stage=EXP_FINAL_WARNING,
-                                     stage_date=now - timedelta(days=2))
+        fake_expiration = ResourceExpiration(
+            expires=now - timedelta(days=1), stage=EXP_FINAL_WARNING,
+            stage_date=now - timedelta(days=2))
         fake_expiration.save()
         expirer = DummyExpirer(final_warning=timedelta(days=1))
         self.assertEqual(EXP_SUCCESS,
                          expirer.do_stage(target, fake_expiration, self.user))
-        expiration = Expiration.objects.get(pk=fake_expiration.pk)
+        expiration = ResourceExpiration.objects.get(pk=fake_expiration.pk)
         self.assertEqual(EXP_EXPIRY_COMPLETED, expiration.stage)
         expirer.do_expire.assert_called_once_with(target)
 
         # When do_expire returns EXP_FAIL ...
-        fake_expiration = Expiration(expires=now - timedelta(days=1),
-                                     stage=EXP_FINAL_WARNING,
-                                     stage_date=now - timedelta(days=2))
+        fake_expiration = ResourceExpiration(
+            expires=now - timedelta(days=1), stage=EXP_FINAL_WARNING,
+            stage_date=now - timedelta(days=2))
         fake_expiration.save()
         expirer = DummyExpirer(res=EXP_FAIL, final_warning=timedelta(days=1))
         self.assertEqual(EXP_FAIL,
                          expirer.do_stage(target, fake_expiration, self.user))
-        expiration = Expiration.objects.get(pk=fake_expiration.pk)
+        expiration = ResourceExpiration.objects.get(pk=fake_expiration.pk)
         self.assertEqual(EXP_EXPIRY_FAILED, expiration.stage)
         expirer.do_expire.assert_called_once_with(target)
 
         # When do_expire returns EXP_STARTED ...
-        fake_expiration = Expiration(expires=now - timedelta(days=1),
-                                     stage=EXP_FINAL_WARNING,
-                                     stage_date=now - timedelta(days=2))
+        fake_expiration = ResourceExpiration(
+            expires=now - timedelta(days=1), stage=EXP_FINAL_WARNING,
+            stage_date=now - timedelta(days=2))
         fake_expiration.save()
         expirer = DummyExpirer(res=EXP_STARTED,
                                final_warning=timedelta(days=1))
         self.assertEqual(EXP_STARTED,
                          expirer.do_stage(target, fake_expiration, self.user))
-        expiration = Expiration.objects.get(pk=fake_expiration.pk)
+        expiration = ResourceExpiration.objects.get(pk=fake_expiration.pk)
         self.assertEqual(EXP_EXPIRING, expiration.stage)
         expirer.do_expire.assert_called_once_with(target)
 
         # When do_expire returns EXP_RETRY ...
-        fake_expiration = Expiration(expires=now - timedelta(days=1),
-                                     stage=EXP_FINAL_WARNING,
-                                     stage_date=now - timedelta(days=2))
+        fake_expiration = ResourceExpiration(
+            expires=now - timedelta(days=1), stage=EXP_FINAL_WARNING,
+            stage_date=now - timedelta(days=2))
         fake_expiration.save()
         expirer = DummyExpirer(res=EXP_RETRY,
                                final_warning=timedelta(days=1))
         self.assertEqual(EXP_RETRY,
                          expirer.do_stage(target, fake_expiration, self.user))
-        expiration = Expiration.objects.get(pk=fake_expiration.pk)
+        expiration = ResourceExpiration.objects.get(pk=fake_expiration.pk)
         self.assertEqual(EXP_EXPIRY_FAILED_RETRYABLE, expiration.stage)
         expirer.do_expire.assert_called_once_with(target)
 
         # When do_expire returns EXP_SKIP ...
-        fake_expiration = Expiration(expires=now - timedelta(days=1),
-                                     stage=EXP_FINAL_WARNING,
-                                     stage_date=now - timedelta(days=2))
+        fake_expiration = ResourceExpiration(
+            expires=now - timedelta(days=1), stage=EXP_FINAL_WARNING,
+            stage_date=now - timedelta(days=2))
         fake_expiration.save()
         expirer = DummyExpirer(res=EXP_SKIP,
                                final_warning=timedelta(days=1))
         self.assertEqual(EXP_SKIP,
                          expirer.do_stage(target, fake_expiration, self.user))
-        expiration = Expiration.objects.get(pk=fake_expiration.pk)
+        expiration = ResourceExpiration.objects.get(pk=fake_expiration.pk)
         self.assertEqual(EXP_FINAL_WARNING, expiration.stage)
         expirer.do_expire.assert_called_once_with(target)
 
@@ -139,14 +142,14 @@ class ExpirerTests(TestCase):
         now = datetime.now(utc)
         target = object()
 
-        fake_expiration = Expiration(expires=now - timedelta(days=1),
-                                     stage=EXP_EXPIRY_FAILED_RETRYABLE,
-                                     stage_date=now - timedelta(days=2))
+        fake_expiration = ResourceExpiration(
+            expires=now - timedelta(days=1), stage=EXP_EXPIRY_FAILED_RETRYABLE,
+            stage_date=now - timedelta(days=2))
         fake_expiration.save()
         expirer = DummyExpirer(final_warning=timedelta(days=1))
         self.assertEqual(EXP_SUCCESS,
                          expirer.do_stage(target, fake_expiration, self.user))
-        expiration = Expiration.objects.get(pk=fake_expiration.pk)
+        expiration = ResourceExpiration.objects.get(pk=fake_expiration.pk)
         self.assertEqual(EXP_EXPIRY_COMPLETED, expiration.stage)
         expirer.do_expire.assert_called_once_with(target)
 
@@ -157,14 +160,14 @@ class ExpirerTests(TestCase):
         now = datetime.now(utc)
         target = object()
 
-        fake_expiration = Expiration(expires=now - timedelta(days=1),
-                                     stage=EXP_EXPIRING,
-                                     stage_date=now - timedelta(days=2))
+        fake_expiration = ResourceExpiration(
+            expires=now - timedelta(days=1), stage=EXP_EXPIRING,
+            stage_date=now - timedelta(days=2))
         fake_expiration.save()
         expirer = DummyExpirer(final_warning=timedelta(days=1))
         self.assertEqual(EXP_SKIP,
                          expirer.do_stage(target, fake_expiration, self.user))
-        expiration = Expiration.objects.get(pk=fake_expiration.pk)
+        expiration = ResourceExpiration.objects.get(pk=fake_expiration.pk)
         self.assertEqual(EXP_EXPIRING, expiration.stage)
         expirer.do_expire.assert_not_called()
         mock_logger.warning.assert_called_once_with(
@@ -177,14 +180,14 @@ class ExpirerTests(TestCase):
         now = datetime.now(utc)
         target = object()
 
-        fake_expiration = Expiration(expires=now - timedelta(days=1),
-                                     stage=EXP_EXPIRY_COMPLETED,
-                                     stage_date=now - timedelta(days=2))
+        fake_expiration = ResourceExpiration(
+            expires=now - timedelta(days=1), stage=EXP_EXPIRY_COMPLETED,
+            stage_date=now - timedelta(days=2))
         fake_expiration.save()
         expirer = DummyExpirer(final_warning=timedelta(days=1))
         self.assertEqual(EXP_SKIP,
                          expirer.do_stage(target, fake_expiration, self.user))
-        expiration = Expiration.objects.get(pk=fake_expiration.pk)
+        expiration = ResourceExpiration.objects.get(pk=fake_expiration.pk)
         self.assertEqual(EXP_EXPIRY_COMPLETED, expiration.stage)
         expirer.do_expire.assert_not_called()
         mock_logger.error.assert_called_once_with(
@@ -193,14 +196,14 @@ class ExpirerTests(TestCase):
 
         mock_logger.error.reset_mock()
 
-        fake_expiration = Expiration(expires=now - timedelta(days=1),
-                                     stage=EXP_EXPIRY_FAILED,
-                                     stage_date=now - timedelta(days=2))
+        fake_expiration = ResourceExpiration(
+            expires=now - timedelta(days=1), stage=EXP_EXPIRY_FAILED,
+            stage_date=now - timedelta(days=2))
         fake_expiration.save()
         expirer = DummyExpirer(final_warning=timedelta(days=1))
         self.assertEqual(EXP_SKIP,
                          expirer.do_stage(target, fake_expiration, self.user))
-        expiration = Expiration.objects.get(pk=fake_expiration.pk)
+        expiration = ResourceExpiration.objects.get(pk=fake_expiration.pk)
         self.assertEqual(EXP_EXPIRY_FAILED, expiration.stage)
         expirer.do_expire.assert_not_called()
         mock_logger.error.assert_called_once_with(
@@ -216,8 +219,8 @@ class ExpirerTests(TestCase):
         """
 
         now = datetime.now(utc)
-        expiration = Expiration(expires=now + timedelta(days=7),
-                                stage=EXP_INITIAL, stage_date=now)
+        expiration = ResourceExpiration(expires=now + timedelta(days=7),
+                                        stage=EXP_INITIAL, stage_date=now)
         expiration.save()
         now = now + timedelta(seconds=1)
         expirer = DummyExpirer(dry_run=False,
@@ -258,14 +261,14 @@ class ExpirerTests(TestCase):
                     expirer.add_target_details.assert_called_once()
                     expirer.add_target_details.reset_mock()
                     expirer.do_expire.assert_not_called()
-                updated = Expiration.objects.get(pk=expiration.pk)
+                updated = ResourceExpiration.objects.get(pk=expiration.pk)
                 self.assertEqual(stage, updated.stage)
                 self.assertEqual(expirer.now, updated.stage_date)
             else:
                 self.assertEqual(stage, expiration.stage)
                 expirer.notify.assert_not_called()
                 expirer.do_expire.assert_not_called()
-                updated = Expiration.objects.get(pk=expiration.pk)
+                updated = ResourceExpiration.objects.get(pk=expiration.pk)
                 self.assertEqual(stage, updated.stage)
                 self.assertEqual(old_stage_date, updated.stage_date)
 
@@ -273,8 +276,8 @@ class ExpirerTests(TestCase):
         "Test staging behavior of an expirer with first and final warnings."
 
         now = datetime.now(utc)
-        expiration = Expiration(expires=now + timedelta(days=14),
-                                stage=EXP_INITIAL, stage_date=now)
+        expiration = ResourceExpiration(expires=now + timedelta(days=14),
+                                        stage=EXP_INITIAL, stage_date=now)
         now = now + timedelta(seconds=1)
         expirer = DummyExpirer(dry_run=False,
                                first_warning=timedelta(days=7),
@@ -320,3 +323,120 @@ class ExpirerTests(TestCase):
                 self.assertEqual(stage, expiration.stage)
                 expirer.notify.assert_not_called()
                 expirer.do_expire.assert_not_called()
+
+    def test_due(self):
+        "Test that due() selects what do_stage wouldn't skip."
+
+        now = datetime.now(utc)
+        stages = [EXP_INITIAL, EXP_FIRST_WARNING, EXP_FINAL_WARNING,
+                  EXP_EXPIRING, EXP_EXPIRY_COMPLETED, EXP_EXPIRY_FAILED,
+                  EXP_EXPIRY_FAILED_RETRYABLE]
+        for warnings in [{},
+                         {'final_warning': timedelta(days=1)},
+                         {'first_warning': timedelta(days=7),
+                          'final_warning': timedelta(days=1)}]:
+            expirer = DummyExpirer(dry_run=True, **warnings)
+            expected = set()
+            for stage in stages:
+                if stage == EXP_FIRST_WARNING and not warnings:
+                    continue
+                for days in [-1, 0.5, 3, 10]:
+                    expiration = ResourceExpiration.objects.create(
+                        expires=now + timedelta(days=days),
+                        stage=stage, stage_date=now)
+                    res = expirer.do_stage(object(), expiration, self.user)
+                    if res != EXP_SKIP or stage == EXP_EXPIRING:
+                        expected.add(expiration.pk)
+            self.assertEqual(
+                expected,
+                set(ResourceExpiration.objects.filter(expirer.due(''))
+                    .values_list('pk', flat=True)))
+            ResourceExpiration.objects.all().delete()
+
+    @patch('vm_manager.utils.expirer.send_notification')
+    def test_run(self, mock_send):
+        now = datetime.now(utc)
+        volumes = []
+        for days in [-1, 3, 30, 60]:
+            volume = VolumeFactory.create(
+                user=self.user, operating_system=self.UBUNTU.id,
+                requesting_feature=self.FEATURE)
+            volume.set_expires(now + timedelta(days=days))
+            volumes.append(volume)
+        VolumeFactory.create(user=self.user,
+                             operating_system=self.UBUNTU.id,
+                             requesting_feature=self.FEATURE)
+
+        with self.settings(VOLUME_WARNING_1=7, VOLUME_WARNING_2=1):
+            expirer = VolumeExpirer()
+        # The volumes that are not due aren't fetched.  There is one
+        # query for the due volumes (with their users, expirations and
+        # features), one for the desktop types, and one to save each
+        # expiration.
+        with self.assertNumQueries(4):
+            counts = expirer.run(self.FEATURE)
+
+        self.assertEqual({EXP_NOTIFY: 2}, counts)
+        self.assertEqual(2, mock_send.call_count)
+        context = mock_send.call_args.args[2]
+        self.assertEqual(self.UBUNTU, context['desktop_type'])
+
+    def make_due(self, count, zone=None):
+        expires = datetime.now(utc) - timedelta(days=1)
+        return [(Mock(zone=zone), Mock(stage=EXP_FINAL_WARNING,
+                                       expires=expires),
+                 self.user)
+                for i in range(count)]
+
+    def test_max_actions(self):
+        expirer = DummyExpirer(final_warning=timedelta(days=1))
+        expirer.max_actions = 2
+        targets = self.make_due(3)
+
+        counts = expirer.stage_all(targets)
+
+        self.assertEqual({EXP_SUCCESS: 2, EXP_SKIP: 1}, counts)
+        self.assertEqual(2, expirer.do_expire.call_count)
+        # The deferred expiration isn't updated
+        targets[2][1].save.assert_not_called()
+
+        # In dry-run mode, the cap applies to the would-be actions
+        expirer = DummyExpirer(final_warning=timedelta(days=1),
+                               dry_run=True)
+        expirer.max_actions = 2
+        self.assertEqual({EXP_SUCCESS: 2, EXP_SKIP: 1},
+                         expirer.stage_all(self.make_due(3)))
+        expirer.do_expire.assert_not_called()
+
+    def test_concurrent(self):
+        with self.settings(EXPIRER_WORKERS=4, EXPIRER_ZONE_WORKERS=1):
+            expirer = DummyExpirer(final_warning=timedelta(days=1))
+        expirer.target_zone = lambda target: target.zone
+        lock = threading.Lock()
+        running = {}
+        most = {}
+
+        def do_expire(target):
+            with lock:
+                running[target.zone] = running.get(target.zone, 0) + 1
+                most[target.zone] = max(most.get(target.zone, 0),
+                                        running[target.zone])
+            time.sleep(0.01)
+            with lock:
+                running[target.zone] -= 1
+            return EXP_SUCCESS
+
+        expirer.do_expire = do_expire
+        counts = expirer.stage_all(
+            self.make_due(4, zone='a') + self.make_due(4, zone='b'))
+
+        self.assertEqual({EXP_SUCCESS: 8}, counts)
+        # At most one action at a time in each zone
+        self.assertEqual({'a': 1, 'b': 1}, most)
+
+    def test_rate_limiter(self):
+        limiter = RateLimiter(50)
+        start = time.monotonic()
+        for i in range(3):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.04)
@@ -0,0 +1,89 @@
+import time
+from unittest.mock import Mock, patch
+
+from django.test import TestCase
+from prometheus_client import REGISTRY
+from redis.exceptions import LockError, RedisError
+
+from vm_manager.utils.expirer import EXP_NOTIFY, EXP_SUCCESS
+from vm_manager.utils.expirer_daemon import ExpirerDaemon
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@patch('vm_manager.utils.expirer_daemon.EXPIRY_JOBS')
+class ExpirerDaemonTests(TestCase):
+
+    def make_daemon(self, owned=False, acquired=True):
+        connection = Mock()
+        lock = connection.lock.return_value
+        lock.owned.return_value = owned
+        lock.acquire.return_value = acquired
+        return ExpirerDaemon({'shelve': 60, 'archive': 120},
+                             connection=connection)
+
+    def test_run_due(self, mock_jobs):
+        mock_job = mock_jobs.__getitem__.return_value
+        mock_job.return_value = {EXP_NOTIFY: 2, EXP_SUCCESS: 1}
+        before = sample('bumblebee_expirer_outcomes_total',
+                        job='shelve', outcome=EXP_NOTIFY)
+        daemon = self.make_daemon()
+
+        wait = daemon.run_due()
+
+        # Both jobs ran, and the shelve job is next
+        self.assertEqual(2, mock_job.call_count)
+        self.assertTrue(55 < wait <= 60)
+        mock_job.assert_called_with(dry_run=False, verbose=False)
+        self.assertEqual(before + 2, sample(
+            'bumblebee_expirer_outcomes_total',
+            job='shelve', outcome=EXP_NOTIFY))
+        self.assertEqual(1, sample('bumblebee_expirer_leader'))
+
+        # Nothing is due yet
+        daemon.run_due()
+        self.assertEqual(2, mock_job.call_count)
+
+    def test_follower(self, mock_jobs):
+        daemon = self.make_daemon(acquired=False)
+
+        self.assertIsNone(daemon.run_due())
+
+        mock_jobs.__getitem__.assert_not_called()
+        self.assertEqual(0, sample('bumblebee_expirer_leader'))
+
+    def test_lost_leadership(self, mock_jobs):
+        daemon = self.make_daemon(owned=True)
+        daemon.lock.reacquire.side_effect = LockError("Not owned")
+
+        self.assertFalse(daemon.is_leader())
+
+    def test_owns_lock(self, mock_jobs):
+        daemon = self.make_daemon(owned=True)
+        self.assertTrue(daemon.owns_lock())
+
+        daemon.lock.owned.side_effect = RedisError("Connection refused")
+        self.assertFalse(daemon.owns_lock())
+
+    def test_job_failed(self, mock_jobs):
+        mock_jobs.__getitem__.return_value.side_effect = Exception("Boom")
+        before = sample('bumblebee_expirer_failures_total', job='shelve')
+        daemon = self.make_daemon()
+
+        self.assertIsNone(daemon.run_job('shelve'))
+
+        self.assertEqual(before + 1, sample(
+            'bumblebee_expirer_failures_total', job='shelve'))
+
+    def test_heartbeat(self, mock_jobs):
+        # The job takes long enough for the lock to be renewed
+        mock_jobs.__getitem__.return_value.side_effect = \
+            lambda **kwargs: time.sleep(0.2) or {}
+        daemon = self.make_daemon(owned=True)
+        daemon.heartbeat = 0.05
+
+        self.assertEqual({}, daemon.run_job('shelve'))
+
+        self.assertTrue(daemon.lock.reacquire.called)
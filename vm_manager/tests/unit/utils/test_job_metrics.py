@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+import time
+from unittest.mock import Mock, patch
+
+from django.test import TestCase
+from redis.exceptions import ConnectionError
+
+from vm_manager.tests.fakes import FakeRedis
+from vm_manager.utils.job_metrics import READY_SECONDS, STEP_SECONDS, \
+    get_histograms, get_queue_stats, get_scheduler_stats, observe, \
+    observe_ready
+
+utc = timezone.utc
+
+
+class JobMetricsTests(TestCase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.redis = FakeRedis()
+
+    def test_histograms(self):
+        for seconds in (0.5, 3, 4, 7200):
+            observe(STEP_SECONDS, ['launch_vm_worker', 'continue'], seconds,
+                    connection=self.redis)
+        observe(STEP_SECONDS, ['shelve_vm_worker', 'failed'], 20,
+                connection=self.redis)
+
+        histograms = get_histograms(connection=self.redis)
+
+        buckets, total = \
+            histograms[STEP_SECONDS][('launch_vm_worker', 'continue')]
+        self.assertEqual(7207.5, total)
+        # The bucket counts are cumulative
+        self.assertEqual([('1', 1), ('5', 3), ('15', 3)], buckets[:3])
+        self.assertEqual([('3600', 3), ('+Inf', 4)], buckets[-2:])
+        buckets, _ = histograms[STEP_SECONDS][('shelve_vm_worker', 'failed')]
+        self.assertEqual([('15', 0), ('30', 1)], buckets[2:4])
+        self.assertEqual({}, histograms[READY_SECONDS])
+
+    @patch('vm_manager.utils.job_metrics._get_connection')
+    def test_observe_ready(self, mock_connection):
+        mock_connection.return_value = self.redis
+        now = datetime.now(utc)
+        vm_status = Mock(operating_system='ubuntu', ready=now,
+                         created=now - timedelta(seconds=100))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            observe_ready(vm_status)
+
+        buckets, total = get_histograms()[READY_SECONDS][('ubuntu',)]
+        self.assertEqual(100, total)
+        self.assertEqual([('60', 0), ('120', 1)], buckets[4:6])
+
+    @patch('vm_manager.utils.job_metrics.logger')
+    def test_observe_no_redis(self, mock_logger):
+        connection = Mock()
+        connection.pipeline.return_value.execute.side_effect = \
+            ConnectionError("Connection refused")
+
+        observe(STEP_SECONDS, ['launch_vm_worker', 'continue'], 1,
+                connection=connection)
+
+        mock_logger.warning.assert_called_once()
+
+    @patch('vm_manager.utils.job_metrics.django_rq')
+    def test_get_queue_stats(self, mock_rq):
+        queue = mock_rq.get_queue.return_value
+        queue.count = 3
+        queue.started_job_registry.count = 2
+        queue.deferred_job_registry.count = 0
+        queue.failed_job_registry.count = 1
+        queue.get_jobs.return_value = [Mock(
+            enqueued_at=datetime.now(utc) - timedelta(seconds=30))]
+
+        counts, lag = get_queue_stats()
+
+        self.assertEqual({'queued': 3, 'started': 2, 'deferred': 0,
+                          'failed': 1}, counts)
+        self.assertTrue(30 <= lag < 40)
+
+        queue.get_jobs.return_value = []
+        self.assertEqual(0, get_queue_stats()[1])
+
+    @patch('vm_manager.utils.job_metrics.django_rq')
+    def test_get_scheduler_stats(self, mock_rq):
+        now = time.time()
+        scores = [now - 600, now - 10, now + 60, now + 3600]
+        connection = mock_rq.get_scheduler.return_value.connection
+        connection.zcard.return_value = len(scores)
+        connection.zcount.side_effect = \
+            lambda key, low, high: len([s for s in scores if s <= high])
+        connection.zrange.return_value = [(b'job', scores[0])]
+
+        counts, lag = get_scheduler_stats()
+
+        self.assertEqual({'pending': 2, 'due': 1, 'overdue': 1}, counts)
+        self.assertTrue(600 <= lag < 610)
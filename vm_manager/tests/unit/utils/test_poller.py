@@ -0,0 +1,250 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+
+from django.test import TestCase
+
+from vm_manager.constants import ACTIVE, BUILD, SHUTDOWN, MISSING
+from vm_manager.models import WorkflowStep
+from vm_manager.tests.fakes import FakeNectar, FakeRedis, FakeServer, \
+    FakeVolume
+from vm_manager.utils.poller import register_wait, Poller, \
+    LOCK_KEY, SERVER, VOLUME, WAITS_KEY
+from vm_manager.utils.utils import get_nectar
+from vm_manager.utils.workflow import decode, run_step
+
+utc = timezone.utc
+
+
+def continuation(*args, **kwargs):
+    pass
+
+
+def server(id, status, environment='tiger'):
+    return FakeServer(id=id, status=status,
+                      metadata={'environment': environment})
+
+
+@patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
+@patch('vm_manager.utils.poller.django_rq')
+class PollerTests(TestCase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.redis = FakeRedis()
+        # The class's patch doesn't cover setUp
+        patcher = patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        fake = get_nectar()
+        fake.nova.servers.list.reset_mock()
+        fake.nova.servers.list.side_effect = None
+        fake.cinder.volumes.list.reset_mock()
+        fake.cinder.volumes.list.side_effect = None
+
+    def register(self, mock_rq, *args, **kwargs):
+        mock_rq.get_connection.return_value = self.redis
+        wait_id = register_wait(*args, **kwargs)
+        self.make_due()
+        return wait_id
+
+    def make_due(self):
+        # Pretend that the waits' intervals have elapsed
+        for wait_id, wait in self.redis.hgetall(WAITS_KEY).items():
+            wait = Poller._load(wait)
+            wait['next_check'] = datetime.now(utc) - timedelta(seconds=1)
+            self.redis.hset(WAITS_KEY, wait_id, Poller._dump(wait))
+
+    def assert_dispatched(self, mock_queue, step_id, *args, **kwargs):
+        step = WorkflowStep.objects.get(pk=step_id)
+        mock_queue.enqueue_call.assert_called_once_with(
+            func=run_step, args=(step.run_id,), job_id=step.job_id)
+        self.assertEqual(list(args), decode(step.args))
+        self.assertEqual(kwargs, decode(step.kwargs))
+
+    def run_poller(self, mock_rq):
+        mock_queue = Mock()
+        mock_rq.get_queue.return_value = mock_queue
+        return Poller(connection=self.redis).run(), mock_queue
+
+    def test_register_wait_needs_targets_or_pending(self, mock_rq):
+        with self.assertRaises(ValueError):
+            register_wait(SERVER, 'x', continuation, interval=5)
+        with self.assertRaises(ValueError):
+            register_wait(SERVER, 'x', continuation, interval=5,
+                          targets={ACTIVE}, pending={BUILD})
+
+    def test_not_due(self, mock_rq):
+        mock_rq.get_connection.return_value = self.redis
+        register_wait(SERVER, 'x', continuation, interval=5,
+                      targets={ACTIVE})
+
+        counts, mock_queue = self.run_poller(mock_rq)
+
+        self.assertEqual({'dispatched': 0, 'waiting': 0}, counts)
+        get_nectar().nova.servers.list.assert_not_called()
+        mock_queue.enqueue_call.assert_not_called()
+
+    def test_target_reached(self, mock_rq):
+        step_id = self.register(mock_rq, SERVER, 'a', continuation, 1, 2,
+                                interval=5, targets={ACTIVE}, x=3)
+        self.register(mock_rq, SERVER, 'b', continuation, 4,
+                      interval=5, targets={ACTIVE})
+        get_nectar().nova.servers.list.return_value = [
+            server('a', ACTIVE),
+            server('b', BUILD),
+        ]
+
+        counts, mock_queue = self.run_poller(mock_rq)
+
+        # One list call for both waits
+        get_nectar().nova.servers.list.assert_called_once()
+        self.assertEqual({'dispatched': 1, 'waiting': 1}, counts)
+        self.assert_dispatched(mock_queue, step_id, 1, 2, x=3)
+        self.assertEqual(1, len(self.redis.hgetall(WAITS_KEY)))
+
+        # The remaining wait isn't due again until its interval is up
+        counts, mock_queue = self.run_poller(mock_rq)
+        self.assertEqual({'dispatched': 0, 'waiting': 0}, counts)
+
+    def test_other_environment(self, mock_rq):
+        step_id = self.register(mock_rq, SERVER, 'a', continuation,
+                                interval=5, targets={MISSING})
+        # Another environment's server, that happens to have the same id
+        get_nectar().nova.servers.list.return_value = [
+            server('a', ACTIVE, environment='other')]
+
+        counts, mock_queue = self.run_poller(mock_rq)
+
+        self.assertEqual({'dispatched': 1, 'waiting': 0}, counts)
+        self.assert_dispatched(mock_queue, step_id)
+
+    def test_pending(self, mock_rq):
+        step_id = self.register(mock_rq, VOLUME, 'v', continuation,
+                                interval=5, pending={'deleting'}, retries=3)
+        get_nectar().cinder.volumes.list.return_value = [
+            FakeVolume(id='v', status='deleting')]
+
+        counts, mock_queue = self.run_poller(mock_rq)
+        self.assertEqual({'dispatched': 0, 'waiting': 1}, counts)
+
+        # The volume has gone
+        self.make_due()
+        get_nectar().cinder.volumes.list.return_value = []
+        counts, mock_queue = self.run_poller(mock_rq)
+        self.assertEqual({'dispatched': 1, 'waiting': 0}, counts)
+        self.assert_dispatched(mock_queue, step_id, retries=2)
+
+    def test_retries(self, mock_rq):
+        step_id = self.register(mock_rq, SERVER, 'a', continuation,
+                                interval=5, targets={MISSING}, retries=2)
+        get_nectar().nova.servers.list.return_value = [
+            server('a', SHUTDOWN)]
+
+        for _ in range(2):
+            counts, mock_queue = self.run_poller(mock_rq)
+            self.assertEqual({'dispatched': 0, 'waiting': 1}, counts)
+            self.make_due()
+
+        # Out of retries, so the continuation gets to deal with it
+        counts, mock_queue = self.run_poller(mock_rq)
+        self.assertEqual({'dispatched': 1, 'waiting': 0}, counts)
+        self.assert_dispatched(mock_queue, step_id, retries=0)
+
+    def test_deadline(self, mock_rq):
+        step_id = self.register(
+            mock_rq, SERVER, 'a', continuation, interval=5, targets={ACTIVE},
+            deadline=datetime.now(utc) - timedelta(seconds=1))
+        get_nectar().nova.servers.list.return_value = [
+            server('a', BUILD)]
+
+        counts, mock_queue = self.run_poller(mock_rq)
+
+        self.assertEqual({'dispatched': 1, 'waiting': 0}, counts)
+        self.assert_dispatched(mock_queue, step_id)
+
+    def test_list_failure(self, mock_rq):
+        self.register(mock_rq, SERVER, 'a', continuation,
+                      interval=5, targets={ACTIVE}, retries=1)
+        get_nectar().nova.servers.list.side_effect = Exception("Boom")
+
+        counts, mock_queue = self.run_poller(mock_rq)
+
+        # The failed check doesn't use up a retry
+        self.assertEqual({'dispatched': 0, 'waiting': 1}, counts)
+        wait = Poller._load(list(self.redis.hgetall(WAITS_KEY).values())[0])
+        self.assertEqual(1, wait['retries'])
+
+    def test_other_poller(self, mock_rq):
+        self.register(mock_rq, SERVER, 'a', continuation,
+                      interval=5, targets={ACTIVE})
+        self.redis.set(LOCK_KEY, 'another-poller')
+
+        counts, mock_queue = self.run_poller(mock_rq)
+
+        self.assertIsNone(counts)
+        get_nectar().nova.servers.list.assert_not_called()
+        self.assertEqual('another-poller', self.redis.get(LOCK_KEY))
+
+    def test_lock_lost(self, mock_rq):
+        self.register(mock_rq, SERVER, 'a', continuation,
+                      interval=5, targets={ACTIVE})
+        waits = self.redis.hgetall(WAITS_KEY)
+
+        def list_slowly(**kwargs):
+            # The listing outlasts the lock, and another poller takes
+            # over (and dispatches the wait)
+            self.redis.set(LOCK_KEY, 'another-poller')
+            self.redis.hashes[WAITS_KEY].clear()
+            return [server('a', BUILD)]
+
+        get_nectar().nova.servers.list.side_effect = list_slowly
+
+        counts, mock_queue = self.run_poller(mock_rq)
+
+        # The wait isn't written back
+        self.assertIsNone(counts)
+        self.assertEqual({}, self.redis.hgetall(WAITS_KEY))
+        self.assertNotEqual({}, waits)
+        self.assertEqual('another-poller', self.redis.get(LOCK_KEY))
+
+    def test_adaptive_interval(self, mock_rq):
+        now = datetime.now(utc)
+        wait = {'interval': 5, 'retries': None, 'typical': 60,
+                'checks': 0, 'deadline': None}
+
+        # The first check is around the typical duration ...
+        self.assertTrue(now + timedelta(seconds=48)
+                        <= Poller._next_check(wait, now)
+                        <= now + timedelta(seconds=72))
+        # ... then the checks back off from the base interval
+        for checks, interval in [(1, 5), (2, 10), (3, 20), (5, 60)]:
+            wait['checks'] = checks
+            delay = Poller._next_check(wait, now) - now
+            self.assertTrue(interval * 0.8 <= delay.total_seconds()
+                            <= interval * 1.2)
+
+        # ... but not past the deadline
+        wait['deadline'] = now + timedelta(seconds=7)
+        self.assertEqual(wait['deadline'], Poller._next_check(wait, now))
+
+        # Waits with retries are checked at fixed intervals
+        wait = {'interval': 5, 'retries': 3, 'typical': None,
+                'checks': 2, 'deadline': None}
+        self.assertEqual(now + timedelta(seconds=5),
+                         Poller._next_check(wait, now))
+
+    def test_reached_recorded(self, mock_rq):
+        reached_id = self.register(mock_rq, SERVER, 'a', continuation,
+                                   interval=5, targets={ACTIVE})
+        timed_out_id = self.register(
+            mock_rq, SERVER, 'b', continuation, interval=5, targets={ACTIVE},
+            deadline=datetime.now(utc) - timedelta(seconds=1))
+        get_nectar().nova.servers.list.return_value = [
+            server('a', ACTIVE),
+            server('b', BUILD)]
+
+        counts, mock_queue = self.run_poller(mock_rq)
+
+        self.assertEqual({'dispatched': 2, 'waiting': 0}, counts)
+        self.assertIsNotNone(WorkflowStep.objects.get(pk=reached_id).reached)
+        self.assertIsNone(WorkflowStep.objects.get(pk=timed_out_id).reached)
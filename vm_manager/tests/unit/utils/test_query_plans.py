@@ -0,0 +1,44 @@
+from unittest.mock import patch
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase
+
+from vm_manager.constants import NO_VM
+from vm_manager.models import VMStatus
+from vm_manager.utils.query_plans import analyze, check_query_plans, \
+    explain, manager_methods, plan_problems, seed
+
+
+class QueryPlansTests(TestCase):
+
+    def test_check_query_plans(self):
+        user = seed(50, batch_size=20)
+        analyze()
+
+        results = check_query_plans(user)
+
+        self.assertEqual(set(manager_methods()), set(results))
+        for name, queries in results.items():
+            self.assertTrue(queries, name)
+            for sql, _, problems in queries:
+                self.assertEqual([], problems, f"{name}: {sql}")
+
+    def test_plan_problems(self):
+        seed(50)
+        analyze()
+        query = VMStatus.objects.filter(status=NO_VM).order_by('created')
+
+        problems = plan_problems(explain(*query.query.sql_with_params()))
+
+        self.assertIn(f"full scan of {VMStatus._meta.db_table}", problems)
+        if connection.vendor == 'sqlite':
+            self.assertIn("sort", problems)
+
+    @patch('vm_manager.management.commands.check_query_plans.seed')
+    def test_unsupported_vendor(self, mock_seed):
+        with patch.object(connection, 'vendor', 'oracle'):
+            with self.assertRaisesRegex(CommandError,
+                                        "Can't check oracle query plans"):
+                call_command('check_query_plans', '--noinput')
+        mock_seed.assert_not_called()
@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+import uuid
+
+from django.test import TestCase
+
+from researcher_workspace.tests.factories import FeatureFactory, UserFactory
+from researcher_desktop.tests.factories import DesktopTypeFactory
+from vm_manager.constants import ACTIVE, SHUTDOWN, MISSING, VOLUME_IN_USE
+from vm_manager.models import Instance, Volume
+from vm_manager.tests.factories import InstanceFactory, VolumeFactory
+from vm_manager.tests.fakes import FakeNectar, FakeServer, FakeVolume
+from vm_manager.utils.reconciler import Reconciler
+from vm_manager.utils.utils import get_nectar
+
+utc = timezone.utc
+
+
+class ReconcilerTests(TestCase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.user = UserFactory.create()
+        self.feature = FeatureFactory.create(app_name='feature')
+        self.desktop_type = DesktopTypeFactory.create(
+            id='desktop', name='desktop', feature=self.feature)
+
+    def make_instance(self):
+        volume = VolumeFactory.create(
+            id=uuid.uuid4(), user=self.user,
+            operating_system=self.desktop_type.id,
+            requesting_feature=self.feature, zone='QRIScloud')
+        return InstanceFactory.create(
+            id=uuid.uuid4(), user=self.user, boot_volume=volume)
+
+    @staticmethod
+    def server(instance, status, environment='tiger'):
+        return FakeServer(id=str(instance.id), status=status,
+                          metadata={'environment': environment})
+
+    @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
+    def test_run(self):
+        active = self.make_instance()
+        shutoff = self.make_instance()
+        gone = self.make_instance()
+        other_env = self.make_instance()
+        deleted = self.make_instance()
+        deleted.deleted = datetime.now(utc)
+        deleted.save()
+
+        fake = get_nectar()
+        fake.nova.servers.list.reset_mock()
+        fake.cinder.volumes.list.reset_mock()
+        fake.nova.servers.list.return_value = [
+            self.server(active, ACTIVE),
+            self.server(shutoff, SHUTDOWN),
+            self.server(other_env, ACTIVE, environment='lion'),
+        ]
+        fake.cinder.volumes.list.return_value = [
+            FakeVolume(id=str(active.boot_volume.id), status=VOLUME_IN_USE),
+        ]
+
+        counts = Reconciler(page_size=10).run()
+
+        self.assertEqual({'observed': 2, 'missing': 2},
+                         counts['instances'])
+        self.assertEqual({'observed': 1, 'missing': 4}, counts['volumes'])
+        fake.nova.servers.list.assert_called_once_with(
+            marker=None, limit=10, detailed=True)
+        fake.cinder.volumes.list.assert_called_once_with(
+            marker=None, limit=10, detailed=True,
+            search_opts={'metadata': {'environment': 'tiger'}})
+
+        def observed(resource):
+            return type(resource).objects.get(pk=resource.pk).observed_status
+
+        self.assertEqual(ACTIVE, observed(active))
+        self.assertEqual(SHUTDOWN, observed(shutoff))
+        self.assertEqual(MISSING, observed(gone))
+        self.assertEqual(MISSING, observed(other_env))
+        self.assertIsNone(observed(deleted))
+        self.assertEqual(VOLUME_IN_USE, observed(active.boot_volume))
+        self.assertEqual(MISSING, observed(gone.boot_volume))
+
+        # The snapshot is used by the status checks
+        fake.nova.servers.get.reset_mock()
+        self.assertTrue(Instance.objects.get(pk=active.pk)
+                        .check_active_status())
+        fake.nova.servers.get.assert_not_called()
+
+    @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
+    def test_run_paging(self):
+        instances = [self.make_instance() for _ in range(3)]
+
+        fake = get_nectar()
+        fake.nova.servers.list.reset_mock()
+        fake.cinder.volumes.list.reset_mock()
+        fake.nova.servers.list.side_effect = [
+            [self.server(instances[0], ACTIVE),
+             self.server(instances[1], ACTIVE)],
+            [self.server(instances[2], SHUTDOWN)],
+        ]
+        fake.cinder.volumes.list.return_value = []
+
+        counts = Reconciler(page_size=2).run()
+
+        self.assertEqual({'observed': 3, 'missing': 0},
+                         counts['instances'])
+        self.assertEqual(2, fake.nova.servers.list.call_count)
+        fake.nova.servers.list.assert_called_with(
+            marker=str(instances[1].id), limit=2, detailed=True)
+
+    @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
+    def test_run_new_resources_not_missing(self):
+        instance = self.make_instance()
+        Instance.objects.filter(pk=instance.pk).update(
+            created=datetime.now(utc) + timedelta(minutes=1))
+
+        fake = get_nectar()
+        fake.nova.servers.list.reset_mock()
+        fake.cinder.volumes.list.reset_mock()
+        fake.nova.servers.list.return_value = []
+        fake.cinder.volumes.list.return_value = []
+
+        counts = Reconciler().run()
+
+        self.assertEqual({'observed': 0, 'missing': 0},
+                         counts['instances'])
+        self.assertIsNone(
+            Instance.objects.get(pk=instance.pk).observed_status)
+        self.assertEqual(
+            MISSING, Volume.objects.get(pk=instance.boot_volume.pk)
+            .observed_status)
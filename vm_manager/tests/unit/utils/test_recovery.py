@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+from unittest.mock import Mock, patch
+
+from django.test import TestCase
+
+from vm_manager.constants import ACTIVE, WF_LAUNCH
+from vm_manager.models import WorkflowRun, WorkflowStep
+from vm_manager.tests.fakes import FakeRedis
+from vm_manager.utils.poller import register_wait, SERVER, WAITS_KEY
+from vm_manager.utils.recovery import recover_runs
+from vm_manager.utils.workflow import start_workflow, run_step
+
+utc = timezone.utc
+
+
+def continuation(*args, **kwargs):
+    pass
+
+
+@patch('vm_manager.utils.recovery.Job')
+@patch('vm_manager.utils.workflow.django_rq')
+@patch('vm_manager.utils.poller.django_rq')
+class RecoveryTests(TestCase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.redis = FakeRedis()
+
+    def test_lost_wait(self, mock_poller_rq, mock_workflow_rq, mock_job):
+        mock_poller_rq.get_connection.return_value = self.redis
+        step_id = register_wait(SERVER, 'a', continuation, 1,
+                                interval=5, targets={ACTIVE})
+
+        counts = recover_runs(connection=self.redis)
+        self.assertEqual(
+            {'running': 1, 'stalled': 0, 'rearmed': 0, 'requeued': 0},
+            counts)
+
+        # Lose the wait (e.g. Redis was restarted) ...
+        self.redis.hdel(WAITS_KEY, str(step_id))
+        counts = recover_runs(connection=self.redis)
+        self.assertEqual(
+            {'running': 0, 'stalled': 0, 'rearmed': 1, 'requeued': 0},
+            counts)
+        self.assertIsNotNone(self.redis.hget(WAITS_KEY, str(step_id)))
+
+    def test_lost_job(self, mock_poller_rq, mock_workflow_rq, mock_job):
+        run = start_workflow(WF_LAUNCH, continuation)
+        step = run.current_step()
+        mock_queue = Mock()
+        mock_workflow_rq.get_queue.return_value = mock_queue
+
+        mock_job.exists.return_value = True
+        counts = recover_runs(connection=self.redis)
+        self.assertEqual(1, counts['running'])
+        mock_job.exists.assert_called_once_with(step.job_id, self.redis)
+        mock_queue.enqueue_call.assert_not_called()
+
+        mock_job.exists.return_value = False
+        counts = recover_runs(connection=self.redis)
+        self.assertEqual(1, counts['requeued'])
+        step = WorkflowStep.objects.get(pk=step.pk)
+        mock_queue.enqueue_call.assert_called_once_with(
+            func=run_step, args=(run.id,), job_id=step.job_id)
+
+    def test_stalled_and_finished(self, mock_poller_rq, mock_workflow_rq,
+                                  mock_job):
+        mock_job.exists.return_value = False
+        stalled = start_workflow(WF_LAUNCH, continuation)
+        WorkflowStep.objects.filter(run=stalled).update(
+            started=datetime.now(utc))
+        finished = start_workflow(WF_LAUNCH, continuation)
+        WorkflowRun.objects.filter(pk=finished.pk).update(
+            finished=datetime.now(utc))
+
+        counts = recover_runs(connection=self.redis)
+
+        self.assertEqual(
+            {'running': 0, 'stalled': 1, 'rearmed': 0, 'requeued': 0},
+            counts)
+        # Only the original two jobs were enqueued
+        mock_queue = mock_workflow_rq.get_queue.return_value
+        self.assertEqual(2, mock_queue.enqueue_call.call_count)
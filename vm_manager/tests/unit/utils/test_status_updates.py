@@ -0,0 +1,176 @@
+from datetime import datetime, timedelta, timezone
+import threading
+import time
+from unittest.mock import ANY, patch
+
+from django.test import TestCase
+from redis.exceptions import ConnectionError
+
+from researcher_workspace.tests.factories import UserFactory
+from researcher_desktop.utils.utils import get_desktop_type, desktops_feature
+
+from vm_manager.constants import VM_ERROR, VM_WAITING, VM_OKAY
+from vm_manager.models import VMStatus
+from vm_manager.tests.fakes import FakeRedis
+from vm_manager.utils.status_updates import publish_status, get_version, \
+    get_status, wait_for_change, _status_key
+from vm_manager.views import get_vm_status_summary, wait_vm_status
+
+utc = timezone.utc
+
+
+class StatusUpdatesTests(TestCase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.user = UserFactory.create(username='joe@acme.com')
+        self.UBUNTU = get_desktop_type('ubuntu')
+        self.redis = FakeRedis()
+
+    def make_vm_status(self, wait_time=None):
+        return VMStatus.objects.create(
+            user=self.user, requesting_feature=desktops_feature(),
+            operating_system=self.UBUNTU.id, status=VM_WAITING,
+            status_progress=0, status_message="Starting",
+            wait_time=wait_time or datetime.now(utc) + timedelta(hours=1))
+
+    @patch('vm_manager.utils.status_updates._get_connection')
+    def test_publish_on_commit(self, mock_get):
+        mock_get.return_value = self.redis
+
+        with self.captureOnCommitCallbacks(execute=True):
+            vm_status = self.make_vm_status()
+        self.assertEqual(1, get_version(self.user.id, self.UBUNTU.id))
+
+        # Each save is a new version, with a new summary
+        with self.captureOnCommitCallbacks(execute=True):
+            vm_status.status_progress = 50
+            vm_status.save()
+        version, summary = get_status(self.user.id, self.UBUNTU.id)
+        self.assertEqual(2, version)
+        self.assertEqual(50, summary['status_progress'])
+        self.assertEqual(vm_status.wait_time.timestamp(),
+                         summary['wait_time'])
+
+        # Publishing doesn't fail if Redis does
+        mock_get.side_effect = ConnectionError("No redis")
+        self.assertIsNone(publish_status(vm_status))
+
+    def test_wait_for_change(self):
+        vm_status = self.make_vm_status()
+
+        # Returns at once if the version has already changed
+        publish_status(vm_status, connection=self.redis)
+        self.assertEqual(1, wait_for_change(
+            self.user.id, self.UBUNTU.id, 0, connection=self.redis))
+
+        # Otherwise, returns the same version when it times out
+        start = time.monotonic()
+        self.assertEqual(1, wait_for_change(
+            self.user.id, self.UBUNTU.id, 1, timeout=0.1,
+            connection=self.redis))
+        self.assertTrue(time.monotonic() - start >= 0.1)
+        self.assertEqual({}, {channel: subscribers for channel, subscribers
+                              in self.redis.subscribers.items()
+                              if subscribers})
+
+    def test_wait_for_publish(self):
+        vm_status = self.make_vm_status()
+        timer = threading.Timer(
+            0.05, publish_status, [vm_status], {'connection': self.redis})
+        timer.start()
+        try:
+            self.assertEqual(1, wait_for_change(
+                self.user.id, self.UBUNTU.id, 0, timeout=5,
+                connection=self.redis))
+        finally:
+            timer.cancel()
+
+    @patch('vm_manager.utils.status_updates._get_connection')
+    def test_get_vm_status_summary(self, mock_get):
+        mock_get.return_value = self.redis
+        vm_status = self.make_vm_status()
+
+        # The summary is filled in from the database the first time
+        version, summary = get_vm_status_summary(self.user, self.UBUNTU.id)
+        self.assertEqual(1, version)
+        self.assertEqual({'status': VM_WAITING, 'status_progress': 0,
+                          'status_message': "Starting"}, summary)
+
+        # ... then it comes from Redis
+        with self.assertNumQueries(0):
+            self.assertEqual((version, summary), get_vm_status_summary(
+                self.user, self.UBUNTU.id))
+
+        # ... unless the workflow has timed out
+        vm_status.wait_time = datetime.now(utc) - timedelta(seconds=1)
+        vm_status.save()
+        publish_status(vm_status)
+        version, summary = get_vm_status_summary(self.user, self.UBUNTU.id)
+        self.assertEqual(VM_ERROR, summary['status'])
+        self.assertEqual(3, version)
+
+        # ... and then it is no longer waiting, so the summary is used
+        # (and the version stays the same)
+        with self.assertNumQueries(0):
+            self.assertEqual((version, summary), get_vm_status_summary(
+                self.user, self.UBUNTU.id))
+
+        # The database is used if Redis is unavailable
+        mock_get.side_effect = ConnectionError("No redis")
+        self.assertEqual((None, summary), get_vm_status_summary(
+            self.user, self.UBUNTU.id))
+
+    @patch('vm_manager.utils.status_updates._get_connection')
+    def test_get_vm_status_summary_timed_out_published(self, mock_get):
+        mock_get.return_value = self.redis
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_vm_status(
+                wait_time=datetime.now(utc) - timedelta(seconds=1))
+
+        # The change to VM_ERROR is published once, by the signal.  (A
+        # request isn't in a transaction, so that is done at once.)
+        with patch('vm_manager.signals.transaction.on_commit',
+                   new=lambda func: func()):
+            version, summary = get_vm_status_summary(
+                self.user, self.UBUNTU.id)
+        self.assertEqual(VM_ERROR, summary['status'])
+        self.assertEqual(2, version)
+        self.assertEqual(2, get_version(self.user.id, self.UBUNTU.id))
+
+    @patch('vm_manager.utils.status_updates._get_connection')
+    def test_get_vm_status_summary_missing(self, mock_get):
+        mock_get.return_value = self.redis
+        with self.captureOnCommitCallbacks(execute=True):
+            vm_status = self.make_vm_status()
+        self.redis.values.pop(f"{_status_key(self.user.id, self.UBUNTU.id)}"
+                              ":summary")
+
+        # Filling in a lost summary isn't a new version
+        version, summary = get_vm_status_summary(self.user, self.UBUNTU.id)
+        self.assertEqual(1, version)
+        self.assertEqual(vm_status.status_message, summary['status_message'])
+        self.assertEqual((1, dict(summary, wait_time=ANY)),
+                         get_status(self.user.id, self.UBUNTU.id))
+
+    @patch('vm_manager.views.wait_for_change')
+    @patch('vm_manager.utils.status_updates._get_connection')
+    def test_wait_vm_status(self, mock_get, mock_wait):
+        mock_get.return_value = self.redis
+        vm_status = self.make_vm_status()
+        vm_status.status = VM_OKAY
+        vm_status.save()
+        publish_status(vm_status)
+
+        result = wait_vm_status(self.user, self.UBUNTU.id, 0)
+
+        self.assertEqual(1, result['version'])
+        self.assertEqual(VM_OKAY, result['status'])
+        mock_wait.assert_called_once_with(self.user.id, self.UBUNTU.id, 0)
+
+        # The browser falls back to polling if waiting fails
+        mock_get.side_effect = ConnectionError("No redis")
+        mock_wait.side_effect = ConnectionError("No redis")
+        result = wait_vm_status(self.user, self.UBUNTU.id, 1)
+        self.assertIsNone(result['version'])
+        self.assertEqual(VM_OKAY, result['status'])
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta, timezone
+
+from django.test import TestCase, override_settings
+
+from vm_manager.models import WorkflowRun, WorkflowStep
+from vm_manager.utils.timing import StepTiming
+from vm_manager.utils.workflow import func_path
+
+utc = timezone.utc
+
+
+def step_func():
+    pass
+
+
+def other_func():
+    pass
+
+
+@override_settings(STEP_TIMING_MIN_SAMPLES=3, STEP_TIMEOUT_MARGIN=1.5)
+class StepTimingTests(TestCase):
+
+    def add_samples(self, durations, desktop_type='desktop', zone='zone',
+                    func=step_func):
+        run = WorkflowRun.objects.create(desktop_type=desktop_type,
+                                         zone=zone)
+        now = datetime.now(utc)
+        for duration in durations:
+            step = WorkflowStep.objects.create(run=run, func=func_path(func))
+            WorkflowStep.objects.filter(pk=step.pk).update(
+                created=now - timedelta(seconds=duration), reached=now)
+
+    def test_too_few_samples(self):
+        self.add_samples([10, 20])
+        # Steps that didn't reach their target don't count
+        WorkflowStep.objects.create(run=WorkflowRun.objects.create(),
+                                    func=func_path(step_func))
+        timing = StepTiming(step_func, 'desktop', 'zone')
+
+        self.assertIsNone(timing.percentile(50))
+        self.assertEqual(180, timing.timeout(180))
+
+    def test_percentiles(self):
+        self.add_samples(range(1, 101))
+        self.add_samples([1000] * 10, func=other_func)
+        timing = StepTiming(step_func, 'desktop', 'zone')
+
+        self.assertEqual(50, timing.percentile(50))
+        self.assertEqual(99, timing.percentile(99))
+        self.assertEqual(149, timing.timeout(180))
+        # The configured timeout is the upper bound
+        self.assertEqual(120, timing.timeout(120))
+
+    def test_fallback(self):
+        self.add_samples([10, 10, 10], zone='zone')
+        self.add_samples([20, 20, 20], zone='other')
+        self.add_samples([40, 40, 40], desktop_type='other')
+
+        self.assertEqual(
+            10, StepTiming(step_func, 'desktop', 'zone').percentile(50))
+        # Too few samples for the zone, so use the desktop type's
+        self.assertEqual(
+            20, StepTiming(step_func, 'desktop', 'new').percentile(99))
+        # Then all of them
+        self.assertEqual(
+            40, StepTiming(step_func, 'new', 'new').percentile(99))
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+import uuid
+
+from vm_manager.models import DailyUsage, Instance, Resize, Volume
+from vm_manager.tests.factories import ResizeFactory
+from vm_manager.tests.fakes import FakeNectar
+from vm_manager.tests.unit.vm_functions.base import VMFunctionTestBase
+from vm_manager.utils.usage import update_daily_usage
+
+utc = timezone.utc
+
+
+@patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
+class DailyUsageTests(VMFunctionTestBase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.day0 = datetime.now(utc).replace(
+            hour=0, minute=0, second=0, microsecond=0) - timedelta(days=5)
+
+    def at(self, days, hours):
+        return self.day0 + timedelta(days=days, hours=hours)
+
+    def make_instance(self, created, deleted=None, error_flag=None):
+        _, instance = self.build_fake_vol_instance(
+            volume_id=uuid.uuid4(), instance_id=uuid.uuid4())
+        Instance.objects.filter(pk=instance.pk).update(
+            created=created, deleted=deleted, error_flag=error_flag)
+        return instance
+
+    def make_resize(self, instance, requested, reverted=None):
+        resize = ResizeFactory.create(instance=instance)
+        Resize.objects.filter(pk=resize.pk).update(
+            requested=requested, reverted=reverted)
+        return resize
+
+    def get_usage(self, days):
+        return DailyUsage.objects.get(
+            date=(self.day0 + timedelta(days=days)).date(),
+            operating_system=self.UBUNTU.id, zone=self.zone.name)
+
+    def assertUsage(self, days, **expected):
+        usage = self.get_usage(days)
+        self.assertEqual(expected, {field: getattr(usage, field)
+                                    for field in expected})
+
+    def test_update_daily_usage(self):
+        self.assertEqual(0, update_daily_usage())
+
+        self.make_instance(self.at(0, 10), deleted=self.at(2, 12))
+        instance = self.make_instance(self.at(0, 11),
+                                      error_flag=self.at(1, 1))
+        self.make_resize(instance, self.at(1, 2), reverted=self.at(3, 3))
+
+        # The days from the first instance to today are rolled up
+        self.assertEqual(6, update_daily_usage())
+        self.assertUsage(0, created=2, instances=2, peak=2, boosts=0)
+        self.assertUsage(1, errored=1, boosted=1, instances=2, boosts=1)
+        self.assertUsage(2, deleted=1, instances=1, peak=2, boosts=1)
+        self.assertUsage(3, reverted=1, instances=1, peak=1, boosts=0)
+        self.assertUsage(5, created=0, instances=1, peak=1)
+
+        # Then only the last day is rolled up again
+        row = self.get_usage(4)
+        self.make_instance(self.at(5, 1), deleted=self.at(5, 2))
+        self.make_instance(self.at(5, 3))
+        self.assertEqual(1, update_daily_usage())
+        self.assertEqual(row, self.get_usage(4))
+        self.assertUsage(5, created=2, deleted=1, instances=2, peak=2)
+
+        # ... unless a rebuild is asked for
+        self.assertEqual(6, update_daily_usage(since=self.day0.date()))
+        self.assertUsage(3, reverted=1, instances=1, peak=1, boosts=0)
+
+    def test_resize_ends_with_instance(self):
+        instance = self.make_instance(self.at(0, 1), deleted=self.at(1, 1))
+        self.make_resize(instance, self.at(0, 2))
+
+        update_daily_usage()
+        self.assertUsage(0, boosted=1, boosts=1)
+        self.assertUsage(1, deleted=1, reverted=1, instances=0, boosts=0)
+
+        # Nothing is live after that, so there are no more rows
+        self.assertEqual(2, DailyUsage.objects.count())
+
+    def test_no_zone(self):
+        for hours in (1, 2):
+            instance = self.make_instance(self.at(5, hours))
+            Volume.objects.filter(pk=instance.boot_volume_id).update(
+                zone=None)
+
+        self.assertEqual(1, update_daily_usage())
+        usage = DailyUsage.objects.get()
+        self.assertEqual(('', 2), (usage.zone, usage.created))
@@ -1,7 +1,17 @@
+from datetime import datetime, timedelta, timezone
+import threading
+
+from unittest.mock import Mock, patch
+
 from django.test import TestCase
+from keystoneauth1 import access
+from redis.exceptions import ConnectionError
 
+from vm_manager.tests.fakes import FakeRedis
 from vm_manager.utils.utils import generate_server_name, generate_hostname, \
-    get_domain
+    get_domain, CachedApplicationCredential, Nectar
+
+utc = timezone.utc
 
 
 class UtilTests(TestCase):
@@ -12,3 +22,100 @@ class UtilTests(TestCase):
         self.assertEqual("vdu-fnoord",
                          generate_hostname('fnoord', 'ubuntu'))
         self.assertEqual("test", get_domain('fred'))
+
+
+def make_access(expires):
+    body = {'token': {'expires_at': expires.isoformat(),
+                      'methods': ['application_credential'],
+                      'roles': [{'id': '1', 'name': 'member'}]}}
+    return access.create(body=body, auth_token='a-token')
+
+
+@patch('vm_manager.utils.utils.django_rq')
+class NectarTests(TestCase):
+
+    @patch('vm_manager.utils.utils.nova_client')
+    @patch('vm_manager.utils.utils.cinder_client')
+    def test_lazy_clients(self, mock_cinder, mock_nova, mock_rq):
+        nectar = Nectar()
+        mock_nova.Client.assert_not_called()
+
+        # The client is built once, even if threads race to use it
+        threads = [threading.Thread(target=lambda: nectar.nova)
+                   for i in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertIs(mock_nova.Client.return_value, nectar.nova)
+        mock_nova.Client.assert_called_once_with(
+            '2', session=nectar.session)
+        mock_cinder.Client.assert_not_called()
+
+        self.assertIs(mock_cinder.Client.return_value, nectar.cinder)
+        self.assertIs(nectar.session,
+                      mock_cinder.Client.call_args.kwargs['session'])
+        mock_rq.get_connection.assert_not_called()
+
+    @patch.object(CachedApplicationCredential.__bases__[0], 'get_auth_ref')
+    def test_token_cache(self, mock_get_auth_ref, mock_rq):
+        redis = FakeRedis()
+        mock_rq.get_connection.return_value = redis
+        auth_ref = make_access(datetime.now(utc) + timedelta(hours=1))
+        mock_get_auth_ref.return_value = auth_ref
+
+        first = Nectar()
+        self.assertEqual('a-token', first.auth.get_access(
+            first.session).auth_token)
+        mock_get_auth_ref.assert_called_once()
+
+        # Another process reuses the cached token
+        second = Nectar()
+        self.assertEqual('a-token', second.auth.get_access(
+            second.session).auth_token)
+        mock_get_auth_ref.assert_called_once()
+
+        # ... unless it is about to expire
+        mock_get_auth_ref.return_value = make_access(
+            datetime.now(utc) + timedelta(seconds=60))
+        redis.values.clear()
+        Nectar().auth.get_access(Mock())
+        self.assertEqual(2, mock_get_auth_ref.call_count)
+        self.assertEqual({}, redis.values)
+
+    @patch.object(CachedApplicationCredential.__bases__[0], 'get_auth_ref')
+    def test_token_rejected(self, mock_get_auth_ref, mock_rq):
+        redis = FakeRedis()
+        mock_rq.get_connection.return_value = redis
+        expires = datetime.now(utc) + timedelta(hours=1)
+        mock_get_auth_ref.return_value = make_access(expires)
+        nectar = Nectar()
+        nectar.auth.get_access(nectar.session)
+        other = Nectar()
+        other.auth.get_access(other.session)
+
+        # Keystone revokes the token, so a request gets a 401, and
+        # keystoneauth invalidates the plugin and authenticates again
+        new_auth_ref = access.create(body=make_access(expires)._data,
+                                     auth_token='b-token')
+        mock_get_auth_ref.return_value = new_auth_ref
+        self.assertTrue(nectar.auth.invalidate())
+        self.assertEqual('b-token', nectar.auth.get_access(
+            nectar.session).auth_token)
+        self.assertEqual(2, mock_get_auth_ref.call_count)
+
+        # The other process gets the new token from the cache
+        self.assertTrue(other.auth.invalidate())
+        self.assertEqual('b-token', other.auth.get_access(
+            other.session).auth_token)
+        self.assertEqual(2, mock_get_auth_ref.call_count)
+
+    @patch.object(CachedApplicationCredential.__bases__[0], 'get_auth_ref')
+    def test_token_cache_unavailable(self, mock_get_auth_ref, mock_rq):
+        mock_rq.get_connection.side_effect = ConnectionError("No redis")
+        mock_get_auth_ref.return_value = make_access(
+            datetime.now(utc) + timedelta(hours=1))
+
+        nectar = Nectar()
+        self.assertEqual('a-token', nectar.auth.get_access(
+            nectar.session).auth_token)
@@ -0,0 +1,137 @@
+from datetime import datetime, timezone
+import uuid
+
+from unittest.mock import patch
+
+import cinderclient
+from django.test import TestCase
+
+from researcher_desktop.models import DesktopType
+from researcher_desktop.tests.factories import AvailabilityZoneFactory
+from researcher_desktop.utils.utils import get_desktop_type
+
+from vm_manager.constants import VOLUME_AVAILABLE, VOLUME_CREATING
+from vm_manager.models import PooledVolume
+from vm_manager.tests.fakes import FakeNectar, FakeVolume
+from vm_manager.utils.volume_pool import VolumePool, pool_volume_name
+
+utc = timezone.utc
+
+
+@patch('vm_manager.utils.volume_pool.get_applicable_zones')
+@patch('vm_manager.utils.volume_pool._get_source_volume')
+@patch('vm_manager.utils.volume_pool.get_nectar')
+class VolumePoolTests(TestCase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        DesktopType.objects.filter(id='ubuntu').update(pool_size=2)
+        self.UBUNTU = get_desktop_type('ubuntu')
+        self.zone = AvailabilityZoneFactory.create(
+            name="a_zone", zone_weight=1, network_id=uuid.uuid4())
+        self.source = FakeVolume(id=str(uuid.uuid4()),
+                                 metadata={'nectar_build': '42'})
+        self.fake = FakeNectar()
+
+    def setup_mocks(self, mock_get, mock_source, mock_zones):
+        mock_get.return_value = self.fake
+        mock_source.return_value = self.source
+        mock_zones.side_effect = lambda desktop_type: [self.zone]
+        self.fake.cinder.volumes.create.side_effect = \
+            lambda **kwargs: FakeVolume(id=str(uuid.uuid4()))
+
+    def make_pooled(self, image=None, ready=None, os=None):
+        return PooledVolume.objects.create(
+            id=uuid.uuid4(), operating_system=os or self.UBUNTU.id,
+            zone=self.zone.name, image=image or self.source.id,
+            size=self.UBUNTU.volume_size, ready=ready)
+
+    def test_fill(self, mock_get, mock_source, mock_zones):
+        self.setup_mocks(mock_get, mock_source, mock_zones)
+
+        counts = VolumePool().run()
+
+        self.assertEqual(2, counts['created'])
+        self.assertEqual(0, counts['recycled'])
+        self.assertEqual(2, PooledVolume.objects.count())
+        pooled = PooledVolume.objects.first()
+        self.assertEqual(self.source.id, pooled.image)
+        self.assertEqual(42, pooled.build)
+        self.assertIsNone(pooled.ready)
+        self.assertEqual(pool_volume_name(self.UBUNTU, self.zone),
+                         self.fake.cinder.volumes.create.call_args.kwargs[
+                             'name'])
+        self.assertEqual(2, self.fake.cinder.volumes.set_bootable.call_count)
+
+        # Dry-run mode counts, but changes nothing
+        self.fake.cinder.volumes.get.return_value = FakeVolume(
+            id='x', status=VOLUME_AVAILABLE)
+        counts = VolumePool(dry_run=True).run()
+        self.assertEqual(2, counts['ready'])
+        self.assertFalse(PooledVolume.objects.exclude(ready=None).exists())
+
+        # The pooled volumes are ready once Cinder says they are available
+        counts = VolumePool().run()
+        self.assertEqual(2, counts['ready'])
+        self.assertEqual(0, counts['created'])
+        self.assertFalse(PooledVolume.objects.filter(ready=None).exists())
+
+    def test_check_pending(self, mock_get, mock_source, mock_zones):
+        self.setup_mocks(mock_get, mock_source, mock_zones)
+        creating = self.make_pooled()
+        failed = self.make_pooled()
+        statuses = {str(creating.id): VOLUME_CREATING,
+                    str(failed.id): 'error'}
+        self.fake.cinder.volumes.get.side_effect = \
+            lambda id: FakeVolume(id=id, status=statuses[str(id)])
+
+        counts = VolumePool().run()
+
+        self.assertEqual(1, counts['pending'])
+        self.assertEqual(1, counts['failed'])
+        self.assertEqual(1, counts['created'])
+        self.assertTrue(PooledVolume.objects.filter(pk=creating.pk).exists())
+        self.assertFalse(PooledVolume.objects.filter(pk=failed.pk).exists())
+        self.fake.cinder.volumes.delete.assert_called_once_with(failed.id)
+
+        # A volume that has gone from Cinder is just forgotten
+        self.fake.cinder.volumes.delete.reset_mock()
+        self.fake.cinder.volumes.get.side_effect = \
+            cinderclient.exceptions.NotFound(404)
+        counts = VolumePool().run()
+        self.assertEqual(2, counts['failed'])
+        self.fake.cinder.volumes.delete.assert_not_called()
+
+    def test_recycle(self, mock_get, mock_source, mock_zones):
+        self.setup_mocks(mock_get, mock_source, mock_zones)
+        now = datetime.now(utc)
+        # Cloned from an older build
+        old = self.make_pooled(image=str(uuid.uuid4()), ready=now)
+        current = self.make_pooled(ready=now)
+        # For a desktop type without a pool
+        other = self.make_pooled(ready=now, os='centos')
+
+        counts = VolumePool().run()
+
+        self.assertEqual(2, counts['recycled'])
+        self.assertEqual(1, counts['ready'])
+        self.assertEqual(1, counts['created'])
+        self.assertEqual(
+            {str(old.id), str(other.id)},
+            {str(c.args[0])
+             for c in self.fake.cinder.volumes.delete.call_args_list})
+        self.assertTrue(PooledVolume.objects.filter(pk=current.pk).exists())
+        self.assertEqual(2, PooledVolume.objects.count())
+
+    def test_no_source(self, mock_get, mock_source, mock_zones):
+        self.setup_mocks(mock_get, mock_source, mock_zones)
+        mock_source.side_effect = RuntimeWarning("No source")
+        pooled = self.make_pooled(ready=datetime.now(utc))
+
+        counts = VolumePool().run()
+
+        # The pool is left alone
+        self.assertEqual(1, counts['skipped'])
+        self.assertTrue(PooledVolume.objects.filter(pk=pooled.pk).exists())
+        self.fake.cinder.volumes.create.assert_not_called()
+        self.fake.cinder.volumes.delete.assert_not_called()
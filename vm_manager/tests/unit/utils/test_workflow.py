@@ -0,0 +1,151 @@
+from datetime import datetime, timezone
+from unittest.mock import Mock, patch
+import uuid
+
+from django.test import TestCase
+
+from researcher_workspace.models import User
+from researcher_workspace.tests.factories import UserFactory
+from vm_manager.constants import WF_SUCCESS, WF_CONTINUE, WF_FAIL, \
+    WF_LAUNCH, WF_SHELVE
+from vm_manager.models import WorkflowRun, WorkflowStep
+from vm_manager.tests.fakes import FakeRedis
+from vm_manager.utils.job_metrics import STEP_SECONDS, STEP_WAIT_SECONDS, \
+    get_histograms
+from vm_manager.utils.workflow import encode, decode, start_workflow, \
+    run_workflow, run_step, add_step, enqueue_step
+
+utc = timezone.utc
+
+# The step functions need to be importable, so they can't be Mocks
+calls = Mock()
+
+
+def first_step(*args, **kwargs):
+    calls(*args, **kwargs)
+    return WF_SUCCESS
+
+
+def continuing_step(*args, **kwargs):
+    calls(*args, **kwargs)
+    add_step(first_step, ['next'], {})
+    return WF_CONTINUE
+
+
+def failing_step(*args, **kwargs):
+    raise Exception("Boom")
+
+
+@patch('vm_manager.utils.workflow.django_rq')
+class WorkflowTests(TestCase):
+
+    def setUp(self, *args, **kwargs):
+        super().setUp(*args, **kwargs)
+        self.user = UserFactory.create()
+        calls.reset_mock()
+
+    def test_encode_decode(self, mock_rq):
+        value = [self.user, datetime.now(utc), uuid.uuid4(), {'a', 'b'},
+                 {'x': (1, 'two', None)}, first_step]
+        encoded = encode(value)
+        self.assertEqual(
+            {'__model__': 'researcher_workspace.user',
+             'pk': str(self.user.pk)},
+            encoded[0])
+        expected = list(value)
+        expected[4] = {'x': [1, 'two', None]}
+        self.assertEqual(expected, decode(encoded))
+
+        # Model instances are fetched afresh
+        User.objects.filter(pk=self.user.pk).update(first_name="Fresh")
+        self.assertEqual("Fresh", decode(encoded)[0].first_name)
+
+        with self.assertRaises(TypeError):
+            encode(object())
+
+    def test_start_workflow(self, mock_rq):
+        mock_queue = Mock()
+        mock_rq.get_queue.return_value = mock_queue
+
+        run = start_workflow(WF_LAUNCH, first_step, self.user, zone='z')
+
+        self.assertEqual(WF_LAUNCH, run.kind)
+        step = run.current_step()
+        self.assertEqual(f"{__name__}.first_step", step.func)
+        mock_rq.get_queue.assert_called_once_with('default')
+        # The job only carries the run id
+        mock_queue.enqueue_call.assert_called_once_with(
+            func=run_step, args=(run.id,), job_id=step.job_id)
+        calls.assert_not_called()
+
+        self.assertEqual(WF_SUCCESS, run_step(run.id))
+
+        calls.assert_called_once_with(self.user, zone='z')
+        step = WorkflowStep.objects.get(pk=step.pk)
+        self.assertIsNotNone(step.started)
+        self.assertIsNotNone(step.finished)
+        self.assertEqual(1, step.attempts)
+        self.assertEqual(WF_SUCCESS, step.outcome)
+        run = WorkflowRun.objects.get(pk=run.pk)
+        self.assertIsNotNone(run.finished)
+        self.assertEqual(WF_SUCCESS, run.outcome)
+
+        # Running a step again is a no-op
+        calls.reset_mock()
+        self.assertIsNone(run_step(run.id))
+        calls.assert_not_called()
+
+    def test_next_step(self, mock_rq):
+        run = start_workflow(WF_SHELVE, continuing_step, 1)
+
+        self.assertEqual(WF_CONTINUE, run_step(run.id))
+
+        run = WorkflowRun.objects.get(pk=run.pk)
+        self.assertIsNone(run.finished)
+        self.assertEqual(2, run.steps.count())
+        step = run.current_step()
+        self.assertIsNone(step.started)
+
+        enqueue_step(step, retries=3)
+        self.assertEqual(WF_SUCCESS, run_step(run.id))
+        calls.assert_called_with('next', retries=3)
+        run = WorkflowRun.objects.get(pk=run.pk)
+        self.assertEqual(WF_SUCCESS, run.outcome)
+
+    def test_failed_step(self, mock_rq):
+        run = start_workflow(WF_SHELVE, failing_step)
+
+        with self.assertRaises(Exception):
+            run_step(run.id)
+
+        run = WorkflowRun.objects.get(pk=run.pk)
+        self.assertIsNotNone(run.finished)
+        self.assertEqual(WF_FAIL, run.outcome)
+        self.assertEqual(WF_FAIL, run.current_step().outcome)
+
+    def test_run_workflow(self, mock_rq):
+        self.assertEqual(WF_CONTINUE,
+                         run_workflow(WF_SHELVE, continuing_step, self.user))
+
+        calls.assert_called_once_with(self.user)
+        mock_rq.get_queue.assert_not_called()
+        run = WorkflowRun.objects.get()
+        self.assertEqual(WF_SHELVE, run.kind)
+        self.assertIsNone(run.finished)
+        self.assertEqual(2, run.steps.count())
+
+    @patch('vm_manager.utils.job_metrics._get_connection')
+    def test_step_metrics(self, mock_connection, mock_rq):
+        mock_connection.return_value = FakeRedis()
+        run = start_workflow(WF_SHELVE, continuing_step, 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            run_step(run.id)
+            with self.assertRaises(Exception):
+                run_workflow(WF_SHELVE, failing_step)
+
+        histograms = get_histograms()
+        self.assertEqual(
+            {('continuing_step', WF_CONTINUE), ('failing_step', WF_FAIL)},
+            set(histograms[STEP_SECONDS]))
+        buckets, _ = histograms[STEP_WAIT_SECONDS][('continuing_step',)]
+        self.assertEqual(('+Inf', 1), buckets[-1])
@@ -1,4 +1,4 @@
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from unittest.mock import call, Mock, patch
 
 import cinderclient
@@ -8,8 +8,10 @@ from vm_manager.tests.unit.vm_functions.base import VMFunctionTestBase
 
 from vm_manager.constants import VM_OKAY, VM_DELETED, VM_WAITING, \
     VM_ERROR, NO_VM, VM_SUPERSIZED, VM_SHELVED, \
-    ACTIVE, SHUTDOWN, VOLUME_IN_USE, VOLUME_AVAILABLE, VOLUME_MAINTENANCE
-from vm_manager.models import VMStatus, Volume, Instance, Resize
+    ACTIVE, SHUTDOWN, VOLUME_IN_USE, VOLUME_AVAILABLE, VOLUME_MAINTENANCE, \
+    WF_DELETE, WF_ARCHIVE, WF_SHELVE, WF_RESIZE
+from vm_manager.models import VMStatus, Volume, Instance, Resize, \
+    DailyUsage
 from vm_manager.tests.factories import ResizeFactory, VMStatusFactory
 from vm_manager.tests.fakes import FakeNectar, FakeServer, FakeVolume
 from vm_manager.vm_functions.admin_functionality import \
@@ -17,7 +19,7 @@ from vm_manager.vm_functions.admin_functionality import \
     admin_delete_volume, admin_archive_volume, \
     admin_archive_instance_and_volume, admin_downsize_resize, \
     admin_check_vmstatus, admin_repair_volume_error, \
-    admin_repair_instance_error
+    admin_repair_instance_error, vm_report_for_csv, vm_report_for_page
 from vm_manager.vm_functions.delete_vm import delete_vm_worker
 from vm_manager.vm_functions.resize_vm import downsize_vm_worker
 from vm_manager.vm_functions.shelve_vm import shelve_vm_worker
@@ -40,11 +42,9 @@ class FakeReporter(Mock):
 
 class AdminVMTests(VMFunctionTestBase):
 
-    @patch('vm_manager.vm_functions.admin_functionality.django_rq')
+    @patch('vm_manager.vm_functions.admin_functionality.start_workflow')
     @patch('vm_manager.vm_functions.admin_functionality.delete_volume')
-    def test_admin_delete_instance_and_volume(self, mock_delete, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    def test_admin_delete_instance_and_volume(self, mock_delete, mock_start):
         fake_volume, fake_instance, fake_vmstatus = \
             self.build_fake_vol_inst_status(
                 ip_address='10.0.0.99', status=VM_OKAY)
@@ -58,16 +58,15 @@ class AdminVMTests(VMFunctionTestBase):
         vm_status = VMStatus.objects.get(pk=fake_vmstatus.pk)
         self.assertEqual(VM_DELETED, vm_status.status)
 
-        mock_rq.get_queue.assert_called_once_with('default')
-        mock_queue.enqueue.assert_called_once_with(
-            delete_vm_worker, fake_instance)
+        mock_start.assert_called_once_with(
+            WF_DELETE, delete_vm_worker, fake_instance)
         mock_delete.assert_not_called()
 
-    @patch('vm_manager.vm_functions.admin_functionality.django_rq')
+    @patch('vm_manager.vm_functions.admin_functionality.run_workflow')
+    @patch('vm_manager.vm_functions.admin_functionality.start_workflow')
     @patch('vm_manager.vm_functions.admin_functionality.delete_volume')
-    def test_admin_delete_instance_and_volume_2(self, mock_delete, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    def test_admin_delete_instance_and_volume_2(self, mock_delete,
+                                                mock_start, mock_run):
         fake_volume, fake_instance, fake_vmstatus = \
             self.build_fake_vol_inst_status(
                 ip_address='10.0.0.99', status=VM_OKAY)
@@ -82,14 +81,13 @@ class AdminVMTests(VMFunctionTestBase):
         vm_status = VMStatus.objects.get(pk=fake_vmstatus.pk)
         self.assertEqual(VM_DELETED, vm_status.status)
 
-        mock_rq.get_queue.assert_not_called()
-        mock_delete.assert_called_once_with(fake_volume)
+        mock_start.assert_not_called()
+        mock_run.assert_called_once_with(
+            WF_DELETE, mock_delete, fake_volume)
 
-    @patch('vm_manager.vm_functions.admin_functionality.django_rq')
+    @patch('vm_manager.vm_functions.admin_functionality.start_workflow')
     @patch('vm_manager.vm_functions.admin_functionality.archive_volume_worker')
-    def test_admin_archive_instance_and_volume(self, mock_archive, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    def test_admin_archive_instance_and_volume(self, mock_archive, mock_start):
         fake_volume, fake_instance, fake_vmstatus = \
             self.build_fake_vol_inst_status(
                 ip_address='10.0.0.99', status=VM_OKAY)
@@ -103,16 +101,15 @@ class AdminVMTests(VMFunctionTestBase):
         vm_status = VMStatus.objects.get(pk=fake_vmstatus.pk)
         self.assertEqual(VM_DELETED, vm_status.status)
 
-        mock_rq.get_queue.assert_called_once_with('default')
-        mock_queue.enqueue.assert_called_once_with(
-            delete_vm_worker, fake_instance, archive=True)
+        mock_start.assert_called_once_with(
+            WF_ARCHIVE, delete_vm_worker, fake_instance, archive=True)
         mock_archive.assert_not_called()
 
-    @patch('vm_manager.vm_functions.admin_functionality.django_rq')
+    @patch('vm_manager.vm_functions.admin_functionality.run_workflow')
+    @patch('vm_manager.vm_functions.admin_functionality.start_workflow')
     @patch('vm_manager.vm_functions.admin_functionality.archive_volume_worker')
-    def test_admin_archive_instance_and_volume_2(self, mock_archive, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    def test_admin_archive_instance_and_volume_2(self, mock_archive,
+                                                 mock_start, mock_run):
         fake_volume, fake_instance, fake_vmstatus = \
             self.build_fake_vol_inst_status(
                 ip_address='10.0.0.99', status=VM_OKAY)
@@ -127,14 +124,14 @@ class AdminVMTests(VMFunctionTestBase):
         vm_status = VMStatus.objects.get(pk=fake_vmstatus.pk)
         self.assertEqual(VM_DELETED, vm_status.status)
 
-        mock_rq.get_queue.assert_not_called()
-        mock_archive.assert_called_once_with(fake_volume, self.FEATURE)
+        mock_start.assert_not_called()
+        mock_run.assert_called_once_with(
+            WF_ARCHIVE, mock_archive, fake_volume, self.FEATURE)
 
-    @patch('vm_manager.vm_functions.admin_functionality.django_rq')
+    @patch('vm_manager.vm_functions.admin_functionality.run_workflow')
+    @patch('vm_manager.vm_functions.admin_functionality.start_workflow')
     @patch('vm_manager.vm_functions.admin_functionality.delete_volume')
-    def test_admin_delete_volume(self, mock_delete, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    def test_admin_delete_volume(self, mock_delete, mock_start, mock_run):
         fake_volume, fake_instance, fake_vmstatus = \
             self.build_fake_vol_inst_status(
                 ip_address='10.0.0.99', status=VM_OKAY)
@@ -147,14 +144,14 @@ class AdminVMTests(VMFunctionTestBase):
         vm_status = VMStatus.objects.get(pk=fake_vmstatus.pk)
         self.assertEqual(VM_DELETED, vm_status.status)
 
-        mock_rq.get_queue.assert_not_called()
-        mock_delete.assert_called_once_with(fake_volume)
+        mock_start.assert_not_called()
+        mock_run.assert_called_once_with(
+            WF_DELETE, mock_delete, fake_volume)
 
-    @patch('vm_manager.vm_functions.admin_functionality.django_rq')
+    @patch('vm_manager.vm_functions.admin_functionality.run_workflow')
+    @patch('vm_manager.vm_functions.admin_functionality.start_workflow')
     @patch('vm_manager.vm_functions.admin_functionality.archive_volume_worker')
-    def test_admin_archive_volume(self, mock_archive, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    def test_admin_archive_volume(self, mock_archive, mock_start, mock_run):
         fake_volume, fake_instance, fake_vmstatus = \
             self.build_fake_vol_inst_status(
                 ip_address='10.0.0.99', status=VM_OKAY)
@@ -166,14 +163,13 @@ class AdminVMTests(VMFunctionTestBase):
         vm_status = VMStatus.objects.get(pk=fake_vmstatus.pk)
         self.assertEqual(VM_DELETED, vm_status.status)
 
-        mock_rq.get_queue.assert_not_called()
-        mock_archive.assert_called_once_with(fake_volume, self.FEATURE)
+        mock_start.assert_not_called()
+        mock_run.assert_called_once_with(
+            WF_ARCHIVE, mock_archive, fake_volume, self.FEATURE)
 
-    @patch('vm_manager.vm_functions.admin_functionality.django_rq')
+    @patch('vm_manager.vm_functions.admin_functionality.start_workflow')
     @patch('vm_manager.vm_functions.admin_functionality.logger')
-    def test_admin_shelve_instance(self, mock_logger, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    def test_admin_shelve_instance(self, mock_logger, mock_start):
         fake_volume, fake_instance, fake_vmstatus = \
             self.build_fake_vol_inst_status(
                 ip_address='10.0.0.99', status=VM_OKAY)
@@ -188,15 +184,12 @@ class AdminVMTests(VMFunctionTestBase):
         self.assertEqual(VM_WAITING, vm_status.status)
         self.assertIsNotNone(vm_status.wait_time)
 
-        mock_rq.get_queue.assert_called_once_with('default')
-        mock_queue.enqueue.assert_called_once_with(
-            shelve_vm_worker, fake_instance)
+        mock_start.assert_called_once_with(
+            WF_SHELVE, shelve_vm_worker, fake_instance)
 
-    @patch('vm_manager.vm_functions.admin_functionality.django_rq')
+    @patch('vm_manager.vm_functions.admin_functionality.start_workflow')
     @patch('vm_manager.vm_functions.admin_functionality.logger')
-    def test_admin_downsize_instance(self, mock_logger, mock_rq):
-        mock_queue = Mock()
-        mock_rq.get_queue.return_value = mock_queue
+    def test_admin_downsize_instance(self, mock_logger, mock_start):
         fake_volume, fake_instance, fake_vmstatus = \
             self.build_fake_vol_inst_status(
                 ip_address='10.0.0.99', status=VM_SUPERSIZED)
@@ -208,9 +201,8 @@ class AdminVMTests(VMFunctionTestBase):
         self.assertEqual(VM_WAITING, vm_status.status)
         self.assertIsNotNone(vm_status.wait_time)
 
-        mock_rq.get_queue.assert_called_once_with('default')
-        mock_queue.enqueue.assert_called_once_with(
-            downsize_vm_worker, fake_instance, self.UBUNTU)
+        mock_start.assert_called_once_with(
+            WF_RESIZE, downsize_vm_worker, fake_instance, self.UBUNTU)
 
     def _setup_fake_reporter(self, mock_reporter_class):
         fake_reporter = FakeReporter()
@@ -855,3 +847,40 @@ class AdminVMTests(VMFunctionTestBase):
         self.assertEqual(NO_VM, vmstatus.status)
         resize = Resize.objects.get(pk=fake_resize.pk)
         self.assertIsNotNone(resize.reverted)
+
+    def test_vm_reports(self):
+        this_month = datetime.now(utc).date().replace(day=1)
+        last_month = (this_month - timedelta(days=1)).replace(day=1)
+        usage = [
+            # zone, date, peak, boosted, boosts, errored
+            ('a', last_month - timedelta(days=1), 1, 0, 1, 0),
+            ('a', last_month, 3, 1, 2, 2),
+            ('b', last_month, 1, 0, 0, 1),
+            ('a', this_month - timedelta(days=1), 2, 0, 2, 0),
+            ('a', this_month, 2, 0, 2, 0),
+        ]
+        for zone, date, peak, boosted, boosts, errored in usage:
+            DailyUsage.objects.create(
+                operating_system=self.UBUNTU.id, zone=zone, date=date,
+                instances=peak, peak=peak, boosted=boosted, boosts=boosts,
+                errored=errored)
+        months = [(last_month.month, last_month.year),
+                  (this_month.month, this_month.year)]
+
+        # The zones are summed, and the live boosts are carried over
+        self.assertEqual(
+            [{'name': "Peak VMs per month",
+              'values': [[self.UBUNTU.id, dict(zip(months, [4, 2]))]]},
+             {'name': "Boosts",
+              'values': [[self.UBUNTU.id, dict(zip(months, [2, 2]))]]}],
+            vm_report_for_csv(2, [self.UBUNTU.id]))
+
+        with self.assertNumQueries(2):
+            report = vm_report_for_page(self.UBUNTU.id)
+        vm_info = report['vm_info'][self.UBUNTU.id]
+        self.assertEqual([1, 4, 2, 2],
+                         [day['count'] for day in vm_info['vm_count']])
+        self.assertEqual([1, 2, 2, 2],
+                         [day['count'] for day in vm_info['resizes']])
+        self.assertEqual([{'date': last_month, 'errored_count': 3}],
+                         vm_info['error_dates'])
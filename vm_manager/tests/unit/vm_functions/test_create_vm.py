@@ -15,11 +15,12 @@ from vm_manager.tests.factories import VMStatusFactory
 from vm_manager.tests.unit.vm_functions.base import VMFunctionTestBase
 
 from vm_manager.constants import VM_OKAY, VM_SHELVED, NO_VM, \
-    VM_WAITING, VOLUME_AVAILABLE, VOLUME_IN_USE
-from vm_manager.models import VMStatus, Volume, Instance
+    VM_WAITING, VOLUME_AVAILABLE, VOLUME_IN_USE, ACTIVE
+from vm_manager.models import VMStatus, Volume, Instance, PooledVolume
 from vm_manager.vm_functions.create_vm import launch_vm_worker, \
     wait_to_create_instance, _create_volume, _create_instance, \
     wait_for_instance_active, _get_source_volume_id, extend_instance
+from vm_manager.utils.poller import SERVER, VOLUME
 from vm_manager.utils.utils import get_nectar
 
 utc = timezone.utc
@@ -28,13 +29,11 @@ utc = timezone.utc
 class CreateVMTests(VMFunctionTestBase):
 
     @patch('vm_manager.vm_functions.create_vm._create_volume')
-    @patch('vm_manager.vm_functions.create_vm.django_rq')
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
     @patch('vm_manager.vm_functions.create_vm.datetime')
-    def test_launch_vm_worker(self, mock_datetime, mock_rq, mock_create):
+    def test_launch_vm_worker(self, mock_datetime, mock_wait, mock_create):
         now = datetime.now(utc)
         mock_datetime.now.return_value = now
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
         fake_volume = self.build_fake_volume()
         mock_create.return_value = fake_volume
 
@@ -42,16 +41,16 @@ class CreateVMTests(VMFunctionTestBase):
         self.assertIsNone(result)
 
         mock_create.assert_called_once_with(self.user, self.UBUNTU, self.zone)
-        mock_rq.get_scheduler.called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=5), wait_to_create_instance,
-            self.user, self.UBUNTU, fake_volume, now)
+        mock_wait.assert_called_once_with(
+            VOLUME, fake_volume.id, wait_to_create_instance,
+            self.user, self.UBUNTU, fake_volume, now,
+            settings.VOLUME_CREATION_WAIT,
+            targets={VOLUME_AVAILABLE}, interval=5,
+            deadline=now + timedelta(seconds=settings.VOLUME_CREATION_WAIT))
 
     @patch('vm_manager.vm_functions.create_vm._create_volume')
-    @patch('vm_manager.vm_functions.create_vm.django_rq')
-    def test_launch_vm_worker_instance_exists(self, mock_rq, mock_create):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
+    def test_launch_vm_worker_instance_exists(self, mock_wait, mock_create):
         fake_volume, _, _ = self.build_fake_vol_inst_status()
         mock_create.return_value = fake_volume
 
@@ -62,28 +61,22 @@ class CreateVMTests(VMFunctionTestBase):
                              str(cm.exception))
 
         mock_create.assert_not_called()
-        mock_rq.get_scheduler.assert_not_called()
-        mock_scheduler.enqueue_in.assert_not_called()
+        mock_wait.assert_not_called()
 
     @patch('vm_manager.vm_functions.create_vm._create_volume')
-    @patch('vm_manager.vm_functions.create_vm.django_rq')
-    def test_launch_vm_worker_volume_bad(self, mock_rq, mock_create):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
+    def test_launch_vm_worker_volume_bad(self, mock_wait, mock_create):
         self.build_fake_volume()
         mock_create.return_value = None
 
         launch_vm_worker(self.user, self.UBUNTU, self.zone)
 
         mock_create.assert_called_once_with(self.user, self.UBUNTU, self.zone)
-        mock_rq.get_scheduler.assert_not_called()
-        mock_scheduler.enqueue_in.assert_not_called()
+        mock_wait.assert_not_called()
 
     @patch('vm_manager.vm_functions.create_vm._create_volume')
-    @patch('vm_manager.vm_functions.create_vm.django_rq')
-    def test_launch_vm_worker_instance_deleted(self, mock_rq, mock_create):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
+    def test_launch_vm_worker_instance_deleted(self, mock_wait, mock_create):
         fake_volume, _, _ = self.build_fake_vol_inst_status(status=NO_VM)
         mock_create.return_value = fake_volume
 
@@ -92,19 +85,16 @@ class CreateVMTests(VMFunctionTestBase):
         # The test_launch_vm_worker test does a more thorough job
         # of checking the mocks
         mock_create.assert_called_once()
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once()
+        mock_wait.assert_called_once()
 
     @patch('vm_manager.vm_functions.create_vm._create_instance')
-    @patch('vm_manager.vm_functions.create_vm.django_rq')
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
     @patch('vm_manager.vm_functions.create_vm.datetime')
     @patch('vm_manager.vm_functions.create_vm.get_nectar')
     def test_wait_to_create(self, mock_get, mock_datetime,
-                            mock_rq, mock_create_instance):
+                            mock_wait, mock_create_instance):
         now = datetime.now(utc)
         mock_datetime.now.return_value = now
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
         fake = FakeNectar()
         fake_volume, fake_instance, fake_status = \
             self.build_fake_vol_inst_status()
@@ -121,25 +111,25 @@ class CreateVMTests(VMFunctionTestBase):
             volume_id=fake_volume.id)
         mock_create_instance.assert_called_once_with(
             self.user, self.UBUNTU, fake_volume)
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=5), wait_for_instance_active,
-            self.user, self.UBUNTU, fake_instance, now)
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, wait_for_instance_active,
+            self.user, self.UBUNTU, fake_instance, now,
+            settings.INSTANCE_LAUNCH_WAIT,
+            targets={ACTIVE}, interval=5,
+            deadline=now + timedelta(seconds=settings.INSTANCE_LAUNCH_WAIT))
 
         updated_status = VMStatus.objects.get(pk=fake_status.pk)
         self.assertEqual(VM_OKAY, updated_status.status)
         self.assertEqual(30, updated_status.status_progress)
 
     @patch('vm_manager.vm_functions.create_vm._create_instance')
-    @patch('vm_manager.vm_functions.create_vm.django_rq')
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
     @patch('vm_manager.vm_functions.create_vm.datetime')
     @patch('vm_manager.vm_functions.create_vm.get_nectar')
-    def test_wait_to_create_unshelve(self, mock_get, mock_datetime, mock_rq,
+    def test_wait_to_create_unshelve(self, mock_get, mock_datetime, mock_wait,
                                      mock_create_instance):
         now = datetime.now(utc)
         mock_datetime.now.return_value = now
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
         fake = FakeNectar()
         fake_volume, fake_instance, fake_status = \
             self.build_fake_vol_inst_status(status=VM_SHELVED)
@@ -158,19 +148,21 @@ class CreateVMTests(VMFunctionTestBase):
 
         self.assertIsNone(fake_volume.shelved_at)
 
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=5), wait_for_instance_active,
-            self.user, self.UBUNTU, fake_instance, now)
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, wait_for_instance_active,
+            self.user, self.UBUNTU, fake_instance, now,
+            settings.INSTANCE_LAUNCH_WAIT,
+            targets={ACTIVE}, interval=5,
+            deadline=now + timedelta(seconds=settings.INSTANCE_LAUNCH_WAIT))
         updated_status = VMStatus.objects.get(pk=fake_status.pk)
         self.assertEqual(VM_SHELVED, updated_status.status)
         self.assertEqual(30, updated_status.status_progress)
 
-    @patch('vm_manager.vm_functions.create_vm.django_rq')
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
     @patch('vm_manager.vm_functions.create_vm._create_instance')
     @patch('vm_manager.vm_functions.create_vm.get_nectar')
     def test_wait_to_create_timeout(self, mock_get, mock_create_instance,
-                                    mock_rq):
+                                    mock_wait):
         fake = FakeNectar()
         fake_volume, _, fake_status = self.build_fake_vol_inst_status()
         fake.cinder.volumes.get.return_value = FakeVolume(
@@ -195,15 +187,13 @@ class CreateVMTests(VMFunctionTestBase):
         self.assertEqual("Volume took too long to create",
                          updated_volume.error_message)
         self.assertIsNotNone(updated_volume.error_flag)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
-    @patch('vm_manager.vm_functions.create_vm.django_rq')
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
     @patch('vm_manager.vm_functions.create_vm._create_instance')
     @patch('vm_manager.vm_functions.create_vm.get_nectar')
     def test_wait_to_create_poll(self, mock_get, mock_create_instance,
-                                 mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+                                 mock_wait):
         fake = FakeNectar()
         fake_volume, _, fake_status = self.build_fake_vol_inst_status()
         fake.cinder.volumes.get.return_value = FakeVolume(
@@ -217,10 +207,12 @@ class CreateVMTests(VMFunctionTestBase):
         fake.cinder.volumes.get.assert_called_with(
             volume_id=fake_volume.id)
         mock_create_instance.assert_not_called()
-        mock_rq.get_scheduler.called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=5), wait_to_create_instance,
-            self.user, self.UBUNTU, fake_volume, start)
+        mock_wait.assert_called_once_with(
+            VOLUME, fake_volume.id, wait_to_create_instance,
+            self.user, self.UBUNTU, fake_volume, start,
+            settings.VOLUME_CREATION_WAIT,
+            targets={VOLUME_AVAILABLE}, interval=5,
+            deadline=start + timedelta(seconds=settings.VOLUME_CREATION_WAIT))
 
     @patch('vm_manager.vm_functions.create_vm.generate_server_name')
     @patch('vm_manager.vm_functions.create_vm._get_source_volume_id')
@@ -262,6 +254,101 @@ class CreateVMTests(VMFunctionTestBase):
         self.assertEqual(NO_VM, vm_status.status)
         self.assertEqual(15, vm_status.status_progress)
 
+    @patch('vm_manager.vm_functions.create_vm.generate_server_name')
+    @patch('vm_manager.vm_functions.create_vm.get_nectar')
+    def test_create_volume_pooled(self, mock_get_nectar, mock_gen):
+        mock_gen.return_value = "abcdef"
+        fake = FakeNectar()
+        mock_get_nectar.return_value = fake
+        now = datetime.now(utc)
+        # Not ready yet
+        PooledVolume.objects.create(
+            id=uuid.uuid4(), operating_system=self.UBUNTU.id,
+            zone=self.zone.name, image=self.UBUNTU_source_volume_id,
+            size=self.UBUNTU.volume_size)
+        pooled = PooledVolume.objects.create(
+            id=UUID_1, operating_system=self.UBUNTU.id,
+            zone=self.zone.name, image=self.UBUNTU_source_volume_id,
+            size=self.UBUNTU.volume_size, ready=now)
+
+        result = _create_volume(self.user, self.UBUNTU, self.zone)
+
+        self.assertEqual(UUID_1, result.id)
+        self.assertEqual(self.user, result.user)
+        self.assertEqual(str(self.UBUNTU_source_volume_id), result.image)
+        self.assertEqual(self.UBUNTU.default_flavor.id, result.flavor)
+        self.assertEqual(VOLUME_AVAILABLE, result.observed_status)
+        self.assertFalse(PooledVolume.objects.filter(pk=pooled.pk).exists())
+        self.assertEqual(1, PooledVolume.objects.count())
+
+        fake.cinder.volumes.create.assert_not_called()
+        fake.cinder.volumes.update.assert_called_once_with(
+            UUID_1, name="abcdef")
+        fake.cinder.volumes.set_metadata.assert_called_once()
+        self.assertEqual(
+            self.user.email,
+            fake.cinder.volumes.set_metadata.call_args.kwargs[
+                'metadata']['user'])
+
+    @patch('vm_manager.vm_functions.create_vm._create_volume')
+    @patch('vm_manager.vm_functions.create_vm._launch_instance')
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
+    def test_launch_vm_worker_pooled(self, mock_wait, mock_launch,
+                                     mock_create):
+        fake_volume = self.build_fake_volume()
+        fake_volume.set_observed_status(VOLUME_AVAILABLE)
+        mock_create.return_value = fake_volume
+
+        launch_vm_worker(self.user, self.UBUNTU, self.zone)
+
+        # The volume is known to be available, so there is no wait
+        mock_launch.assert_called_once_with(
+            self.user, self.UBUNTU, fake_volume)
+        mock_wait.assert_not_called()
+
+    @patch('vm_manager.vm_functions.create_vm._get_source_volume_id')
+    @patch('vm_manager.vm_functions.create_vm.get_nectar')
+    def test_create_volume_pool_claim_failed(self, mock_get_nectar,
+                                             mock_get_id):
+        mock_get_id.return_value = self.UBUNTU_source_volume_id
+        fake = FakeNectar()
+        fake.cinder.volumes.update.side_effect = \
+            cinderclient.exceptions.ClientException(500)
+        mock_get_nectar.return_value = fake
+        pooled = PooledVolume.objects.create(
+            id=uuid.uuid4(), operating_system=self.UBUNTU.id,
+            zone=self.zone.name, image=self.UBUNTU_source_volume_id,
+            size=self.UBUNTU.volume_size, ready=datetime.now(utc))
+
+        result = _create_volume(self.user, self.UBUNTU, self.zone)
+
+        # A new volume is cloned, and the pooled volume goes back in the
+        # pool for the refill job to check
+        self.assertEqual(UUID_1, result.id)
+        fake.cinder.volumes.create.assert_called_once()
+        pooled = PooledVolume.objects.get(pk=pooled.pk)
+        self.assertIsNone(pooled.ready)
+
+    @patch('vm_manager.vm_functions.create_vm._get_source_volume_id')
+    @patch('vm_manager.vm_functions.create_vm.get_nectar')
+    def test_create_volume_pool_not_ready(self, mock_get_nectar,
+                                          mock_get_id):
+        mock_get_id.return_value = self.UBUNTU_source_volume_id
+        fake = FakeNectar()
+        mock_get_nectar.return_value = fake
+        PooledVolume.objects.create(
+            id=uuid.uuid4(), operating_system=self.UBUNTU.id,
+            zone=self.zone.name, image=self.UBUNTU_source_volume_id,
+            size=self.UBUNTU.volume_size)
+
+        result = _create_volume(self.user, self.UBUNTU, self.zone)
+
+        # The pooled volume isn't ready, so a new volume is cloned
+        self.assertEqual(UUID_1, result.id)
+        fake.cinder.volumes.create.assert_called_once()
+        fake.cinder.volumes.update.assert_not_called()
+        self.assertEqual(1, PooledVolume.objects.count())
+
     @patch('vm_manager.vm_functions.create_vm.get_nectar')
     @patch('vm_manager.vm_functions.create_vm.logger')
     def test_create_volume_exists(self, mock_logger, mock_get):
@@ -456,10 +543,10 @@ class CreateVMTests(VMFunctionTestBase):
             key_name=settings.OS_KEYNAME,
         )
 
-    @patch('vm_manager.vm_functions.create_vm.django_rq')
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
     @patch('vm_manager.vm_functions.create_vm.get_nectar')
     @patch('vm_manager.models.get_nectar')
-    def test_wait_for_active_timeout(self, mock_get, mock_get_2, mock_rq):
+    def test_wait_for_active_timeout(self, mock_get, mock_get_2, mock_wait):
         fake = FakeNectar()
         _, fake_instance, fake_status = self.build_fake_vol_inst_status()
         fake.nova.servers.get.return_value = FakeServer(
@@ -479,14 +566,12 @@ class CreateVMTests(VMFunctionTestBase):
         self.assertEqual("Instance took too long to launch",
                          updated_instance.error_message)
         self.assertIsNotNone(updated_instance.error_flag)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
-    @patch('vm_manager.vm_functions.create_vm.django_rq')
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
     @patch('vm_manager.vm_functions.create_vm.get_nectar')
     @patch('vm_manager.models.get_nectar')
-    def test_wait_for_active_poll(self, mock_get, mock_get_2, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_wait_for_active_poll(self, mock_get, mock_get_2, mock_wait):
         fake = FakeNectar()
         _, fake_instance, fake_status = self.build_fake_vol_inst_status()
         fake.nova.servers.get.return_value = FakeServer(
@@ -498,22 +583,25 @@ class CreateVMTests(VMFunctionTestBase):
         wait_for_instance_active(self.user, self.UBUNTU, fake_instance, start)
 
         fake.nova.servers.get.assert_called_with(fake_instance.id)
-        mock_rq.get_scheduler.called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=5), wait_for_instance_active,
-            self.user, self.UBUNTU, fake_instance, start)
-
-    @patch('vm_manager.vm_functions.create_vm.django_rq')
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, wait_for_instance_active,
+            self.user, self.UBUNTU, fake_instance, start,
+            settings.INSTANCE_LAUNCH_WAIT,
+            targets={ACTIVE}, interval=5,
+            deadline=start + timedelta(seconds=settings.INSTANCE_LAUNCH_WAIT))
+
+    @patch('vm_manager.models.Instance.create_guac_connection')
+    @patch('vm_manager.vm_functions.create_vm.register_wait')
     @patch('vm_manager.models.get_nectar')
     @patch('vm_manager.vm_functions.create_vm.get_nectar')
-    def test_wait_for_active_success(self, mock_get, mock_get_2, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_wait_for_active_success(self, mock_get, mock_get_2, mock_wait,
+                                     mock_guac):
         fake = FakeNectar()
         _, fake_instance, fake_status = self.build_fake_vol_inst_status(
             status=VM_WAITING)
         fake.nova.servers.get.return_value = FakeServer(
-            id=fake_instance.id, status='ACTIVE')
+            id=fake_instance.id, status='ACTIVE',
+            addresses={'private': [{'addr': '10.0.0.5'}]})
         mock_get.return_value = fake
         mock_get_2.return_value = fake
 
@@ -521,12 +609,16 @@ class CreateVMTests(VMFunctionTestBase):
         wait_for_instance_active(self.user, self.UBUNTU, fake_instance, start)
 
         fake.nova.servers.get.assert_called_with(fake_instance.id)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
         updated_status = VMStatus.objects.get(pk=fake_status.pk)
         # (Still waiting for the boot callback ...)
         self.assertEqual(VM_WAITING, updated_status.status)
         self.assertEqual(45, updated_status.status_progress)
+        # The IP address and the Guacamole connection are recorded up front
+        self.assertEqual('10.0.0.5',
+                         Instance.objects.get(pk=fake_instance.pk).ip_address)
+        mock_guac.assert_called_once_with()
 
     @patch('vm_manager.models.logger')
     @patch('vm_manager.vm_functions.create_vm.InstanceExpiryPolicy')
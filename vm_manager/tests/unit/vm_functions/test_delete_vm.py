@@ -11,7 +11,7 @@ from guacamole.tests.factories import GuacamoleConnectionFactory
 from vm_manager.tests.fakes import Fake, FakeServer, FakeNectar
 from vm_manager.tests.unit.vm_functions.base import VMFunctionTestBase
 
-from vm_manager.constants import ACTIVE, SHUTDOWN, RESCUE, \
+from vm_manager.constants import ACTIVE, SHUTDOWN, RESCUE, MISSING, \
     VOLUME_AVAILABLE, VM_WAITING, VM_SHELVED, NO_VM, \
     BACKUP_CREATING, BACKUP_AVAILABLE, \
     WF_RETRY, WF_SUCCESS, WF_CONTINUE
@@ -24,6 +24,7 @@ from vm_manager.vm_functions.delete_vm import delete_vm_worker, \
     _dispose_volume_once_instance_is_deleted, delete_volume, \
     archive_volume_worker, wait_for_backup, delete_backup_worker, \
     _wait_until_backup_is_deleted, _wait_until_volume_is_deleted
+from vm_manager.utils.poller import SERVER, VOLUME, BACKUP
 from vm_manager.utils.utils import get_nectar
 
 utc = timezone.utc
@@ -32,11 +33,9 @@ utc = timezone.utc
 class DeleteVMTests(VMFunctionTestBase):
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.logger')
-    def test_delete_vm_worker(self, mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_delete_vm_worker(self, mock_logger, mock_wait):
         _, fake_instance = self.build_fake_vol_instance(ip_address='10.0.0.99')
 
         fake_guac = GuacamoleConnectionFactory.create(instance=fake_instance)
@@ -53,24 +52,23 @@ class DeleteVMTests(VMFunctionTestBase):
             0,
             GuacamoleConnection.objects.filter(instance=instance).count())
         fake_nectar.nova.servers.stop.assert_called_once_with(fake_instance.id)
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.INSTANCE_POLL_SHUTOFF_WAIT),
-            _check_instance_is_shutoff_and_delete,
-            fake_instance,
-            settings.INSTANCE_POLL_SHUTOFF_RETRIES,
-            _dispose_volume_once_instance_is_deleted,
-            (fake_instance, False, settings.INSTANCE_POLL_DELETED_RETRIES))
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _check_instance_is_shutoff_and_delete,
+            fake_instance, targets={SHUTDOWN},
+            interval=settings.INSTANCE_POLL_SHUTOFF_WAIT,
+            retries=settings.INSTANCE_POLL_SHUTOFF_RETRIES,
+            func=_dispose_volume_once_instance_is_deleted,
+            func_kwargs={
+                'instance': fake_instance, 'archive': False,
+                'retries': settings.INSTANCE_POLL_DELETED_RETRIES})
 
         mock_logger.info.assert_called_once_with(
             f"About to delete {fake_instance}")
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.logger')
-    def test_delete_vm_worker_missing_instance(self, mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_delete_vm_worker_missing_instance(self, mock_logger, mock_wait):
         _, fake_instance = self.build_fake_vol_instance(ip_address='10.0.0.99')
 
         fake_guac = GuacamoleConnectionFactory.create(instance=fake_instance)
@@ -90,14 +88,15 @@ class DeleteVMTests(VMFunctionTestBase):
             0,
             GuacamoleConnection.objects.filter(instance=instance).count())
         fake_nectar.nova.servers.stop.assert_not_called()
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.INSTANCE_POLL_SHUTOFF_WAIT),
-            _check_instance_is_shutoff_and_delete,
-            fake_instance,
-            settings.INSTANCE_POLL_SHUTOFF_RETRIES,
-            _dispose_volume_once_instance_is_deleted,
-            (fake_instance, False, settings.INSTANCE_POLL_DELETED_RETRIES))
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _check_instance_is_shutoff_and_delete,
+            fake_instance, targets={SHUTDOWN},
+            interval=settings.INSTANCE_POLL_SHUTOFF_WAIT,
+            retries=settings.INSTANCE_POLL_SHUTOFF_RETRIES,
+            func=_dispose_volume_once_instance_is_deleted,
+            func_kwargs={
+                'instance': fake_instance, 'archive': False,
+                'retries': settings.INSTANCE_POLL_DELETED_RETRIES})
 
         mock_logger.error.assert_called_once_with(
             f"Trying to delete {fake_instance} but it is not found in Nova.")
@@ -108,11 +107,9 @@ class DeleteVMTests(VMFunctionTestBase):
         self.assertIsNotNone(instance.marked_for_deletion)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.logger')
-    def test_delete_vm_worker_already_stopped(self, mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_delete_vm_worker_already_stopped(self, mock_logger, mock_wait):
         _, fake_instance = self.build_fake_vol_instance(ip_address='10.0.0.99')
 
         fake_guac = GuacamoleConnectionFactory.create(instance=fake_instance)
@@ -131,14 +128,15 @@ class DeleteVMTests(VMFunctionTestBase):
             0,
             GuacamoleConnection.objects.filter(instance=instance).count())
         fake_nectar.nova.servers.stop.assert_not_called()
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.INSTANCE_POLL_SHUTOFF_WAIT),
-            _check_instance_is_shutoff_and_delete,
-            fake_instance,
-            settings.INSTANCE_POLL_SHUTOFF_RETRIES,
-            _dispose_volume_once_instance_is_deleted,
-            (fake_instance, False, settings.INSTANCE_POLL_DELETED_RETRIES))
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _check_instance_is_shutoff_and_delete,
+            fake_instance, targets={SHUTDOWN},
+            interval=settings.INSTANCE_POLL_SHUTOFF_WAIT,
+            retries=settings.INSTANCE_POLL_SHUTOFF_RETRIES,
+            func=_dispose_volume_once_instance_is_deleted,
+            func_kwargs={
+                'instance': fake_instance, 'archive': False,
+                'retries': settings.INSTANCE_POLL_DELETED_RETRIES})
 
         mock_logger.info.assert_has_calls([
             call(f"About to delete {fake_instance}"),
@@ -146,11 +144,9 @@ class DeleteVMTests(VMFunctionTestBase):
         ])
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.logger')
-    def test_delete_vm_worker_wrong_state(self, mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_delete_vm_worker_wrong_state(self, mock_logger, mock_wait):
         _, fake_instance = self.build_fake_vol_instance(ip_address='10.0.0.99')
 
         fake_guac = GuacamoleConnectionFactory.create(instance=fake_instance)
@@ -169,7 +165,7 @@ class DeleteVMTests(VMFunctionTestBase):
             0,
             GuacamoleConnection.objects.filter(instance=instance).count())
         fake_nectar.nova.servers.stop.assert_not_called()
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         mock_logger.error.assert_called_once_with(
             f"Nova instance for {fake_instance} is in unexpected state "
             f"{RESCUE}.  Needs manual cleanup.")
@@ -178,15 +174,13 @@ class DeleteVMTests(VMFunctionTestBase):
                          instance.error_message)
 
     @patch('vm_manager.models.get_nectar')
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.logger')
-    def test_check_instance_shutoff(self, mock_logger, mock_rq,
+    def test_check_instance_shutoff(self, mock_logger, mock_wait,
                                     mock_get_nectar):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
         _, fake_instance = self.build_fake_vol_instance(ip_address='10.0.0.99')
         funky = Fake()
-        funky_args = (1, 2)
+        funky_kwargs = {'a': 1, 'retries': 2}
 
         fake_nectar = FakeNectar()
         mock_get_nectar.return_value = fake_nectar
@@ -195,30 +189,28 @@ class DeleteVMTests(VMFunctionTestBase):
         self.assertEqual(
             WF_CONTINUE,
             _check_instance_is_shutoff_and_delete(
-                fake_instance, retries, funky, funky_args))
+                fake_instance, retries, funky, funky_kwargs))
 
         mock_logger.info.assert_called_with(
             f"{fake_instance} is not yet SHUTOFF! Will check again in "
             f"{settings.INSTANCE_POLL_SHUTOFF_WAIT} seconds "
             f"with {retries} retries remaining.")
-        mock_rq.get_scheduler.assert_called_once_with("default")
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.INSTANCE_POLL_SHUTOFF_WAIT),
-            _check_instance_is_shutoff_and_delete, fake_instance,
-            0, funky, funky_args)
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _check_instance_is_shutoff_and_delete,
+            fake_instance, targets={SHUTDOWN},
+            interval=settings.INSTANCE_POLL_SHUTOFF_WAIT, retries=0,
+            func=funky, func_kwargs=funky_kwargs)
 
     @patch('vm_manager.models.get_nectar')
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     @patch('vm_manager.vm_functions.delete_vm.delete_instance')
     def test_check_instance_shutoff_2(self, mock_worker, mock_logger,
-                                      mock_rq, mock_get_nectar):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+                                      mock_wait, mock_get_nectar):
         _, fake_instance, fake_status = self.build_fake_vol_inst_status(
             ip_address='10.0.0.99', status=VM_WAITING)
         funky = Fake()
-        funky_args = (1, 2)
+        funky_kwargs = {'a': 1, 'retries': 2}
 
         fake_nectar = FakeNectar()
         mock_get_nectar.return_value = fake_nectar
@@ -227,32 +219,29 @@ class DeleteVMTests(VMFunctionTestBase):
         self.assertEqual(
             WF_CONTINUE,
             _check_instance_is_shutoff_and_delete(
-                fake_instance, 0, funky, funky_args))
+                fake_instance, 0, funky, funky_kwargs))
 
-        mock_rq.get_scheduler.assert_called_once_with("default")
         mock_logger.info.assert_called_with(
             f"Ran out of retries shutting down {fake_instance}. "
             "Proceeding to delete Nova instance anyway!")
         mock_worker.assert_called_once_with(fake_instance)
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.INSTANCE_POLL_DELETED_WAIT),
-            funky, *funky_args)
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, funky, targets={MISSING},
+            interval=settings.INSTANCE_POLL_DELETED_WAIT, a=1, retries=2)
         updated_status = VMStatus.objects.get(pk=fake_status.pk)
         self.assertEqual(45, updated_status.status_progress)
         self.assertIsNotNone(updated_status.status_message)
 
     @patch('vm_manager.models.get_nectar')
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     @patch('vm_manager.vm_functions.delete_vm.delete_instance')
     def test_check_instance_shutoff_3(self, mock_worker, mock_logger,
-                                      mock_rq, mock_get_nectar):
+                                      mock_wait, mock_get_nectar):
         # This is the case where there is no VMStatus ...
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
         _, fake_instance = self.build_fake_vol_instance(ip_address='10.0.0.99')
         funky = Fake()
-        funky_args = (1, 2)
+        funky_kwargs = {'a': 1, 'retries': 2}
 
         fake_nectar = FakeNectar()
         mock_get_nectar.return_value = fake_nectar
@@ -261,16 +250,15 @@ class DeleteVMTests(VMFunctionTestBase):
         self.assertEqual(
             WF_CONTINUE,
             _check_instance_is_shutoff_and_delete(
-                fake_instance, 0, funky, funky_args))
+                fake_instance, 0, funky, funky_kwargs))
 
-        mock_rq.get_scheduler.assert_called_once_with("default")
         mock_logger.info.assert_called_with(
             f"Ran out of retries shutting down {fake_instance}. "
             "Proceeding to delete Nova instance anyway!")
         mock_worker.assert_called_once_with(fake_instance)
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.INSTANCE_POLL_DELETED_WAIT),
-            funky, *funky_args)
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, funky, targets={MISSING},
+            interval=settings.INSTANCE_POLL_DELETED_WAIT, a=1, retries=2)
 
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
     @patch('vm_manager.vm_functions.delete_vm.logger')
@@ -322,16 +310,14 @@ class DeleteVMTests(VMFunctionTestBase):
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     @patch('vm_manager.vm_functions.delete_vm.delete_volume')
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     def test_dispose_volume_once_instance_is_deleted(
-            self, mock_rq, mock_delete, mock_logger, mock_get_nectar):
+            self, mock_wait, mock_delete, mock_logger, mock_get_nectar):
         fake_nectar = FakeNectar()
         mock_get_nectar.return_value = fake_nectar
         fake_nectar.nova.servers.get.side_effect = \
             novaclient.exceptions.NotFound(code=400)
         mock_delete.return_value = True
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
 
         fake_volume, fake_instance = self.build_fake_vol_instance(
             ip_address='10.0.0.99')
@@ -347,11 +333,11 @@ class DeleteVMTests(VMFunctionTestBase):
             f"to delete {fake_volume} now!")
         instance = Instance.objects.get(pk=fake_instance.pk)
         self.assertIsNotNone(instance.deleted)
-        mock_rq.get_scheduler.assert_called_once_with("default")
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.VOLUME_POLL_DELETED_WAIT),
-            _wait_until_volume_is_deleted, fake_volume,
-            settings.VOLUME_POLL_DELETED_RETRIES)
+        mock_wait.assert_called_once_with(
+            VOLUME, fake_volume.id, _wait_until_volume_is_deleted,
+            fake_volume, pending={'deleting'},
+            interval=settings.VOLUME_POLL_DELETED_WAIT,
+            retries=settings.VOLUME_POLL_DELETED_RETRIES)
 
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
     @patch('vm_manager.vm_functions.delete_vm.logger')
@@ -378,15 +364,13 @@ class DeleteVMTests(VMFunctionTestBase):
         self.assertIsNone(instance.deleted)
 
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     @patch('vm_manager.vm_functions.delete_vm.delete_volume')
     @patch('vm_manager.vm_functions.delete_vm.delete_instance')
     def test_dispose_volume_once_instance_is_deleted_3(
             self, mock_delete_instance, mock_delete_volume,
-            mock_logger, mock_rq, mock_get_nectar):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+            mock_logger, mock_wait, mock_get_nectar):
 
         fake_volume, fake_instance = self.build_fake_vol_instance(
             ip_address='10.0.0.99')
@@ -404,22 +388,19 @@ class DeleteVMTests(VMFunctionTestBase):
         fake_nectar.nova.servers.get.assert_called_once_with(fake_instance.id)
         mock_delete_volume.assert_not_called()
         mock_delete_instance.assert_not_called()
-        mock_rq.get_scheduler.assert_called_once_with("default")
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.INSTANCE_POLL_DELETED_WAIT),
-            _dispose_volume_once_instance_is_deleted,
-            fake_instance, False, 0)
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _dispose_volume_once_instance_is_deleted,
+            fake_instance, False, targets={MISSING},
+            interval=settings.INSTANCE_POLL_DELETED_WAIT, retries=0)
 
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     @patch('vm_manager.vm_functions.delete_vm.delete_volume')
     @patch('vm_manager.vm_functions.delete_vm.delete_instance')
     def test_dispose_volume_once_instance_is_deleted_4(
             self, mock_delete_instance, mock_delete_volume,
-            mock_logger, mock_rq, mock_get_nectar):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+            mock_logger, mock_wait, mock_get_nectar):
 
         fake_volume, fake_instance = self.build_fake_vol_instance(
             ip_address='10.0.0.99')
@@ -439,8 +420,7 @@ class DeleteVMTests(VMFunctionTestBase):
         fake_nectar.nova.servers.get.assert_called_once_with(fake_instance.id)
         mock_delete_volume.assert_not_called()
         mock_delete_instance.assert_not_called()
-        mock_rq.get_scheduler.assert_not_called()
-        mock_scheduler.enqueue_in.assert_not_called()
+        mock_wait.assert_not_called()
         instance = Instance.objects.get(pk=fake_instance.pk)
         self.assertEqual(message, instance.error_message)
 
@@ -523,14 +503,12 @@ class DeleteVMTests(VMFunctionTestBase):
 
 class ArchiveVMTests(VMFunctionTestBase):
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     @patch('vm_manager.utils.utils.datetime')
     def test_archive_volume_worker(self, mock_datetime, mock_logger,
-                               mock_get, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+                               mock_get, mock_wait):
         fake_volume, _, fake_vm_status = self.build_fake_vol_inst_status(
             status=VM_SHELVED)
         backup_id = uuid4()
@@ -554,16 +532,17 @@ class ArchiveVMTests(VMFunctionTestBase):
         mock_logger.info.assert_called_once_with(
             f'Cinder backup {backup_id} started for volume {fake_volume.id}')
 
-        mock_rq.get_scheduler.assert_called_once_with("default")
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=5), wait_for_backup, fake_volume, backup_id,
-            now + timedelta(seconds=settings.ARCHIVE_WAIT))
+        deadline = now + timedelta(seconds=settings.ARCHIVE_WAIT)
+        mock_wait.assert_called_once_with(
+            BACKUP, backup_id, wait_for_backup, fake_volume, backup_id,
+            deadline, pending={BACKUP_CREATING},
+            interval=settings.ARCHIVE_POLL_WAIT, deadline=deadline)
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     def test_archive_volume_worker_missing(
-            self, mock_logger, mock_get, mock_rq):
+            self, mock_logger, mock_get, mock_wait):
         fake_volume, _, fake_vm_status = self.build_fake_vol_inst_status(
             status=VM_SHELVED)
 
@@ -579,16 +558,16 @@ class ArchiveVMTests(VMFunctionTestBase):
             volume_id=fake_volume.id)
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(VM_SHELVED, vm_status.status)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertEqual("Cinder volume missing.  Cannot be archived.",
                          volume.error_message)
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     def test_archive_volume_worker_backup_reject(
-            self, mock_logger, mock_get, mock_rq):
+            self, mock_logger, mock_get, mock_wait):
         fake_volume, _, fake_vm_status = self.build_fake_vol_inst_status(
             status=VM_SHELVED)
 
@@ -609,15 +588,15 @@ class ArchiveVMTests(VMFunctionTestBase):
             fake_volume.id, name=f"{fake_volume.id}-archive")
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(VM_SHELVED, vm_status.status)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertEqual("Cinder backup failed", volume.error_message)
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     def test_archive_volume_worker_wrong_state(
-            self, mock_logger, mock_get, mock_rq):
+            self, mock_logger, mock_get, mock_wait):
         fake_volume, _, fake_vm_status = self.build_fake_vol_inst_status(
             status=VM_SHELVED)
 
@@ -634,16 +613,14 @@ class ArchiveVMTests(VMFunctionTestBase):
             volume_id=fake_volume.id)
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(VM_SHELVED, vm_status.status)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     @patch('vm_manager.vm_functions.delete_vm.delete_volume')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
     def test_wait_for_backup(self, mock_get, mock_delete,
-                             mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+                             mock_logger, mock_wait):
         fake_volume, _, fake_vm_status = self.build_fake_vol_inst_status(
             status=VM_SHELVED)
         backup_id = uuid4()
@@ -658,7 +635,7 @@ class ArchiveVMTests(VMFunctionTestBase):
         fake_nectar.cinder.backups.get.assert_called_once_with(backup_id)
         mock_logger.error.assert_called_once_with(
             f'Backup took too long: backup {backup_id}, volume {fake_volume}')
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
         deadline = datetime.now(utc) + timedelta(seconds=10)
         fake_nectar.cinder.backups.get.reset_mock()
@@ -666,13 +643,13 @@ class ArchiveVMTests(VMFunctionTestBase):
         wait_for_backup(fake_volume, backup_id, deadline)
         fake_nectar.cinder.backups.get.assert_called_once_with(backup_id)
         mock_logger.error.assert_not_called()
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.ARCHIVE_POLL_WAIT), wait_for_backup,
-            fake_volume, backup_id, deadline)
+        mock_wait.assert_called_once_with(
+            BACKUP, backup_id, wait_for_backup, fake_volume, backup_id,
+            deadline, pending={BACKUP_CREATING},
+            interval=settings.ARCHIVE_POLL_WAIT, deadline=deadline)
 
         mock_logger.info.reset_mock()
-        mock_rq.get_scheduler.reset_mock()
+        mock_wait.reset_mock()
         fake_nectar.cinder.backups.get.reset_mock()
         fake_nectar.cinder.backups.get.return_value = Fake(
             status=BACKUP_AVAILABLE, id=backup_id)
@@ -683,7 +660,7 @@ class ArchiveVMTests(VMFunctionTestBase):
         mock_logger.info.assert_has_calls([
             call(f'Backup {backup_id} completed for volume {fake_volume}'),
             call(f'About to delete the archived volume {fake_volume}')])
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertEqual(backup_id, volume.backup_id)
         self.assertIsNotNone(volume.archived_at)
@@ -692,7 +669,7 @@ class ArchiveVMTests(VMFunctionTestBase):
         mock_delete.assert_called_once_with(fake_volume)
 
         mock_logger.info.reset_mock()
-        mock_rq.get_scheduler.reset_mock()
+        mock_wait.reset_mock()
         fake_nectar.cinder.backups.get.reset_mock()
         fake_nectar.cinder.backups.get.return_value = Fake(
             status="reversing", id=backup_id)
@@ -702,33 +679,31 @@ class ArchiveVMTests(VMFunctionTestBase):
         mock_logger.error.assert_called_once_with(
             f'Backup {backup_id} for volume {fake_volume} '
             'is in unexpected state reversing')
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    def test_delete_backup(self, mock_get_nectar, mock_rq):
+    def test_delete_backup(self, mock_get_nectar, mock_wait):
         "Backup deletion starts successfully"
 
         fake_volume, backup_id = self.build_fake_volume_with_backup()
         fake_nectar = FakeNectar()
         mock_get_nectar.return_value = fake_nectar
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
 
         self.assertEqual(WF_CONTINUE, delete_backup_worker(fake_volume))
         mock_get_nectar.assert_called_once()
         fake_nectar.cinder.backups.delete.assert_called_once_with(backup_id)
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertIsNotNone(volume.backup_id)
-        mock_rq.get_scheduler.assert_called_once_with("default")
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.BACKUP_POLL_DELETED_WAIT),
-            _wait_until_backup_is_deleted,
-            fake_volume, settings.BACKUP_POLL_DELETED_RETRIES)
+        mock_wait.assert_called_once_with(
+            BACKUP, fake_volume.backup_id, _wait_until_backup_is_deleted,
+            fake_volume, targets={MISSING},
+            interval=settings.BACKUP_POLL_DELETED_WAIT,
+            retries=settings.BACKUP_POLL_DELETED_RETRIES)
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    def test_delete_backup_missing(self, mock_get_nectar, mock_rq):
+    def test_delete_backup_missing(self, mock_get_nectar, mock_wait):
         "Backup has already been deleted"
 
         fake_volume, backup_id = self.build_fake_volume_with_backup()
@@ -742,11 +717,11 @@ class ArchiveVMTests(VMFunctionTestBase):
         fake_nectar.cinder.backups.delete.assert_called_once_with(backup_id)
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertIsNone(volume.backup_id)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    def test_delete_backup_failed(self, mock_get_nectar, mock_rq):
+    def test_delete_backup_failed(self, mock_get_nectar, mock_wait):
         "Backup deletion request failed"
 
         fake_volume, backup_id = self.build_fake_volume_with_backup()
@@ -760,11 +735,11 @@ class ArchiveVMTests(VMFunctionTestBase):
         fake_nectar.cinder.backups.delete.assert_called_once_with(backup_id)
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertIsNotNone(volume.backup_id)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    def test_wait_until_backup_deleted(self, mock_get_nectar, mock_rq):
+    def test_wait_until_backup_deleted(self, mock_get_nectar, mock_wait):
         "Backup deletion still progressing"
 
         fake_volume, backup_id = self.build_fake_volume_with_backup(
@@ -773,8 +748,6 @@ class ArchiveVMTests(VMFunctionTestBase):
         fake_nectar.cinder.backups.get.side_effect = \
             cinderclient.exceptions.NotFound(404)
         mock_get_nectar.return_value = fake_nectar
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
 
         self.assertEqual(
             WF_SUCCESS,
@@ -785,19 +758,17 @@ class ArchiveVMTests(VMFunctionTestBase):
         self.assertIsNone(volume.backup_id)
         self.assertEqual(EXP_EXPIRY_COMPLETED,
                          volume.backup_expiration.stage)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    def test_wait_until_backup_deleted_2(self, mock_get_nectar, mock_rq):
+    def test_wait_until_backup_deleted_2(self, mock_get_nectar, mock_wait):
         "Backup deletion still progressing"
 
         fake_volume, backup_id = self.build_fake_volume_with_backup(
             stage=EXP_EXPIRING)
         fake_nectar = FakeNectar()
         mock_get_nectar.return_value = fake_nectar
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
 
         self.assertEqual(
             WF_CONTINUE,
@@ -807,15 +778,14 @@ class ArchiveVMTests(VMFunctionTestBase):
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertIsNotNone(volume.backup_id)
         self.assertEqual(EXP_EXPIRING, volume.backup_expiration.stage)
-        mock_rq.get_scheduler.assert_called_once_with("default")
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.BACKUP_POLL_DELETED_WAIT),
-            _wait_until_backup_is_deleted,
-            fake_volume, 4)
+        mock_wait.assert_called_once_with(
+            BACKUP, fake_volume.backup_id, _wait_until_backup_is_deleted,
+            fake_volume, targets={MISSING},
+            interval=settings.BACKUP_POLL_DELETED_WAIT, retries=4)
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    def test_wait_until_backup_deleted_3(self, mock_get_nectar, mock_rq):
+    def test_wait_until_backup_deleted_3(self, mock_get_nectar, mock_wait):
         "Backup deletion did not complete in time"
 
         fake_volume, backup_id = self.build_fake_volume_with_backup(
@@ -832,13 +802,13 @@ class ArchiveVMTests(VMFunctionTestBase):
         self.assertIsNotNone(volume.backup_id)
         self.assertEqual(EXP_EXPIRY_FAILED_RETRYABLE,
                          volume.backup_expiration.stage)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     def test_wait_until_backup_deleted_4(self, mock_logger,
-                                         mock_get_nectar, mock_rq):
+                                         mock_get_nectar, mock_wait):
         "Backup get call failed"
 
         fake_volume, backup_id = self.build_fake_volume_with_backup(
@@ -857,12 +827,12 @@ class ArchiveVMTests(VMFunctionTestBase):
         self.assertIsNotNone(volume.backup_id)
         self.assertEqual(EXP_EXPIRY_FAILED_RETRYABLE,
                          volume.backup_expiration.stage)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         mock_logger.exception.assert_called_once()
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    def test_wait_until_volume_deleted(self, mock_get_nectar, mock_rq):
+    def test_wait_until_volume_deleted(self, mock_get_nectar, mock_wait):
         "Volume deletion still progressing"
 
         fake_volume = self.build_fake_volume(stage=EXP_EXPIRING)
@@ -870,8 +840,6 @@ class ArchiveVMTests(VMFunctionTestBase):
         fake_nectar.cinder.volumes.get.side_effect = \
             cinderclient.exceptions.NotFound(404)
         mock_get_nectar.return_value = fake_nectar
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
 
         self.assertEqual(
             WF_SUCCESS,
@@ -881,19 +849,17 @@ class ArchiveVMTests(VMFunctionTestBase):
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertIsNotNone(volume.deleted)
         self.assertEqual(EXP_EXPIRY_COMPLETED, volume.expiration.stage)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    def test_wait_until_volume_deleted_2(self, mock_get_nectar, mock_rq):
+    def test_wait_until_volume_deleted_2(self, mock_get_nectar, mock_wait):
         "Volume deletion still progressing"
 
         fake_volume = self.build_fake_volume(stage=EXP_EXPIRING)
         fake_nectar = FakeNectar()
         fake_nectar.cinder.volumes.get.return_value = Fake(status='deleting')
         mock_get_nectar.return_value = fake_nectar
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
 
         self.assertEqual(
             WF_CONTINUE,
@@ -903,15 +869,14 @@ class ArchiveVMTests(VMFunctionTestBase):
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertIsNone(volume.deleted)
         self.assertEqual(EXP_EXPIRING, volume.expiration.stage)
-        mock_rq.get_scheduler.assert_called_once_with("default")
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.BACKUP_POLL_DELETED_WAIT),
-            _wait_until_volume_is_deleted,
-            fake_volume, 4)
+        mock_wait.assert_called_once_with(
+            VOLUME, fake_volume.id, _wait_until_volume_is_deleted,
+            fake_volume, pending={'deleting'},
+            interval=settings.VOLUME_POLL_DELETED_WAIT, retries=4)
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    def test_wait_until_volume_deleted_3(self, mock_get_nectar, mock_rq):
+    def test_wait_until_volume_deleted_3(self, mock_get_nectar, mock_wait):
         "Volume deletion did not complete in time"
 
         fake_volume = self.build_fake_volume(stage=EXP_EXPIRING)
@@ -926,13 +891,13 @@ class ArchiveVMTests(VMFunctionTestBase):
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertIsNone(volume.deleted)
         self.assertEqual(EXP_EXPIRY_FAILED_RETRYABLE, volume.expiration.stage)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
     @patch('vm_manager.vm_functions.delete_vm.logger')
     def test_wait_until_volume_deleted_4(self, mock_logger,
-                                         mock_get_nectar, mock_rq):
+                                         mock_get_nectar, mock_wait):
         "Volume get call failed"
 
         fake_volume = self.build_fake_volume(stage=EXP_EXPIRING)
@@ -949,20 +914,18 @@ class ArchiveVMTests(VMFunctionTestBase):
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertIsNone(volume.deleted)
         self.assertEqual(EXP_EXPIRY_FAILED_RETRYABLE, volume.expiration.stage)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         mock_logger.exception.assert_called_once()
 
-    @patch('vm_manager.vm_functions.delete_vm.django_rq')
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
     @patch('vm_manager.vm_functions.delete_vm.get_nectar')
-    def test_wait_until_volume_deleted_5(self, mock_get_nectar, mock_rq):
+    def test_wait_until_volume_deleted_5(self, mock_get_nectar, mock_wait):
         "Volume delete goes to bad state"
 
         fake_volume = self.build_fake_volume(stage=EXP_EXPIRING)
         fake_nectar = FakeNectar()
         fake_nectar.cinder.volumes.get.return_value = Fake(status='smoldering')
         mock_get_nectar.return_value = fake_nectar
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
 
         self.assertEqual(
             WF_RETRY,
@@ -972,4 +935,4 @@ class ArchiveVMTests(VMFunctionTestBase):
         volume = Volume.objects.get(pk=fake_volume.pk)
         self.assertIsNone(volume.deleted)
         self.assertEqual(EXP_EXPIRY_FAILED_RETRYABLE, volume.expiration.stage)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
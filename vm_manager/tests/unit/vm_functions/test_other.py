@@ -1,4 +1,3 @@
-from datetime import timedelta
 from unittest.mock import Mock, patch, call
 
 import novaclient
@@ -13,17 +12,16 @@ from vm_manager.constants import ACTIVE, SHUTDOWN, RESCUE, REBOOT, \
 from vm_manager.models import VMStatus, Volume, Instance
 from vm_manager.vm_functions.other_vm_functions import reboot_vm_worker, \
     _check_power_state
+from vm_manager.utils.poller import SERVER
 from vm_manager.utils.utils import get_nectar
 
 
 class RebootVMTests(VMFunctionTestBase):
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.other_vm_functions.django_rq')
+    @patch('vm_manager.vm_functions.other_vm_functions.register_wait')
     @patch('vm_manager.vm_functions.other_vm_functions.logger')
-    def test_reboot_vm_worker(self, mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_reboot_vm_worker(self, mock_logger, mock_wait):
         fake_vol, fake_instance, fake_status = self.build_fake_vol_inst_status(
             ip_address='10.0.0.99')
 
@@ -38,11 +36,12 @@ class RebootVMTests(VMFunctionTestBase):
 
         fake_nectar.nova.servers.get.assert_called_once_with(fake_instance.id)
         mock_server.reboot.assert_called_once_with(REBOOT_SOFT)
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.REBOOT_CONFIRM_WAIT),
-            _check_power_state, settings.REBOOT_CONFIRM_RETRIES,
-            fake_instance, VM_OKAY, self.UBUNTU.feature)
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _check_power_state,
+            instance=fake_instance, target_status=VM_OKAY,
+            requesting_feature=self.UBUNTU.feature, targets={ACTIVE},
+            interval=settings.REBOOT_CONFIRM_WAIT,
+            retries=settings.REBOOT_CONFIRM_RETRIES)
 
         mock_logger.info.assert_called_once_with(
             f"Performing {REBOOT_SOFT} reboot on {fake_instance}")
@@ -54,11 +53,9 @@ class RebootVMTests(VMFunctionTestBase):
         self.assertIsNotNone(updated_volume.rebooted_at)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.other_vm_functions.django_rq')
+    @patch('vm_manager.vm_functions.other_vm_functions.register_wait')
     @patch('vm_manager.vm_functions.other_vm_functions.logger')
-    def test_reboot_vm_worker_shutdown(self, mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_reboot_vm_worker_shutdown(self, mock_logger, mock_wait):
         fake_vol, fake_instance, fake_status = self.build_fake_vol_inst_status(
             ip_address='10.0.0.99')
 
@@ -73,11 +70,12 @@ class RebootVMTests(VMFunctionTestBase):
 
         fake_nectar.nova.servers.get.assert_called_once_with(fake_instance.id)
         mock_server.reboot.assert_called_once_with(REBOOT_HARD)
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.REBOOT_CONFIRM_WAIT),
-            _check_power_state, settings.REBOOT_CONFIRM_RETRIES,
-            fake_instance, VM_OKAY, self.UBUNTU.feature)
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _check_power_state,
+            instance=fake_instance, target_status=VM_OKAY,
+            requesting_feature=self.UBUNTU.feature, targets={ACTIVE},
+            interval=settings.REBOOT_CONFIRM_WAIT,
+            retries=settings.REBOOT_CONFIRM_RETRIES)
 
         mock_logger.info.assert_has_calls([
             call(f"Forcing {REBOOT_HARD} reboot because Nova instance "
@@ -92,11 +90,9 @@ class RebootVMTests(VMFunctionTestBase):
         self.assertIsNotNone(updated_volume.rebooted_at)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.other_vm_functions.django_rq')
+    @patch('vm_manager.vm_functions.other_vm_functions.register_wait')
     @patch('vm_manager.vm_functions.other_vm_functions.logger')
-    def test_reboot_vm_worker_wrong_state(self, mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_reboot_vm_worker_wrong_state(self, mock_logger, mock_wait):
         fake_vol, fake_instance, fake_status = self.build_fake_vol_inst_status(
             ip_address='10.0.0.99')
 
@@ -111,7 +107,7 @@ class RebootVMTests(VMFunctionTestBase):
 
         fake_nectar.nova.servers.get.assert_called_once_with(fake_instance.id)
         mock_server.reboot.assert_not_called()
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         mock_logger.info.assert_not_called()
         mock_logger.error.assert_called_once_with(
             f"Nova instance for {fake_instance} in unexpected state {RESCUE}."
@@ -127,11 +123,9 @@ class RebootVMTests(VMFunctionTestBase):
                          instance.error_message)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.other_vm_functions.django_rq')
+    @patch('vm_manager.vm_functions.other_vm_functions.register_wait')
     @patch('vm_manager.vm_functions.other_vm_functions.logger')
-    def test_reboot_vm_worker_missing(self, mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_reboot_vm_worker_missing(self, mock_logger, mock_wait):
         fake_vol, fake_instance, fake_status = self.build_fake_vol_inst_status(
             ip_address='10.0.0.99')
 
@@ -144,7 +138,7 @@ class RebootVMTests(VMFunctionTestBase):
                          REBOOT_SOFT, VM_OKAY, self.UBUNTU.feature)
 
         fake_nectar.nova.servers.get.assert_called_once_with(fake_instance.id)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         mock_logger.info.assert_not_called()
         mock_logger.error.assert_called_once_with(
             f"Nova instance is missing for {fake_instance}")
@@ -158,11 +152,9 @@ class RebootVMTests(VMFunctionTestBase):
         self.assertEqual("Nova instance is missing", instance.error_message)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.other_vm_functions.django_rq')
+    @patch('vm_manager.vm_functions.other_vm_functions.register_wait')
     @patch('vm_manager.vm_functions.other_vm_functions.logger')
-    def test_check_power_state(self, mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_check_power_state(self, mock_logger, mock_wait):
         _, fake_instance, fake_status = self.build_fake_vol_inst_status(
             ip_address='10.0.0.99')
 
@@ -174,7 +166,7 @@ class RebootVMTests(VMFunctionTestBase):
                            VM_OKAY, self.UBUNTU.feature)
 
         fake_nectar.nova.servers.get.assert_called_once_with(fake_instance.id)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         mock_logger.info.assert_called_once_with(
             f"Instance {fake_instance.id} is {ACTIVE}")
         mock_logger.error.assert_not_called()
@@ -184,11 +176,9 @@ class RebootVMTests(VMFunctionTestBase):
         self.assertIsNotNone(updated_status.status_message)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.other_vm_functions.django_rq')
+    @patch('vm_manager.vm_functions.other_vm_functions.register_wait')
     @patch('vm_manager.vm_functions.other_vm_functions.logger')
-    def test_check_power_state_2(self, mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_check_power_state_2(self, mock_logger, mock_wait):
         _, fake_instance, fake_status = self.build_fake_vol_inst_status(
             ip_address='10.0.0.99')
 
@@ -201,10 +191,11 @@ class RebootVMTests(VMFunctionTestBase):
 
         fake_nectar.nova.servers.get.assert_called_once_with(fake_instance.id)
 
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.REBOOT_CONFIRM_WAIT),
-            _check_power_state, 0, fake_instance, VM_OKAY, self.UBUNTU.feature)
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _check_power_state,
+            instance=fake_instance, target_status=VM_OKAY,
+            requesting_feature=self.UBUNTU.feature, targets={ACTIVE},
+            interval=settings.REBOOT_CONFIRM_WAIT, retries=0)
 
         mock_logger.info.assert_not_called()
         mock_logger.error.assert_not_called()
@@ -214,11 +205,9 @@ class RebootVMTests(VMFunctionTestBase):
         self.assertIsNone(updated_status.status_message)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.other_vm_functions.django_rq')
+    @patch('vm_manager.vm_functions.other_vm_functions.register_wait')
     @patch('vm_manager.vm_functions.other_vm_functions.logger')
-    def test_check_power_state_3(self, mock_logger, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    def test_check_power_state_3(self, mock_logger, mock_wait):
         _, fake_instance, fake_status = self.build_fake_vol_inst_status(
             ip_address='10.0.0.99')
 
@@ -231,8 +220,7 @@ class RebootVMTests(VMFunctionTestBase):
 
         fake_nectar.nova.servers.get.assert_called_once_with(fake_instance.id)
 
-        mock_rq.get_scheduler.assert_not_called()
-        mock_scheduler.enqueue_in.assert_not_called()
+        mock_wait.assert_not_called()
 
         mock_logger.info.assert_not_called()
         mock_logger.error.assert_called_once_with(
@@ -17,6 +17,7 @@ from vm_manager.models import VMStatus, Resize, Instance
 from vm_manager.vm_functions.resize_vm import supersize_vm_worker, \
     downsize_vm_worker, extend_boost, _resize_vm, _wait_to_confirm_resize, \
     downsize_expired_vm
+from vm_manager.utils.poller import SERVER
 from vm_manager.utils.utils import get_nectar, after_time
 from vm_manager.utils.expiry import BoostExpiryPolicy
 
@@ -182,15 +183,13 @@ class ResizeVMTests(VMFunctionTestBase):
         mock_policy.new_expiry.assert_called_once_with(resize)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.resize_vm.django_rq')
+    @patch('vm_manager.vm_functions.resize_vm.register_wait')
     @patch('vm_manager.vm_functions.resize_vm.after_time')
-    def test_resize_vm(self, mock_after_time, mock_rq):
+    def test_resize_vm(self, mock_after_time, mock_wait):
         _, fake_instance, fake_vm_status = self.build_fake_vol_inst_status(
             status=VM_RESIZING, status_progress=0)
         default_flavor_id = self.UBUNTU.default_flavor.id
         big_flavor_id = self.UBUNTU.big_flavor.id
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
 
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get.return_value = FakeServer(
@@ -222,22 +221,19 @@ class ResizeVMTests(VMFunctionTestBase):
         fake_nectar.nova.servers.resize.assert_called_with(
             fake_instance.id, big_flavor_id)
 
-        mock_rq.get_scheduler.assert_called_once_with("default")
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=5), _wait_to_confirm_resize,
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _wait_to_confirm_resize,
             fake_instance, big_flavor_id, VM_SUPERSIZED, after,
-            self.FEATURE)
+            self.FEATURE, pending={RESIZE}, interval=5, deadline=after)
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(30, vm_status.status_progress)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.resize_vm.django_rq')
-    def test_resize_vm_missing(self, mock_rq):
+    @patch('vm_manager.vm_functions.resize_vm.register_wait')
+    def test_resize_vm_missing(self, mock_wait):
         # The Nova instance is missing when we try to check its status.
         _, fake_instance, fake_vm_status = self.build_fake_vol_inst_status(
             status=VM_RESIZING, status_progress=0)
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
 
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get.side_effect = NotFound(code=42)
@@ -246,7 +242,7 @@ class ResizeVMTests(VMFunctionTestBase):
             _resize_vm(fake_instance, self.UBUNTU.default_flavor.id,
                        VM_OKAY, self.FEATURE))
         fake_nectar.nova.servers.get.assert_called_with(fake_instance.id)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         instance = Instance.objects.get(pk=fake_instance.pk)
         self.assertEqual("Nova instance is missing", instance.error_message)
         self.assertIsNotNone(instance.marked_for_deletion)
@@ -254,15 +250,13 @@ class ResizeVMTests(VMFunctionTestBase):
         fake_nectar.nova.servers.get.side_effect = None
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.resize_vm.django_rq')
-    def test_resize_vm_wrong_state(self, mock_rq):
+    @patch('vm_manager.vm_functions.resize_vm.register_wait')
+    def test_resize_vm_wrong_state(self, mock_wait):
         # The Nova instance has the wrong status for a resize.
         _, fake_instance, fake_vm_status = self.build_fake_vol_inst_status(
             status=VM_RESIZING, status_progress=0)
         default_flavor_id = self.UBUNTU.default_flavor.id
         big_flavor_id = self.UBUNTU.big_flavor.id
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
 
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get.side_effect = None
@@ -274,7 +268,7 @@ class ResizeVMTests(VMFunctionTestBase):
             _resize_vm(fake_instance, big_flavor_id,
                        VM_OKAY, self.FEATURE))
         fake_nectar.nova.servers.get.assert_called_with(fake_instance.id)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         instance = Instance.objects.get(pk=fake_instance.pk)
         self.assertEqual(f"Nova instance state is {RESCUE}",
                          instance.error_message)
@@ -283,10 +277,8 @@ class ResizeVMTests(VMFunctionTestBase):
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
     @patch('vm_manager.vm_functions.resize_vm.logger')
-    @patch('vm_manager.vm_functions.resize_vm.django_rq')
-    def test_wait_to_confirm_resize(self, mock_rq, mock_logger):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.resize_vm.register_wait')
+    def test_wait_to_confirm_resize(self, mock_wait, mock_logger):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get.side_effect = None
         fake_nectar.nova.servers.get.return_value = FakeServer(
@@ -307,7 +299,6 @@ class ResizeVMTests(VMFunctionTestBase):
             f"Confirming resize of {fake_instance}")
         fake_nectar.nova.servers.confirm_resize.assert_called_once_with(
             fake_instance.id)
-        mock_scheduler.enqueue_in.assert_not_called()
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(45, vm_status.status_progress)
         resize = Resize.objects.get(pk=fake_resize.pk)
@@ -315,10 +306,8 @@ class ResizeVMTests(VMFunctionTestBase):
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
     @patch('vm_manager.vm_functions.resize_vm.logger')
-    @patch('vm_manager.vm_functions.resize_vm.django_rq')
-    def test_wait_to_confirm_resize_2(self, mock_rq, mock_logger):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.resize_vm.register_wait')
+    def test_wait_to_confirm_resize_2(self, mock_wait, mock_logger):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get.side_effect = None
         fake_nectar.nova.servers.get.return_value = FakeServer(
@@ -338,20 +327,18 @@ class ResizeVMTests(VMFunctionTestBase):
             f"Waiting for resize of {fake_instance}")
         mock_logger.error.assert_not_called()
         fake_nectar.nova.servers.confirm_resize.assert_not_called()
-        mock_rq.get_scheduler.assert_called_once_with("default")
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=5), _wait_to_confirm_resize,
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _wait_to_confirm_resize,
             fake_instance, self.UBUNTU.default_flavor.id,
-            VM_OKAY, deadline, self.FEATURE)
+            VM_OKAY, deadline, self.FEATURE,
+            pending={RESIZE}, interval=5, deadline=deadline)
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(50, vm_status.status_progress)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
     @patch('vm_manager.vm_functions.resize_vm.logger')
-    @patch('vm_manager.vm_functions.resize_vm.django_rq')
-    def test_wait_to_confirm_resize_3(self, mock_rq, mock_logger):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.resize_vm.register_wait')
+    def test_wait_to_confirm_resize_3(self, mock_wait, mock_logger):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get.side_effect = None
         fake_nectar.nova.servers.get.return_value = FakeServer(
@@ -375,8 +362,7 @@ class ResizeVMTests(VMFunctionTestBase):
             call("Resize has taken too long"),
             call(error)])
         fake_nectar.nova.servers.confirm_resize.assert_not_called()
-        mock_rq.get_scheduler.assert_not_called()
-        mock_scheduler.enqueue_in.assert_not_called()
+        mock_wait.assert_not_called()
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(VM_ERROR, vm_status.status)
         self.assertEqual(error, vm_status.instance.error_message)
@@ -385,8 +371,8 @@ class ResizeVMTests(VMFunctionTestBase):
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
     @patch('vm_manager.vm_functions.resize_vm.logger')
-    @patch('vm_manager.vm_functions.resize_vm.django_rq')
-    def test_wait_to_confirm_resize_4(self, mock_rq, mock_logger):
+    @patch('vm_manager.vm_functions.resize_vm.register_wait')
+    def test_wait_to_confirm_resize_4(self, mock_wait, mock_logger):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get.side_effect = [
             FakeServer(status=ACTIVE),
@@ -406,7 +392,7 @@ class ResizeVMTests(VMFunctionTestBase):
         mock_logger.exception.assert_called_once_with(
             f"Instance get failed for {fake_instance}")
         fake_nectar.nova.servers.confirm_resize.assert_not_called()
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(50, vm_status.status_progress)
 
@@ -414,8 +400,8 @@ class ResizeVMTests(VMFunctionTestBase):
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
     @patch('vm_manager.vm_functions.resize_vm.logger')
-    @patch('vm_manager.vm_functions.resize_vm.django_rq')
-    def test_wait_to_confirm_resize_5(self, mock_rq, mock_logger):
+    @patch('vm_manager.vm_functions.resize_vm.register_wait')
+    def test_wait_to_confirm_resize_5(self, mock_wait, mock_logger):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get.side_effect = None
         fake_nectar.nova.servers.get.return_value = FakeServer(
@@ -438,7 +424,7 @@ class ResizeVMTests(VMFunctionTestBase):
         mock_logger.info.assert_not_called()
         mock_logger.error.assert_called_once_with(error)
         fake_nectar.nova.servers.confirm_resize.assert_not_called()
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(VM_ERROR, vm_status.status)
         self.assertEqual(error, vm_status.instance.error_message)
@@ -447,10 +433,8 @@ class ResizeVMTests(VMFunctionTestBase):
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
     @patch('vm_manager.vm_functions.resize_vm.logger')
-    @patch('vm_manager.vm_functions.resize_vm.django_rq')
-    def test_wait_to_confirm_resize_6(self, mock_rq, mock_logger):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.resize_vm.register_wait')
+    def test_wait_to_confirm_resize_6(self, mock_wait, mock_logger):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get.side_effect = None
         fake_nectar.nova.servers.get.return_value = FakeServer(
@@ -472,7 +456,6 @@ class ResizeVMTests(VMFunctionTestBase):
             f"Resize of {fake_instance} was confirmed automatically")
         mock_logger.error.assert_not_called()
         fake_nectar.nova.servers.confirm_resize.assert_not_called()
-        mock_scheduler.enqueue_in.assert_not_called()
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(VM_WAITING, vm_status.status)
         self.assertEqual(45, vm_status.status_progress)
@@ -481,10 +464,8 @@ class ResizeVMTests(VMFunctionTestBase):
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
     @patch('vm_manager.vm_functions.resize_vm.logger')
-    @patch('vm_manager.vm_functions.resize_vm.django_rq')
-    def test_wait_to_confirm_resize_6a(self, mock_rq, mock_logger):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.resize_vm.register_wait')
+    def test_wait_to_confirm_resize_6a(self, mock_wait, mock_logger):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get.side_effect = None
         fake_nectar.nova.servers.get.return_value = FakeServer(
@@ -506,7 +487,6 @@ class ResizeVMTests(VMFunctionTestBase):
             f"Resize of {fake_instance} was confirmed automatically")
         mock_logger.error.assert_not_called()
         fake_nectar.nova.servers.confirm_resize.assert_not_called()
-        mock_scheduler.enqueue_in.assert_not_called()
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(VM_WAITING, vm_status.status)
         self.assertEqual(45, vm_status.status_progress)
@@ -515,8 +495,8 @@ class ResizeVMTests(VMFunctionTestBase):
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
     @patch('vm_manager.vm_functions.resize_vm.logger')
-    @patch('vm_manager.vm_functions.resize_vm.django_rq')
-    def test_wait_to_confirm_resize_7(self, mock_rq, mock_logger):
+    @patch('vm_manager.vm_functions.resize_vm.register_wait')
+    def test_wait_to_confirm_resize_7(self, mock_wait, mock_logger):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get.side_effect = None
         fake_nectar.nova.servers.get.return_value = FakeServer(status=SHUTDOWN)
@@ -537,7 +517,7 @@ class ResizeVMTests(VMFunctionTestBase):
             f"state: {SHUTDOWN}")
         mock_logger.error.assert_called_once_with(error)
         fake_nectar.nova.servers.confirm_resize.assert_not_called()
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         vm_status = VMStatus.objects.get(pk=fake_vm_status.pk)
         self.assertEqual(VM_ERROR, vm_status.status)
         self.assertEqual(error, vm_status.instance.error_message)
@@ -6,17 +6,19 @@ import novaclient
 from django.conf import settings
 
 from guacamole.tests.factories import GuacamoleConnectionFactory
-from vm_manager.constants import ACTIVE, SHUTDOWN, RESCUE, \
+from vm_manager.constants import ACTIVE, SHUTDOWN, RESCUE, MISSING, \
     VM_OKAY, VM_WAITING, VM_ERROR, VM_SHELVED, \
     WF_RETRY, WF_SUCCESS, WF_CONTINUE
 from vm_manager.models import VMStatus, Instance, Volume
 from vm_manager.tests.common import UUID_4
 from vm_manager.tests.fakes import FakeNectar, FakeServer
 from vm_manager.tests.unit.vm_functions.base import VMFunctionTestBase
+from vm_manager.utils.poller import SERVER
 from vm_manager.utils.utils import get_nectar
-from vm_manager.vm_functions.shelve_vm import shelve_vm_worker, \
-    shelve_expired_vm, _confirm_instance_deleted, \
+from vm_manager.vm_functions.delete_vm import \
     _check_instance_is_shutoff_and_delete
+from vm_manager.vm_functions.shelve_vm import shelve_vm_worker, \
+    shelve_expired_vm, _confirm_instance_deleted
 
 utc = timezone.utc
 
@@ -24,10 +26,8 @@ utc = timezone.utc
 class ShelveVMTests(VMFunctionTestBase):
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.shelve_vm.django_rq')
-    def test_shelve_vm_worker_wrong_state(self, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
+    def test_shelve_vm_worker_wrong_state(self, mock_wait):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get = Mock()
         # (Could be any state apart from ACTIVE or SHUTDOWN)
@@ -41,15 +41,13 @@ class ShelveVMTests(VMFunctionTestBase):
         self.assertEqual(WF_RETRY, shelve_vm_worker(fake_instance))
 
         fake_nectar.nova.servers.get.assert_called_once_with(UUID_4)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         instance = Instance.objects.get(pk=fake_instance.pk)
         self.assertIsNotNone(instance.error_message)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.shelve_vm.django_rq')
-    def test_shelve_vm_worker_missing(self, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
+    def test_shelve_vm_worker_missing(self, mock_wait):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get = Mock()
         fake_nectar.nova.servers.get.side_effect = \
@@ -63,15 +61,13 @@ class ShelveVMTests(VMFunctionTestBase):
         self.assertEqual(WF_SUCCESS, shelve_vm_worker(fake_instance))
 
         fake_nectar.nova.servers.get.assert_called_once_with(UUID_4)
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
         instance = Instance.objects.get(pk=fake_instance.pk)
         self.assertIsNotNone(instance.error_message)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.shelve_vm.django_rq')
-    def test_shelve_vm_worker_shutdown(self, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
+    def test_shelve_vm_worker_shutdown(self, mock_wait):
         now = datetime.now(utc)
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get = Mock()
@@ -93,19 +89,19 @@ class ShelveVMTests(VMFunctionTestBase):
         self.assertEqual(33, vm_status.status_progress)
         self.assertTrue(vm_status.wait_time >= now + timedelta(
             seconds=settings.SHELVE_WAIT))
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.INSTANCE_POLL_SHUTOFF_WAIT),
-            _check_instance_is_shutoff_and_delete, fake_instance,
-            settings.INSTANCE_POLL_SHUTOFF_RETRIES,
-            _confirm_instance_deleted,
-            (fake_instance, settings.INSTANCE_POLL_DELETED_RETRIES))
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _check_instance_is_shutoff_and_delete,
+            fake_instance, targets={SHUTDOWN},
+            interval=settings.INSTANCE_POLL_SHUTOFF_WAIT,
+            retries=settings.INSTANCE_POLL_SHUTOFF_RETRIES,
+            func=_confirm_instance_deleted,
+            func_kwargs={
+                'instance': fake_instance,
+                'retries': settings.INSTANCE_POLL_DELETED_RETRIES})
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.shelve_vm.django_rq')
-    def test_shelve_vm_worker(self, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.delete_vm.register_wait')
+    def test_shelve_vm_worker(self, mock_wait):
         now = datetime.now(utc)
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get = Mock()
@@ -127,19 +123,19 @@ class ShelveVMTests(VMFunctionTestBase):
         self.assertEqual(33, vm_status.status_progress)
         self.assertTrue(vm_status.wait_time >= now + timedelta(
             seconds=settings.SHELVE_WAIT))
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.INSTANCE_POLL_SHUTOFF_WAIT),
-            _check_instance_is_shutoff_and_delete, fake_instance,
-            settings.INSTANCE_POLL_SHUTOFF_RETRIES,
-            _confirm_instance_deleted,
-            (fake_instance, settings.INSTANCE_POLL_DELETED_RETRIES))
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _check_instance_is_shutoff_and_delete,
+            fake_instance, targets={SHUTDOWN},
+            interval=settings.INSTANCE_POLL_SHUTOFF_WAIT,
+            retries=settings.INSTANCE_POLL_SHUTOFF_RETRIES,
+            func=_confirm_instance_deleted,
+            func_kwargs={
+                'instance': fake_instance,
+                'retries': settings.INSTANCE_POLL_DELETED_RETRIES})
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.shelve_vm.django_rq')
-    def test_confirm_instance_deleted(self, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.shelve_vm.register_wait')
+    def test_confirm_instance_deleted(self, mock_wait):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get = Mock()
         fake_nectar.nova.servers.get.side_effect = \
@@ -151,7 +147,7 @@ class ShelveVMTests(VMFunctionTestBase):
         self.assertEqual(WF_SUCCESS,
                          _confirm_instance_deleted(fake_instance, 0))
 
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
         instance = Instance.objects.get(pk=fake_instance.pk)
         self.assertIsNotNone(instance.deleted)
@@ -163,10 +159,8 @@ class ShelveVMTests(VMFunctionTestBase):
         self.assertEqual(100, vm_status.status_progress)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.shelve_vm.django_rq')
-    def test_confirm_instance_deleted_2(self, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.shelve_vm.register_wait')
+    def test_confirm_instance_deleted_2(self, mock_wait):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get = Mock()
 
@@ -178,19 +172,17 @@ class ShelveVMTests(VMFunctionTestBase):
         self.assertEqual(WF_CONTINUE,
                          _confirm_instance_deleted(fake_instance, 3))
 
-        mock_rq.get_scheduler.assert_called_once_with('default')
-        mock_scheduler.enqueue_in.assert_called_once_with(
-            timedelta(seconds=settings.INSTANCE_POLL_DELETED_WAIT),
-            _confirm_instance_deleted, fake_instance, 2)
+        mock_wait.assert_called_once_with(
+            SERVER, fake_instance.id, _confirm_instance_deleted,
+            fake_instance, targets={MISSING},
+            interval=settings.INSTANCE_POLL_DELETED_WAIT, retries=2)
 
         instance = Instance.objects.get(pk=fake_instance.pk)
         self.assertIsNone(instance.deleted)
 
     @patch('vm_manager.utils.utils.Nectar', new=FakeNectar)
-    @patch('vm_manager.vm_functions.shelve_vm.django_rq')
-    def test_confirm_instance_deleted_3(self, mock_rq):
-        mock_scheduler = Mock()
-        mock_rq.get_scheduler.return_value = mock_scheduler
+    @patch('vm_manager.vm_functions.shelve_vm.register_wait')
+    def test_confirm_instance_deleted_3(self, mock_wait):
         fake_nectar = get_nectar()
         fake_nectar.nova.servers.get = Mock()
 
@@ -202,7 +194,7 @@ class ShelveVMTests(VMFunctionTestBase):
         self.assertEqual(WF_RETRY,
                          _confirm_instance_deleted(fake_instance, 0))
 
-        mock_rq.get_scheduler.assert_not_called()
+        mock_wait.assert_not_called()
 
         instance = Instance.objects.get(pk=fake_instance.pk)
         self.assertIsNone(instance.deleted)
@@ -0,0 +1,124 @@
+import logging
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import caches
+
+from vm_manager.utils.utils import get_nectar, FlavorDetails
+
+logger = logging.getLogger(__name__)
+
+# The kinds of catalogue entry.  Each kind has its own TTL setting.
+FLAVORS = 'flavors'
+SOURCE_VOLUMES = 'source_volumes'
+NETWORKS = 'networks'
+
+CATALOGUE_KINDS = (FLAVORS, SOURCE_VOLUMES, NETWORKS)
+
+HIT = 'hits'
+MISS = 'misses'
+
+
+class SourceVolume(object):
+    """The parts of a Cinder source ("golden") volume that we cache."""
+
+    def __init__(self, volume):
+        self.id = volume.id
+        self.name = volume.name
+        self.metadata = dict(volume.metadata)
+
+
+def _get_cache():
+    return caches[settings.CATALOGUE_CACHE]
+
+
+def _ttl(kind):
+    return settings.CATALOGUE_CACHE_TTLS[kind]
+
+
+def _generation(cache, kind):
+    # Invalidating a kind bumps its generation, which orphans all of
+    # its entries; they then expire in the usual way.
+    return cache.get_or_set(f"generation:{kind}", 1, timeout=None)
+
+
+def _key(cache, kind, key):
+    # Quoted, since image names have spaces
+    return f"{kind}:{_generation(cache, kind)}:{quote(str(key))}"
+
+
+def _count(cache, kind, outcome):
+    key = f"stats:{kind}:{outcome}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def cached(kind, key, fetch, refresh=False):
+    """Get a catalogue entry from the cache, or fetch() and cache it.
+
+    The cache is shared by all of the processes (web, rqworkers, poller
+    and cronjobs), so an entry is only fetched from OpenStack (or the
+    database) once per TTL.  If 'refresh' is True, the entry is fetched
+    and cached regardless.
+    """
+
+    cache = _get_cache()
+    cache_key = _key(cache, kind, key)
+    if not refresh:
+        value = cache.get(cache_key)
+        if value is not None:
+            _count(cache, kind, HIT)
+            return value
+    _count(cache, kind, MISS)
+    value = fetch()
+    cache.set(cache_key, value, timeout=_ttl(kind))
+    return value
+
+
+def invalidate(kind, key=None):
+    """Invalidate one catalogue entry, or all entries of a kind."""
+
+    cache = _get_cache()
+    if key is None:
+        try:
+            cache.incr(f"generation:{kind}")
+        except ValueError:
+            pass
+        logger.info(f"Invalidated the cached {kind}")
+    else:
+        cache.delete(_key(cache, kind, key))
+        logger.info(f"Invalidated the cached {kind} for {key}")
+
+
+def get_stats():
+    """Get the hit and miss counts for each kind of catalogue entry.
+
+    Each miss is a call to OpenStack (or the database), so the hits
+    are the calls that the cache saved.
+    """
+
+    cache = _get_cache()
+    keys = [f"stats:{kind}:{outcome}"
+            for kind in CATALOGUE_KINDS for outcome in (HIT, MISS)]
+    values = cache.get_many(keys)
+    return {kind: {outcome: values.get(f"stats:{kind}:{outcome}", 0)
+                   for outcome in (HIT, MISS)}
+            for kind in CATALOGUE_KINDS}
+
+
+def reset_stats():
+    _get_cache().delete_many(
+        [f"stats:{kind}:{outcome}"
+         for kind in CATALOGUE_KINDS for outcome in (HIT, MISS)])
+
+
+def _fetch_flavor_map():
+    return {f.name: FlavorDetails(f) for f in get_nectar().nova.flavors.list()}
+
+
+def get_flavor_map():
+    "Get the Nova flavors, by name"
+
+    return cached(FLAVORS, 'all', _fetch_flavor_map)
@@ -0,0 +1,241 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import logging
+
+import django_rq
+
+from django.conf import settings
+from django.db import connection
+
+from guacamole.models import GuacamoleConnection
+from vm_manager.models import Instance, ReconciliationReport, Volume
+from vm_manager.utils.utils import get_nectar, list_all
+from vm_manager.vm_functions.admin_functionality import \
+    admin_repair_instance_error, admin_repair_volume_error
+
+logger = logging.getLogger(__name__)
+
+utc = timezone.utc
+
+# The categories of discrepancy between the database and OpenStack.
+# Each entry is [id, name, environment].
+DELETED_INSTANCES = 'deleted_instances'
+DELETED_VOLUMES = 'deleted_volumes'
+MISSING_INSTANCES = 'missing_instances'
+MISSING_VOLUMES = 'missing_volumes'
+VANISHED_INSTANCES = 'vanished_instances'
+VANISHED_VOLUMES = 'vanished_volumes'
+ORPHANED_CONNECTIONS = 'orphaned_connections'
+
+# The categories' titles and descriptions, for the db_check page
+CATEGORIES = {
+    DELETED_INSTANCES: (
+        "Deleted Instances",
+        "Openstack instances whose Bumblebee Instance records are marked "
+        "as deleted."),
+    DELETED_VOLUMES: (
+        "Deleted Volumes",
+        "Openstack volumes whose Bumblebee Volume records are marked as "
+        "deleted."),
+    MISSING_INSTANCES: (
+        "Missing Instances",
+        "Openstack instances that do not have a corresponding Bumblebee "
+        "Instance record.  These may be instances managed by another "
+        "Bumblebee environment or Bumblebee control VMs (in dev)."),
+    MISSING_VOLUMES: (
+        "Missing Volumes",
+        "Openstack volumes that do not have a corresponding Bumblebee "
+        "Volume record in this Bumblebee environment.  These may be "
+        "master boot volumes or volumes managed by a different Bumblebee "
+        "environment (in dev)."),
+    VANISHED_INSTANCES: (
+        "Vanished Instances",
+        "Bumblebee Instances that are not marked as deleted that have "
+        "gone missing on the Openstack side.  These can be repaired."),
+    VANISHED_VOLUMES: (
+        "Vanished Volumes",
+        "Bumblebee Volumes that are not marked as deleted that have gone "
+        "missing on the Openstack side.  These can be repaired."),
+    ORPHANED_CONNECTIONS: (
+        "Orphaned connections",
+        "Guacamole connections that are not associated with a live "
+        "Instance."),
+}
+
+# The outcomes of the repairs
+REPAIRED = 'repaired'
+NOT_REPAIRED = 'not_repaired'
+REPAIR_FAILED = 'failed'
+
+
+def request_db_check(user, repair=False):
+    """Start a database check, in an rq job."""
+
+    report = ReconciliationReport.objects.create(
+        requested_by=user, repair=repair)
+    _prune_reports()
+    queue = django_rq.get_queue('default')
+    queue.enqueue(run_db_check, report.id,
+                  job_timeout=settings.DB_CHECK_TIMEOUT)
+    logger.info(f"{user} requested {report}")
+    return report
+
+
+def _prune_reports():
+    ReconciliationReport.objects.filter(pk__in=list(
+        ReconciliationReport.objects.order_by('-created')
+        .values_list('pk', flat=True)[settings.DB_CHECK_REPORTS_KEPT:])) \
+        .delete()
+
+
+def run_db_check(report_id):
+    """The rq job that does a database check."""
+
+    report = ReconciliationReport.objects.get(pk=report_id)
+    try:
+        results = db_check()
+        repairs = repair_all(results) if report.repair else {}
+    except Exception as e:
+        logger.exception(f"{report} failed")
+        _update(report, error=str(e), finished=datetime.now(utc))
+        return
+    _update(report, results=results, repairs=repairs,
+            counts={category: len(entries)
+                    for category, entries in results.items()},
+            finished=datetime.now(utc))
+
+
+def _update(report, **fields):
+    ReconciliationReport.objects.filter(pk=report.pk).update(**fields)
+
+
+def db_check(page_size=None):
+    """Compare our Instances, Volumes and Guacamole connections with
+    the Nova servers and Cinder volumes.
+
+    The servers and volumes are listed a page at a time, and each one
+    is looked up in sets of our (live and deleted) ids.  Returns a dict
+    of category to entries.
+    """
+
+    page_size = page_size or settings.RECONCILE_PAGE_SIZE
+    started = datetime.now(utc)
+    n = get_nectar()
+    results = {}
+
+    servers = list_all(n.nova.servers.list, page_size, detailed=True)
+    results[DELETED_INSTANCES], results[MISSING_INSTANCES], \
+        results[VANISHED_INSTANCES] = _diff(
+            Instance, servers, started,
+            lambda server: server.metadata.get('environment', ''))
+
+    volumes = list_all(n.cinder.volumes.list, page_size, detailed=True)
+    results[DELETED_VOLUMES], results[MISSING_VOLUMES], \
+        results[VANISHED_VOLUMES] = _diff(
+            Volume, volumes, started,
+            lambda volume: volume.metadata.get('environment',
+                                               volume.name[-1]))
+
+    live_connections = Instance.objects.filter(
+        deleted=None, marked_for_deletion=None,
+        guac_connection__isnull=False).values('guac_connection')
+    results[ORPHANED_CONNECTIONS] = [
+        list(row) for row in GuacamoleConnection.objects
+        .exclude(connection_id__in=live_connections)
+        .values_list('connection_id', 'connection_name')]
+    return results
+
+
+def _ids(queryset):
+    # Nova and Cinder return ids in the dashed form
+    return {str(id) for id in queryset.values_list('id', flat=True)
+            .iterator(chunk_size=10000)}
+
+
+def _unattended(model):
+    # The live records that no workflow is deleting (or shelving).  This
+    # is evaluated when it is used, as records may be marked or deleted
+    # while the servers and volumes are being listed.
+    return model.objects.filter(deleted=None, marked_for_deletion=None)
+
+
+def _diff(model, resources, started, environment):
+    """Diff the listed OpenStack resources against one of our models.
+
+    Returns the entries for the resources whose records are deleted,
+    the resources that have no records, and the live records (created
+    before the check started, and not being deleted) whose resources
+    were not listed.
+    """
+
+    live = _ids(model.objects.filter(deleted=None))
+    deleted = _ids(model.objects.exclude(deleted=None))
+    deleted_entries = []
+    missing_entries = []
+    listed = set()
+    for resource in resources:
+        listed.add(resource.id)
+        if resource.id in live:
+            continue
+        entry = [resource.id, resource.name, environment(resource)]
+        if resource.id in deleted:
+            deleted_entries.append(entry)
+        else:
+            missing_entries.append(entry)
+
+    vanished_entries = [
+        [str(record.id), str(record), settings.ENVIRONMENT_NAME]
+        for record in _unattended(model).filter(
+            id__in=live - listed, created__lt=started).order_by('created')]
+    return deleted_entries, missing_entries, vanished_entries
+
+
+def repair_all(results, workers=None):
+    """Repair the vanished Instances and Volumes.
+
+    The repairs only bring our records into line with OpenStack.  They
+    are done by up to DB_CHECK_REPAIR_WORKERS threads.  A volume whose
+    instance is being repaired is left to that repair.  Returns the
+    counts of the outcomes.  Records that have been deleted, or marked
+    for deletion, since the check are left to their workflows.
+    """
+
+    workers = workers or settings.DB_CHECK_REPAIR_WORKERS
+    instances = list(_unattended(Instance).filter(
+        id__in=[entry[0] for entry in results[VANISHED_INSTANCES]])
+        .select_related('boot_volume'))
+    boot_volumes = {instance.boot_volume_id for instance in instances}
+    volumes = _unattended(Volume).filter(
+        id__in=[entry[0] for entry in results[VANISHED_VOLUMES]]) \
+        .exclude(id__in=boot_volumes)
+    targets = ([(admin_repair_instance_error, instance)
+                for instance in instances]
+               + [(admin_repair_volume_error, volume) for volume in volumes])
+
+    counts = dict.fromkeys([REPAIRED, NOT_REPAIRED, REPAIR_FAILED], 0)
+    if workers <= 1:
+        for target in targets:
+            counts[_repair(*target)] += 1
+        return counts
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for outcome in executor.map(lambda target: _repair_in_thread(
+                *target), targets):
+            counts[outcome] += 1
+    return counts
+
+
+def _repair(repair, resource):
+    try:
+        return REPAIRED if repair(None, resource) else NOT_REPAIRED
+    except Exception:
+        logger.exception(f"Repairing {resource} failed")
+        return REPAIR_FAILED
+
+
+def _repair_in_thread(repair, resource):
+    try:
+        return _repair(repair, resource)
+    finally:
+        # Each thread has its own database connection
+        connection.close()
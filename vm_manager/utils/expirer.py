@@ -1,14 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
 import logging
 from datetime import datetime, timedelta, timezone
+import threading
+import time
 
 from django.conf import settings
+from django.db import connection
+from django.db.models import Q
 
 from researcher_workspace.utils import send_notification, format_notification
 from researcher_desktop.models import DesktopType
-from vm_manager.constants import WF_SUCCESS, WF_CONTINUE, WF_RETRY, WF_FAIL
+from vm_manager.constants import WF_SUCCESS, WF_CONTINUE, WF_RETRY, WF_FAIL, \
+    WF_ARCHIVE, WF_DELETE, WF_SHELVE, WF_RESIZE
 from vm_manager.models import Instance, Volume, Resize, \
     EXP_INITIAL, EXP_FIRST_WARNING, EXP_FINAL_WARNING, EXP_EXPIRING, \
     EXP_EXPIRY_COMPLETED, EXP_EXPIRY_FAILED, EXP_EXPIRY_FAILED_RETRYABLE
+from vm_manager.utils.workflow import run_workflow
 from vm_manager.vm_functions.delete_vm import \
     archive_expired_volume, delete_backup_worker
 from vm_manager.vm_functions.resize_vm import downsize_expired_vm
@@ -40,11 +48,69 @@ EXP_FAIL = WF_FAIL
 # the expiry is already running.
 EXP_SKIP = 'skipped'
 
+# The number of rows that run() fetches at a time
+CHUNK_SIZE = 200
+
 
 def days(days):
     return timedelta(days=days) if days and days > 0 else None
 
 
+class RateLimiter(object):
+    "Spaces out the callers of acquire() to at most 'rate' per second."
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next)
+            self.next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class ExpiryThrottle(object):
+    """Limits the concurrency and rate of the expiry actions.
+
+    The limits are global and per availability zone.  A limit of zero
+    (or None) means no limit.
+    """
+
+    def __init__(self, zone_workers=0, rate=0, zone_rate=0):
+        self.zone_workers = zone_workers
+        self.zone_rate = zone_rate
+        self.rate_limiter = RateLimiter(rate) if rate else None
+        self.zone_semaphores = {}
+        self.zone_rate_limiters = {}
+        self.lock = threading.Lock()
+
+    def _for_zone(self, zone):
+        with self.lock:
+            if zone not in self.zone_semaphores:
+                self.zone_semaphores[zone] = (
+                    threading.Semaphore(self.zone_workers)
+                    if self.zone_workers else None)
+                self.zone_rate_limiters[zone] = (
+                    RateLimiter(self.zone_rate) if self.zone_rate else None)
+            return (self.zone_semaphores[zone],
+                    self.zone_rate_limiters[zone])
+
+    def run(self, zone, func, *args):
+        semaphore, zone_rate_limiter = self._for_zone(zone)
+        with ExitStack() as stack:
+            if semaphore:
+                stack.enter_context(semaphore)
+            if zone_rate_limiter:
+                zone_rate_limiter.acquire()
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            return func(*args)
+
+
 class Expirer(object):
     '''The Expirer class handles Bumblebee resource expiry lifecycles.
 
@@ -86,6 +152,15 @@ class Expirer(object):
         self.first_warning = first_warning
         self.final_warning = final_warning
         self.counts = {}
+        self._desktop_types = None
+        self.workers = settings.EXPIRER_WORKERS
+        self.max_actions = settings.EXPIRER_MAX_ACTIONS
+        self.actions = 0
+        self.actions_lock = threading.Lock()
+        self.throttle = ExpiryThrottle(
+            zone_workers=settings.EXPIRER_ZONE_WORKERS,
+            rate=settings.EXPIRER_RATE,
+            zone_rate=settings.EXPIRER_ZONE_RATE)
 
     def accumulate(self, outcome):
         if outcome in self.counts:
@@ -93,6 +168,82 @@ class Expirer(object):
         else:
             self.counts[outcome] = 1
 
+    def get_desktop_type(self, id):
+        # The desktop types are fetched once per run
+        if self._desktop_types is None:
+            self._desktop_types = DesktopType.objects.in_bulk()
+        return self._desktop_types.get(id)
+
+    def due(self, prefix):
+        """A filter for the targets whose next expiry stage is due.
+
+        This is the query equivalent of the staging logic in do_stage,
+        so that run() doesn't fetch the targets that it would skip.
+        The 'prefix' is the path to the Expiration; e.g. 'expiration__'.
+        Targets whose expiry is already running are included, so that
+        do_stage logs them.
+        """
+
+        def reached(warning):
+            # i.e. expires - warning <= now
+            return Q(**{f'{prefix}expires__lte': self.now + warning})
+
+        def stage(*stages):
+            return Q(**{f'{prefix}stage__in': stages})
+
+        if self.first_warning:
+            initial = reached(self.first_warning)
+        elif self.final_warning:
+            initial = reached(self.final_warning)
+        else:
+            initial = Q()
+        return ((stage(EXP_INITIAL) & initial)
+                | (stage(EXP_FIRST_WARNING)
+                   & reached(self.final_warning or timedelta(0)))
+                | (stage(EXP_FINAL_WARNING) & reached(timedelta(0)))
+                | ~stage(EXP_INITIAL, EXP_FIRST_WARNING, EXP_FINAL_WARNING,
+                         EXP_EXPIRY_COMPLETED, EXP_EXPIRY_FAILED))
+
+    def stage_all(self, targets):
+        """Do the next expiry stage for each (target, expiration, user).
+
+        The 'targets' should be ordered by expiry deadline, so that the
+        oldest deadlines are expired first if EXPIRER_MAX_ACTIONS is
+        reached.  If EXPIRER_WORKERS is more than one, the stages are
+        done concurrently by a pool of threads.  Either way, the counts
+        of the outcomes are accumulated in this (the calling) thread.
+        """
+
+        if self.workers <= 1:
+            for target, expiration, user in targets:
+                self.accumulate(self.do_stage(target, expiration, user))
+            return self.counts
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._do_stage_in_thread, *args)
+                       for args in targets]
+            for future in as_completed(futures):
+                self.accumulate(future.result())
+        return self.counts
+
+    def _do_stage_in_thread(self, target, expiration, user):
+        try:
+            return self.do_stage(target, expiration, user)
+        finally:
+            # Each thread has its own database connection
+            connection.close()
+
+    def target_zone(self, target):
+        "The availability zone of the target, for the zone limits"
+        return None
+
+    def _take_action(self):
+        with self.actions_lock:
+            if self.max_actions and self.actions >= self.max_actions:
+                return False
+            self.actions += 1
+            return True
+
     def notify(self, user, context):
         if not self.dry_run:
             send_notification(user, self.template, context)
@@ -158,9 +309,14 @@ class Expirer(object):
                 self.add_target_details(target, context)
                 self.notify(user, context)
                 res = EXP_NOTIFY
+            elif stage == EXP_EXPIRING and not self._take_action():
+                logger.info(f"Expiry of {target} deferred: the maximum "
+                            f"of {self.max_actions} actions was reached")
+                res = EXP_SKIP
             elif stage == EXP_EXPIRING:
                 if not self.dry_run:
-                    res = self.do_expire(target)
+                    res = self.throttle.run(self.target_zone(target),
+                                            self.do_expire, target)
                     if res in (EXP_FAIL, EXP_RETRY):
                         logger.error(f"Expiration action failed ({res})"
                                      f" for {target}")
@@ -199,18 +355,25 @@ class VolumeExpirer(Expirer):
                          **kwargs)
 
     def run(self, feature):
-        for v in Volume.objects.exclude(expiration=None) \
-                               .filter(deleted=None,
-                                       marked_for_deletion=None) \
-                               .prefetch_related('expiration', 'user'):
-            self.accumulate(self.do_stage(v, v.expiration, v.user))
-        return self.counts
+        volumes = Volume.objects.filter(
+            self.due('expiration__'), deleted=None,
+            marked_for_deletion=None
+        ).select_related(
+            'expiration', 'user', 'requesting_feature'
+        ).order_by('expiration__expires')
+        return self.stage_all(
+            (v, v.expiration, v.user)
+            for v in volumes.iterator(chunk_size=CHUNK_SIZE))
+
+    def target_zone(self, volume):
+        return volume.zone
 
     def do_expire(self, volume):
-        return archive_expired_volume(volume, volume.requesting_feature)
+        return run_workflow(WF_ARCHIVE, archive_expired_volume, volume,
+                            volume.requesting_feature)
 
     def add_target_details(self, volume, context):
-        context['desktop_type'] = DesktopType.objects.get_desktop_type(
+        context['desktop_type'] = self.get_desktop_type(
             volume.operating_system)
         context['volume'] = volume
 
@@ -226,16 +389,20 @@ class ArchiveExpirer(Expirer):
         super().__init__(None, **kwargs)
 
     def run(self, feature):
-        for v in Volume.objects \
-                       .exclude(backup_expiration=None) \
-                       .exclude(backup_expiration__stage__in=[
-                           EXP_EXPIRY_COMPLETED, EXP_EXPIRY_FAILED]) \
-                       .prefetch_related('backup_expiration', 'user'):
-            self.accumulate(self.do_stage(v, v.backup_expiration, v.user))
-        return self.counts
+        volumes = Volume.objects.filter(
+            self.due('backup_expiration__')
+        ).select_related(
+            'backup_expiration', 'user'
+        ).order_by('backup_expiration__expires')
+        return self.stage_all(
+            (v, v.backup_expiration, v.user)
+            for v in volumes.iterator(chunk_size=CHUNK_SIZE))
+
+    def target_zone(self, volume):
+        return volume.zone
 
     def do_expire(self, volume):
-        return delete_backup_worker(volume)
+        return run_workflow(WF_DELETE, delete_backup_worker, volume)
 
     def add_target_details(self, volume, context):
         pass
@@ -251,19 +418,25 @@ class InstanceExpirer(Expirer):
                          **kwargs)
 
     def run(self, feature):
-        for i in Instance.objects.exclude(expiration=None) \
-                                 .filter(deleted=None,
-                                         marked_for_deletion=None) \
-                                 .prefetch_related('expiration', 'user'):
-            self.accumulate(self.do_stage(i, i.expiration, i.user))
-        return self.counts
+        instances = Instance.objects.filter(
+            self.due('expiration__'), deleted=None,
+            marked_for_deletion=None
+        ).select_related(
+            'expiration', 'user', 'boot_volume__requesting_feature'
+        ).order_by('expiration__expires')
+        return self.stage_all(
+            (i, i.expiration, i.user)
+            for i in instances.iterator(chunk_size=CHUNK_SIZE))
+
+    def target_zone(self, instance):
+        return instance.boot_volume.zone
 
     def do_expire(self, instance):
-        return shelve_expired_vm(instance,
-                                 instance.boot_volume.requesting_feature)
+        return run_workflow(WF_SHELVE, shelve_expired_vm, instance,
+                            instance.boot_volume.requesting_feature)
 
     def add_target_details(self, instance, context):
-        context['desktop_type'] = DesktopType.objects.get_desktop_type(
+        context['desktop_type'] = self.get_desktop_type(
             instance.boot_volume.operating_system)
         context['instance'] = instance
         context['volume'] = instance.boot_volume
@@ -279,21 +452,27 @@ class ResizeExpirer(Expirer):
                          **kwargs)
 
     def run(self, feature):
-        for r in Resize.objects.exclude(expiration=None) \
-                               .filter(reverted=None,
-                                       instance__marked_for_deletion=None,
-                                       instance__deleted=None) \
-                               .prefetch_related('expiration', 'instance'):
-            self.accumulate(self.do_stage(r, r.expiration, r.instance.user))
-        return self.counts
+        resizes = Resize.objects.filter(
+            self.due('expiration__'), reverted=None,
+            instance__marked_for_deletion=None, instance__deleted=None
+        ).select_related(
+            'expiration', 'instance__user',
+            'instance__boot_volume__requesting_feature'
+        ).order_by('expiration__expires')
+        return self.stage_all(
+            (r, r.expiration, r.instance.user)
+            for r in resizes.iterator(chunk_size=CHUNK_SIZE))
+
+    def target_zone(self, resize):
+        return resize.instance.boot_volume.zone
 
     def do_expire(self, resize):
-        return downsize_expired_vm(
-            resize,
+        return run_workflow(
+            WF_RESIZE, downsize_expired_vm, resize,
             resize.instance.boot_volume.requesting_feature)
 
     def add_target_details(self, resize, context):
-        context['desktop_type'] = DesktopType.objects.get_desktop_type(
+        context['desktop_type'] = self.get_desktop_type(
             resize.instance.boot_volume.operating_system)
         context['resize'] = resize
         context['instance'] = resize.instance
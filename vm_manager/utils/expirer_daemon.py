@@ -0,0 +1,196 @@
+import logging
+import threading
+import time
+
+import django_rq
+from prometheus_client import Counter, Gauge, Histogram
+from redis.exceptions import LockError, RedisError
+
+from django.conf import settings
+from django.db import connection as db_connection
+
+from researcher_desktop.utils.utils import desktops_feature
+from vm_manager.utils.expirer import VolumeExpirer, InstanceExpirer, \
+    ResizeExpirer, ArchiveExpirer
+from vm_manager.utils.usage import update_daily_usage
+from vm_manager.utils.volume_pool import VolumePool
+
+logger = logging.getLogger(__name__)
+
+
+def _expiry_job(job_class):
+    def run(dry_run, verbose):
+        return job_class(dry_run=dry_run,
+                         verbose=verbose).run(desktops_feature())
+    return run
+
+
+def refill_pool(dry_run, verbose):
+    return VolumePool(dry_run=dry_run).run()
+
+
+def rollup_usage(dry_run, verbose):
+    if dry_run:
+        return {}
+    rows = update_daily_usage()
+    if rows is None:
+        raise RuntimeError("The daily usage rollup failed")
+    return {'rows': rows}
+
+
+# The jobs, as for the cronjob command.  Each is called with the
+# 'dry_run' and 'verbose' flags, and returns its counts.
+EXPIRY_JOBS = {
+    'shelve': _expiry_job(InstanceExpirer),
+    'downsize': _expiry_job(ResizeExpirer),
+    'archive': _expiry_job(VolumeExpirer),
+    'delete_archives': _expiry_job(ArchiveExpirer),
+    'refill_pool': refill_pool,
+    'rollup_usage': rollup_usage,
+}
+
+# Only the replica that holds this lock runs the jobs
+LEADER_KEY = 'bumblebee:expirer:leader'
+
+RUN_SECONDS = Histogram(
+    'bumblebee_expirer_run_seconds', 'Duration of expiry job runs',
+    ['job'], buckets=(1, 5, 15, 60, 300, 900, 1800, 3600, float('inf')))
+OUTCOMES = Counter(
+    'bumblebee_expirer_outcomes', 'Outcomes of expiry job stages',
+    ['job', 'outcome'])
+FAILURES = Counter(
+    'bumblebee_expirer_failures', 'Expiry job runs that raised an error',
+    ['job'])
+LAST_SUCCESS = Gauge(
+    'bumblebee_expirer_last_success_seconds',
+    'When each expiry job last completed', ['job'])
+LEADER = Gauge(
+    'bumblebee_expirer_leader', 'Whether this replica is the leader')
+
+
+class ExpirerDaemon(object):
+    """Runs the expiry jobs on a schedule in a resident process.
+
+    Unlike the cronjob, the process (and hence its Nectar session and
+    database connection) persists between runs.  Each job is run every
+    'intervals[job]' seconds.  Only one replica runs the jobs: the one
+    that holds the leader lock in Redis.  The lock expires after
+    EXPIRER_LEADER_TIMEOUT seconds if the leader stops renewing it.
+    While a job runs, a heartbeat thread renews it every 'heartbeat'
+    seconds, so a long run doesn't let another replica take over.
+    """
+
+    def __init__(self, intervals, connection=None, dry_run=False,
+                 verbose=False):
+        self.intervals = intervals
+        self.dry_run = dry_run
+        self.verbose = verbose
+        self.heartbeat = max(1, settings.EXPIRER_LEADER_TIMEOUT // 3)
+        connection = connection or django_rq.get_connection('default')
+        self.lock = connection.lock(
+            LEADER_KEY, timeout=settings.EXPIRER_LEADER_TIMEOUT,
+            thread_local=False)
+        # The jobs are all due when the process starts
+        self.next_run = {job: 0 for job in intervals}
+
+    def owns_lock(self):
+        "Does this replica hold the leader lock?  (Without renewing it.)"
+
+        try:
+            return self.lock.owned()
+        except (LockError, RedisError):
+            return False
+
+    def is_leader(self):
+        """Acquire or renew the leader lock.
+
+        Returns True if this replica is (still) the leader.
+        """
+
+        try:
+            if self.lock.owned():
+                self.lock.reacquire()
+                leader = True
+            else:
+                leader = self.lock.acquire(blocking=False)
+                if leader:
+                    logger.info("This expirer replica is now the leader")
+        except (LockError, RedisError) as e:
+            logger.warning(f"Leader lock check failed: {e}")
+            leader = False
+        LEADER.set(1 if leader else 0)
+        return leader
+
+    def run_due(self):
+        """Run the jobs that are due, if we are the leader.
+
+        Returns the number of seconds until the next job is due, or
+        None if we are not the leader.
+        """
+
+        for job, interval in self.intervals.items():
+            if time.monotonic() < self.next_run[job]:
+                continue
+            if not self.is_leader():
+                return None
+            self.run_job(job)
+            self.next_run[job] = time.monotonic() + interval
+        return max(0, min(self.next_run.values()) - time.monotonic())
+
+    def run_job(self, job):
+        self._check_connection()
+        logger.info(f"Starting the {job} job")
+        start = time.monotonic()
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._renew, args=(stop,),
+                                     name=f"expirer-heartbeat-{job}",
+                                     daemon=True)
+        heartbeat.start()
+        try:
+            counts = EXPIRY_JOBS[job](dry_run=self.dry_run,
+                                      verbose=self.verbose)
+        except Exception:
+            logger.exception(f"The {job} job failed")
+            FAILURES.labels(job).inc()
+            return None
+        finally:
+            stop.set()
+            heartbeat.join()
+            RUN_SECONDS.labels(job).observe(time.monotonic() - start)
+        for outcome, count in counts.items():
+            OUTCOMES.labels(job, outcome).inc(count)
+        LAST_SUCCESS.labels(job).set_to_current_time()
+        logger.info(f"The {job} job counts: {counts}")
+        return counts
+
+    def _renew(self, stop):
+        # Renew the leader lock until the job is done.  If the lock has
+        # been lost, the job carries on (it can't be stopped part way),
+        # but the next is_leader() check will stop any more jobs.
+        while not stop.wait(self.heartbeat):
+            try:
+                self.lock.reacquire()
+            except (LockError, RedisError) as e:
+                logger.warning(f"Leader lock renewal failed: {e}")
+                LEADER.set(0)
+                return
+
+    def _check_connection(self):
+        # The database connection is kept between runs, unless it has
+        # gone away (e.g. the database server timed it out)
+        if db_connection.connection and not db_connection.is_usable():
+            db_connection.close()
+
+    def loop(self, tick):
+        while True:
+            wait = self.run_due()
+            # Check back at least every 'tick' seconds, so that the
+            # leader renews its lock, and a follower can take over
+            time.sleep(tick if wait is None else min(wait, tick))
+
+    def release(self):
+        try:
+            if self.lock.owned():
+                self.lock.release()
+        except (LockError, RedisError):
+            pass
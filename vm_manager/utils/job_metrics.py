@@ -0,0 +1,185 @@
+from datetime import datetime, timezone
+import json
+import logging
+import time
+
+import django_rq
+from redis.exceptions import RedisError
+
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+utc = timezone.utc
+
+# The workflow steps are run in rq work horses (which are forked for
+# each job, and exit when it is done), the expirer and the web tier, so
+# their timings are accumulated in Redis rather than in the processes.
+# Each histogram is a Redis hash, with a count per (labels, bucket) and
+# a sum per labels.  The web tier's collector serves them.
+METRICS_KEY_PREFIX = 'bumblebee:job_metrics'
+
+# The histograms' upper bounds in seconds (plus +Inf)
+BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+INF = '+Inf'
+
+# The time that each workflow step (vm_functions entry point) took to
+# run, by function and outcome
+STEP_SECONDS = 'workflow_step_seconds'
+# The time from a step being added (by the request or the previous
+# step) to it starting, including any wait for OpenStack, by function
+STEP_WAIT_SECONDS = 'workflow_step_wait_seconds'
+# The time from a desktop being requested to it being ready, by type
+READY_SECONDS = 'desktop_ready_seconds'
+
+HISTOGRAMS = {
+    STEP_SECONDS: ("Run time of workflow steps", ['function', 'outcome']),
+    STEP_WAIT_SECONDS: ("Time from workflow steps being added to them "
+                        "starting", ['function']),
+    READY_SECONDS: ("Time from desktops being requested to them being "
+                    "ready", ['type']),
+}
+
+
+def _get_connection():
+    return django_rq.get_connection('default')
+
+
+def _key(name):
+    return f"{METRICS_KEY_PREFIX}:{name}"
+
+
+def observe(name, labels, seconds, connection=None):
+    """Add an observation to one of the HISTOGRAMS.
+
+    The metrics must never break a workflow, so if Redis is unavailable
+    the observation is dropped.
+    """
+
+    seconds = max(0, seconds)
+    bucket = next((str(b) for b in BUCKETS if seconds <= b), INF)
+    prefix = json.dumps([str(label) for label in labels])
+    try:
+        connection = connection or _get_connection()
+        pipe = connection.pipeline()
+        pipe.hincrby(_key(name), f"{prefix}|{bucket}", 1)
+        pipe.hincrbyfloat(_key(name), f"{prefix}|sum", seconds)
+        pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Recording {name} {labels} failed: {e}")
+
+
+def _observe_on_commit(name, labels, seconds):
+    # As with the VMStatus change notifications, this is done once the
+    # change being timed has been committed
+    transaction.on_commit(lambda: observe(name, labels, seconds))
+
+
+def step_function(step):
+    # The function's name, without its module
+    return step.func.rsplit('.', 1)[-1]
+
+
+def observe_step_started(step):
+    _observe_on_commit(STEP_WAIT_SECONDS, [step_function(step)],
+                       (step.started - step.created).total_seconds())
+
+
+def observe_step_finished(step):
+    _observe_on_commit(STEP_SECONDS,
+                       [step_function(step), step.outcome or 'none'],
+                       (step.finished - step.started).total_seconds())
+
+
+def observe_ready(vm_status):
+    _observe_on_commit(
+        READY_SECONDS, [vm_status.operating_system],
+        (vm_status.ready - vm_status.created).total_seconds())
+
+
+def get_histograms(connection=None):
+    """Get the HISTOGRAMS, as cumulative bucket counts and sums.
+
+    Returns a dict of name to a dict of labels (a tuple) to a list of
+    (bound, count) pairs and a sum, as HistogramMetricFamily wants them.
+    """
+
+    connection = connection or _get_connection()
+    pipe = connection.pipeline()
+    for name in HISTOGRAMS:
+        pipe.hgetall(_key(name))
+    histograms = {}
+    for name, fields in zip(HISTOGRAMS, pipe.execute()):
+        counts = {}
+        sums = {}
+        for field, value in fields.items():
+            field = field.decode() if isinstance(field, bytes) else field
+            prefix, bucket = field.rsplit('|', 1)
+            labels = tuple(json.loads(prefix))
+            if bucket == 'sum':
+                sums[labels] = float(value)
+            else:
+                counts.setdefault(labels, {})[bucket] = int(value)
+        histograms[name] = {}
+        for labels, bucket_counts in counts.items():
+            total = 0
+            buckets = []
+            for bound in [str(b) for b in BUCKETS] + [INF]:
+                total += bucket_counts.get(bound, 0)
+                buckets.append((bound, total))
+            histograms[name][labels] = (buckets, sums.get(labels, 0))
+    return histograms
+
+
+def get_queue_stats(queue_name='default'):
+    """Get the depth and lag of an rq queue.
+
+    The lag is the age of the oldest job waiting in the queue.  Returns
+    a dict of job counts by state, and the lag in seconds.
+    """
+
+    queue = django_rq.get_queue(queue_name)
+    counts = {
+        'queued': queue.count,
+        'started': queue.started_job_registry.count,
+        'deferred': queue.deferred_job_registry.count,
+        'failed': queue.failed_job_registry.count,
+    }
+    lag = 0
+    oldest = queue.get_jobs(0, 1)
+    if oldest and oldest[0].enqueued_at:
+        enqueued_at = oldest[0].enqueued_at.replace(tzinfo=utc)
+        lag = max(0, (datetime.now(utc) - enqueued_at).total_seconds())
+    return counts, lag
+
+
+def get_scheduler_stats(queue_name='default'):
+    """Get the rq-scheduler backlog.
+
+    The scheduled jobs are 'pending' until their time, 'due' until they
+    are RQ_SCHEDULER_GRACE seconds late, and 'overdue' after that (i.e.
+    the rqscheduler is not keeping up, or is not running).  The lag is
+    how late the oldest due job is.  Returns a dict of job counts by
+    state, and the lag in seconds.
+    """
+
+    scheduler = django_rq.get_scheduler(queue_name)
+    now = time.time()
+    scheduled = scheduler.connection.zcard(scheduler.scheduled_jobs_key)
+    due = scheduler.connection.zcount(
+        scheduler.scheduled_jobs_key, '-inf', now)
+    overdue = scheduler.connection.zcount(
+        scheduler.scheduled_jobs_key, '-inf',
+        now - settings.RQ_SCHEDULER_GRACE)
+    lag = 0
+    if due:
+        [(_, oldest)] = scheduler.connection.zrange(
+            scheduler.scheduled_jobs_key, 0, 0, withscores=True)
+        lag = now - oldest
+    counts = {
+        'pending': scheduled - due,
+        'due': due - overdue,
+        'overdue': overdue,
+    }
+    return counts, lag
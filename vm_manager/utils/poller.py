@@ -0,0 +1,271 @@
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import random
+
+import django_rq
+from redis.exceptions import LockError
+
+from django.conf import settings
+
+from vm_manager.constants import MISSING
+from vm_manager.models import WorkflowStep
+from vm_manager.utils.timing import StepTiming
+from vm_manager.utils.utils import get_nectar, list_all
+from vm_manager.utils.workflow import add_step, enqueue_step, \
+    encode, decode
+
+logger = logging.getLogger(__name__)
+
+utc = timezone.utc
+
+# The kinds of OpenStack resource that can be waited for
+SERVER = 'server'
+VOLUME = 'volume'
+BACKUP = 'backup'
+
+# The registry is a Redis hash of workflow step id -> wait
+WAITS_KEY = 'bumblebee:poller:waits'
+
+# Only the poller that holds this lock does a pass, so that a wait isn't
+# written back after another poller has dispatched it
+LOCK_KEY = 'bumblebee:poller:lock'
+
+# The random variation in the adaptive polling intervals
+JITTER = 0.2
+
+
+def _get_connection():
+    return django_rq.get_connection('default')
+
+
+def register_wait(kind, resource_id, func, /, *args, interval,
+                  targets=None, pending=None, deadline=None, retries=None,
+                  **kwargs):
+    """Register a wait for an OpenStack resource to change state.
+
+    Rather than each workflow polling OpenStack for its own resources,
+    the poller checks all registered waits in bulk.  Every 'interval'
+    seconds, the resource's status is checked, and func(*args, **kwargs)
+    is enqueued once the status is in 'targets' (or is no longer in
+    'pending'), the 'deadline' has passed or the 'retries' have run out.
+    A resource that is not found has the status MISSING.
+
+    If 'retries' is given, the number of retries remaining is passed
+    to the continuation as its 'retries' keyword argument.  As with the
+    old self-rescheduling polls, each check uses up one retry.
+
+    Otherwise, the wait is adaptive: the first check is after the
+    step's typical (p50) duration, and subsequent checks back off
+    exponentially from 'interval'.
+
+    The continuation is recorded as the next step of the current
+    workflow run, so the registry only holds the step id.
+    """
+
+    if (targets is None) == (pending is None):
+        raise ValueError("Exactly one of 'targets' or 'pending' is needed")
+    step = add_step(func, args, kwargs, deadline=deadline, wait={
+        'kind': kind,
+        'resource_id': str(resource_id),
+        'targets': sorted(targets) if targets is not None else None,
+        'pending': sorted(pending) if pending is not None else None,
+        'interval': interval,
+        'retries': retries,
+        'typical': None,
+    })
+    if retries is None:
+        step.wait['typical'] = StepTiming(
+            func, step.run.desktop_type, step.run.zone).percentile(50)
+        step.save()
+    arm_wait(step)
+    logger.debug(f"Registered wait for {kind} {resource_id} for {step}")
+    return step.id
+
+
+def arm_wait(step, connection=None):
+    """Add the wait for a workflow step to the registry.
+
+    This is also used to re-arm a wait that has been lost from Redis.
+    """
+
+    wait = dict(step.wait, step_id=step.id, deadline=step.deadline,
+                checks=0)
+    wait['next_check'] = Poller._next_check(wait, datetime.now(utc))
+    connection = connection or _get_connection()
+    connection.hset(WAITS_KEY, str(step.id), Poller._dump(wait))
+
+
+def _list_statuses(kind, page_size):
+    n = get_nectar()
+    if kind == SERVER:
+        # As for the reconciler, other environments' servers (in a shared
+        # project) are left out.  Volumes only get their environment
+        # metadata after they have been created, so they can't be.
+        resources = [
+            server for server in list_all(n.nova.servers.list, page_size,
+                                          detailed=True)
+            if server.metadata.get('environment')
+            == settings.ENVIRONMENT_NAME]
+    elif kind == VOLUME:
+        resources = list_all(n.cinder.volumes.list, page_size, detailed=True)
+    elif kind == BACKUP:
+        resources = list_all(n.cinder.backups.list, page_size, detailed=True)
+    else:
+        raise ValueError(f"Unknown resource kind {kind}")
+    return {resource.id: resource.status for resource in resources}
+
+
+class Poller(object):
+    """Resolves the registered waits.
+
+    Each pass makes one (paged) 'list' call for each kind of resource
+    that has waits that are due, rather than one 'get' call per wait.
+    Passes hold a lock in Redis, so if several pollers are running
+    (e.g. a looping one and one from cron), only one of them does a
+    pass at a time.  The lock expires after POLLER_LOCK_TIMEOUT seconds.
+    """
+
+    def __init__(self, connection=None, page_size=None):
+        self.connection = connection or _get_connection()
+        self.page_size = page_size or settings.RECONCILE_PAGE_SIZE
+        self.lock = self.connection.lock(
+            LOCK_KEY, timeout=settings.POLLER_LOCK_TIMEOUT,
+            thread_local=False)
+
+    def run(self):
+        """Do one polling pass, and return the counts.
+
+        If another poller is doing a pass, this one is skipped, and
+        None is returned.
+        """
+
+        if not self.lock.acquire(blocking=False):
+            logger.debug("Another poller is polling")
+            return None
+        try:
+            return self._poll()
+        finally:
+            try:
+                self.lock.release()
+            except LockError as e:
+                logger.warning(f"Poller lock release failed: {e}")
+
+    def _poll(self):
+        now = datetime.now(utc)
+        due = {}
+        for wait_id, data in self.connection.hgetall(WAITS_KEY).items():
+            wait = self._load(data)
+            if wait['next_check'] <= now:
+                due[wait_id] = wait
+        counts = {'dispatched': 0, 'waiting': 0}
+        if not due:
+            return counts
+
+        statuses = {}
+        for kind in {wait['kind'] for wait in due.values()}:
+            try:
+                statuses[kind] = _list_statuses(kind, self.page_size)
+            except Exception:
+                # Retry on the next pass
+                logger.exception(f"Listing {kind}s failed")
+
+        # The listing may have been slow, so the lock is renewed (or
+        # the pass is abandoned) before any waits are written back
+        try:
+            self.lock.reacquire()
+        except LockError as e:
+            logger.warning(f"Poller lock lost: {e}")
+            return None
+
+        queue = django_rq.get_queue('default')
+        for wait_id, wait in due.items():
+            if wait['kind'] in statuses:
+                status = statuses[wait['kind']].get(
+                    wait['resource_id'], MISSING)
+            else:
+                status = None
+            if self._is_resolved(wait, status, now):
+                # Only dispatch if we are the one that removed the wait
+                if self.connection.hdel(WAITS_KEY, wait_id):
+                    self._dispatch(queue, wait,
+                                   now if self._is_reached(wait, status)
+                                   else None)
+                    counts['dispatched'] += 1
+            else:
+                if status is not None:
+                    wait['checks'] += 1
+                    if wait['retries'] is not None:
+                        wait['retries'] -= 1
+                wait['next_check'] = self._next_check(wait, now)
+                self.connection.hset(WAITS_KEY, wait_id, self._dump(wait))
+                counts['waiting'] += 1
+        logger.debug(f"Polling counts: {counts}")
+        return counts
+
+    @staticmethod
+    def _dump(wait):
+        return json.dumps(encode(wait))
+
+    @staticmethod
+    def _load(data):
+        return decode(json.loads(data))
+
+    @staticmethod
+    def _next_check(wait, now):
+        """When the wait should next be checked.
+
+        Waits with retries are checked every 'interval' seconds, since
+        the retries are counted in checks.  Adaptive waits are first
+        checked after the typical duration, then back off exponentially
+        (with jitter) up to POLL_MAX_INTERVAL, but not past the deadline.
+        """
+
+        interval = wait['interval']
+        if wait['retries'] is None:
+            if wait['checks'] == 0 and wait['typical']:
+                interval = max(interval, wait['typical'])
+            else:
+                interval = min(
+                    interval * 2 ** max(wait['checks'] - 1, 0),
+                    max(interval, settings.POLL_MAX_INTERVAL))
+            interval *= random.uniform(1 - JITTER, 1 + JITTER)
+        next_check = now + timedelta(seconds=interval)
+        if wait['deadline'] and wait['deadline'] < next_check:
+            return wait['deadline']
+        return next_check
+
+    @staticmethod
+    def _is_reached(wait, status):
+        if status is None:
+            return False
+        if wait['targets'] is not None:
+            return status in wait['targets']
+        return status not in wait['pending']
+
+    @classmethod
+    def _is_resolved(cls, wait, status, now):
+        if wait['deadline'] and now > wait['deadline']:
+            return True
+        if status is None:
+            # We don't know the status, so this check doesn't count
+            return False
+        if wait['retries'] is not None and wait['retries'] <= 0:
+            return True
+        return cls._is_reached(wait, status)
+
+    @staticmethod
+    def _dispatch(queue, wait, reached):
+        try:
+            step = WorkflowStep.objects.get(pk=wait['step_id'])
+        except WorkflowStep.DoesNotExist:
+            logger.error(f"Workflow step {wait['step_id']} has gone")
+            return
+        # Record when the state was reached, for the step timings
+        step.reached = reached
+        kwargs = {}
+        if wait['retries'] is not None:
+            kwargs['retries'] = wait['retries']
+        logger.debug(f"Dispatching {step} for "
+                     f"{wait['kind']} {wait['resource_id']}")
+        enqueue_step(step, queue=queue, **kwargs)
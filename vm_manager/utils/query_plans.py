@@ -0,0 +1,249 @@
+from datetime import datetime, timezone
+import inspect
+import ipaddress
+import logging
+import re
+import uuid
+
+from django.db import connection
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext
+
+from researcher_desktop.models import DesktopType
+from researcher_workspace.models import Feature, User
+from vm_manager.constants import NO_VM, VM_OKAY
+from vm_manager.models import Instance, InstanceManager, Resize, \
+    ResizeExpiration, ResizeManager, ResourceExpiration, VMStatus, \
+    VMStatusManager, Volume, VolumeManager
+
+logger = logging.getLogger(__name__)
+
+utc = timezone.utc
+
+# The managers whose methods are checked
+MANAGERS = [VolumeManager, InstanceManager, ResizeManager, VMStatusManager]
+
+# The tables that are small enough that scanning them is fine
+SMALL_TABLES = {DesktopType._meta.db_table, Feature._meta.db_table}
+
+SEEDED_MODELS = [User, ResourceExpiration, ResizeExpiration, Volume,
+                 Instance, Resize, VMStatus]
+
+SEED_PREFIX = 'query-plans-'
+# The databases whose query plans plan_problems can read
+SUPPORTED_VENDORS = ('sqlite', 'mysql', 'postgresql')
+
+
+def _next_id(model):
+    # The ids are set explicitly, because bulk_create doesn't return
+    # them on every database
+    return (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+
+
+def seed(users, batch_size=1000):
+    """Create a dataset for checking the query plans.
+
+    Each of the 'users' has a volume, a deleted and a live instance, a
+    resize and a VMStatus for each instance, plus one with no instance.
+    Returns the user in the middle of the dataset.
+    """
+
+    desktop_types = list(DesktopType.objects.select_related('feature'))
+    now = datetime.now(utc)
+    for start in range(0, users, batch_size):
+        numbers = range(start, min(start + batch_size, users))
+        user_id = _next_id(User)
+        expiration_id = _next_id(ResourceExpiration)
+        resize_expiration_id = _next_id(ResizeExpiration)
+        new_users = [User(id=user_id + i, username=f"{SEED_PREFIX}{n}",
+                          email=f"{SEED_PREFIX}{n}@example.com")
+                     for i, n in enumerate(numbers)]
+        User.objects.bulk_create(new_users)
+        ResourceExpiration.objects.bulk_create([
+            ResourceExpiration(id=expiration_id + i, expires=now,
+                               stage_date=now)
+            for i in range(2 * len(new_users))])
+        ResizeExpiration.objects.bulk_create([
+            ResizeExpiration(id=resize_expiration_id + i, expires=now,
+                             stage_date=now)
+            for i in range(len(new_users))])
+
+        volumes = []
+        instances = []
+        resizes = []
+        vm_statuses = []
+        for i, (n, user) in enumerate(zip(numbers, new_users)):
+            desktop_type = desktop_types[n % len(desktop_types)]
+            volume = Volume(
+                id=uuid.uuid4(), user=user, image='seed',
+                operating_system=desktop_type.id, flavor=uuid.uuid4(),
+                requesting_feature=desktop_type.feature, zone='seed',
+                expiration_id=expiration_id + 2 * i)
+            deleted = Instance(
+                id=uuid.uuid4(), user=user, boot_volume=volume,
+                username='seed', password='seed', deleted=now)
+            live = Instance(
+                id=uuid.uuid4(), user=user, boot_volume=volume,
+                username='seed', password='seed',
+                ip_address=str(ipaddress.ip_address(0x0a000000 + n)),
+                expiration_id=expiration_id + 2 * i + 1)
+            volumes.append(volume)
+            instances.extend([deleted, live])
+            resizes.append(Resize(
+                instance=live,
+                expiration_id=resize_expiration_id + i))
+            vm_statuses.extend([
+                VMStatus(user=user, requesting_feature=desktop_type.feature,
+                         operating_system=desktop_type.id, instance=instance,
+                         status=status)
+                for instance, status in [(None, NO_VM), (deleted, NO_VM),
+                                         (live, VM_OKAY)]])
+        Volume.objects.bulk_create(volumes)
+        Instance.objects.bulk_create(instances)
+        Resize.objects.bulk_create(resizes)
+        VMStatus.objects.bulk_create(vm_statuses)
+    return User.objects.get(username=f"{SEED_PREFIX}{users // 2}")
+
+
+def analyze():
+    "Update the database's statistics, so the planner sees the dataset"
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            tables = ", ".join(connection.ops.quote_name(
+                model._meta.db_table) for model in SEEDED_MODELS)
+            cursor.execute(f"ANALYZE TABLE {tables}")
+            cursor.fetchall()
+        else:
+            cursor.execute("ANALYZE")
+
+
+def manager_methods():
+    """The public methods of the MANAGERS, as 'Manager.method' names."""
+
+    return [f"{manager.__name__}.{name}" for manager in MANAGERS
+            for name, value in vars(manager).items()
+            if inspect.isfunction(value) and not name.startswith('_')]
+
+
+def _cases(user):
+    # A call of each manager method for the user
+    volume = Volume.objects.get(user=user)
+    instance = Instance.objects.get(user=user, deleted=None)
+    desktop_type = DesktopType.objects.get(id=volume.operating_system)
+    feature = desktop_type.feature
+    return {
+        'VolumeManager.get_volume':
+            lambda: Volume.objects.get_volume(user, desktop_type),
+        'InstanceManager.live_instances':
+            lambda: list(Instance.objects.live_instances(user)),
+        'InstanceManager.get_live_instances':
+            lambda: Instance.objects.get_live_instances(user, desktop_type),
+        'InstanceManager.count_live_instances':
+            lambda: Instance.objects.count_live_instances(user),
+        'InstanceManager.get_instance':
+            lambda: Instance.objects.get_instance(user, desktop_type),
+        'InstanceManager.get_latest_instance_for_volume':
+            lambda: Instance.objects.get_latest_instance_for_volume(volume),
+        'InstanceManager.get_instance_by_ip_address':
+            lambda: Instance.objects.get_instance_by_ip_address(
+                instance.ip_address, feature),
+        'InstanceManager.get_instance_by_untrusted_vm_id':
+            lambda: Instance.objects.get_instance_by_untrusted_vm_id(
+                instance.id, user, feature),
+        'InstanceManager.get_instance_by_untrusted_vm_id_2':
+            lambda: Instance.objects.get_instance_by_untrusted_vm_id_2(
+                instance.id, feature),
+        'ResizeManager.get_latest_resize':
+            lambda: Resize.objects.get_latest_resize(instance),
+        'VMStatusManager.get_latest_vm_status':
+            lambda: VMStatus.objects.get_latest_vm_status(
+                user, desktop_type),
+        'VMStatusManager.get_latest_vm_statuses':
+            lambda: VMStatus.objects.get_latest_vm_statuses(
+                user, [desktop_type]),
+        'VMStatusManager.get_vm_status_by_instance':
+            lambda: VMStatus.objects.get_vm_status_by_instance(
+                instance, feature),
+        'VMStatusManager.get_vm_status_by_volume':
+            lambda: VMStatus.objects.get_vm_status_by_volume(
+                volume, feature),
+        'VMStatusManager.get_vm_status_by_untrusted_vm_id':
+            lambda: VMStatus.objects.get_vm_status_by_untrusted_vm_id(
+                instance.id, user, feature),
+    }
+
+
+def explain(sql, params=None):
+    "The database's query plan for 'sql', as a list of dicts"
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}",
+                       params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def plan_problems(plan):
+    """The ways in which a query plan falls back to brute force.
+
+    That is, full scans of tables other than the SMALL_TABLES (full
+    index scans count, as they are no better for a large table), and
+    sorts (which an index in the right order would avoid).  Returns a
+    list of descriptions.
+    """
+
+    if connection.vendor == 'sqlite':
+        scans = [row['detail'].split()[1] for row in plan
+                 if row['detail'].startswith('SCAN ')
+                 and not row['detail'].startswith('SCAN CONSTANT ROW')]
+        sorts = [row for row in plan if 'TEMP B-TREE' in row['detail']]
+    elif connection.vendor == 'mysql':
+        scans = [row['table'] for row in plan
+                 if row['type'] in ('ALL', 'index')]
+        sorts = [row for row in plan
+                 if 'filesort' in (row['Extra'] or '')]
+    elif connection.vendor == 'postgresql':
+        scans = [match.group(1) for row in plan
+                 for match in [re.search(r'Seq Scan on (\S+)',
+                                         row['QUERY PLAN'])] if match]
+        sorts = [row for row in plan
+                 if re.search(r'\bSort\s+\(', row['QUERY PLAN'])]
+    else:
+        raise NotImplementedError(
+            f"Can't read {connection.vendor} query plans")
+    return ([f"full scan of {table}" for table in scans
+             if table not in SMALL_TABLES]
+            + ["sort"] * len(sorts))
+
+
+def check_query_plans(user):
+    """Run each manager method for a seeded user, and EXPLAIN its queries.
+
+    Returns a dict of 'Manager.method' name to a list of (sql, plan,
+    problems), with an entry for each of its queries.  The
+    methods that have no case here, or whose call failed, map to None.
+    """
+
+    cases = _cases(user)
+    results = {}
+    for name in manager_methods():
+        if name not in cases:
+            logger.error(f"There is no query plan check for {name}")
+            results[name] = None
+
+    for name, call in cases.items():
+        with CaptureQueriesContext(connection) as queries:
+            try:
+                call()
+            except Exception:
+                logger.exception(f"Query plan check for {name} failed")
+                results[name] = None
+                continue
+        results[name] = []
+        for query in queries.captured_queries:
+            if not query['sql'].lstrip().upper().startswith('SELECT'):
+                continue
+            plan = explain(query['sql'])
+            results[name].append((query['sql'], plan, plan_problems(plan)))
+    return results
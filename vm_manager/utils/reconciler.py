@@ -0,0 +1,77 @@
+from collections import defaultdict
+from datetime import datetime, timezone
+import logging
+
+from django.conf import settings
+
+from vm_manager.constants import MISSING
+from vm_manager.models import Instance, Volume
+from vm_manager.utils.utils import get_nectar, list_all
+
+logger = logging.getLogger(__name__)
+
+utc = timezone.utc
+
+
+class Reconciler(object):
+    """Records the observed OpenStack status of our Instances and Volumes.
+
+    Each pass lists all of the servers and volumes for this environment
+    (a handful of paged calls rather than one call per resource) and
+    writes their statuses to 'observed_status' / 'observed_at'.  Live
+    resources that are not listed are recorded as MISSING.
+    """
+
+    def __init__(self, page_size=None):
+        self.page_size = page_size or settings.RECONCILE_PAGE_SIZE
+
+    def run(self):
+        """Do one reconciliation pass, and return the counts."""
+
+        n = get_nectar()
+        started = datetime.now(utc)
+        counts = {}
+
+        servers = list_all(n.nova.servers.list, self.page_size,
+                           detailed=True)
+        statuses = {server.id: server.status for server in servers
+                    if (server.metadata.get('environment')
+                        == settings.ENVIRONMENT_NAME)}
+        counts['instances'] = self._record(Instance, statuses, started)
+
+        volumes = list_all(
+            n.cinder.volumes.list, self.page_size, detailed=True,
+            search_opts={
+                'metadata': {'environment': settings.ENVIRONMENT_NAME}})
+        statuses = {volume.id: volume.status for volume in volumes}
+        counts['volumes'] = self._record(Volume, statuses, started)
+
+        logger.info(f"Reconciliation counts: {counts}")
+        return counts
+
+    @staticmethod
+    def _record(model, statuses, started):
+        """Write the observed statuses for one kind of resource.
+
+        Updates are grouped by status, so this is one UPDATE per distinct
+        status rather than one per resource.  Only resources created
+        before the pass started can be considered MISSING; anything newer
+        may have been created after it was (not) listed.
+        """
+
+        live = model.objects.filter(deleted=None)
+        by_status = defaultdict(list)
+        seen = set()
+        for id in live.values_list('id', flat=True):
+            # Nova and Cinder return ids in the dashed form
+            status = statuses.get(str(id))
+            if status:
+                by_status[status].append(id)
+                seen.add(id)
+
+        for status, ids in by_status.items():
+            model.objects.filter(id__in=ids).update(
+                observed_status=status, observed_at=started)
+        missing = live.filter(created__lt=started).exclude(id__in=seen) \
+                      .update(observed_status=MISSING, observed_at=started)
+        return {'observed': len(seen), 'missing': missing}
@@ -0,0 +1,49 @@
+import logging
+
+from rq.job import Job
+
+from vm_manager.models import WorkflowRun
+from vm_manager.utils.poller import WAITS_KEY, arm_wait, _get_connection
+from vm_manager.utils.workflow import enqueue_step
+
+logger = logging.getLogger(__name__)
+
+
+def recover_runs(connection=None):
+    """Re-arm the unfinished workflow runs whose current step is lost.
+
+    A waiting step is lost if its wait is missing from the poller's
+    registry, and a queued step is lost if its rq job is missing; e.g.
+    after Redis has been restarted without its data.  Steps that were
+    started but never finished are counted as 'stalled' but are not
+    rerun, since the steps are not idempotent.
+    """
+
+    connection = connection or _get_connection()
+    counts = {'running': 0, 'stalled': 0, 'rearmed': 0, 'requeued': 0}
+    for run in WorkflowRun.objects.filter(finished=None):
+        step = run.current_step()
+        if not step:
+            continue
+        if step.started:
+            if step.job_id and Job.exists(step.job_id, connection):
+                counts['running'] += 1
+            else:
+                logger.warning(f"{step} started but did not finish")
+                counts['stalled'] += 1
+        elif step.job_id:
+            if Job.exists(step.job_id, connection):
+                counts['running'] += 1
+            else:
+                logger.info(f"Requeuing {step}")
+                enqueue_step(step)
+                counts['requeued'] += 1
+        elif step.wait:
+            if connection.hget(WAITS_KEY, str(step.id)) is not None:
+                counts['running'] += 1
+            else:
+                logger.info(f"Re-arming the wait for {step}")
+                arm_wait(step, connection=connection)
+                counts['rearmed'] += 1
+    logger.info(f"Workflow recovery counts: {counts}")
+    return counts
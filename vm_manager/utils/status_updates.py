@@ -0,0 +1,171 @@
+from datetime import datetime, timezone
+import json
+import logging
+import time
+
+import django_rq
+from redis.exceptions import RedisError
+
+from django.conf import settings
+
+from vm_manager.constants import VM_WAITING
+
+logger = logging.getLogger(__name__)
+
+utc = timezone.utc
+
+# Each user's desktop type has a version counter, which is bumped (and
+# published on a channel of the same name) whenever its VMStatus changes.
+# A summary of the VMStatus is kept alongside it.
+STATUS_KEY_PREFIX = 'bumblebee:vm_status'
+
+# How long an idle version counter and summary are kept in Redis
+VERSION_TTL = 30 * 24 * 60 * 60
+
+# The VMStatus fields that the progress bar uses
+STATUS_FIELDS = ('status', 'status_progress', 'status_message')
+
+
+def _get_connection():
+    return django_rq.get_connection('default')
+
+
+def _status_key(user_id, desktop_type_id):
+    return f"{STATUS_KEY_PREFIX}:{user_id}:{desktop_type_id}"
+
+
+def _summary_key(user_id, desktop_type_id):
+    return f"{_status_key(user_id, desktop_type_id)}:summary"
+
+
+def summarize(vm_status):
+    """Get the fields of a VMStatus that the progress bar uses."""
+
+    summary = {field: getattr(vm_status, field) for field in STATUS_FIELDS}
+    summary['wait_time'] = (vm_status.wait_time.timestamp()
+                            if vm_status.wait_time else None)
+    return summary
+
+
+def is_timed_out(summary):
+    """Has the workflow in the summary run past its wait time?
+
+    The wait time is left in place once the workflow is done, so it only
+    counts while the status is VM_WAITING.
+    """
+
+    return bool(summary['status'] == VM_WAITING
+                and summary['wait_time']
+                and summary['wait_time'] <= datetime.now(utc).timestamp())
+
+
+def is_changed(summary, vm_status):
+    """Do the fields that the progress bar shows differ?"""
+
+    return any(summary[field] != getattr(vm_status, field)
+               for field in STATUS_FIELDS)
+
+
+def publish_status(vm_status, connection=None):
+    """Tell the browsers that are waiting that a VMStatus has changed.
+
+    The version and the summary are updated together, so that a reader
+    never sees a summary with the wrong version.  Returns the new
+    version, or None if Redis is unavailable (in which case the browsers
+    fall back to polling).
+    """
+
+    key = _status_key(vm_status.user_id, vm_status.operating_system)
+    try:
+        connection = connection or _get_connection()
+        pipe = connection.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, VERSION_TTL)
+        pipe.set(_summary_key(vm_status.user_id, vm_status.operating_system),
+                 json.dumps(summarize(vm_status)), ex=VERSION_TTL)
+        version = pipe.execute()[0]
+        connection.publish(key, version)
+    except RedisError as e:
+        logger.warning(f"Publishing a change to {vm_status} failed: {e}")
+        return None
+    logger.debug(f"Published version {version} of {vm_status}")
+    return version
+
+
+def store_summary(vm_status, connection=None):
+    """Store the summary of a VMStatus, without a new version.
+
+    This fills in a missing or stale summary when the browsers have
+    nothing new to show, so they aren't woken and their ETags stay
+    valid.  Returns the current version (starting one, if there isn't
+    one), or None if Redis is unavailable.
+    """
+
+    key = _status_key(vm_status.user_id, vm_status.operating_system)
+    try:
+        connection = connection or _get_connection()
+        pipe = connection.pipeline()
+        pipe.set(key, 1, nx=True)
+        pipe.expire(key, VERSION_TTL)
+        pipe.set(_summary_key(vm_status.user_id, vm_status.operating_system),
+                 json.dumps(summarize(vm_status)), ex=VERSION_TTL)
+        pipe.get(key)
+        version = int(pipe.execute()[-1])
+    except RedisError as e:
+        logger.warning(f"Storing the summary of {vm_status} failed: {e}")
+        return None
+    return version
+
+
+def get_version(user_id, desktop_type_id, connection=None):
+    """Get the current version of a user's status for a desktop type."""
+
+    connection = connection or _get_connection()
+    return int(connection.get(_status_key(user_id, desktop_type_id)) or 0)
+
+
+def get_status(user_id, desktop_type_id, connection=None):
+    """Get the version and summary of a user's status for a desktop type.
+
+    The summary is None if there isn't one in Redis.
+    Raises RedisError if Redis is unavailable.
+    """
+
+    connection = connection or _get_connection()
+    version, summary = connection.mget(
+        _status_key(user_id, desktop_type_id),
+        _summary_key(user_id, desktop_type_id))
+    if version is None or summary is None:
+        return None, None
+    return int(version), json.loads(summary)
+
+
+def wait_for_change(user_id, desktop_type_id, version, timeout=None,
+                    connection=None):
+    """Wait until the status version differs from 'version'.
+
+    Returns the current version as soon as it differs, or after
+    'timeout' seconds (STATUS_WAIT_TIMEOUT by default) if it doesn't.
+    Raises RedisError if Redis is unavailable.
+    """
+
+    if timeout is None:
+        timeout = settings.STATUS_WAIT_TIMEOUT
+    connection = connection or _get_connection()
+    pubsub = connection.pubsub(ignore_subscribe_messages=True)
+    try:
+        # Subscribe before checking the version, so that a change in
+        # between is not missed
+        pubsub.subscribe(_status_key(user_id, desktop_type_id))
+        current = get_version(user_id, desktop_type_id, connection)
+        deadline = time.monotonic() + timeout
+        while current == version:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            message = pubsub.get_message(timeout=remaining)
+            if message:
+                current = int(message['data'])
+        return current
+    finally:
+        pubsub.close()
@@ -0,0 +1,62 @@
+import logging
+import math
+
+from django.conf import settings
+
+from vm_manager.models import WorkflowStep
+from vm_manager.utils.workflow import func_path
+
+logger = logging.getLogger(__name__)
+
+
+class StepTiming(object):
+    """The observed durations of a workflow wait step.
+
+    A step's duration is the time from when its wait was registered
+    until the poller saw the resource reach the state being waited for.
+    The samples are for the same desktop type and zone if there are
+    enough of them, falling back to the desktop type, then to all runs.
+    """
+
+    def __init__(self, func, desktop_type=None, zone=None):
+        self.samples = []
+        for dt, az in ((desktop_type, zone), (desktop_type, None),
+                       (None, None)):
+            samples = self._durations(func, dt, az)
+            if len(samples) >= settings.STEP_TIMING_MIN_SAMPLES:
+                self.samples = samples
+                break
+
+    @staticmethod
+    def _durations(func, desktop_type, zone):
+        steps = WorkflowStep.objects.filter(func=func_path(func),
+                                            reached__isnull=False)
+        if desktop_type:
+            steps = steps.filter(run__desktop_type=desktop_type)
+        if zone:
+            steps = steps.filter(run__zone=zone)
+        times = steps.order_by('-reached') \
+                     .values_list('created', 'reached')[
+                         :settings.STEP_TIMING_SAMPLES]
+        return sorted((reached - created).total_seconds()
+                      for created, reached in times)
+
+    def percentile(self, percent):
+        "The nearest-rank percentile, or None if there are too few samples"
+
+        if not self.samples:
+            return None
+        rank = math.ceil(percent / 100 * len(self.samples))
+        return self.samples[max(rank, 1) - 1]
+
+    def timeout(self, maximum):
+        """The timeout for the step in seconds.
+
+        This is the p99 duration with a safety margin, but no more than
+        'maximum' (the configured timeout).
+        """
+
+        p99 = self.percentile(99)
+        if p99 is None:
+            return maximum
+        return min(maximum, math.ceil(p99 * settings.STEP_TIMEOUT_MARGIN))
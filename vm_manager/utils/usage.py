@@ -0,0 +1,129 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone
+import logging
+
+from django.db import DatabaseError, transaction
+from django.db.models import Count, Max, Min, Q
+from django.db.models.functions import Coalesce
+
+from vm_manager.models import DailyUsage, Instance, Resize
+
+logger = logging.getLogger(__name__)
+
+utc = timezone.utc
+
+# The DailyUsage counters that each kind of event adds to
+CREATED = 'created'
+DELETED = 'deleted'
+ERRORED = 'errored'
+BOOSTED = 'boosted'
+REVERTED = 'reverted'
+
+OS = 'boot_volume__operating_system'
+ZONE = 'boot_volume__zone'
+
+
+def _day_start(day):
+    return datetime.combine(day, time.min, tzinfo=utc)
+
+
+def _key(os, zone):
+    # A volume with no zone is rolled up with the zone '', so that its
+    # rows are unique
+    return (os, zone or '')
+
+
+def _resizes():
+    # A resize ends when it is reverted, or when its instance is deleted
+    return Resize.objects.annotate(
+        ended=Coalesce('reverted', 'instance__deleted'))
+
+
+def update_daily_usage(since=None):
+    """Bring the DailyUsage rollup up to date.
+
+    The rows from 'since' to today are recomputed.  By default, that
+    is from the last day that was rolled up (as it may have been rolled
+    up part way through), or from the first instance if there are no
+    rows yet.  Returns the number of rows written, or None if the
+    rollup failed (e.g. because another process was doing it).
+    """
+
+    if since is None:
+        since = DailyUsage.objects.aggregate(Max('date'))['date__max']
+    if since is None:
+        first = Instance.objects.aggregate(Min('created'))['created__min']
+        if first is None:
+            return 0
+        since = first.astimezone(utc).date()
+    start = _day_start(since)
+
+    # The numbers live at the start, by desktop type and zone
+    instances = defaultdict(int)
+    for os, zone, count in Instance.objects \
+            .filter(created__lt=start) \
+            .filter(Q(deleted=None) | Q(deleted__gte=start)) \
+            .values_list(OS, ZONE).annotate(Count('id')).order_by():
+        instances[_key(os, zone)] += count
+    boosts = defaultdict(int)
+    for os, zone, count in _resizes() \
+            .filter(requested__lt=start) \
+            .filter(Q(ended=None) | Q(ended__gte=start)) \
+            .values_list(f"instance__{OS}", f"instance__{ZONE}") \
+            .annotate(Count('id')).order_by():
+        boosts[_key(os, zone)] += count
+
+    # The events since the start, by desktop type and zone
+    events = defaultdict(list)
+    for kind, field in [(CREATED, 'created'), (DELETED, 'deleted'),
+                        (ERRORED, 'error_flag')]:
+        for os, zone, when in Instance.objects \
+                .filter(**{f"{field}__gte": start}) \
+                .values_list(OS, ZONE, field):
+            events[_key(os, zone)].append((when, kind))
+    for kind, field in [(BOOSTED, 'requested'), (REVERTED, 'ended')]:
+        for os, zone, when in _resizes() \
+                .filter(**{f"{field}__gte": start}) \
+                .values_list(f"instance__{OS}", f"instance__{ZONE}", field):
+            events[_key(os, zone)].append((when, kind))
+
+    last = max([datetime.now(utc)]
+               + [when for group in events.values() for when, _ in group])
+    days = (last.astimezone(utc).date() - since).days + 1
+
+    rows = []
+    for key in set(instances) | set(boosts) | set(events):
+        group = sorted(events[key], key=lambda event: event[0], reverse=True)
+        for day in (since + timedelta(days=n) for n in range(days)):
+            usage = DailyUsage(date=day, operating_system=key[0],
+                               zone=key[1], instances=instances[key],
+                               peak=instances[key], boosts=boosts[key])
+            end = _day_start(day + timedelta(days=1))
+            while group and group[-1][0] < end:
+                _, kind = group.pop()
+                setattr(usage, kind, getattr(usage, kind) + 1)
+                if kind == CREATED:
+                    usage.instances += 1
+                    usage.peak = max(usage.peak, usage.instances)
+                elif kind == DELETED:
+                    usage.instances -= 1
+                elif kind == BOOSTED:
+                    usage.boosts += 1
+                elif kind == REVERTED:
+                    usage.boosts -= 1
+            instances[key] = usage.instances
+            boosts[key] = usage.boosts
+            if (usage.instances or usage.boosts or usage.created
+                    or usage.deleted or usage.errored or usage.reverted):
+                rows.append(usage)
+
+    try:
+        with transaction.atomic():
+            DailyUsage.objects.filter(date__gte=since).delete()
+            DailyUsage.objects.bulk_create(rows, batch_size=1000)
+    except DatabaseError as e:
+        logger.warning(f"Rolling up the daily usage since {since} "
+                       f"failed: {e}")
+        return None
+    logger.debug(f"Rolled up {len(rows)} days of usage since {since}")
+    return len(rows)
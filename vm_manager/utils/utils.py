@@ -1,19 +1,139 @@
 from datetime import datetime, timedelta, timezone
+import json
+import logging
+import threading
 
 from cinderclient import client as cinder_client
+import django_rq
 from glanceclient import client as glance_client
+from keystoneauth1 import access
 from keystoneauth1.identity.v3 import ApplicationCredential
 from keystoneauth1 import session
 from keystoneclient import client as keystone_client
 from nectarallocationclient import client as allocation_client
 from novaclient import client as nova_client
+from redis.exceptions import RedisError
+import requests
 from taynacclient import client as taynac_client
 
 from django.conf import settings
 from django.utils.crypto import get_random_string
 
+logger = logging.getLogger(__name__)
+
 utc = timezone.utc
 
+# The cached keystone tokens, by application credential id
+TOKEN_KEY_PREFIX = 'bumblebee:keystone:token'
+
+_nectar_lock = threading.Lock()
+
+# The number of OpenStack API calls made by each thread
+_openstack_calls = threading.local()
+
+
+class CachedApplicationCredential(ApplicationCredential):
+    """An application credential whose token is shared via Redis.
+
+    Rather than every process authenticating separately, a process
+    reuses the token that another process has cached, until the token
+    is about to expire.  If Keystone rejects the token (e.g. because it
+    has been revoked), it is dropped from the cache, and a new one is
+    fetched.  If Redis is unavailable, this just behaves like an
+    ApplicationCredential.
+    """
+
+    # The last token that was invalidated, which is never reused
+    _rejected_token = None
+
+    def _token_key(self):
+        method = self.auth_methods[0]
+        return f"{TOKEN_KEY_PREFIX}:{method.application_credential_id}"
+
+    def get_auth_ref(self, session, **kwargs):
+        auth_ref = self._load_token()
+        if auth_ref and auth_ref.auth_token != self._rejected_token \
+                and not auth_ref.will_expire_soon(
+                    self.MIN_TOKEN_LIFE_SECONDS):
+            return auth_ref
+        auth_ref = super().get_auth_ref(session, **kwargs)
+        self._save_token(auth_ref)
+        return auth_ref
+
+    def invalidate(self):
+        # This is called when a request gets a 401, so the token is
+        # dropped from the cache (unless another process has already
+        # replaced it)
+        if not self.auth_ref:
+            return False
+        self._rejected_token = self.auth_ref.auth_token
+        cached = self._load_token()
+        if cached and cached.auth_token == self._rejected_token:
+            try:
+                django_rq.get_connection('default').delete(
+                    self._token_key())
+            except RedisError as e:
+                logger.warning(f"Cannot drop the cached token: {e}")
+        return super().invalidate()
+
+    def _load_token(self):
+        try:
+            data = django_rq.get_connection('default').get(self._token_key())
+        except RedisError as e:
+            logger.warning(f"Cannot get the cached token: {e}")
+            return None
+        if not data:
+            return None
+        data = json.loads(data)
+        return access.create(body=data['body'],
+                             auth_token=data['auth_token'])
+
+    def _save_token(self, auth_ref):
+        ttl = int((auth_ref.expires - datetime.now(utc)).total_seconds()
+                  - self.MIN_TOKEN_LIFE_SECONDS)
+        if ttl <= 0:
+            return
+        # This is the same as get_auth_state(), for the new token
+        data = json.dumps({'auth_token': auth_ref.auth_token,
+                           'body': auth_ref._data})
+        try:
+            django_rq.get_connection('default').set(
+                self._token_key(), data, ex=ttl)
+        except RedisError as e:
+            logger.warning(f"Cannot cache the token: {e}")
+
+
+def _count_openstack_call(response, *args, **kwargs):
+    _openstack_calls.count = get_openstack_call_count() + 1
+
+
+def get_openstack_call_count():
+    """Get the number of OpenStack API calls this thread has made."""
+
+    return getattr(_openstack_calls, 'count', 0)
+
+
+class NectarClient(object):
+    """A Nectar client attribute that is built on first use."""
+
+    def __init__(self, build):
+        self.build = build
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, nectar, owner=None):
+        if nectar is None:
+            return self
+        client = nectar.__dict__.get(self.name)
+        if client is None:
+            with nectar._lock:
+                client = nectar.__dict__.get(self.name)
+                if client is None:
+                    client = self.build(nectar.session)
+                    nectar.__dict__[self.name] = client
+        return client
+
 
 class Nectar(object):
     """Nectar
@@ -22,12 +142,16 @@ class Nectar(object):
     authentication and includes some custom methods for complex
     queries.
 
+    The clients share one keystoneauth session, and each client is only
+    built when it is first used.  Nothing authenticates until then.
+
     :Attributes:
         * **nova** - :class:`novaclient.client.Client`
         * **allocation** - `nectarallocationclient v1`_
         * **keystone** - :class:`keystoneclient.client.Client`
         * **glance** - :class:`glanceclient.client.Client`
         * **cinder** - :class:`cinderclient.client.Client`
+        * **taynac** - :class:`taynacclient.client.Client`
         * **roles** - A list of roles (names) scoped to the authenticated
           user and project.
 
@@ -35,30 +159,58 @@ class Nectar(object):
               loading environment variables.
     """
 
+    nova = NectarClient(
+        lambda sess: nova_client.Client('2', session=sess))
+    allocation = NectarClient(
+        lambda sess: allocation_client.Client('1', session=sess))
+    keystone = NectarClient(
+        lambda sess: keystone_client.Client('3', session=sess))
+    glance = NectarClient(
+        lambda sess: glance_client.Client('2', session=sess))
+    cinder = NectarClient(
+        lambda sess: cinder_client.Client('3', session=sess))
+    taynac = NectarClient(
+        lambda sess: taynac_client.Client('1', session=sess))
+
     def __init__(self):
-        auth = ApplicationCredential(
+        self._lock = threading.RLock()
+        self.auth = CachedApplicationCredential(
             auth_url=settings.OS_AUTH_URL,
             application_credential_secret=(
                 settings.OS_APPLICATION_CREDENTIAL_SECRET),
             application_credential_id=settings.OS_APPLICATION_CREDENTIAL_ID)
-        sess = session.Session(auth=auth)
 
-        # Roles
-        auth_ref = auth.get_auth_ref(sess)
-        self.roles = auth_ref.role_names
+        # The clients' HTTP connections are pooled, per host
+        http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_maxsize=settings.OS_CONNECTION_POOL_SIZE)
+        http.mount('https://', adapter)
+        http.mount('http://', adapter)
+        http.hooks['response'].append(_count_openstack_call)
+        self.session = session.Session(auth=self.auth, session=http)
+
+    @property
+    def roles(self):
+        return self.auth.get_access(self.session).role_names
+
+
+def list_all(list_func, page_size, **kwargs):
+    """Iterate over an OpenStack 'list' call, one page at a time."""
 
-        # Establish clients
-        self.nova = nova_client.Client('2', session=sess)
-        self.allocation = allocation_client.Client('1', session=sess)
-        self.keystone = keystone_client.Client('3', session=sess)
-        self.glance = glance_client.Client('2', session=sess)
-        self.cinder = cinder_client.Client('3', session=sess)
-        self.taynac = taynac_client.Client('1', session=sess)
+    marker = None
+    while True:
+        page = list_func(marker=marker, limit=page_size, **kwargs)
+        yield from page
+        if len(page) < page_size:
+            return
+        marker = page[-1].id
 
 
 def get_nectar():
     if not hasattr(get_nectar, 'nectar'):
-        get_nectar.nectar = Nectar()
+        with _nectar_lock:
+            if not hasattr(get_nectar, 'nectar'):
+                get_nectar.nectar = Nectar()
     return get_nectar.nectar
 
 
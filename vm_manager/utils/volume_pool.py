@@ -0,0 +1,156 @@
+from datetime import datetime, timezone
+import logging
+
+import cinderclient
+
+from django.conf import settings
+
+from researcher_desktop.models import DesktopType
+from researcher_desktop.utils.utils import get_applicable_zones
+from vm_manager.constants import VOLUME_AVAILABLE
+from vm_manager.models import PooledVolume
+from vm_manager.utils.utils import get_nectar
+from vm_manager.vm_functions.create_vm import _get_source_volume
+
+logger = logging.getLogger(__name__)
+
+utc = timezone.utc
+
+# Cinder volume statuses that mean that a pooled volume is unusable
+POOL_FAILED_STATUSES = frozenset(['error', 'error_restoring',
+                                  'error_extending'])
+
+
+def pool_volume_name(desktop_type, zone):
+    return f"pool-{desktop_type.id}-{zone.name}"
+
+
+class VolumePool(object):
+    """Keeps the pools of pre-cloned volumes topped up.
+
+    For each enabled desktop type with a 'pool_size', and each of its
+    availability zones, this:
+     - recycles the pooled volumes that were cloned from a source volume
+       other than the current one (e.g. because a newer 'nectar_build'
+       has been published) or that have the wrong size,
+     - marks the pooled volumes that Cinder reports as available as
+       ready to be claimed, and discards the ones that failed,
+     - clones new volumes until the pool is 'pool_size' volumes.
+    Pooled volumes for desktop types or zones that no longer have a pool
+    are recycled.
+
+    In dry-run mode, the volumes are counted but nothing is changed.
+    """
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+
+    def run(self):
+        counts = {'ready': 0, 'pending': 0, 'created': 0,
+                  'recycled': 0, 'failed': 0, 'skipped': 0}
+        pooled_ids = set()
+        for desktop_type in DesktopType.objects.filter(
+                enabled=True, pool_size__gt=0):
+            for zone in get_applicable_zones(desktop_type):
+                pooled_ids.update(
+                    self.refill(desktop_type, zone, counts))
+        for pooled in PooledVolume.objects.exclude(pk__in=pooled_ids):
+            self._recycle(pooled, counts)
+        logger.info(f"Volume pool counts: {counts}")
+        return counts
+
+    def refill(self, desktop_type, zone, counts):
+        """Refill the pool for a desktop type in a zone.
+
+        Returns the ids of the volumes in the pool.
+        """
+
+        try:
+            source = _get_source_volume(desktop_type, zone, refresh=True)
+        except RuntimeWarning:
+            # Already logged.  Leave the pool as it is.
+            counts['skipped'] += 1
+            return set(PooledVolume.objects.filter(
+                operating_system=desktop_type.id,
+                zone=zone.name).values_list('id', flat=True))
+
+        pool = []
+        for pooled in PooledVolume.objects.filter(
+                operating_system=desktop_type.id,
+                zone=zone.name).order_by('created'):
+            if (pooled.image != source.id
+                    or pooled.size != desktop_type.volume_size
+                    or len(pool) >= desktop_type.pool_size):
+                self._recycle(pooled, counts)
+            elif pooled.ready or self._check(pooled, counts):
+                pool.append(pooled)
+
+        counts['ready'] += len([p for p in pool if p.ready])
+        counts['pending'] += len([p for p in pool if not p.ready])
+        for _ in range(desktop_type.pool_size - len(pool)):
+            pooled = self._create(desktop_type, zone, source)
+            if pooled:
+                pool.append(pooled)
+            counts['created'] += 1
+        return {pooled.id for pooled in pool}
+
+    def _check(self, pooled, counts):
+        "Check if a pending pooled volume is ready, or has failed"
+
+        n = get_nectar()
+        try:
+            status = n.cinder.volumes.get(pooled.id).status
+        except cinderclient.exceptions.NotFound:
+            logger.error(f"Cinder volume missing for {pooled}")
+            status = None
+        if status == VOLUME_AVAILABLE:
+            pooled.ready = datetime.now(utc)
+            if not self.dry_run:
+                pooled.save()
+            return True
+        if status is None or status in POOL_FAILED_STATUSES:
+            logger.error(f"Discarding {pooled} with status {status}")
+            counts['failed'] += 1
+            self._delete(pooled, status is not None)
+            return False
+        return True
+
+    def _recycle(self, pooled, counts):
+        logger.info(f"Recycling {pooled}")
+        counts['recycled'] += 1
+        self._delete(pooled, True)
+
+    def _delete(self, pooled, delete_volume):
+        if self.dry_run:
+            return
+        # Delete the pool record first, so that it can't be claimed
+        if not PooledVolume.objects.filter(pk=pooled.pk).delete()[0]:
+            # A launch claimed it in the meantime
+            return
+        if delete_volume:
+            n = get_nectar()
+            try:
+                n.cinder.volumes.delete(pooled.id)
+            except cinderclient.exceptions.NotFound:
+                pass
+
+    def _create(self, desktop_type, zone, source):
+        if self.dry_run:
+            return None
+        n = get_nectar()
+        volume = n.cinder.volumes.create(
+            source_volid=source.id,
+            size=desktop_type.volume_size,
+            name=pool_volume_name(desktop_type, zone),
+            metadata={'readonly': 'False',
+                      'desktop': desktop_type.id,
+                      'environment': settings.ENVIRONMENT_NAME},
+            availability_zone=zone.name)
+        n.cinder.volumes.set_bootable(volume=volume, flag=True)
+        pooled = PooledVolume.objects.create(
+            id=volume.id, operating_system=desktop_type.id,
+            zone=zone.name, image=source.id,
+            build=int(source.metadata.get('nectar_build', 0)),
+            size=desktop_type.volume_size)
+        logger.info(f"Created {pooled}")
+        return pooled
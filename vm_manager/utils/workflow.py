@@ -0,0 +1,201 @@
+from datetime import datetime, timezone
+import importlib
+import logging
+import threading
+import uuid
+
+import django_rq
+
+from django.apps import apps
+from django.db import models
+
+from vm_manager.constants import WF_SUCCESS, WF_CONTINUE, WF_RETRY, WF_FAIL
+from vm_manager.models import WorkflowRun, WorkflowStep
+from vm_manager.utils import job_metrics
+
+logger = logging.getLogger(__name__)
+
+utc = timezone.utc
+
+WF_OUTCOMES = frozenset([WF_SUCCESS, WF_CONTINUE, WF_RETRY, WF_FAIL])
+
+# The step that this thread is currently running
+_local = threading.local()
+
+
+def encode(value):
+    """Encode a workflow function argument as JSON-compatible data.
+
+    Model instances are encoded as references, so that the step
+    gets the current row from the database rather than a stale copy.
+    """
+
+    if isinstance(value, models.Model):
+        return {'__model__': value._meta.label_lower, 'pk': str(value.pk)}
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, uuid.UUID):
+        return {'__uuid__': str(value)}
+    if isinstance(value, (set, frozenset)):
+        return {'__set__': [encode(v) for v in value]}
+    if isinstance(value, dict):
+        return {'__dict__': {k: encode(v) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return [encode(v) for v in value]
+    if callable(value):
+        return {'__func__': func_path(value)}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"Cannot encode {value!r} as a workflow argument")
+
+
+def decode(value):
+    "The inverse of encode()"
+
+    if isinstance(value, list):
+        return [decode(v) for v in value]
+    if not isinstance(value, dict):
+        return value
+    if '__model__' in value:
+        model = apps.get_model(value['__model__'])
+        return model.objects.get(pk=value['pk'])
+    if '__datetime__' in value:
+        return datetime.fromisoformat(value['__datetime__'])
+    if '__uuid__' in value:
+        return uuid.UUID(value['__uuid__'])
+    if '__set__' in value:
+        return {decode(v) for v in value['__set__']}
+    if '__func__' in value:
+        return import_func(value['__func__'])
+    return {k: decode(v) for k, v in value['__dict__'].items()}
+
+
+def func_path(func):
+    return f"{func.__module__}.{func.__qualname__}"
+
+
+def import_func(path):
+    module, name = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module), name)
+
+
+def current_step():
+    return getattr(_local, 'step', None)
+
+
+def describe_run(desktop_type, zone):
+    """Record the desktop type and zone of the current workflow run.
+
+    These are used to look up the timings of the run's steps.
+    """
+
+    step = current_step()
+    if step and (step.run.desktop_type, step.run.zone) != (desktop_type,
+                                                           zone):
+        step.run.desktop_type = desktop_type
+        step.run.zone = zone
+        step.run.save()
+
+
+def add_step(func, args, kwargs, deadline=None, wait=None):
+    """Add the next step to the current workflow run.
+
+    If this isn't called from a workflow step, the step is the first
+    step of a new (unnamed) run.
+    """
+
+    step = current_step()
+    run = step.run if step else WorkflowRun.objects.create()
+    return _create_step(run, func, args, kwargs,
+                        deadline=deadline, wait=wait)
+
+
+def _create_step(run, func, args, kwargs, **fields):
+    return WorkflowStep.objects.create(
+        run=run, func=func_path(func), args=encode(list(args)),
+        kwargs=encode(kwargs), **fields)
+
+
+def start_workflow(kind, func, /, *args, **kwargs):
+    """Start a workflow run whose first step is func(*args, **kwargs).
+
+    The step is run by an rqworker.  The rq job carries just the run id.
+    """
+
+    run = WorkflowRun.objects.create(kind=kind)
+    step = _create_step(run, func, args, kwargs)
+    enqueue_step(step)
+    logger.info(f"Started {run}")
+    return run
+
+
+def run_workflow(kind, func, /, *args, **kwargs):
+    """Run the first step of a workflow run in this process.
+
+    This is for callers (such as the expirers) that need the outcome of
+    the first step.  Any subsequent steps are run by the rqworkers.
+    """
+
+    run = WorkflowRun.objects.create(kind=kind)
+    step = _create_step(run, func, args, kwargs)
+    return _run(step, func, args, kwargs)
+
+
+def enqueue_step(step, queue=None, **kwargs):
+    """Enqueue an rq job to run the step, updating its keyword arguments.
+
+    This is also used to resume a step whose job has been lost.
+    """
+
+    if kwargs:
+        step.kwargs['__dict__'].update(encode(kwargs)['__dict__'])
+    step.job_id = uuid.uuid4().hex
+    step.save()
+    queue = queue or django_rq.get_queue('default')
+    queue.enqueue_call(func=run_step, args=(step.run_id,),
+                       job_id=step.job_id)
+
+
+def run_step(run_id):
+    "The rq job function: run the current step of a workflow run"
+
+    run = WorkflowRun.objects.get(pk=run_id)
+    step = run.current_step()
+    if not step or step.started or run.finished:
+        logger.warning(f"Nothing to run for {run}")
+        return None
+    return _run(step, import_func(step.func),
+                decode(step.args), decode(step.kwargs))
+
+
+def _run(step, func, args, kwargs):
+    step.started = datetime.now(utc)
+    step.attempts += 1
+    step.save()
+    job_metrics.observe_step_started(step)
+    previous, _local.step = current_step(), step
+    try:
+        result = func(*args, **kwargs)
+    except Exception:
+        _finish(step, WF_FAIL)
+        raise
+    finally:
+        _local.step = previous
+    _finish(step, result)
+    return result
+
+
+def _finish(step, result):
+    now = datetime.now(utc)
+    step.finished = now
+    step.outcome = result if (isinstance(result, str)
+                              and result in WF_OUTCOMES) else None
+    step.save()
+    job_metrics.observe_step_finished(step)
+    # The run is finished unless the step added a next step
+    run = step.run
+    if not run.steps.filter(id__gt=step.id).exists():
+        run.finished = now
+        run.outcome = step.outcome
+        run.save()
+        logger.info(f"Finished {run}")
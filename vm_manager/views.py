@@ -3,16 +3,19 @@ import logging
 from math import ceil
 from operator import itemgetter
 
+from redis.exceptions import RedisError
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.humanize.templatetags.humanize import naturaltime
 from django.contrib import messages
 from django.forms.models import model_to_dict
-from django.http import Http404
+from django.http import Http404, HttpResponseRedirect
+from django.shortcuts import render
 from django.template import loader
+from django.urls import reverse
 from django.utils.html import format_html
 from django.views.decorators.csrf import csrf_exempt
-import django_rq
 
 from researcher_desktop.models import AvailabilityZone
 from researcher_desktop.utils.utils import get_desktop_type
@@ -23,17 +26,22 @@ from vm_manager.constants import VM_ERROR, VM_OKAY, VM_WAITING, \
     CLOUD_INIT_FINISHED, CLOUD_INIT_STARTED, \
     REBOOT_SOFT, REBOOT_HARD, SCRIPT_OKAY, \
     BOOST_BUTTON, EXTEND_BUTTON, EXTEND_BOOST_BUTTON, \
-    WF_SUCCESS, WF_RETRY
-from vm_manager.models import VMStatus, Instance, Resize, Volume, EXP_EXPIRING
+    WF_SUCCESS, WF_RETRY, WF_LAUNCH, WF_DELETE, WF_SHELVE, WF_REBOOT, \
+    WF_RESIZE
+from vm_manager.models import VMStatus, Instance, Resize, Volume, \
+    ReconciliationReport, EXP_EXPIRING
+from vm_manager.utils import db_check, job_metrics
 from vm_manager.utils.expiry import BoostExpiryPolicy, InstanceExpiryPolicy, \
     VolumeExpiryPolicy
+from vm_manager.utils.status_updates import STATUS_FIELDS, get_status, \
+    is_changed, is_timed_out, publish_status, store_summary, summarize, \
+    wait_for_change
 from vm_manager.utils.utils import after_time, generate_hostname
+from vm_manager.utils.workflow import start_workflow, run_workflow
 
 # These are needed, as they're consumed by researcher_workspace/views.py
 from vm_manager.vm_functions.admin_functionality import \
     vm_report_for_page, vm_report_for_csv  # noqa
-
-from vm_manager.vm_functions.admin_functionality import db_check
 from vm_manager.vm_functions.create_vm import launch_vm_worker, extend_instance
 from vm_manager.vm_functions.delete_vm import delete_vm_worker, \
     delete_volume_worker
@@ -71,9 +79,9 @@ def desktop_limit_check(user, desktop_type, log=False) -> str:
     # Policy on number of simultaneous desktops: one per user.  As it is
     # designed the UI shouldn't give the user the option of creating more
     # than one desktop.  This is to guard against accidents ...
-    existing = Instance.objects.get_live_instances(user, None)
+    existing = Instance.objects.count_live_instances(user)
     if existing:
-        message = f"User {user} already has {len(existing)} live desktops"
+        message = f"User {user} already has {existing} live desktops"
         if log:
             logger.error(message)
         return message
@@ -109,9 +117,8 @@ def launch_vm(user, desktop_type, zone) -> str:
         logger.error(error_message)
         return error_message
 
-    queue = django_rq.get_queue('default')
-    queue.enqueue(launch_vm_worker, user=user, desktop_type=desktop_type,
-                  zone=zone)
+    start_workflow(WF_LAUNCH, launch_vm_worker, user=user,
+                   desktop_type=desktop_type, zone=zone)
 
     return str(vm_status)
 
@@ -137,8 +144,7 @@ def delete_vm(user, vm_id, requesting_feature) -> str:
     vm_status.instance.set_marked_for_deletion()
     vm_status.instance.boot_volume.set_marked_for_deletion()
 
-    queue = django_rq.get_queue('default')
-    queue.enqueue(delete_vm_worker, vm_status.instance)
+    start_workflow(WF_DELETE, delete_vm_worker, vm_status.instance)
 
     return str(vm_status)
 
@@ -166,8 +172,7 @@ def shelve_vm(user, vm_id, requesting_feature) -> str:
     vm_status.save()
     vm_status.instance.set_marked_for_deletion()
 
-    queue = django_rq.get_queue('default')
-    queue.enqueue(shelve_vm_worker, vm_status.instance)
+    start_workflow(WF_SHELVE, shelve_vm_worker, vm_status.instance)
 
     return str(vm_status)
 
@@ -194,9 +199,8 @@ def unshelve_vm(user, desktop_type) -> str:
                          status_done="has been unshelved")
     vm_status.save()
 
-    queue = django_rq.get_queue('default')
-    queue.enqueue(unshelve_vm_worker, user=user, desktop_type=desktop_type,
-                  zone=zone)
+    start_workflow(WF_LAUNCH, unshelve_vm_worker, user=user,
+                   desktop_type=desktop_type, zone=zone)
 
     return str(vm_status)
 
@@ -219,7 +223,7 @@ def delete_shelved_vm(user, desktop_type) -> str:
     volume = Volume.objects.get_volume(user, desktop_type)
     if volume:
         logger.info(f"Deleting shelved volume {volume}")
-        delete_volume_worker(volume)
+        run_workflow(WF_DELETE, delete_volume_worker, volume)
     return str(vm_status)
 
 
@@ -244,9 +248,8 @@ def reboot_vm(user, vm_id, reboot_level, requesting_feature) -> str:
     vm_status.status_done = "has been rebooted"
     vm_status.save()
 
-    queue = django_rq.get_queue('default')
-    queue.enqueue(reboot_vm_worker, user, vm_id, reboot_level,
-                  target_status, requesting_feature)
+    start_workflow(WF_REBOOT, reboot_vm_worker, user, vm_id, reboot_level,
+                   target_status, requesting_feature)
 
     return str(vm_status)
 
@@ -272,9 +275,8 @@ def supersize_vm(user, vm_id, requesting_feature) -> str:
     vm_status.status_done = "has been boosted"
     vm_status.save()
 
-    queue = django_rq.get_queue('default')
-    queue.enqueue(supersize_vm_worker, instance=vm_status.instance,
-                  desktop_type=desktop_type)
+    start_workflow(WF_RESIZE, supersize_vm_worker,
+                   instance=vm_status.instance, desktop_type=desktop_type)
 
     return str(vm_status)
 
@@ -301,9 +303,8 @@ def downsize_vm(user, vm_id, requesting_feature) -> str:
     vm_status.status_done = "has been downsized"
     vm_status.save()
 
-    queue = django_rq.get_queue('default')
-    queue.enqueue(downsize_vm_worker, instance=vm_status.instance,
-                  desktop_type=desktop_type)
+    start_workflow(WF_RESIZE, downsize_vm_worker,
+                   instance=vm_status.instance, desktop_type=desktop_type)
 
     return str(vm_status)
 
@@ -412,9 +413,11 @@ def get_vm_state(vm_status, user, desktop_type):
             'extended_expiration': policy.new_expiry(instance)
         }, instance.id
 
-    if not instance.check_active_or_resize_statuses():
-        instance_status = instance.get_status()
-        instance.error(f"Error at OpenStack level. Status: {instance_status}")
+    # Confirm with Nova before flagging an error based on the snapshot
+    if not instance.check_active_or_resize_statuses() \
+       and not instance.check_active_or_resize_statuses(max_age=0):
+        instance.error("Error at OpenStack level. "
+                       f"Status: {instance.observed_status}")
         return VM_ERROR, "Error at OpenStack level", instance.id
 
     if vm_status.status == VM_SUPERSIZED:
@@ -432,7 +435,7 @@ def get_vm_state(vm_status, user, desktop_type):
     raise NotImplementedError
 
 
-def get_vm_status(user, desktop_type):
+def _check_vm_status(user, desktop_type):
     vm_status = VMStatus.objects.get_latest_vm_status(user, desktop_type)
     logger.debug(f"get_vm_status: {vm_status}")
     if vm_status.status == VM_WAITING:
@@ -450,12 +453,100 @@ def get_vm_status(user, desktop_type):
                     f"Instance is missing at timeout {vm_status.id}, "
                     f"{user}, {desktop_type}")
             logger.debug(f"get_vm_status: updated {vm_status}")
-    return model_to_dict(vm_status)
+    return vm_status
+
+
+def get_vm_status(user, desktop_type):
+    return model_to_dict(_check_vm_status(user, desktop_type))
+
+
+def get_vm_status_summary(user, desktop_type_id):
+    """Get the version, and the fields that the progress bar uses, of
+    the user's latest VMStatus for a desktop type.
+
+    These normally come from the summary in Redis.  The database is only
+    used if the summary is missing, or the workflow has timed out.  The
+    version is None if Redis is unavailable.
+    """
+
+    try:
+        version, summary = get_status(user.id, desktop_type_id)
+    except RedisError as e:
+        logger.warning(f"get_vm_status_summary: Redis failed: {e}")
+        return None, model_to_dict(
+            _check_vm_status(user, get_desktop_type(desktop_type_id)),
+            fields=STATUS_FIELDS)
+    if summary is None or is_timed_out(summary):
+        vm_status = _check_vm_status(
+            user, get_desktop_type(desktop_type_id))
+        version = _refresh_summary(user, desktop_type_id, vm_status)
+        summary = summarize(vm_status)
+    return version, {field: summary[field] for field in STATUS_FIELDS}
+
+
+def _refresh_summary(user, desktop_type_id, vm_status):
+    # Fill in the summary for the next time.  Only a change that the
+    # browsers would show is a new version.  If _check_vm_status changed
+    # the VMStatus, the change has already been published by the signal,
+    # unless the transaction hasn't been committed yet.
+    try:
+        _, summary = get_status(user.id, desktop_type_id)
+    except RedisError as e:
+        logger.warning(f"get_vm_status_summary: Redis failed: {e}")
+        return None
+    if summary is None or not is_changed(summary, vm_status):
+        return store_summary(vm_status)
+    return publish_status(vm_status)
+
+
+def wait_vm_status(user, desktop_type_id, version):
+    """Wait for the VM status to change from 'version', then get it.
+
+    The result includes the new version, which is None if the wait
+    failed, in which case the browser falls back to polling.
+    """
+
+    try:
+        wait_for_change(user.id, desktop_type_id, version)
+    except RedisError as e:
+        logger.warning(f"wait_vm_status: waiting failed: {e}")
+    version, summary = get_vm_status_summary(user, desktop_type_id)
+    return dict(summary, version=version)
 
 
 def render_vm(request, user, desktop_type, buttons):
     vm_status = VMStatus.objects.get_latest_vm_status(user, desktop_type)
     state, what_to_show, vm_id = get_vm_state(vm_status, user, desktop_type)
+    return _render_vm(request, desktop_type, buttons, vm_status,
+                      state, what_to_show, vm_id)
+
+
+def render_vms(request, user, desktops):
+    """Render the modules for a user's desktops in one pass.
+
+    'desktops' is a list of (DesktopType, buttons).  The latest VMStatus
+    for each desktop type is fetched in one query.  Only the last active
+    desktop (i.e. the one that the home page shows) has its full module
+    rendered; the module is None for the others.  Returns a list of
+    (module, alt_module, script, state), as for render_vm.
+    """
+
+    vm_statuses = VMStatus.objects.get_latest_vm_statuses(
+        user, [desktop_type for desktop_type, _ in desktops])
+    states = []
+    for desktop_type, buttons in desktops:
+        vm_status = vm_statuses[desktop_type.id]
+        states.append((desktop_type, buttons, vm_status) + get_vm_state(
+            vm_status, user, desktop_type))
+    active = [i for i, (_, _, _, state, _, _) in enumerate(states)
+              if state != NO_VM]
+    return [_render_vm(request, *args,
+                       render_module=not active or i == active[-1])
+            for i, args in enumerate(states)]
+
+
+def _render_vm(request, desktop_type, buttons, vm_status, state,
+               what_to_show, vm_id, render_module=True):
     app_name = desktop_type.feature.app_name
 
     if state in [VM_SUPERSIZED, VM_OKAY, VM_SHELVED]:
@@ -499,8 +590,9 @@ def render_vm(request, user, desktop_type, buttons):
         "vm_status": vm_status
     }
 
-    vm_module = loader.render_to_string(
+    vm_module = (loader.render_to_string(
         f'vm_manager/html/{state}.html', context, request)
+        if render_module or state == NO_VM else None)
     script = loader.render_to_string(
         f'vm_manager/javascript/{state}.js', context, request)
     vm_alt_module = (vm_module if state == NO_VM else
@@ -537,6 +629,8 @@ def notify_vm(request, requesting_feature):
             vm_status.status_progress = 100
             vm_status.status_message = 'Instance ready'
             vm_status.save()
+            if vm_status.set_ready():
+                job_metrics.observe_ready(vm_status)
         elif msg == CLOUD_INIT_STARTED:
             volume.checked_in = True
             volume.save()
@@ -564,7 +658,7 @@ def phone_home(request, requesting_feature):
         instance, requesting_feature)
     if vm_status.status != VM_WAITING:
         if vm_status.status == VM_ERROR \
-           and instance.check_active_status():
+           and instance.check_active_status(max_age=0):
             logger.info(f"Handling a late phone_home event for {instance}")
         else:
             result = (f"Unexpected phone home for {instance}. "
@@ -587,6 +681,8 @@ def phone_home(request, requesting_feature):
     vm_status.status_message = 'Instance ready'
     vm_status.status = status
     vm_status.save()
+    if vm_status.set_ready():
+        job_metrics.observe_ready(vm_status)
     outcome = "success" if status in (VM_OKAY, VM_SUPERSIZED) else "failed"
     result = f"Phone home for {instance} - {outcome}!"
     logger.info(result)
@@ -623,4 +719,18 @@ def database_check(request):
     if not request.user.is_superuser:
         logger.error(f"Attempted db_check by non-admin user {request.user}")
         raise Http404()
-    return db_check(request)
+    if request.method == 'POST':
+        db_check.request_db_check(request.user,
+                                  repair='repair' in request.POST)
+        messages.info(request, "The database check has been started.")
+        return HttpResponseRedirect(reverse('vm_manager:db_check'))
+    reports = ReconciliationReport.objects.select_related(
+        'requested_by').order_by('-created')[:5]
+    report = reports[0] if reports else None
+    categories = [
+        (title, description, report.results.get(category, []))
+        for category, (title, description)
+        in db_check.CATEGORIES.items()] if report else []
+    return render(request, 'vm_manager/db_check.html',
+                  {'reports': reports, 'report': report,
+                   'categories': categories})
@@ -1,31 +1,27 @@
-from datetime import datetime, timezone
+from datetime import date, datetime, timedelta, timezone
 import logging
-from operator import itemgetter
-from uuid import UUID
 
 from django.conf import settings
 from django.contrib import messages
 from django.core.mail import mail_managers
-from django.db.models import Count
-from django.db.models.functions import TruncDay
+from django.db.models import Sum
 from django.http import HttpResponse, Http404
-from django.shortcuts import render
 
 import cinderclient
-import django_rq
 import novaclient
 
-from guacamole.models import GuacamoleConnection
 from researcher_desktop.models import DesktopType
 from researcher_workspace.utils import offset_month_and_year
 from vm_manager.constants import VM_DELETED, VM_WAITING, \
     VM_ERROR, VM_OKAY, VM_MISSING, VM_SUPERSIZED, NO_VM, VM_SHELVED,  \
-    VOLUME_AVAILABLE, VOLUME_IN_USE, ACTIVE
-from vm_manager.models import Instance, Resize, Volume, VMStatus
+    VOLUME_AVAILABLE, VOLUME_IN_USE, ACTIVE, \
+    WF_DELETE, WF_ARCHIVE, WF_SHELVE, WF_RESIZE
+from vm_manager.models import DailyUsage, Instance, Resize, VMStatus
 from vm_manager.utils.Check_ResearchDesktop_Availability import \
     check_availability
 from vm_manager.utils.expiry import VolumeExpiryPolicy
 from vm_manager.utils.utils import after_time, get_nectar
+from vm_manager.utils.workflow import start_workflow, run_workflow
 from vm_manager.vm_functions.delete_vm import \
     delete_vm_worker, delete_volume, archive_volume_worker
 from vm_manager.vm_functions.resize_vm import downsize_vm_worker
@@ -45,6 +41,11 @@ def test_function(request):
 
 
 class _Reporter(object):
+    """Logs the repair messages, and shows them to the admin user.
+
+    The request is None when the repairs are done by an rq job (see
+    vm_manager.utils.db_check), so they are just logged.
+    """
 
     def __init__(self, request):
         self.request = request
@@ -53,17 +54,20 @@ class _Reporter(object):
 
     def error(self, message):
         logger.error(message)
-        messages.error(self.request, message, extra_tags='error')
+        if self.request:
+            messages.error(self.request, message, extra_tags='error')
         self.errors = True
 
     def repair(self, message):
         logger.info(message)
-        messages.info(self.request, message)
+        if self.request:
+            messages.info(self.request, message)
         self.repairs = True
 
     def info(self, message):
         logger.info(message)
-        messages.info(self.request, message)
+        if self.request:
+            messages.info(self.request, message)
 
 
 #
@@ -277,13 +281,12 @@ def admin_delete_instance_and_volume(request, instance):
     volume = instance.boot_volume
     if instance.deleted:
         volume.set_marked_for_deletion()
-        delete_volume(volume)
+        run_workflow(WF_DELETE, delete_volume, volume)
         logger.info(f"{request.user} admin deleted volume {volume.id}")
     else:
         instance.set_marked_for_deletion()
         volume.set_marked_for_deletion()
-        queue = django_rq.get_queue('default')
-        queue.enqueue(delete_vm_worker, instance)
+        start_workflow(WF_DELETE, delete_vm_worker, instance)
         logger.info(
             f"{request.user} admin deleting instance {instance.id} "
             f"and volume {volume.id}")
@@ -300,13 +303,13 @@ def admin_archive_instance_and_volume(request, instance):
     volume = instance.boot_volume
     if instance.deleted:
         volume.set_marked_for_deletion()
-        archive_volume_worker(volume, volume.requesting_feature)
+        run_workflow(WF_ARCHIVE, archive_volume_worker, volume,
+                     volume.requesting_feature)
         logger.info(f"{request.user} admin archived volume {volume.id}")
     else:
         instance.set_marked_for_deletion()
         volume.set_marked_for_deletion()
-        queue = django_rq.get_queue('default')
-        queue.enqueue(delete_vm_worker, instance, archive=True)
+        start_workflow(WF_ARCHIVE, delete_vm_worker, instance, archive=True)
         logger.info(
             f"{request.user} admin archiving instance {instance.id} "
             f"and volume {volume.id}")
@@ -321,7 +324,7 @@ def admin_delete_volume(request, volume):
         vm_status.save()
 
     volume.set_marked_for_deletion()
-    delete_volume(volume)
+    run_workflow(WF_DELETE, delete_volume, volume)
     logger.info(f"{request.user} admin deleted volume {volume.id}")
 
 
@@ -333,7 +336,8 @@ def admin_archive_volume(request, volume):
         vm_status.status = VM_DELETED
         vm_status.save()
 
-    archive_volume_worker(volume, volume.requesting_feature)
+    run_workflow(WF_ARCHIVE, archive_volume_worker, volume,
+                 volume.requesting_feature)
     logger.info(f"{request.user} admin archiving volume {volume.id}")
 
 
@@ -349,8 +353,7 @@ def admin_shelve_instance(request, instance):
         vm_status.save()
     instance.set_marked_for_deletion()
 
-    queue = django_rq.get_queue('default')
-    queue.enqueue(shelve_vm_worker, instance)
+    start_workflow(WF_SHELVE, shelve_vm_worker, instance)
 
     logger.info(f"{request.user} admin shelved vm {instance.id}")
 
@@ -369,62 +372,11 @@ def admin_downsize_resize(request, resize):
 
     desktop_type = DesktopType.objects.get_desktop_type(
         instance.boot_volume.operating_system)
-    queue = django_rq.get_queue('default')
-    queue.enqueue(downsize_vm_worker, instance, desktop_type)
+    start_workflow(WF_RESIZE, downsize_vm_worker, instance, desktop_type)
 
     logger.info(f"{request.user} admin downsizing vm {instance.id}")
 
 
-def db_check(request):
-    n = get_nectar()
-    nova_servers = n.nova.servers.list()
-    cinder_volumes = n.cinder.volumes.list()
-
-    db_deleted_instances = Instance.objects.exclude(deleted=None) \
-                                           .values_list('id', flat=True)
-    deleted_instances = [
-        (server.id, server.name, server.metadata.get('environment', ''))
-        for server in nova_servers
-            if UUID(server.id) in db_deleted_instances]
-
-    db_deleted_volumes = Volume.objects.exclude(deleted=None) \
-                                       .values_list('id', flat=True)
-    deleted_volumes = [
-        (volume.id, volume.name, volume.metadata.get('environment',
-                                                     volume.name[-1]))
-        for volume in cinder_volumes
-            if UUID(volume.id) in db_deleted_volumes]
-
-    db_instances = Instance.objects.filter(deleted=None) \
-                                   .values_list('id', flat=True)
-    missing_instances = [
-        (server.id, server.name, server.metadata.get('environment', ''))
-        for server in nova_servers if UUID(server.id) not in db_instances]
-
-    db_volumes = Volume.objects.filter(deleted=None) \
-                               .values_list('id', flat=True)
-    missing_volumes = [
-        (volume.id, volume.name, volume.metadata.get('environment',
-                                                     volume.name[-1]))
-        for volume in cinder_volumes if UUID(volume.id) not in db_volumes]
-
-    live_connections = set(
-        Instance.objects.filter(deleted=None, marked_for_deletion=None)
-        .values_list('guac_connection', flat=True))
-
-    orphaned_connections = [
-        (connection.connection_id, connection.connection_name)
-        for connection in GuacamoleConnection.objects.all()
-        if connection.connection_id not in live_connections]
-
-    return render(request, 'vm_manager/db_check.html',
-                  {'missing_instances': missing_instances,
-                   'missing_volumes': missing_volumes,
-                   'deleted_instances': deleted_instances,
-                   'deleted_volumes': deleted_volumes,
-                   'orphaned_connections': orphaned_connections})
-
-
 def _generate_weekly_availability_report():
     try:
         availability = check_availability()
@@ -436,55 +388,42 @@ def _generate_weekly_availability_report():
 
 def vm_report_for_csv(reporting_months, operating_systems):
     now = datetime.now(utc)
-    # A dict of zero values for the last year and this month so far
-    date_list = [
-        (offset_month_and_year(month_offset, now.month, now.year), 0)
-        for month_offset in range(reporting_months, 0, -1)]
-    start_date = datetime(day=1, month=date_list[0][0][0],
-                          year=date_list[0][0][1], tzinfo=utc)
-    empty_date_dict = dict(date_list)
-    results = []
-
-    # table of peak number of simultaneous vms of each OS
-    data_lists = [
-        [operating_system, empty_date_dict.copy()]
-        for operating_system in operating_systems]
-    for operating_system, instance_count in data_lists:
-        date_counts = _get_vm_info(operating_system)['vm_count']
-        for date_count in date_counts:
-            date_count["simple_date"] = (
-                date_count["date"].month, date_count["date"].year)
-        for date in instance_count:
-            date_counts_from_this_month = [
-                date_count["count"] for date_count in date_counts
-                if date_count["simple_date"] == date]
-            if date_counts_from_this_month:
-                instance_count[date] = max(date_counts_from_this_month)
-    results.append({"name": "Peak VMs per month", "values": data_lists})
-
-    # table of number of resizes per month
-    data_lists = [
-        [operating_system, empty_date_dict.copy()]
-        for operating_system in operating_systems]
-    for operating_system, resize_count in data_lists:
-        resizes = Resize.objects.filter(
-            instance__boot_volume__operating_system=operating_system,
-            requested__gte=start_date)
-        for resize in resizes:
-            resize.start = (resize.requested.month
-                            + 12 * resize.requested.year)
-            if resize.expired():
-                resize.end = resize.expired()
-            else:
-                resize.end = datetime.now(utc)
-            resize.end = resize.end.month + 12 * resize.end.year
-        for (month, year) in resize_count.keys():
-            resize_count_month = month + 12 * year
-            for resize in resizes:
-                if resize.start <= resize_count_month <= resize.end:
-                    resize_count[(month, year)] += 1
-    results.append({"name": "Boosts", "values": data_lists})
-    return results
+    months = [offset_month_and_year(month_offset, now.month, now.year)
+              for month_offset in range(reporting_months, 0, -1)]
+    start_date = date(day=1, month=months[0][0], year=months[0][1])
+    peak_lists = []
+    boost_lists = []
+
+    for operating_system in operating_systems:
+        # The daily totals over the zones, from the day before the
+        # first month (for the boosts that were live at its start).
+        # The sum of the zones' peaks is an upper bound on the peak.
+        days = DailyUsage.objects.filter(
+            operating_system=operating_system,
+            date__gte=start_date - timedelta(days=1)) \
+            .values('date') \
+            .annotate(peak=Sum('peak'), boosted=Sum('boosted'),
+                      boosts=Sum('boosts')) \
+            .order_by('date')
+        days = {day['date']: day for day in days}
+        peak_count = dict.fromkeys(months, 0)
+        boost_count = dict.fromkeys(months, 0)
+        for (month, year) in months:
+            first = date(day=1, month=month, year=year)
+            before = days.get(first - timedelta(days=1))
+            boost_count[(month, year)] = before['boosts'] if before else 0
+        for day in days.values():
+            key = (day['date'].month, day['date'].year)
+            if key in peak_count:
+                peak_count[key] = max(peak_count[key], day['peak'])
+                boost_count[key] += day['boosted']
+        peak_lists.append([operating_system, peak_count])
+        boost_lists.append([operating_system, boost_count])
+
+    # tables of peak number of simultaneous vms, and of number of
+    # resizes, of each OS per month
+    return [{"name": "Peak VMs per month", "values": peak_lists},
+            {"name": "Boosts", "values": boost_lists}]
 
 
 def vm_report_for_page(operating_system):
@@ -497,41 +436,16 @@ def vm_report_for_page(operating_system):
 
 
 def _get_vm_info(operating_system):
-    vms = Instance.objects.filter(
-        boot_volume__operating_system=operating_system).order_by('created')
-    error_dates = vms.filter(error_flag__isnull=False) \
-                     .order_by('error_flag') \
-                     .annotate(date=TruncDay('error_flag', tzinfo=utc)) \
-                     .values('date') \
-                     .annotate(errored_count=Count('id')) \
-                     .order_by('date')
-
-    deleted = [
-        {'date': vm.deleted, 'count': -1}
-        for vm in vms.order_by('deleted') if vm.deleted]
-    created = [{'date': vm.created, 'count': 1} for vm in vms]
-    # `sorted` uses timsort, which means that for sorting two concatenated
-    # sorted lists, it actually just merges the two lists in O(n)
-    vm_count = sorted(created + deleted, key=itemgetter('date'))
-    count = 0
-    for date_obj in vm_count:
-        count += date_obj['count']
-        date_obj['count'] = count
-
-    resizes = Resize.objects.filter(
-        instance__boot_volume__operating_system=operating_system)
-    resize_list = [
-        resize.expired() for resize in resizes if resize.expired()]
-    downsized = [
-        {'date': expiry, 'count': -1} for expiry in sorted(resize_list)]
-    supersized = [
-        {'date': resize.requested, 'count': 1} for resize in resizes]
-    resize_count = sorted(downsized + supersized, key=itemgetter('date'))
-    count = 0
-    for date_obj in resize_count:
-        count += date_obj['count']
-        date_obj['count'] = count
-
-    return {'vm_count': vm_count,
-            'error_dates': error_dates,
-            'resizes': resize_count}
+    days = DailyUsage.objects.filter(operating_system=operating_system) \
+        .values('date') \
+        .annotate(instances=Sum('instances'), boosts=Sum('boosts'),
+                  errored=Sum('errored')) \
+        .order_by('date')
+
+    return {'vm_count': [{'date': day['date'], 'count': day['instances']}
+                         for day in days],
+            'error_dates': [{'date': day['date'],
+                             'errored_count': day['errored']}
+                            for day in days if day['errored']],
+            'resizes': [{'date': day['date'], 'count': day['boosts']}
+                        for day in days]}
@@ -3,21 +3,25 @@ from datetime import datetime, timedelta, timezone
 import logging
 
 import cinderclient
-import django_rq
 
 from django.conf import settings
 from django.template.loader import render_to_string
 from django.urls import reverse
 
 from vm_manager.constants import NO_VM, VM_SHELVED, VOLUME_AVAILABLE, ACTIVE
+from vm_manager.utils.catalogue import cached, invalidate, SourceVolume, \
+    SOURCE_VOLUMES, NETWORKS
 from vm_manager.utils.expiry import InstanceExpiryPolicy
+from vm_manager.utils.poller import register_wait, SERVER, VOLUME
+from vm_manager.utils.timing import StepTiming
 from vm_manager.utils.utils import get_nectar, generate_server_name, \
     generate_hostname, generate_password
-from vm_manager.models import Instance, Volume, VMStatus
+from vm_manager.utils.workflow import describe_run
+from vm_manager.models import Instance, Volume, VMStatus, PooledVolume
 
 from researcher_desktop.models import AvailabilityZone
 
-from guacamole.models import GuacamoleConnection
+from guacamole.models import GuacamoleConnection, GuacamoleEntity
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +31,7 @@ utc = timezone.utc
 def launch_vm_worker(user, desktop_type, zone):
     desktop_id = desktop_type.id
     logger.info(f'Launching {desktop_id} VM for {user.username}')
+    describe_run(desktop_id, zone.name)
 
     instance = Instance.objects.get_instance(user, desktop_type)
     if instance:
@@ -39,10 +44,12 @@ def launch_vm_worker(user, desktop_type, zone):
 
     volume = _create_volume(user, desktop_type, zone)
     if volume:
-        scheduler = django_rq.get_scheduler('default')
-        scheduler.enqueue_in(timedelta(seconds=5), wait_to_create_instance,
-                             user, desktop_type, volume,
-                             datetime.now(utc))
+        if (volume.observed_status == VOLUME_AVAILABLE
+                and volume.observed_status_is_fresh()):
+            # E.g. a pooled volume, so there's no need to wait for it
+            _launch_instance(user, desktop_type, volume)
+        else:
+            _wait_for_volume(user, desktop_type, volume, datetime.now(utc))
         logger.info(f'{desktop_id} VM creation scheduled '
                     f'for {user.username}')
 
@@ -100,6 +107,10 @@ def _create_volume(user, desktop_type, zone):
     # Either there is no existing volume, or we have decided to ignore it
     # and make a new one for the user.
 
+    volume = _claim_pooled_volume(user, desktop_type, zone)
+    if volume:
+        return volume
+
     vm_status = VMStatus.objects.get_latest_vm_status(user, desktop_type)
     if vm_status:
         vm_status.status_progress = 15
@@ -110,12 +121,17 @@ def _create_volume(user, desktop_type, zone):
     source_volume_id = _get_source_volume_id(desktop_type, zone)
 
     n = get_nectar()
-    volume_result = n.cinder.volumes.create(
-        source_volid=source_volume_id,
-        size=desktop_type.volume_size,
-        name=name,
-        metadata={'readonly': 'False'},
-        availability_zone=zone.name)
+    try:
+        volume_result = n.cinder.volumes.create(
+            source_volid=source_volume_id,
+            size=desktop_type.volume_size,
+            name=name,
+            metadata={'readonly': 'False'},
+            availability_zone=zone.name)
+    except cinderclient.exceptions.ClientException:
+        # The cached source volume may have been deleted
+        invalidate(SOURCE_VOLUMES, _source_volume_key(desktop_type, zone))
+        raise
     n.cinder.volumes.set_bootable(volume=volume_result, flag=True)
 
     # Create record in DB
@@ -127,21 +143,91 @@ def _create_volume(user, desktop_type, zone):
         zone=zone.name,
         flavor=desktop_type.default_flavor.id)
     volume.save()
+    _set_volume_metadata(volume, user, desktop_type)
+    return volume
+
+
+def _claim_pooled_volume(user, desktop_type, zone):
+    """Claim a ready volume from the volume pool, if there is one.
+
+    The claim is made by deleting the pool record, so that a volume
+    can only be claimed by one launch.
+    """
+
+    candidates = PooledVolume.objects.filter(
+        operating_system=desktop_type.id, zone=zone.name,
+        size=desktop_type.volume_size, ready__isnull=False
+    ).order_by('created')
+    for pooled in candidates[:settings.VOLUME_POOL_CLAIM_ATTEMPTS]:
+        if PooledVolume.objects.filter(pk=pooled.pk).delete()[0]:
+            break
+    else:
+        return None
+
+    n = get_nectar()
+    name = generate_server_name(user.username, desktop_type.id)
+    try:
+        n.cinder.volumes.update(pooled.id, name=name)
+    except cinderclient.exceptions.ClientException as e:
+        # Put the volume back in the pool, so it isn't leaked.  It goes
+        # back as not ready, so that the refill job checks it with
+        # Cinder before it can be claimed again.  Then fall back to
+        # creating a new volume.
+        logger.error(f"Failed to claim {pooled}: {e}")
+        pooled.ready = None
+        pooled.save()
+        return None
+
+    volume = Volume(
+        id=pooled.id, user=user,
+        image=pooled.image,
+        requesting_feature=desktop_type.feature,
+        operating_system=desktop_type.id,
+        zone=zone.name,
+        flavor=desktop_type.default_flavor.id)
+    volume.save()
+    _set_volume_metadata(volume, user, desktop_type)
+    volume.set_observed_status(VOLUME_AVAILABLE)
+    logger.info(f"Claimed {pooled} for {user.username}")
+    return volume
 
+
+def _set_volume_metadata(volume, user, desktop_type):
     # Add the volume's hostname to the volume's metadata on openstack
+    n = get_nectar()
     n.cinder.volumes.set_metadata(
-        volume=volume_result,
+        volume=volume.id,
         metadata={
-            'hostname': generate_hostname(volume.hostname_id, desktop_id),
+            'hostname': generate_hostname(volume.hostname_id,
+                                          desktop_type.id),
             'user': user.email,
-            'desktop': desktop_id,
+            'desktop': desktop_type.id,
             'environment': settings.ENVIRONMENT_NAME,
-            'requesting_feature': requesting_feature.name,
+            'requesting_feature': desktop_type.feature.name,
         })
-    return volume
 
 
 def _get_source_volume_id(desktop_type, zone):
+    return _get_source_volume(desktop_type, zone).id
+
+
+def _get_source_volume(desktop_type, zone, refresh=False):
+    """Get the latest source volume for a desktop type in a zone.
+
+    The source volume is cached (see SOURCE_VOLUME_CACHE_TTL), unless
+    'refresh' is True.
+    """
+
+    return cached(SOURCE_VOLUMES, _source_volume_key(desktop_type, zone),
+                  lambda: _find_source_volume(desktop_type, zone),
+                  refresh=refresh)
+
+
+def _source_volume_key(desktop_type, zone):
+    return f"{desktop_type.image_name}:{zone.name}"
+
+
+def _find_source_volume(desktop_type, zone):
     n = get_nectar()
     res = n.cinder.volumes.list(
         search_opts={'name~': desktop_type.image_name,
@@ -168,10 +254,63 @@ def _get_source_volume_id(desktop_type, zone):
     match = matches[0]
     logger.debug(f"Found source volume: {match.name} ({match.id}) in "
                  f"availability zone {zone.name}")
-    return match.id
+    return SourceVolume(match)
+
+
+def _get_network_id(zone_name):
+    return cached(NETWORKS, zone_name,
+                  lambda: AvailabilityZone.objects.get(
+                      name=zone_name).network_id)
+
+
+def _wait_for_volume(user, desktop_type, volume, start_time, timeout=None):
+    if timeout is None:
+        timeout = StepTiming(
+            wait_to_create_instance, desktop_type.id, volume.zone
+        ).timeout(settings.VOLUME_CREATION_WAIT)
+    register_wait(
+        VOLUME, volume.id, wait_to_create_instance,
+        user, desktop_type, volume, start_time, timeout,
+        targets={VOLUME_AVAILABLE}, interval=settings.POLLER_INTERVAL,
+        deadline=start_time + timedelta(seconds=timeout))
+
+
+def _wait_for_instance(user, desktop_type, instance, start_time,
+                       timeout=None):
+    if timeout is None:
+        timeout = StepTiming(
+            wait_for_instance_active, desktop_type.id,
+            instance.boot_volume.zone
+        ).timeout(settings.INSTANCE_LAUNCH_WAIT)
+    register_wait(
+        SERVER, instance.id, wait_for_instance_active,
+        user, desktop_type, instance, start_time, timeout,
+        targets={ACTIVE}, interval=settings.POLLER_INTERVAL,
+        deadline=start_time + timedelta(seconds=timeout))
+
+
+def _launch_instance(user, desktop_type, volume):
+    instance = _create_instance(user, desktop_type, volume)
+    vm_status = VMStatus.objects.get_latest_vm_status(user, desktop_type)
+    vm_status.instance = instance
+    vm_status.status_progress = 30
+    if volume.shelved_at:
+        vm_status.status_message = 'Unshelving instance'
+    else:
+        vm_status.status_message = 'Volume created, launching instance'
+    vm_status.save()
+
+    volume.shelved_at = None
+    volume.expiry = None
+    volume.save()
+    logger.info(f'{desktop_type.name} VM creation initiated '
+                f'for {user.username}')
+    _wait_for_instance(user, desktop_type, instance, datetime.now(utc))
 
 
-def wait_to_create_instance(user, desktop_type, volume, start_time):
+def wait_to_create_instance(user, desktop_type, volume, start_time,
+                            timeout=None):
+    timeout = timeout or settings.VOLUME_CREATION_WAIT
     n = get_nectar()
     now = datetime.now(utc)
     openstack_volume = n.cinder.volumes.get(volume_id=volume.id)
@@ -179,27 +318,9 @@ def wait_to_create_instance(user, desktop_type, volume, start_time):
                 f"volume status is {openstack_volume.status}")
 
     if openstack_volume.status == VOLUME_AVAILABLE:
-        instance = _create_instance(user, desktop_type, volume)
-        vm_status = VMStatus.objects.get_latest_vm_status(user, desktop_type)
-        vm_status.instance = instance
-        vm_status.status_progress = 30
-        if volume.shelved_at:
-            vm_status.status_message = 'Unshelving instance'
-        else:
-            vm_status.status_message = 'Volume created, launching instance'
-        vm_status.save()
+        _launch_instance(user, desktop_type, volume)
 
-        volume.shelved_at = None
-        volume.expiry = None
-        volume.save()
-        logger.info(f'{desktop_type.name} VM creation initiated '
-                    f'for {user.username}')
-        scheduler = django_rq.get_scheduler('default')
-        scheduler.enqueue_in(timedelta(seconds=5), wait_for_instance_active,
-                             user, desktop_type, instance,
-                             datetime.now(utc))
-
-    elif (now - start_time > timedelta(seconds=settings.VOLUME_CREATION_WAIT)):
+    elif now - start_time > timedelta(seconds=timeout):
         logger.error(f"Volume took too long to create: user:{user} "
                      f"desktop_id:{desktop_type.id} volume:{volume} "
                      f"volume.status:{openstack_volume.status} "
@@ -215,9 +336,7 @@ def wait_to_create_instance(user, desktop_type, volume, start_time):
         raise TimeoutError(msg)
 
     else:
-        scheduler = django_rq.get_scheduler('default')
-        scheduler.enqueue_in(timedelta(seconds=5), wait_to_create_instance,
-                             user, desktop_type, volume, start_time)
+        _wait_for_volume(user, desktop_type, volume, start_time, timeout)
 
 
 def _create_instance(user, desktop_type, volume):
@@ -250,7 +369,7 @@ def _create_instance(user, desktop_type, volume):
     }]
 
     zone = volume.zone
-    network_id = AvailabilityZone.objects.get(name=zone).network_id
+    network_id = _get_network_id(zone)
     nics = [{'net-id': network_id}]
     family = desktop_type.family
 
@@ -308,9 +427,11 @@ def _create_instance(user, desktop_type, volume):
     return instance
 
 
-def wait_for_instance_active(user, desktop_type, instance, start_time):
+def wait_for_instance_active(user, desktop_type, instance, start_time,
+                             timeout=None):
+    timeout = timeout or settings.INSTANCE_LAUNCH_WAIT
     now = datetime.now(utc)
-    if instance.check_active_status():
+    if instance.check_active_status(max_age=0):
         logger.info(f"Instance {instance.id} is now {ACTIVE}")
         vm_status = VMStatus.objects.get_vm_status_by_instance(
             instance, desktop_type.feature)
@@ -319,10 +440,21 @@ def wait_for_instance_active(user, desktop_type, instance, start_time):
         vm_status.save()
         instance.set_expires(
             InstanceExpiryPolicy().initial_expiry(now=instance.created))
-    elif (now - start_time > timedelta(seconds=settings.INSTANCE_LAUNCH_WAIT)):
+        # Record the IP address now, so that the boot callbacks (which
+        # look the instance up by IP address) don't need to ask Nova
+        instance.get_ip_addr()
+        # Write the Guacamole connection parameters now that the instance
+        # has an IP address, rather than when the desktop is first shown
+        try:
+            instance.create_guac_connection()
+        except GuacamoleEntity.DoesNotExist:
+            logger.warning(f"No Guacamole entity for {user} yet; the "
+                           f"connection for {instance} will be written "
+                           "when it is first used")
+    elif now - start_time > timedelta(seconds=timeout):
         logger.error(f"Instance took too long to launch: user:{user} "
                      f"desktop:{desktop_type.id} instance:{instance} "
-                     f"instance.status:{instance.get_status()} "
+                     f"instance.status:{instance.observed_status} "
                      f"start_time:{start_time} "
                      f"datetime.now:{now}")
         msg = "Instance took too long to launch"
@@ -332,9 +464,8 @@ def wait_for_instance_active(user, desktop_type, instance, start_time):
         vm_status.save()
         instance.error(msg)
     else:
-        scheduler = django_rq.get_scheduler('default')
-        scheduler.enqueue_in(timedelta(seconds=5), wait_for_instance_active,
-                             user, desktop_type, instance, start_time)
+        _wait_for_instance(user, desktop_type, instance, start_time,
+                           timeout)
 
 
 # TODO(SC) - Analyse for possible race conditions with create/delete
@@ -2,18 +2,20 @@ from datetime import datetime, timedelta, timezone
 import logging
 
 import cinderclient
-import django_rq
 import novaclient
 
 from django.conf import settings
 
 from vm_manager.constants import ACTIVE, SHUTDOWN, NO_VM, VM_SHELVED, \
     VOLUME_AVAILABLE, BACKUP_CREATING, BACKUP_AVAILABLE, VM_WAITING, \
-    WF_RETRY, WF_SUCCESS, WF_FAIL, WF_CONTINUE
-from vm_manager.models import VMStatus, Expiration, \
+    MISSING, WF_RETRY, WF_SUCCESS, WF_FAIL, WF_CONTINUE
+from vm_manager.models import VMStatus, \
     EXP_EXPIRING, EXP_EXPIRY_COMPLETED, \
     EXP_EXPIRY_FAILED, EXP_EXPIRY_FAILED_RETRYABLE
+from vm_manager.utils.poller import register_wait, SERVER, VOLUME, BACKUP
+from vm_manager.utils.timing import StepTiming
 from vm_manager.utils.utils import get_nectar, after_time
+from vm_manager.utils.workflow import describe_run
 
 from guacamole.models import GuacamoleConnection
 
@@ -29,10 +31,14 @@ utc = timezone.utc
 
 def delete_vm_worker(instance, archive=False):
     logger.info(f"About to delete {instance}")
+    describe_run(instance.boot_volume.operating_system,
+                 instance.boot_volume.zone)
 
     if instance.guac_connection:
         GuacamoleConnection.objects.filter(instance=instance).delete()
         instance.guac_connection = None
+        instance.guac_url = None
+        instance.guac_inputs = None
         instance.save()
 
     n = get_nectar()
@@ -59,29 +65,31 @@ def delete_vm_worker(instance, archive=False):
 
     # Next step is to check if the Instance is Shutoff in Nova before
     # telling Nova to delete it
-    scheduler = django_rq.get_scheduler('default')
-    scheduler.enqueue_in(
-        timedelta(seconds=settings.INSTANCE_POLL_SHUTOFF_WAIT),
-        _check_instance_is_shutoff_and_delete, instance,
-        settings.INSTANCE_POLL_SHUTOFF_RETRIES,
+    wait_for_instance_shutoff(
+        instance, settings.INSTANCE_POLL_SHUTOFF_RETRIES,
         _dispose_volume_once_instance_is_deleted,
-        (instance, archive, settings.INSTANCE_POLL_DELETED_RETRIES))
+        {'instance': instance, 'archive': archive,
+         'retries': settings.INSTANCE_POLL_DELETED_RETRIES})
     return WF_CONTINUE
 
 
+def wait_for_instance_shutoff(instance, retries, func, func_kwargs):
+    register_wait(
+        SERVER, instance.id, _check_instance_is_shutoff_and_delete,
+        instance, targets={SHUTDOWN},
+        interval=settings.INSTANCE_POLL_SHUTOFF_WAIT, retries=retries,
+        func=func, func_kwargs=func_kwargs)
+
+
 def _check_instance_is_shutoff_and_delete(
-        instance, retries, func, func_args):
+        instance, retries, func, func_kwargs):
     logger.info(f"Checking whether {instance} is ShutOff.")
-    scheduler = django_rq.get_scheduler('default')
-    if not instance.check_shutdown_status() and retries > 0:
-        # If the instance is not Shutoff, schedule the recheck
+    if not instance.check_shutdown_status(max_age=0) and retries > 0:
+        # If the instance is not Shutoff, wait for the recheck
         logger.info(f"{instance} is not yet SHUTOFF! Will check again "
                     f"in {settings.INSTANCE_POLL_SHUTOFF_WAIT} seconds with "
                     f"{retries} retries remaining.")
-        scheduler.enqueue_in(
-            timedelta(seconds=settings.INSTANCE_POLL_SHUTOFF_WAIT),
-            _check_instance_is_shutoff_and_delete, instance,
-            retries - 1, func, func_args)
+        wait_for_instance_shutoff(instance, retries - 1, func, func_kwargs)
         return WF_CONTINUE
     if retries <= 0:
         logger.info(f"Ran out of retries shutting down {instance}. "
@@ -98,11 +106,11 @@ def _check_instance_is_shutoff_and_delete(
     if not delete_instance(instance):
         return WF_FAIL
 
-    # The 'func' will do the next step; e.g. delete the volume
-    # or mark the volume as shelved.
-    scheduler.enqueue_in(
-        timedelta(seconds=settings.INSTANCE_POLL_DELETED_WAIT),
-        func, *func_args)
+    # The 'func' will do the next step once the instance has gone;
+    # e.g. delete the volume or mark the volume as shelved.
+    register_wait(
+        SERVER, instance.id, func, targets={MISSING},
+        interval=settings.INSTANCE_POLL_DELETED_WAIT, **func_kwargs)
     return WF_CONTINUE
 
 
@@ -140,11 +148,8 @@ def _dispose_volume_once_instance_is_deleted(instance, archive, retries):
             logger.info(f"Instance {instance.id} successfully deleted. "
                         f"Proceeding to delete {volume} now!")
             if delete_volume(volume):
-                scheduler = django_rq.get_scheduler('default')
-                scheduler.enqueue_in(
-                    timedelta(seconds=settings.VOLUME_POLL_DELETED_WAIT),
-                    _wait_until_volume_is_deleted, volume,
-                    settings.VOLUME_POLL_DELETED_RETRIES)
+                _wait_for_volume_deletion(
+                    volume, settings.VOLUME_POLL_DELETED_RETRIES)
                 return WF_CONTINUE
             else:
                 return _end_delete(volume, WF_RETRY)
@@ -154,11 +159,11 @@ def _dispose_volume_once_instance_is_deleted(instance, archive, retries):
 
     # Nova still has the instance
     if retries > 0:
-        scheduler = django_rq.get_scheduler('default')
-        scheduler.enqueue_in(
-            timedelta(seconds=settings.INSTANCE_POLL_DELETED_WAIT),
-            _dispose_volume_once_instance_is_deleted, instance, archive,
-            retries - 1)
+        register_wait(
+            SERVER, instance.id, _dispose_volume_once_instance_is_deleted,
+            instance, archive, targets={MISSING},
+            interval=settings.INSTANCE_POLL_DELETED_WAIT,
+            retries=retries - 1)
         return WF_CONTINUE
     else:
         error_message = "Ran out of retries trying to delete"
@@ -190,6 +195,14 @@ def delete_volume(volume):
     return True
 
 
+def _wait_for_volume_deletion(volume, retries):
+    # Cinder volumes stay 'deleting' until they disappear
+    register_wait(
+        VOLUME, volume.id, _wait_until_volume_is_deleted, volume,
+        pending={'deleting'}, interval=settings.VOLUME_POLL_DELETED_WAIT,
+        retries=retries)
+
+
 def _wait_until_volume_is_deleted(volume, retries):
     n = get_nectar()
     try:
@@ -209,10 +222,7 @@ def _wait_until_volume_is_deleted(volume, retries):
         return _end_delete(volume, WF_RETRY)
 
     if retries > 0:
-        scheduler = django_rq.get_scheduler('default')
-        scheduler.enqueue_in(
-            timedelta(seconds=settings.VOLUME_POLL_DELETED_WAIT),
-            _wait_until_volume_is_deleted, volume, retries - 1)
+        _wait_for_volume_deletion(volume, retries - 1)
         return WF_CONTINUE
     else:
         error_message = "Ran out of retries trying to delete"
@@ -241,14 +251,17 @@ def delete_backup_worker(volume):
                          f"backup {volume.backup_id}")
         return WF_RETRY
 
-    scheduler = django_rq.get_scheduler('default')
-    scheduler.enqueue_in(
-        timedelta(seconds=settings.BACKUP_POLL_DELETED_WAIT),
-        _wait_until_backup_is_deleted, volume,
-        settings.BACKUP_POLL_DELETED_RETRIES)
+    _wait_for_backup_deletion(volume, settings.BACKUP_POLL_DELETED_RETRIES)
     return WF_CONTINUE
 
 
+def _wait_for_backup_deletion(volume, retries):
+    register_wait(
+        BACKUP, volume.backup_id, _wait_until_backup_is_deleted, volume,
+        targets={MISSING}, interval=settings.BACKUP_POLL_DELETED_WAIT,
+        retries=retries)
+
+
 def _wait_until_backup_is_deleted(volume, retries):
     n = get_nectar()
     try:
@@ -265,11 +278,7 @@ def _wait_until_backup_is_deleted(volume, retries):
         return _end_delete(volume, WF_RETRY)
 
     if retries > 0:
-        scheduler = django_rq.get_scheduler('default')
-        scheduler.enqueue_in(
-            timedelta(seconds=settings.BACKUP_POLL_DELETED_WAIT),
-            _wait_until_backup_is_deleted, volume,
-            retries - 1)
+        _wait_for_backup_deletion(volume, retries - 1)
         return WF_CONTINUE
     else:
         logger.info("Cinder backup deletion took too long for {volume}, "
@@ -281,7 +290,7 @@ def _end_delete(volume, wf_status):
     for expiration in [volume.expiration, volume.backup_expiration]:
         if not expiration:
             continue
-        expiration = Expiration.objects.get(pk=expiration.pk)
+        expiration = type(expiration).objects.get(pk=expiration.pk)
         if expiration.stage == EXP_EXPIRING:
             if wf_status == WF_FAIL:
                 expiration.stage = EXP_EXPIRY_FAILED
@@ -301,6 +310,7 @@ def archive_volume_worker(volume, requesting_feature):
     # another one to be created / launched without errors.
     volume.marked_for_deletion = datetime.now(utc)
     volume.save()
+    describe_run(volume.operating_system, volume.zone)
 
     n = get_nectar()
     try:
@@ -327,10 +337,10 @@ def archive_volume_worker(volume, requesting_feature):
             f"Cinder backup failed for volume {volume.id}: {e}")
         return _end_delete(volume, WF_RETRY)
 
-    scheduler = django_rq.get_scheduler('default')
-    scheduler.enqueue_in(timedelta(seconds=5), wait_for_backup,
-                         volume, backup.id,
-                         after_time(settings.ARCHIVE_WAIT))
+    timeout = StepTiming(
+        wait_for_backup, volume.operating_system, volume.zone
+    ).timeout(settings.ARCHIVE_WAIT)
+    _wait_for_backup_creation(volume, backup.id, after_time(timeout))
 
     # This allows the user to launch a new desktop immediately.
     vm_status = VMStatus.objects.get_vm_status_by_volume(
@@ -342,6 +352,13 @@ def archive_volume_worker(volume, requesting_feature):
     return WF_CONTINUE
 
 
+def _wait_for_backup_creation(volume, backup_id, deadline):
+    register_wait(
+        BACKUP, backup_id, wait_for_backup, volume, backup_id, deadline,
+        pending={BACKUP_CREATING}, interval=settings.ARCHIVE_POLL_WAIT,
+        deadline=deadline)
+
+
 def wait_for_backup(volume, backup_id, deadline):
     n = get_nectar()
     try:
@@ -357,9 +374,7 @@ def wait_for_backup(volume, backup_id, deadline):
             logger.error(f"Backup took too long: backup {backup_id}, "
                          f"volume {volume}")
             return _end_delete(volume, WF_RETRY)
-        scheduler = django_rq.get_scheduler('default')
-        scheduler.enqueue_in(timedelta(seconds=settings.ARCHIVE_POLL_WAIT),
-                             wait_for_backup, volume, backup_id, deadline)
+        _wait_for_backup_creation(volume, backup_id, deadline)
         return WF_CONTINUE
     elif details.status == BACKUP_AVAILABLE:
         logger.info(f"Backup {backup_id} completed for volume {volume}")
@@ -1,14 +1,15 @@
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 import logging
 
-import django_rq
 import novaclient
 
 from django.conf import settings
 
 from vm_manager.constants import ACTIVE, SHUTDOWN, REBOOT_HARD
 from vm_manager.models import Instance, VMStatus
+from vm_manager.utils.poller import register_wait, SERVER
 from vm_manager.utils.utils import get_nectar
+from vm_manager.utils.workflow import describe_run
 
 logger = logging.getLogger(__name__)
 
@@ -17,6 +18,8 @@ def reboot_vm_worker(user, vm_id, reboot_level,
                      target_status, requesting_feature):
     instance = Instance.objects.get_instance_by_untrusted_vm_id(
         vm_id, user, requesting_feature)
+    describe_run(instance.boot_volume.operating_system,
+                 instance.boot_volume.zone)
     n = get_nectar()
     try:
         nova_server = n.nova.servers.get(instance.id)
@@ -49,19 +52,26 @@ def reboot_vm_worker(user, vm_id, reboot_level,
     vm_status.status_message = "Reboot request sent; waiting for restart"
     vm_status.save()
 
-    scheduler = django_rq.get_scheduler('default')
-    scheduler.enqueue_in(
-        timedelta(seconds=settings.REBOOT_CONFIRM_WAIT),
-        _check_power_state, settings.REBOOT_CONFIRM_RETRIES,
-        instance, target_status, requesting_feature)
+    _wait_for_power_state(settings.REBOOT_CONFIRM_RETRIES,
+                          instance, target_status, requesting_feature)
 
     return reboot_result
 
 
+def _wait_for_power_state(retries, instance, target_status,
+                          requesting_feature):
+    register_wait(
+        SERVER, instance.id, _check_power_state,
+        instance=instance, target_status=target_status,
+        requesting_feature=requesting_feature,
+        targets={ACTIVE}, interval=settings.REBOOT_CONFIRM_WAIT,
+        retries=retries)
+
+
 def _check_power_state(retries, instance, target_status, requesting_feature):
     vm_status = VMStatus.objects.get_vm_status_by_instance(
         instance, requesting_feature)
-    active = instance.check_active_status()
+    active = instance.check_active_status(max_age=0)
     if active:
         logger.info(f"Instance {instance.id} is {ACTIVE}")
         vm_status.status_progress = 45
@@ -69,11 +79,8 @@ def _check_power_state(retries, instance, target_status, requesting_feature):
         vm_status.save()
         # The final stage is done in response to a phone_home request
     elif retries > 0:
-        scheduler = django_rq.get_scheduler('default')
-        scheduler.enqueue_in(
-            timedelta(seconds=settings.REBOOT_CONFIRM_WAIT),
-            _check_power_state, retries - 1, instance, target_status,
-            requesting_feature)
+        _wait_for_power_state(retries - 1, instance, target_status,
+                              requesting_feature)
     else:
         msg = f"Instance {instance.id} has not gone {ACTIVE} after reboot"
         logger.error(msg)
@@ -1,15 +1,17 @@
 import logging
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 
 from django.conf import settings
-import django_rq
 import novaclient
 
 from vm_manager.constants import \
     RESIZE, VERIFY_RESIZE, ACTIVE, \
     VM_SUPERSIZED, VM_RESIZING, VM_OKAY, \
     WF_SUCCESS, WF_FAIL, WF_RETRY, WF_CONTINUE
+from vm_manager.utils.poller import register_wait, SERVER
+from vm_manager.utils.timing import StepTiming
 from vm_manager.utils.utils import after_time, get_nectar
+from vm_manager.utils.workflow import describe_run
 from vm_manager.utils.expiry import BoostExpiryPolicy
 from vm_manager.models import VMStatus, Instance, Resize, \
     EXP_EXPIRING, EXP_EXPIRY_COMPLETED, EXP_EXPIRY_FAILED, \
@@ -25,6 +27,7 @@ def supersize_vm_worker(instance, desktop_type) -> str:
         logger.error(f"{desktop_type.id} is not resizable")
         return WF_FAIL
 
+    describe_run(desktop_type.id, instance.boot_volume.zone)
     logger.info(f"About to supersize {desktop_type.id} instance "
                 f"for user {instance.user.username} to "
                 f"flavor {desktop_type.big_flavor_name}")
@@ -43,6 +46,7 @@ def downsize_vm_worker(instance, desktop_type) -> str:
         logger.error(f"{desktop_type.id} is not resizable")
         return WF_FAIL
 
+    describe_run(desktop_type.id, instance.boot_volume.zone)
     logger.info(f"About to downsize {desktop_type.id} instance "
                 f"for user {instance.user.username} to "
                 f"flavor {desktop_type.default_flavor_name}")
@@ -110,15 +114,24 @@ def _resize_vm(instance, flavor, target_status, requesting_feature):
     vm_status.status_progress = 30
     vm_status.status_message = "Resize initiated; waiting to confirm"
     vm_status.save()
-    scheduler = django_rq.get_scheduler('default')
-    scheduler.enqueue_in(timedelta(seconds=5),
-                         _wait_to_confirm_resize,
-                         instance, flavor, target_status,
-                         after_time(settings.RESIZE_CONFIRM_WAIT),
-                         requesting_feature)
+    volume = instance.boot_volume
+    timeout = StepTiming(
+        _wait_to_confirm_resize, volume.operating_system, volume.zone
+    ).timeout(settings.RESIZE_CONFIRM_WAIT)
+    _wait_for_resize(instance, flavor, target_status, after_time(timeout),
+                     requesting_feature)
     return WF_CONTINUE
 
 
+def _wait_for_resize(instance, flavor, target_status, deadline,
+                     requesting_feature):
+    register_wait(
+        SERVER, instance.id, _wait_to_confirm_resize,
+        instance, flavor, target_status, deadline, requesting_feature,
+        pending={RESIZE}, interval=settings.POLLER_INTERVAL,
+        deadline=deadline)
+
+
 def _wait_to_confirm_resize(instance, flavor, target_status,
                             deadline, requesting_feature):
     n = get_nectar()
@@ -149,11 +162,8 @@ def _wait_to_confirm_resize(instance, flavor, target_status,
     elif status == RESIZE:
         logger.info(f"Waiting for resize of {instance}")
         if datetime.now(utc) < deadline:
-            scheduler = django_rq.get_scheduler('default')
-            scheduler.enqueue_in(timedelta(seconds=5),
-                                 _wait_to_confirm_resize,
-                                 instance, flavor, target_status, deadline,
-                                 requesting_feature)
+            _wait_for_resize(instance, flavor, target_status, deadline,
+                             requesting_feature)
             return WF_CONTINUE
         else:
             logger.error("Resize has taken too long")
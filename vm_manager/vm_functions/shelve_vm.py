@@ -1,21 +1,21 @@
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
 import logging
 
-import django_rq
 import novaclient
 
 from django.conf import settings
 
-from vm_manager.constants import ACTIVE, SHUTDOWN, \
+from vm_manager.constants import ACTIVE, SHUTDOWN, MISSING, \
     VM_MISSING, VM_SHELVED, VM_WAITING, VM_OKAY, VM_ERROR, VM_SUPERSIZED, \
     WF_SUCCESS, WF_FAIL, WF_RETRY, WF_CONTINUE
-from vm_manager.models import VMStatus, Expiration, EXP_EXPIRING, \
+from vm_manager.models import VMStatus, ResourceExpiration, EXP_EXPIRING, \
     EXP_EXPIRY_FAILED, EXP_EXPIRY_FAILED_RETRYABLE, EXP_EXPIRY_COMPLETED
 from vm_manager.utils.expiry import VolumeExpiryPolicy
+from vm_manager.utils.poller import register_wait, SERVER
 from vm_manager.utils.utils import get_nectar, after_time
+from vm_manager.utils.workflow import describe_run
 from vm_manager.vm_functions.create_vm import launch_vm_worker
-from vm_manager.vm_functions.delete_vm import \
-    _check_instance_is_shutoff_and_delete
+from vm_manager.vm_functions.delete_vm import wait_for_instance_shutoff
 
 from guacamole.models import GuacamoleConnection
 
@@ -27,10 +27,14 @@ utc = timezone.utc
 
 def shelve_vm_worker(instance):
     logger.info(f"About to shelve {instance}")
+    describe_run(instance.boot_volume.operating_system,
+                 instance.boot_volume.zone)
 
     if instance.guac_connection:
         GuacamoleConnection.objects.filter(instance=instance).delete()
         instance.guac_connection = None
+        instance.guac_url = None
+        instance.guac_inputs = None
         instance.save()
 
     vm_status = VMStatus.objects.get_vm_status_by_instance(
@@ -76,13 +80,11 @@ def shelve_vm_worker(instance):
         vm_status.save()
 
     # Confirm instance is ShutOff and then Delete it
-    scheduler = django_rq.get_scheduler('default')
-    scheduler.enqueue_in(
-        timedelta(seconds=settings.INSTANCE_POLL_SHUTOFF_WAIT),
-        _check_instance_is_shutoff_and_delete, instance,
-        settings.INSTANCE_POLL_SHUTOFF_RETRIES,
+    wait_for_instance_shutoff(
+        instance, settings.INSTANCE_POLL_SHUTOFF_RETRIES,
         _confirm_instance_deleted,
-        (instance, settings.INSTANCE_POLL_DELETED_RETRIES))
+        {'instance': instance,
+         'retries': settings.INSTANCE_POLL_DELETED_RETRIES})
     return WF_CONTINUE
 
 
@@ -121,10 +123,10 @@ def _confirm_instance_deleted(instance, retries):
         logger.error(f"{error_message} {instance}")
         return _end_shelve(instance, WF_RETRY)
     else:
-        scheduler = django_rq.get_scheduler('default')
-        scheduler.enqueue_in(
-            timedelta(seconds=settings.INSTANCE_POLL_DELETED_WAIT),
-            _confirm_instance_deleted, instance, retries - 1)
+        register_wait(
+            SERVER, instance.id, _confirm_instance_deleted, instance,
+            targets={MISSING}, interval=settings.INSTANCE_POLL_DELETED_WAIT,
+            retries=retries - 1)
         return WF_CONTINUE
 
 
@@ -146,7 +148,8 @@ def shelve_expired_vm(instance, requesting_feature):
 
 def _end_shelve(instance, wf_status):
     if instance.expiration:
-        expiration = Expiration.objects.get(pk=instance.expiration.pk)
+        expiration = ResourceExpiration.objects.get(
+            pk=instance.expiration.pk)
         if expiration.stage == EXP_EXPIRING:
             if wf_status == WF_FAIL:
                 expiration.stage = EXP_EXPIRY_FAILED